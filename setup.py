@@ -7,12 +7,15 @@ setup(
     author='jasmina.orlowska',
     author_email='jo448417@students.mimuw.edu.pl',
     packages=find_namespace_packages(),
+    python_requires='>=3.11',
     install_requires=['geopy',
                       'numpy',
                       'pandas',
-                      'concurrent',
                       'requests',
-                      'typing',
                       'schedule'
-                      ]
+                      ],
+    extras_require={'metrics': ['prometheus_client']},
+    entry_points={
+        'console_scripts': ['bus-analysis=src.cli:main']
+    }
 )
@@ -1,10 +1,36 @@
 import os
-from typing import List
+from typing import Hashable, List, Tuple
 import pandas as pd
 from geopy.distance import geodesic as GD
 from pandas import DataFrame
 from src.analyze.dictionary_data import *
+from src.common.log import get_logger
+from src.common.metrics import timed
 
+logger = get_logger(__name__)
+
+# Average speeds (km/h) outside this range are treated as measurement noise.
+MIN_AVG_SPEED = 30
+MAX_AVG_SPEED = 80
+
+
+def vehicle_key(bus_line: Hashable, bus_brigade: Hashable) -> Tuple[Hashable, Hashable]:
+    """
+    Key of a vehicle as group_by_bus sees it. Numeric identifiers become integers,
+    the same way pd.read_json reads the processed files, so "020" and "20" are the same brigade.
+
+    Args:
+    - bus_line, bus_brigade: Lines and Brigade values of a bus location record.
+
+    Returns:
+    Tuple: (Lines, Brigade) key.
+    """
+    def normalise(value):
+        return int(value) if isinstance(value, str) and value.isdigit() else value
+    return normalise(bus_line), normalise(bus_brigade)
+
+
+@timed()
 def combine_bus_locations_within_hour(folder: str) -> DataFrame:
     """
     Combine bus locations within an hour from JSON files in the given folder.
@@ -27,9 +53,10 @@ def combine_bus_locations_within_hour(folder: str) -> DataFrame:
         result = pd.concat(combined_data, ignore_index=True)
         return result
     except Exception as e:
-        print(f"Error occurred while combining bus locations files: {e}")
+        logger.error("Error occurred while combining bus locations files", extra={"error": str(e)})
 
 
+@timed()
 def group_by_bus(df: DataFrame) -> DataFrame:
     """
     Group bus location DataFrame by lines and brigade.
@@ -39,13 +66,15 @@ def group_by_bus(df: DataFrame) -> DataFrame:
 
     Returns:
     DataFrame: Grouped DataFrame with a new column "Data" containing grouped records.
+    Records keep the Timestamp of compact locations (see compact_locations) next to or instead of Time.
     """
     try:
-        return df.groupby([lines, brigade]).apply(
-            lambda x: x[[time, lon, lat]].sort_values(by=time).to_dict("records"),
+        columns = [column for column in (time, timestamp) if column in df.columns] + [lon, lat]
+        return df.groupby([lines, brigade], observed=True).apply(
+            lambda x: x[columns].sort_values(by=columns[0], kind="stable").to_dict("records"),
             include_groups=False).reset_index(name=data)
     except Exception as e:
-        print(f"Error occurred while grouping by bus: {e}")
+        logger.error("Error occurred while grouping by bus", extra={"error": str(e)})
 
 
 def count_trip_duration(items: List):
@@ -59,6 +88,9 @@ def count_trip_duration(items: List):
     float: Trip duration in hours.
     """
     try:
+        if timestamp in items[0]:
+            seconds = [item[timestamp] for item in items]
+            return (max(seconds) - min(seconds)) / 3600
         min_time = max_time = items[0][time]
         for item in items[1:]:
             if item[time] < min_time:
@@ -68,9 +100,10 @@ def count_trip_duration(items: List):
         trip_dur = pd.to_datetime(max_time) - pd.to_datetime(min_time)
         return trip_dur.total_seconds() / 3600
     except Exception as e:
-        print(f"Error occurred while counting trip duration: {e}")
+        logger.error("Error occurred while counting trip duration", extra={"error": str(e)})
 
 
+@timed()
 def count_durations(df: DataFrame) -> DataFrame:
     """
     Count trip durations for each group in DataFrame.
@@ -85,7 +118,7 @@ def count_durations(df: DataFrame) -> DataFrame:
         df[trip_duration] = df[data].apply(count_trip_duration)
         return df
     except Exception as e:
-        print(f"Error occurred while counting durations: {e}")
+        logger.error("Error occurred while counting durations", extra={"error": str(e)})
 
 
 def count_distance(items):
@@ -109,29 +142,45 @@ def count_distance(items):
             prev_loc = curr_loc
         return bus_total_distance
     except Exception as e:
-        print(f"Error occurred while counting distance: {e}")
+        logger.error("Error occurred while counting distance", extra={"error": str(e)})
 
 
+@timed()
 def count_avg_speed(df: DataFrame) -> DataFrame:
     """
     Count average speed for each group in DataFrame.
 
     Args:
-    - df (DataFrame): DataFrame containing bus location data.
+    - df (DataFrame): DataFrame containing bus location data, or driving times and distances of every vehicle
+      that already has the total_distance column (see trip_segmentation.trip_totals).
 
     Returns:
     DataFrame: DataFrame with added total_distance and avg_speed columns.
     """
     try:
-        df[total_distance] = df[data].apply(count_distance)
+        if total_distance not in df.columns:
+            df[total_distance] = df[data].apply(count_distance)
         df[avg_speed] = df[total_distance] / df[trip_duration]
         df.dropna(inplace=True)
         return df
     except Exception as e:
-        print(f"Error occurred while counting average speed: {e}")
+        logger.error("Error occurred while counting average speed", extra={"error": str(e)})
+
+
+@timed()
+def clean_df(df: DataFrame, min_speed: float = MIN_AVG_SPEED, max_speed: float = MAX_AVG_SPEED) -> DataFrame:
+    """
+    Remove rows with an implausible average speed.
 
-def clean_df(df: DataFrame) -> DataFrame:
-    rows_to_remove = df.loc[(df[avg_speed] < 30) | (df[avg_speed] > 80)]
+    Args:
+    - df (DataFrame): DataFrame with the avg_speed column.
+    - min_speed (float): Lowest accepted average speed in km/h.
+    - max_speed (float): Highest accepted average speed in km/h.
+
+    Returns:
+    DataFrame: The same DataFrame without the rejected rows.
+    """
+    rows_to_remove = df.loc[(df[avg_speed] < min_speed) | (df[avg_speed] > max_speed)]
     df.drop(rows_to_remove.index, inplace=True)
     df.dropna(inplace=True)
     return df
@@ -1,5 +1,5 @@
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 from geopy.distance import geodesic
 
@@ -9,18 +9,23 @@ def analyze_punctuality_thread_executor(row, timetables, lat, lon):
         return result.result()
 
 
-def analyze_punctuality_for_a_bus_stop(df_locations, row, timetables, lat, lon):
-    arrivals_number = 0
-    delay_sum = 0
+def arrival_delays(df_locations, row, timetables, lat, lon):
+    """
+    Delays of the arrivals at a bus stop found in the bus locations.
+
+    Yields:
+    Tuple[str, str, float]: Line, expected arrival time ("%H:%M:%S") and delay in minutes of every expected
+    arrival matched with a location of the bus.
+    """
     timetables = row[timetables]
     lat = row[lat]
     lon = row[lon]
     now = datetime.now().date()
 
-    for line in timetables:
-        timetable_for_line = timetables[line]
+    for line_name in timetables:
+        timetable_for_line = timetables[line_name]
         # if line[0].isdigit():
-        line = np.int64(line)
+        line = np.int64(line_name)
 
         for expected_arrival_for_a_line in timetable_for_line:
             best_delay_in_minutes = -1
@@ -35,7 +40,10 @@ def analyze_punctuality_for_a_bus_stop(df_locations, row, timetables, lat, lon):
                 locations_of_expected_bus = list(bus_locations['Data'])[0]
                 for element in locations_of_expected_bus:
                     if geodesic((lat, lon), (element['Lat'], element['Lon'])).meters < 100:
-                        arrival_time = datetime.strptime(element['Time'], "%Y-%m-%d %H:%M:%S").time()
+                        if 'Timestamp' in element:
+                            arrival_time = (datetime(1970, 1, 1) + timedelta(seconds=int(element['Timestamp']))).time()
+                        else:
+                            arrival_time = datetime.strptime(element['Time'], "%Y-%m-%d %H:%M:%S").time()
                         diff = datetime.combine(now, expected_arrival_time) - datetime.combine(now, arrival_time)
                         diff = diff.total_seconds() / 60
                         # We don't count Delays > 3h and < 0h (wrong data)
@@ -47,12 +55,19 @@ def analyze_punctuality_for_a_bus_stop(df_locations, row, timetables, lat, lon):
                             best_delay_in_minutes = diff
                             if best_delay_in_minutes < 5:
                                 break
-            # If we have result - update it.
+            # If we have result - yield it.
             if best_delay_in_minutes != -1:
-                arrivals_number = arrivals_number + 1
-                delay_sum += best_delay_in_minutes
+                yield str(line_name), expected_arrival_for_a_line['czas'], best_delay_in_minutes
+
+
+def analyze_punctuality_for_a_bus_stop(df_locations, row, timetables, lat, lon):
+    arrivals_number = 0
+    delay_sum = 0
+    for _, _, delay in arrival_delays(df_locations, row, timetables, lat, lon):
+        arrivals_number = arrivals_number + 1
+        delay_sum += delay
 
     if arrivals_number != 0:
         return delay_sum / arrivals_number
     else:
-        return -1
\ No newline at end of file
+        return -1
@@ -1,37 +1,54 @@
 from datetime import datetime
 from src.analyze.analyze_avg_speed import *
 from src.common.config import *
+from src.common.log import get_logger
+from src.common.metrics import timed
+
+logger = get_logger(__name__)
+
+# Speed band (km/h) of a segment between two consecutive fixes that counts as speeding.
+SPEEDING_MIN_SPEED = 50
+SPEEDING_MAX_SPEED = 85
+
+EPOCH = datetime(1970, 1, 1)
+
 
 def analyze_speeding_points_single(items: List):
     coordinates = []
     if len(items) < 2:
         return []
     try:
+        # Timestamps of compact locations are parsed already; Time strings are parsed here.
+        if timestamp in items[0]:
+            seconds = [item[timestamp] for item in items]
+        else:
+            seconds = [(datetime.strptime(item[time], DATE_FORMAT) - EPOCH).total_seconds() for item in items]
         prev_loc = (items[0][lat], items[0][lon])
-        prev_time = datetime.strptime(items[0][time], DATE_FORMAT)
+        prev_time = seconds[0]
 
-        for item in items[1:]:
+        for item, curr_time in zip(items[1:], seconds[1:]):
             curr_loc = (item[lat], item[lon])
-            curr_time = datetime.strptime(item[time], DATE_FORMAT)
             dist = GD(prev_loc, curr_loc).km
-            time_delta = (curr_time - prev_time).total_seconds() / 3600
+            time_delta = (curr_time - prev_time) / 3600
             speed = dist/time_delta if time_delta > 0 else 0
-            if 50 < speed < 85:
+            if SPEEDING_MIN_SPEED < speed < SPEEDING_MAX_SPEED:
                 coordinates.append(((curr_loc[0] + prev_loc[0])/2, (curr_loc[1] + prev_loc[1])/2))
             prev_loc = curr_loc
             prev_time = curr_time
         return coordinates
     except Exception as e:
-        print(f"Error occurred while counting speeding points single: {e}")
+        logger.error("Error occurred while counting speeding points single", extra={"error": str(e)})
         return coordinates
 
+@timed()
 def analyze_speeding_points(df: DataFrame) -> DataFrame:
     try:
         df[speeding_points] = df[data].apply(analyze_speeding_points_single)
     except Exception as e:
-        print(f"Error occurred while counting  speeding points: {e}")
+        logger.error("Error occurred while counting speeding points", extra={"error": str(e)})
     return df
 
+@timed()
 def collect_speeding_points(df: DataFrame) -> List:
     all_speeding_points = []
     for values_list in df[speeding_points]:
@@ -0,0 +1,252 @@
+"""
+Incremental per-vehicle average speed.
+
+The batch pipeline (combine_bus_locations_within_hour -> group_by_bus -> count_durations ->
+count_avg_speed -> clean_df) needs a finished hour folder. AvgSpeedAccumulator keeps, for every
+(Lines, Brigade) pair, the first fix, the last few fixes, the travelled distance and the number of points,
+so it can be updated poll by poll, queried at any moment and merged across shards and hours.
+"""
+import json
+import os
+from bisect import bisect_right
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+import pandas as pd
+from geopy.distance import geodesic as GD
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import MIN_AVG_SPEED, MAX_AVG_SPEED, vehicle_key
+from src.analyze.dictionary_data import *
+from src.common.config import DATE_FORMAT
+
+__all__ = [
+    "VehicleSpeedState",
+    "AvgSpeedAccumulator"
+]
+
+VehicleKey = Tuple[Hashable, Hashable]
+
+
+# Processed fixes lie within a minute of their poll time, so a fix can arrive at most
+# two minutes after a newer fix of the same (Lines, Brigade) pair.
+REORDER_WINDOW = timedelta(minutes=2)
+
+
+@dataclass
+class VehicleSpeedState:
+    """
+    Running totals for a single vehicle.
+
+    Fixes newer than REORDER_WINDOW (relative to the newest fix) are kept in a short time-sorted tail,
+    so late fixes are still put in the order the batch functions would sort them into.
+    Older fixes are folded into the settled part, which only remembers its ends and its distance.
+    """
+    first_time: Optional[datetime] = None
+    first_loc: Optional[Tuple[float, float]] = None
+    settled_time: Optional[datetime] = None
+    settled_loc: Optional[Tuple[float, float]] = None
+    settled_distance: float = 0.0
+    tail: List[Tuple[datetime, Tuple[float, float]]] = field(default_factory=list)
+    tail_segments: List[float] = field(default_factory=list)
+    points: int = 0
+
+    def add(self, loc: Tuple[float, float], item_time: datetime) -> bool:
+        """
+        Insert a fix into the time-sorted trajectory.
+
+        Returns:
+        bool: False if the fix is older than the settled part and was skipped.
+        """
+        if self.settled_time is not None and item_time < self.settled_time:
+            return False
+        position = bisect_right(self.tail, item_time, key=itemgetter(0))
+        self.tail.insert(position, (item_time, loc))
+        if 0 < position < len(self.tail) - 1:
+            del self.tail_segments[position - 1]
+        if position > 0:
+            self.tail_segments.insert(position - 1, GD(self.tail[position - 1][1], loc).km)
+        if position < len(self.tail) - 1:
+            self.tail_segments.insert(position, GD(loc, self.tail[position + 1][1]).km)
+        self.points += 1
+        self._settle()
+        return True
+
+    def _settle(self) -> None:
+        """Fold fixes that can no longer be preceded by a late fix into the settled part."""
+        newest = self.tail[-1][0]
+        while len(self.tail) > 1 and newest - self.tail[0][0] > REORDER_WINDOW:
+            item_time, loc = self.tail.pop(0)
+            if self.settled_time is None:
+                self.first_time, self.first_loc = item_time, loc
+            else:
+                self.settled_distance += GD(self.settled_loc, loc).km
+            self.settled_time, self.settled_loc = item_time, loc
+            self.tail_segments.pop(0)
+
+    @property
+    def start(self) -> Tuple[datetime, Tuple[float, float]]:
+        """Time and position of the earliest fix."""
+        if self.first_time is not None:
+            return self.first_time, self.first_loc
+        return self.tail[0]
+
+    @property
+    def end(self) -> Tuple[datetime, Tuple[float, float]]:
+        """Time and position of the latest fix."""
+        if self.tail:
+            return self.tail[-1]
+        return self.settled_time, self.settled_loc
+
+    @property
+    def distance(self) -> float:
+        """Distance in kilometres along the time-sorted fixes, as count_distance computes it."""
+        total = self.settled_distance + sum(self.tail_segments)
+        if self.settled_time is not None and self.tail:
+            total += GD(self.settled_loc, self.tail[0][1]).km
+        return total
+
+    def trip_duration(self) -> float:
+        """Time between the first and the last fix in hours, as count_trip_duration computes it."""
+        return (self.end[0] - self.start[0]).total_seconds() / 3600
+
+    def avg_speed(self) -> Optional[float]:
+        """Average speed in km/h, None when it is undefined (a single fix or no elapsed time)."""
+        duration = self.trip_duration()
+        if duration > 0:
+            return self.distance / duration
+        return float("inf") if self.distance > 0 else None
+
+    def copy(self) -> "VehicleSpeedState":
+        """Independent copy: later fixes added to either state do not change the other."""
+        return replace(self, tail=list(self.tail), tail_segments=list(self.tail_segments))
+
+    def merged(self, other: "VehicleSpeedState") -> "VehicleSpeedState":
+        """
+        Combine two states of the same vehicle covering consecutive, non-overlapping periods.
+
+        Raises:
+        ValueError: If the periods overlap, because the combined distance would depend on
+        the interleaving of fixes that are no longer available.
+        """
+        earlier, later = (self, other) if self.start[0] <= other.start[0] else (other, self)
+        (earlier_end, earlier_loc), (later_start, later_loc) = earlier.end, later.start
+        if earlier_end > later_start:
+            raise ValueError(f"Cannot merge overlapping periods ending {earlier_end} and starting {later_start}")
+        result = VehicleSpeedState(tail=list(later.tail), tail_segments=list(later.tail_segments),
+                                   points=earlier.points + later.points)
+        result.first_time, result.first_loc = earlier.start
+        result.settled_distance = earlier.distance + GD(earlier_loc, later_loc).km + later.settled_distance
+        if later.settled_time is not None:
+            result.settled_time, result.settled_loc = later.settled_time, later.settled_loc
+        else:
+            # The later state has not settled anything yet: its first fix becomes the settled end.
+            result.settled_time, result.settled_loc = result.tail.pop(0)
+            if result.tail_segments:
+                result.tail_segments.pop(0)
+        return result
+
+
+class AvgSpeedAccumulator:
+    """
+    Average speed per (Lines, Brigade), updated one fix at a time.
+
+    Vehicles are keyed with vehicle_key, the way the batch functions see them. Fixes may arrive
+    out of order by up to REORDER_WINDOW, which covers consecutive polls and processed files read
+    in filename order; with that, the results are the same as running the batch functions over all
+    the fixes seen so far. Older fixes are counted in skipped_points. Fixes with the same time keep
+    their arrival order, while the batch sort leaves their order unspecified; this only matters when
+    two vehicles report the same Lines and Brigade.
+    """
+
+    def __init__(self) -> None:
+        self.vehicles: Dict[VehicleKey, VehicleSpeedState] = {}
+        self.skipped_points = 0
+
+    def __len__(self) -> int:
+        return len(self.vehicles)
+
+    def add(self, bus_line: Hashable, bus_brigade: Hashable, lat_value: float, lon_value: float,
+            item_time: str) -> None:
+        """
+        Add a single fix.
+
+        Args:
+        - bus_line, bus_brigade: Vehicle identifiers (Lines and Brigade).
+        - lat_value, lon_value (float): Position of the vehicle.
+        - item_time (str): Time of the fix in DATE_FORMAT.
+        """
+        state = self.vehicles.setdefault(vehicle_key(bus_line, bus_brigade), VehicleSpeedState())
+        if not state.add((lat_value, lon_value), datetime.strptime(item_time, DATE_FORMAT)):
+            self.skipped_points += 1
+
+    def update(self, records: Iterable[Dict]) -> None:
+        """
+        Add all fixes of a poll.
+
+        Args:
+        - records: Bus location dictionaries with Lines, Brigade, Lat, Lon and Time keys,
+          as stored in the processed buses_live_locations files.
+        """
+        for record in records:
+            self.add(record[lines], record[brigade], record[lat], record[lon], record[time])
+
+    def update_from_folder(self, folder: str) -> None:
+        """
+        Add all fixes from a processed hour folder, reading the files in chronological order.
+
+        Args:
+        - folder (str): The path to the folder containing JSON files.
+        """
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith('.json'):
+                with open(os.path.join(folder, filename), 'r', encoding='utf-8') as file:
+                    self.update(json.load(file))
+
+    def merge(self, other: "AvgSpeedAccumulator") -> "AvgSpeedAccumulator":
+        """
+        Merge another accumulator into this one, e.g. a different shard of vehicles or the next hour.
+        The states of the other accumulator are copied, so both can keep being updated independently.
+
+        Returns:
+        AvgSpeedAccumulator: self, to allow chaining.
+        """
+        for key, state in other.vehicles.items():
+            own_state = self.vehicles.get(key)
+            self.vehicles[key] = state.copy() if own_state is None else own_state.merged(state)
+        self.skipped_points += other.skipped_points
+        return self
+
+    def avg_speed(self, bus_line: Hashable, bus_brigade: Hashable) -> Optional[float]:
+        """Current average speed of a single vehicle in km/h, None if unknown or undefined."""
+        state = self.vehicles.get(vehicle_key(bus_line, bus_brigade))
+        return state.avg_speed() if state else None
+
+    def to_dataframe(self, clean: bool = True, min_speed: float = MIN_AVG_SPEED,
+                     max_speed: float = MAX_AVG_SPEED) -> DataFrame:
+        """
+        Current results in the shape produced by count_avg_speed.
+
+        Args:
+        - clean (bool): Apply the same speed filter as clean_df.
+        - min_speed, max_speed (float): Accepted average speed range in km/h.
+
+        Returns:
+        DataFrame: Lines, Brigade, Trip_Duration, Total_Distance and Average_Speed columns,
+        without vehicles whose average speed is undefined.
+        """
+        rows = []
+        for (bus_line, bus_brigade), state in self.vehicles.items():
+            speed = state.avg_speed()
+            if speed is None:
+                continue
+            if clean and not (min_speed <= speed <= max_speed):
+                continue
+            rows.append({
+                lines: bus_line,
+                brigade: bus_brigade,
+                trip_duration: state.trip_duration(),
+                total_distance: state.distance,
+                avg_speed: speed
+            })
+        return pd.DataFrame(rows, columns=[lines, brigade, trip_duration, total_distance, avg_speed])
@@ -2,6 +2,7 @@ avg_speed = "Average_Speed"
 lines = "Lines"
 brigade = "Brigade"
 time = "Time"
+timestamp = "Timestamp"
 lon = "Lon"
 lat = "Lat"
 trip_duration = "Trip_Duration"
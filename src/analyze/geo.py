@@ -0,0 +1,52 @@
+"""
+Vectorized geographic helpers.
+
+Distances within Warsaw are short enough to use a local flat approximation of the WGS84 ellipsoid,
+which lets whole arrays of coordinates be handled with NumPy instead of calling geodesic point by point.
+"""
+import numpy as np
+from src.common.config import WARSAW_LAT_MIN, WARSAW_LAT_MAX, WARSAW_LON_MIN, WARSAW_LON_MAX
+
+__all__ = [
+    "WARSAW_CENTER_LAT",
+    "WARSAW_CENTER_LON",
+    "metres_per_degree",
+    "to_local_metres"
+]
+
+WARSAW_CENTER_LAT = (WARSAW_LAT_MIN + WARSAW_LAT_MAX) / 2
+WARSAW_CENTER_LON = (WARSAW_LON_MIN + WARSAW_LON_MAX) / 2
+
+
+def metres_per_degree(lat_deg):
+    """
+    Length of one degree of latitude and of longitude on the WGS84 ellipsoid.
+
+    Args:
+    - lat_deg (float or ndarray): Latitude in degrees.
+
+    Returns:
+    tuple: (metres per degree of latitude, metres per degree of longitude).
+    """
+    phi = np.radians(lat_deg)
+    lat_m = 111132.92 - 559.82 * np.cos(2 * phi) + 1.175 * np.cos(4 * phi) - 0.0023 * np.cos(6 * phi)
+    lon_m = 111412.84 * np.cos(phi) - 93.5 * np.cos(3 * phi) + 0.118 * np.cos(5 * phi)
+    return lat_m, lon_m
+
+
+def to_local_metres(lat_deg, lon_deg):
+    """
+    Project coordinates onto a plane tangent at the centre of Warsaw.
+
+    The scale is fixed at the centre, which distorts distances by less than 0.3% within the Warsaw bounds.
+
+    Args:
+    - lat_deg (float or ndarray): Latitude in degrees.
+    - lon_deg (float or ndarray): Longitude in degrees.
+
+    Returns:
+    tuple: (x, y) in metres east and north of the centre.
+    """
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    return (np.asarray(lon_deg, dtype=np.float64) - WARSAW_CENTER_LON) * lon_m, \
+        (np.asarray(lat_deg, dtype=np.float64) - WARSAW_CENTER_LAT) * lat_m
@@ -0,0 +1,218 @@
+"""
+Headway regularity and bunching of the buses of every line at every stop.
+
+Passages are derived from compact bus locations with the stops of every line (LineStopsIndex): every fix is
+assigned to the nearest stop of its line, fixes closer than ARRIVAL_RADIUS form runs of a vehicle at a stop, and
+the fix of a run closest to the stop is the passage. The headway of a passage is the time since the previous
+passage of the same line at the same stop, found by sorting all passages by (line, stop, time) and differencing.
+The scheduled headway is the gap between the departures of timetables.json around the passage, found with one
+searchsorted over all departures sorted the same way. find_passages loops over the lines in Python, handling
+all the fixes of a line at once, and no step loops over vehicles, stops or fixes, so a day of the whole city
+takes seconds.
+
+A passage is bunched when its headway is below BUNCHING_RATIO of the scheduled headway and gapped when it is
+over GAP_RATIO of it. Summaries give the regularity per line and stop or per line: the coefficient of variation
+of the headways and the excess wait time, the average wait of a passenger arriving at random beyond the wait the
+schedule promises.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from src.analyze.dictionary_data import brigade, lat, lines, lon, timestamp
+from src.analyze.line_stops import ARRIVAL_RADIUS, LineStopsIndex
+from src.common.log import get_logger
+from src.common.metrics import count_records, timed
+from src.fetch_and_preprocess.process_data import stop_code
+
+__all__ = [
+    "BUNCHING_RATIO",
+    "GAP_RATIO",
+    "PASSAGE_GAP",
+    "MAX_HEADWAY",
+    "STOP_COLUMNS",
+    "find_passages",
+    "scheduled_departures",
+    "compute_headways",
+    "summarise_headways"
+]
+
+logger = get_logger(__name__)
+
+BUNCHING_RATIO = 0.25
+GAP_RATIO = 2.0
+# Fixes of a vehicle at a stop further apart than this (seconds) are separate passages, e.g. of a loop line.
+PASSAGE_GAP = 300
+# Passages further apart than this (seconds) are not successive: there is a gap in the data, e.g. between hours.
+MAX_HEADWAY = 2 * 3600
+DAY_SECONDS = 24 * 3600
+
+STOP_COLUMNS = ["busstopId", "busstopNr"]
+PASSAGE_COLUMNS = [lines, *STOP_COLUMNS, brigade, timestamp, "distance"]
+
+
+@timed()
+def find_passages(df: DataFrame, index: LineStopsIndex, radius: float = ARRIVAL_RADIUS,
+                  max_gap: float = PASSAGE_GAP) -> DataFrame:
+    """
+    Passages of the vehicles at the stops of their lines.
+
+    Args:
+    - df (DataFrame): Compact bus locations (see compact_locations), of one or more hours.
+    - index (LineStopsIndex): Stops of every line.
+    - radius (float): Largest distance in metres between a fix and the stop it passes.
+    - max_gap (float): Largest time in seconds between fixes of one passage.
+
+    Returns:
+    DataFrame: Lines (str), busstopId, busstopNr, Brigade, Timestamp of the fix closest to the stop and its
+    distance in metres, one row per passage.
+    """
+    df = df.assign(**{lines: df[lines].astype(str)}).sort_values([lines, brigade, timestamp], kind='stable')
+    line_values = df[lines].to_numpy()
+    starts = np.flatnonzero(np.concatenate([[True], line_values[1:] != line_values[:-1]]))
+    ends = np.concatenate([starts[1:], [len(df)]])
+    brigades, times = df[brigade].to_numpy(), df[timestamp].to_numpy(np.int64)
+    lats, lons = df[lat].to_numpy(np.float64), df[lon].to_numpy(np.float64)
+
+    parts = []
+    for start, end in zip(starts, ends):
+        stops = index.stops(line_values[start])
+        if stops is None or not len(stops):
+            continue
+        distances = stops.distances(lats[start:end], lons[start:end])
+        nearest = distances.argmin(axis=1)
+        distance = distances[np.arange(end - start), nearest]
+        near = np.flatnonzero(distance < radius)
+        if not len(near):
+            continue
+        stop, vehicle, seconds = nearest[near], brigades[start:end][near], times[start:end][near]
+        new_run = np.concatenate([[True], (stop[1:] != stop[:-1]) | (vehicle[1:] != vehicle[:-1])
+                                  | (np.diff(seconds) > max_gap)])
+        run = np.cumsum(new_run)
+        order = np.lexsort((distance[near], run))
+        closest = order[np.concatenate([[True], run[order][1:] != run[order][:-1]])]
+        parts.append(DataFrame({
+            lines: line_values[start],
+            "busstopId": stops.bus_stop_ids[stop[closest]],
+            "busstopNr": stops.bus_stop_nrs[stop[closest]],
+            brigade: vehicle[closest],
+            timestamp: seconds[closest],
+            "distance": distance[near][closest]
+        }))
+    passages = pd.concat(parts, ignore_index=True) if parts else DataFrame(columns=PASSAGE_COLUMNS)
+    count_records("find_passages", len(df), len(passages))
+    return passages
+
+
+def scheduled_departures(timetables: Iterable[Dict[str, Any]]) -> DataFrame:
+    """
+    Departures of processed timetables as a table.
+
+    Args:
+    - timetables (Iterable[Dict]): Processed timetables (TIMETABLES), records with 'busstopId', 'busstopNr' and
+      'rozklad', the departures ({'czas': 'HH:MM:SS', ...}) by line.
+
+    Returns:
+    DataFrame: Lines (str), busstopId, busstopNr and seconds (since midnight, times past 24:00 wrapped around).
+    """
+    rows = []
+    for stop in timetables:
+        bus_stop_id, bus_stop_nr = stop_code(stop['busstopId'], 4), stop_code(stop['busstopNr'], 2)
+        for line, departures in stop['rozklad'].items():
+            for departure in departures:
+                hours, minutes, seconds = map(int, departure['czas'].split(':'))
+                seconds_of_day = (hours * 3600 + minutes * 60 + seconds) % DAY_SECONDS
+                rows.append((str(line), bus_stop_id, bus_stop_nr, seconds_of_day))
+    return DataFrame(rows, columns=[lines, *STOP_COLUMNS, "seconds"])
+
+
+def _keys(frames: Sequence[DataFrame]) -> List[np.ndarray]:
+    """Common integer codes of the (line, stop) pairs of several tables."""
+    labels = [(frame[lines].astype(str) + "|" + frame["busstopId"].astype(str) + "|"
+               + frame["busstopNr"].astype(str)).to_numpy() for frame in frames]
+    codes, _ = pd.factorize(np.concatenate(labels))
+    return np.split(codes.astype(np.int64), np.cumsum([len(label) for label in labels])[:-1])
+
+
+@timed()
+def compute_headways(passages: DataFrame, schedule: Optional[DataFrame] = None,
+                     bunching_ratio: float = BUNCHING_RATIO, gap_ratio: float = GAP_RATIO,
+                     max_headway: float = MAX_HEADWAY) -> DataFrame:
+    """
+    Headways of the passages, with the scheduled headways and the bunching flags.
+
+    The scheduled headway of a passage is the gap between the scheduled departures of its line at its stop just
+    before and just after the time of the passage; it is NaN outside the schedule or without one.
+
+    Args:
+    - passages (DataFrame): Passages from find_passages.
+    - schedule (DataFrame): Departures from scheduled_departures or TimetableStore.departures, or None.
+    - bunching_ratio, gap_ratio (float): Thresholds of the ratio of the headway to the scheduled headway.
+    - max_headway (float): Longest headway in seconds; passages further apart are not successive.
+
+    Returns:
+    DataFrame: Every passage following another of its line at its stop, with headway and scheduled_headway
+    (seconds), bunched and gapped, sorted by line, stop and time.
+    """
+    schedule = schedule if schedule is not None else DataFrame(columns=[lines, *STOP_COLUMNS, "seconds"])
+    passage_keys, schedule_keys = _keys([passages, schedule])
+    times = passages[timestamp].to_numpy(np.int64)
+    order = np.lexsort((times, passage_keys))
+    passage_keys, times = passage_keys[order], times[order]
+    follows = np.flatnonzero((passage_keys[1:] == passage_keys[:-1]) & (np.diff(times) <= max_headway)) + 1
+
+    # Departures of all pairs on one axis: key * 2 days + seconds, so one searchsorted finds the departures around
+    # every passage, and a departure found under another key means there is none.
+    departures = np.sort(schedule_keys * 2 * DAY_SECONDS + schedule["seconds"].to_numpy(np.int64) % DAY_SECONDS)
+    scheduled = np.full(len(follows), np.nan)
+    if len(departures):
+        positions = passage_keys[follows] * 2 * DAY_SECONDS + times[follows] % DAY_SECONDS
+        after = np.searchsorted(departures, positions)
+        inside = (after > 0) & (after < len(departures))
+        after, before = np.minimum(after, len(departures) - 1), np.maximum(after - 1, 0)
+        inside &= (departures[before] // (2 * DAY_SECONDS) == passage_keys[follows]) \
+            & (departures[after] // (2 * DAY_SECONDS) == passage_keys[follows])
+        scheduled = np.where(inside, departures[after] - departures[before], np.nan)
+
+    headways = passages.iloc[order[follows]].reset_index(drop=True)
+    headways["headway"] = times[follows] - times[follows - 1]
+    headways["scheduled_headway"] = np.where(scheduled > 0, scheduled, np.nan)
+    ratio = headways["headway"] / headways["scheduled_headway"]
+    headways["bunched"] = (ratio < bunching_ratio).to_numpy()
+    headways["gapped"] = (ratio > gap_ratio).to_numpy()
+    return headways
+
+
+def summarise_headways(headways: DataFrame, by: Sequence[str] = (lines, *STOP_COLUMNS)) -> DataFrame:
+    """
+    Regularity of the headways of every group.
+
+    Args:
+    - headways (DataFrame): Headways from compute_headways.
+    - by (Sequence[str]): Columns to group by, the line and the stop by default, e.g. [Lines] for lines.
+
+    Returns:
+    DataFrame: The group columns and headways, mean_headway, std_headway, mean_scheduled_headway (minutes),
+    cv (coefficient of variation of the headways), bunched and gapped (counts), bunched_share and
+    excess_wait (minutes, over the headways with a scheduled headway).
+    """
+    scheduled = headways["scheduled_headway"].notna()
+    minutes = headways["headway"] / 60
+    table = headways[list(by)].assign(
+        minutes=minutes, squared=minutes ** 2,
+        scheduled=headways["scheduled_headway"] / 60, scheduled_squared=(headways["scheduled_headway"] / 60) ** 2,
+        actual=minutes.where(scheduled, 0), actual_squared=(minutes ** 2).where(scheduled, 0),
+        bunched=headways["bunched"], gapped=headways["gapped"])
+    summary = table.groupby(list(by), sort=True).agg(
+        headways=("minutes", "size"), mean_headway=("minutes", "mean"), std_headway=("minutes", "std"),
+        mean_scheduled_headway=("scheduled", "mean"), bunched=("bunched", "sum"), gapped=("gapped", "sum"),
+        actual=("actual", "sum"), actual_squared=("actual_squared", "sum"),
+        scheduled_sum=("scheduled", "sum"), scheduled_squared=("scheduled_squared", "sum")).reset_index()
+    summary["cv"] = summary["std_headway"] / summary["mean_headway"]
+    summary["bunched_share"] = summary["bunched"] / summary["headways"]
+    # Average wait of a passenger arriving at random: sum(h^2) / (2 sum(h)), actual minus scheduled.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary["excess_wait"] = summary["actual_squared"] / (2 * summary["actual"]) \
+            - summary["scheduled_squared"] / (2 * summary["scheduled_sum"])
+    return summary[[*by, "headways", "mean_headway", "std_headway", "mean_scheduled_headway", "cv", "bunched",
+                    "gapped", "bunched_share", "excess_wait"]]
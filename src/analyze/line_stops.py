@@ -0,0 +1,121 @@
+"""
+Stops served by every bus line.
+
+The reverse index built by process_buses_at_stops (LINES_TO_STOPS_FILE) lets proximity and arrival
+matching of a vehicle on a line consider only the stops of that line instead of every stop in Warsaw.
+"""
+import json
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from src.analyze.geo import to_local_metres
+from src.common.config import LINES_TO_STOPS_FILE
+
+__all__ = [
+    "ARRIVAL_RADIUS",
+    "LineStops",
+    "LineStopsIndex"
+]
+
+# A vehicle closer than this (metres) to a stop is at the stop, as in analyze_punctuality_for_a_bus_stop.
+ARRIVAL_RADIUS = 100
+
+
+class LineStops:
+    """Stops of one line as arrays, with their positions projected to metres."""
+
+    def __init__(self, bus_stop_ids: List[str], bus_stop_nrs: List[str], lats: List[float], lons: List[float]) -> None:
+        self.bus_stop_ids = np.array(bus_stop_ids, dtype=object)
+        self.bus_stop_nrs = np.array(bus_stop_nrs, dtype=object)
+        self.lat = np.array(lats, dtype=np.float64)
+        self.lon = np.array(lons, dtype=np.float64)
+        self.x, self.y = to_local_metres(self.lat, self.lon)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def stop(self, index: int) -> Tuple[str, str]:
+        """(busstopId, busstopNr) of a stop."""
+        return self.bus_stop_ids[index], self.bus_stop_nrs[index]
+
+    def distances(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Matrix of distances in metres between positions (rows) and the stops of the line (columns)."""
+        x, y = to_local_metres(np.atleast_1d(lats), np.atleast_1d(lons))
+        return np.hypot(x[:, None] - self.x[None, :], y[:, None] - self.y[None, :])
+
+
+class LineStopsIndex:
+    """
+    The index of stops by line, loaded from LINES_TO_STOPS_FILE.
+
+    Lines are looked up by their string form, so line 138 read by pd.read_json as an integer is line "138".
+    """
+
+    def __init__(self, index: Dict[str, Dict[str, List]]) -> None:
+        self._index = index
+        self._lines: Dict[str, LineStops] = {}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "LineStopsIndex":
+        """
+        Args:
+        - path (str): The index file, LINES_TO_STOPS_FILE of the processed data folder by default.
+        """
+        if path is None:
+            from src.fetch_and_preprocess.file_utils import get_filepath
+            path = get_filepath(LINES_TO_STOPS_FILE, False)
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def lines(self) -> List[str]:
+        return list(self._index)
+
+    def stops(self, line: Hashable) -> Optional[LineStops]:
+        """Stops of a line, None for a line not in the index."""
+        key = str(line)
+        stops = self._lines.get(key)
+        if stops is None and key in self._index:
+            entry = self._index[key]
+            stops = self._lines[key] = LineStops(entry['busstopId'], entry['busstopNr'], entry['lat'], entry['lon'])
+        return stops
+
+    def nearest_stops(self, line: Hashable, lats: np.ndarray,
+                      lons: np.ndarray) -> Tuple[List[Optional[Tuple[str, str]]], np.ndarray]:
+        """
+        Nearest stop of the line to every position.
+
+        Args:
+        - line: The line of the vehicle.
+        - lats, lons (ndarray): Positions of the vehicle.
+
+        Returns:
+        Tuple[List, ndarray]: (busstopId, busstopNr) of the nearest stop of every position (None if the line
+        is unknown) and the distances to them in metres (inf if the line is unknown).
+        """
+        stops = self.stops(line)
+        count = len(np.atleast_1d(lats))
+        if stops is None or not len(stops):
+            return [None] * count, np.full(count, np.inf)
+        distances = stops.distances(lats, lons)
+        nearest = distances.argmin(axis=1)
+        return [stops.stop(index) for index in nearest], distances[np.arange(count), nearest]
+
+    def stops_near(self, line: Hashable, lats: np.ndarray, lons: np.ndarray,
+                   radius: float = ARRIVAL_RADIUS) -> List[Tuple[int, str, str, float]]:
+        """
+        All pairs of a position and a stop of the line closer than the radius.
+
+        Args:
+        - line: The line of the vehicle.
+        - lats, lons (ndarray): Positions of the vehicle.
+        - radius (float): Largest distance in metres.
+
+        Returns:
+        List[Tuple]: (index of the position, busstopId, busstopNr, distance in metres), ordered by position.
+        """
+        stops = self.stops(line)
+        if stops is None or not len(stops):
+            return []
+        distances = stops.distances(lats, lons)
+        positions, stop_indices = np.nonzero(distances < radius)
+        return [(int(position), *stops.stop(stop_index), float(distances[position, stop_index]))
+                for position, stop_index in zip(positions, stop_indices)]
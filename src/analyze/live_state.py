@@ -0,0 +1,279 @@
+"""
+In-memory state of the recent positions of every vehicle, fed by the live poller.
+
+LiveState is a consumer of fetch_and_save_bus_locations: every poll is written into per-vehicle ring buffers
+held in preallocated (vehicles x fixes) arrays, and the current positions are indexed by a grid of square cells
+(their cell codes sorted once per poll, so the vehicles of a cell are one contiguous range). Questions such as
+"where has vehicle X been in the last 15 minutes" or "which buses are within 300 m of stop S now" are then
+answered from memory in microseconds instead of by reading the snapshots in data/raw/buses_live_locations.
+
+    live = LiveState(stops=TimetableStore.load().stops())
+    fetch_and_save_bus_locations(api_key, consumers=[live])
+    live.history(180, 3, minutes=15)
+    live.buses_near_stop("1001", "01", radius=300)
+
+Memory is bounded by capacity x buffer_length: vehicles that stop reporting are forgotten after stale_after seconds,
+and when every slot is taken the vehicles seen least recently give their slots up.
+"""
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from pandas import DataFrame, notna
+from src.analyze.analyze_avg_speed import vehicle_key
+from src.analyze.compact_locations import epoch_seconds
+from src.analyze.dictionary_data import brigade, lat, lines, lon, time, timestamp
+from src.analyze.geo import to_local_metres
+from src.common.log import get_logger
+from src.fetch_and_preprocess.process_data import stop_code
+
+__all__ = [
+    "DEFAULT_CAPACITY",
+    "DEFAULT_BUFFER_LENGTH",
+    "GRID_CELL_SIZE",
+    "STALE_SECONDS",
+    "LiveState"
+]
+
+logger = get_logger(__name__)
+
+# Vehicles tracked at once; Warsaw has about 1,500 buses in service at peak.
+DEFAULT_CAPACITY = 4096
+# Fixes kept per vehicle: an hour of polls every minute.
+DEFAULT_BUFFER_LENGTH = 64
+# Side of a cell of the grid of current positions, in metres.
+GRID_CELL_SIZE = 250
+# Vehicles that have not reported for this long (seconds) are forgotten, as in SpeedingDetector.
+STALE_SECONDS = 10 * 60
+
+_FREE = -1
+
+
+class LiveState:
+    """
+    Ring buffers of the recent fixes of every vehicle and a grid of their current positions.
+
+    Vehicles are keyed by vehicle_key(line, brigade), as in group_by_bus. Fix times are seconds since the epoch of
+    the local time of the fix, as the Timestamp of compact_locations. Updates and queries may come from different
+    threads.
+
+    Args:
+    - capacity (int): Largest number of vehicles tracked at once.
+    - buffer_length (int): Fixes kept per vehicle.
+    - cell_size (float): Side of a grid cell in metres.
+    - stale_after (float): Seconds without a fix after which a vehicle is forgotten.
+    - stops (DataFrame): Bus stops with positions (TimetableStore.stops()), for buses_near_stop.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, buffer_length: int = DEFAULT_BUFFER_LENGTH,
+                 cell_size: float = GRID_CELL_SIZE, stale_after: float = STALE_SECONDS,
+                 stops: Optional[DataFrame] = None) -> None:
+        self.capacity, self.buffer_length = capacity, buffer_length
+        self.cell_size, self.stale_after = cell_size, stale_after
+        self.times = np.zeros((capacity, buffer_length), dtype=np.int64)
+        self.lats = np.zeros((capacity, buffer_length), dtype=np.float64)
+        self.lons = np.zeros((capacity, buffer_length), dtype=np.float64)
+        # Position of the next write and number of fixes in every ring buffer.
+        self.heads = np.zeros(capacity, dtype=np.int64)
+        self.sizes = np.zeros(capacity, dtype=np.int64)
+        # Time of the latest fix of every slot, _FREE for a free slot.
+        self.last_seen = np.full(capacity, _FREE, dtype=np.int64)
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self._slots: Dict[Tuple[Hashable, Hashable], int] = {}
+        self._keys: List[Optional[Tuple[Hashable, Hashable]]] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._grid_cells = np.empty(0, dtype=np.int64)
+        self._grid_slots = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        self.now: Optional[int] = None
+        self.skipped_points = 0
+        self.stops: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        if stops is not None:
+            self.stops = {(stop_code(bus_stop_id, 4), stop_code(bus_stop_nr, 2)): (stop_lat, stop_lon)
+                          for bus_stop_id, bus_stop_nr, stop_lat, stop_lon
+                          in stops[["busstopId", "busstopNr", "szer_geo", "dlug_geo"]].itertuples(index=False)
+                          if notna(stop_lat) and notna(stop_lon)}
+
+    def __call__(self, records: List[Dict[str, Any]]) -> int:
+        return self.update(records)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the preallocated arrays, fixed at construction."""
+        return sum(array.nbytes for array in (self.times, self.lats, self.lons, self.heads, self.sizes,
+                                              self.last_seen, self.x, self.y))
+
+    def _slot(self, key: Tuple[Hashable, Hashable]) -> int:
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if not self._free:
+            return _FREE
+        slot = self._free.pop()
+        self._slots[key] = slot
+        self._keys[slot] = key
+        self.heads[slot] = self.sizes[slot] = 0
+        return slot
+
+    def _make_room(self, keys: List[Tuple[Hashable, Hashable]]) -> None:
+        # Vehicles seen least recently, and not in this poll, give their slots up to the new vehicles.
+        missing = len(set(keys).difference(self._slots)) - len(self._free)
+        if missing <= 0:
+            return
+        in_poll = set(keys)
+        for slot in np.argsort(self.last_seen, kind='stable'):
+            if missing <= 0:
+                break
+            if self._keys[slot] is not None and self._keys[slot] not in in_poll:
+                self._release(int(slot))
+                missing -= 1
+
+    def _release(self, slot: int) -> None:
+        del self._slots[self._keys[slot]]
+        self._keys[slot] = None
+        self.last_seen[slot] = _FREE
+        self._free.append(slot)
+
+    def _cells(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return np.floor(y / self.cell_size).astype(np.int64), np.floor(x / self.cell_size).astype(np.int64)
+
+    def update(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Add the fixes of a poll. Fixes not newer than the latest fix of their vehicle are skipped: the API
+        repeats the last fix of a vehicle until it reports again.
+
+        Args:
+        - records (List[Dict]): Bus location dictionaries with Lines, Brigade, Lat, Lon and Time keys, filtered
+          as in the processed buses_live_locations files.
+
+        Returns:
+        int: Number of fixes added.
+        """
+        if not records:
+            return 0
+        fix_times = epoch_seconds(record[time] for record in records).astype(np.int64)
+        fix_lats = np.array([record[lat] for record in records], dtype=np.float64)
+        fix_lons = np.array([record[lon] for record in records], dtype=np.float64)
+        keys = [vehicle_key(record[lines], record[brigade]) for record in records]
+        with self._lock:
+            self._make_room(keys)
+            # Vehicles beyond the capacity (a poll of more vehicles than slots) get _FREE and are skipped.
+            slots = np.array([self._slot(key) for key in keys], dtype=np.int64)
+            # The newest fix of every vehicle in the poll, if newer than its latest fix.
+            order = np.lexsort((fix_times, slots))
+            last = order[np.concatenate([slots[order][1:] != slots[order][:-1], [True]])]
+            last = last[slots[last] != _FREE]
+            newer = last[fix_times[last] > self.last_seen[slots[last]]]
+            self.skipped_points += len(records) - len(newer)
+            slots, fix_times = slots[newer], fix_times[newer]
+
+            heads = self.heads[slots]
+            self.times[slots, heads] = fix_times
+            self.lats[slots, heads] = fix_lats[newer]
+            self.lons[slots, heads] = fix_lons[newer]
+            self.heads[slots] = (heads + 1) % self.buffer_length
+            self.sizes[slots] = np.minimum(self.sizes[slots] + 1, self.buffer_length)
+            self.last_seen[slots] = fix_times
+            self.x[slots], self.y[slots] = to_local_metres(fix_lats[newer], fix_lons[newer])
+            if len(fix_times):
+                self.now = max(self.now or 0, int(fix_times.max()))
+            self._forget_stale()
+            self._index_positions()
+        return len(newer)
+
+    def _forget_stale(self) -> None:
+        if self.now is None:
+            return
+        for slot in np.flatnonzero((self.last_seen != _FREE) & (self.last_seen < self.now - self.stale_after)):
+            self._release(int(slot))
+
+    def _index_positions(self) -> None:
+        slots = np.flatnonzero(self.last_seen != _FREE)
+        rows, cols = self._cells(self.x[slots], self.y[slots])
+        # One code per cell, ordered by row and then column, so a row of cells is one range of codes.
+        cells = (rows << 32) + cols
+        order = np.argsort(cells, kind='stable')
+        self._grid_cells, self._grid_slots = cells[order], slots[order]
+
+    def history(self, bus_line: Hashable, bus_brigade: Hashable,
+                minutes: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Recent fixes of a vehicle.
+
+        Args:
+        - bus_line, bus_brigade: The vehicle.
+        - minutes (float): Only the fixes of the last minutes before the newest fix of the state; all kept fixes
+          by default.
+
+        Returns:
+        Tuple[ndarray, ndarray, ndarray]: Times (seconds since the epoch), latitudes and longitudes of the fixes,
+        oldest first; empty for an unknown vehicle.
+        """
+        with self._lock:
+            slot = self._slots.get(vehicle_key(bus_line, bus_brigade))
+            if slot is None:
+                return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+            head, size = int(self.heads[slot]), int(self.sizes[slot])
+            if size < self.buffer_length:
+                # The buffer has not wrapped around yet: its fixes are the first size ones.
+                rows = [array[slot, :size].copy() for array in (self.times, self.lats, self.lons)]
+            else:
+                rows = [np.concatenate((array[slot, head:], array[slot, :head]))
+                        for array in (self.times, self.lats, self.lons)]
+            if minutes is not None:
+                # Fixes are in time order, so the window is a suffix of them.
+                start = int(np.searchsorted(rows[0], self.now - minutes * 60))
+                rows = [row[start:] for row in rows]
+            return rows[0], rows[1], rows[2]
+
+    def buses_near(self, lat_value: float, lon_value: float, radius: float) -> List[Dict[str, Any]]:
+        """
+        Vehicles whose current position is within a radius of a point.
+
+        Args:
+        - lat_value, lon_value (float): The point in degrees.
+        - radius (float): Radius in metres.
+
+        Returns:
+        List[Dict]: Lines, Brigade, distance (metres), Timestamp, Lat and Lon of the latest fix of every vehicle
+        within the radius, nearest first.
+        """
+        x, y = to_local_metres(lat_value, lon_value)
+        row_min, col_min = self._cells(x - radius, y - radius)
+        row_max, col_max = self._cells(x + radius, y + radius)
+        with self._lock:
+            cells = self._grid_cells
+            row_codes = np.arange(row_min, row_max + 1, dtype=np.int64) << 32
+            starts = np.searchsorted(cells, row_codes + col_min, side='left')
+            ends = np.searchsorted(cells, row_codes + col_max, side='right')
+            slots = np.concatenate([self._grid_slots[start:end] for start, end in zip(starts, ends)])
+            distances = np.hypot(self.x[slots] - x, self.y[slots] - y)
+            near = np.argsort(distances)
+            near = near[distances[near] <= radius]
+            result = []
+            for index in near:
+                slot = slots[index]
+                head = (self.heads[slot] - 1) % self.buffer_length
+                bus_line, bus_brigade = self._keys[slot]
+                result.append({lines: bus_line, brigade: bus_brigade, "distance": float(distances[index]),
+                               timestamp: int(self.last_seen[slot]), lat: float(self.lats[slot, head]),
+                               lon: float(self.lons[slot, head])})
+            return result
+
+    def buses_near_stop(self, bus_stop_id: Any, bus_stop_nr: Any, radius: float) -> List[Dict[str, Any]]:
+        """
+        Vehicles within a radius of a bus stop, see buses_near.
+
+        Raises:
+        KeyError: The stop is not among the stops of the state.
+        """
+        stop_lat, stop_lon = self.stops[(stop_code(bus_stop_id, 4), stop_code(bus_stop_nr, 2))]
+        return self.buses_near(stop_lat, stop_lon, radius)
+
+    def vehicles(self) -> List[Tuple[Hashable, Hashable]]:
+        """Keys of the vehicles tracked now."""
+        with self._lock:
+            return list(self._slots)
@@ -0,0 +1,450 @@
+"""
+Pre-aggregated metrics cube of speeds and delays.
+
+Speeds of the segments between consecutive locations of a vehicle and delays of matched arrivals are
+aggregated into count, sum, sum of squares, minimum and maximum, keyed by metric, line, date, hour of day and
+a square cell of a grid laid over the Warsaw bounds (as in speeding_grid, but coarser). Segments in the speeding
+band of analyze_speeding are also aggregated as a metric of their own, so their counts locate speeding hotspots.
+Each processed hour is aggregated once into a partition file; the cube is the union of the partitions, and any
+question such as
+"average speed of line 180 at 8:00" or "mean delay in an area" is answered by rolling the matching rows up,
+without touching the raw locations again. Means and standard deviations are derived from the rolled-up sums.
+
+Timetables are crawled daily and describe the day they were crawled on, so a partition stores the date of the
+timetables its delays were computed with. It is aggregated again when its locations change, or when delays are
+requested and it has none yet or the timetables of the hour's own day have become available.
+"""
+import os
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import group_by_bus
+from src.analyze.analyze_punctuality import arrival_delays
+from src.analyze.analyze_speeding import SPEEDING_MIN_SPEED, SPEEDING_MAX_SPEED
+from src.analyze.compact_locations import from_compact, read_locations_compact
+from src.analyze.dictionary_data import brigade, lat, lines, lon, time, timestamp
+from src.analyze.geo import to_local_metres
+from src.analyze.speeding_grid import grid_edges
+from src.common.metrics import timed
+
+__all__ = [
+    "CUBE_CELL_SIZE",
+    "SPEED",
+    "DELAY",
+    "SPEEDING",
+    "DIMENSIONS",
+    "MEASURES",
+    "cube_cells",
+    "cells_in_box",
+    "cell_bounds",
+    "speed_facts",
+    "delay_facts",
+    "aggregate_facts",
+    "hour_partition",
+    "timetable_date",
+    "roll_up",
+    "MetricsCube"
+]
+
+# Side of a cube cell in metres; coarse enough to keep an hour partition small.
+CUBE_CELL_SIZE = 1000
+
+SPEED = "speed"
+DELAY = "delay"
+SPEEDING = "speeding"
+
+DIMENSIONS = ("metric", "line", "date", "hour", "cell")
+MEASURES = ("count", "sum", "sumsq", "min", "max")
+
+# Segments longer than this (seconds) span gaps in the data and are not counted.
+MAX_SEGMENT_GAP = 300
+# Segment speeds above this (km/h) are GPS jumps.
+MAX_SEGMENT_SPEED = 120
+
+CUBE_FILE_EXTENSION = ".npz"
+
+_COLUMN_TYPES = {"metric": str, "line": str, "date": str, "hour": np.int8, "cell": np.int32, "count": np.int64,
+                 "sum": np.float64, "sumsq": np.float64, "min": np.float64, "max": np.float64}
+
+
+def cube_cells(lats: Sequence[float], lons: Sequence[float], cell_size: float = CUBE_CELL_SIZE) -> np.ndarray:
+    """
+    Flat index (row * columns + column) of the grid cell of every position, -1 outside the Warsaw bounds.
+
+    Args:
+    - lats, lons (Sequence[float]): Positions in degrees.
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    ndarray: Cell indices.
+    """
+    lat_edges, lon_edges = grid_edges(cell_size)
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    rows = np.searchsorted(lat_edges, lats, side='right') - 1
+    cols = np.searchsorted(lon_edges, lons, side='right') - 1
+    inside = (rows >= 0) & (rows < len(lat_edges) - 1) & (cols >= 0) & (cols < len(lon_edges) - 1)
+    return np.where(inside, rows * (len(lon_edges) - 1) + cols, -1)
+
+
+def cells_in_box(lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+                 cell_size: float = CUBE_CELL_SIZE) -> np.ndarray:
+    """
+    Indices of the cells overlapping a bounding box.
+
+    Args:
+    - lat_min, lat_max, lon_min, lon_max (float): The box in degrees.
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    ndarray: Cell indices, ascending.
+    """
+    lat_edges, lon_edges = grid_edges(cell_size)
+    rows = np.arange(len(lat_edges) - 1)
+    cols = np.arange(len(lon_edges) - 1)
+    rows = rows[(lat_edges[1:] > lat_min) & (lat_edges[:-1] < lat_max)]
+    cols = cols[(lon_edges[1:] > lon_min) & (lon_edges[:-1] < lon_max)]
+    return (rows[:, None] * (len(lon_edges) - 1) + cols[None, :]).ravel()
+
+
+def cell_bounds(cells: Sequence[int], cell_size: float = CUBE_CELL_SIZE) -> Tuple[np.ndarray, np.ndarray,
+                                                                                  np.ndarray, np.ndarray]:
+    """
+    Bounds of cells given by their indices.
+
+    Returns:
+    Tuple[ndarray, ndarray, ndarray, ndarray]: Minimum and maximum latitudes, minimum and maximum longitudes.
+    """
+    lat_edges, lon_edges = grid_edges(cell_size)
+    rows, cols = np.divmod(np.asarray(cells, dtype=np.int64), len(lon_edges) - 1)
+    return lat_edges[rows], lat_edges[rows + 1], lon_edges[cols], lon_edges[cols + 1]
+
+
+@timed()
+def speed_facts(df: DataFrame, cell_size: float = CUBE_CELL_SIZE) -> DataFrame:
+    """
+    Speeds of the segments between consecutive locations of every vehicle.
+
+    Args:
+    - df (DataFrame): Compact bus locations (see compact_locations) or combined bus locations, as returned by
+      combine_bus_locations_within_hour.
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    DataFrame: Columns line, date, hour, cell and value (km/h). A segment is keyed by the time of its end
+    and the cell of its midpoint.
+    """
+    if timestamp not in df.columns:
+        df = df.assign(**{timestamp: pd.to_datetime(df[time]).to_numpy().astype('datetime64[s]').astype(np.int64)})
+    df = df.sort_values([lines, brigade, timestamp], kind='stable')
+    x, y = to_local_metres(df[lat].to_numpy(), df[lon].to_numpy())
+    seconds = df[timestamp].to_numpy().astype(np.int64)
+    line_values = df[lines].astype(str).to_numpy()
+    same_vehicle = (line_values[1:] == line_values[:-1]) & \
+        (df[brigade].astype(str).to_numpy()[1:] == df[brigade].astype(str).to_numpy()[:-1])
+    dt = np.diff(seconds)
+    speeds = np.hypot(np.diff(x), np.diff(y)) / np.maximum(dt, 1) * 3.6
+    valid = same_vehicle & (dt > 0) & (dt <= MAX_SEGMENT_GAP) & (speeds <= MAX_SEGMENT_SPEED)
+
+    lats, lons = df[lat].to_numpy(np.float64), df[lon].to_numpy(np.float64)
+    ends = seconds[1:][valid]
+    return DataFrame({
+        "line": line_values[1:][valid],
+        "date": ends.astype('datetime64[s]').astype('datetime64[D]').astype(str),
+        "hour": ends // 3600 % 24,
+        "cell": cube_cells((lats[1:] + lats[:-1])[valid] / 2, (lons[1:] + lons[:-1])[valid] / 2, cell_size),
+        "value": speeds[valid]
+    })
+
+
+@timed()
+def delay_facts(df_locations: DataFrame, df_bus_stop_info: DataFrame, date: str,
+                cell_size: float = CUBE_CELL_SIZE) -> DataFrame:
+    """
+    Delays of the arrivals matched at every bus stop, as in analyze_punctuality_for_a_bus_stop.
+
+    Args:
+    - df_locations (DataFrame): Bus locations grouped by group_by_bus.
+    - df_bus_stop_info (DataFrame): Bus stop coordinates merged with the timetables (as in cached_punctuality).
+    - date (str): Date of the locations ("YYYY-MM-DD").
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    DataFrame: Columns line, date, hour (of the expected arrival), cell (of the stop) and value (minutes).
+    """
+    rows = []
+    cells = cube_cells(df_bus_stop_info['szer_geo'], df_bus_stop_info['dlug_geo'], cell_size)
+    for cell, (_, row) in zip(cells, df_bus_stop_info.iterrows()):
+        for line, expected_time, delay in arrival_delays(df_locations, row, 'rozklad', 'szer_geo', 'dlug_geo'):
+            rows.append((line, date, int(expected_time[:2]) % 24, cell, delay))
+    return DataFrame(rows, columns=["line", "date", "hour", "cell", "value"])
+
+
+def aggregate_facts(facts: DataFrame, metric: str) -> DataFrame:
+    """
+    Aggregate facts of one metric into cube rows.
+
+    Args:
+    - facts (DataFrame): Facts as returned by speed_facts or delay_facts.
+    - metric (str): SPEED, DELAY or SPEEDING.
+
+    Returns:
+    DataFrame: One row per line, date, hour and cell with the DIMENSIONS and MEASURES columns.
+    """
+    if facts.empty:
+        return DataFrame({column: [] for column in DIMENSIONS + MEASURES})
+    grouped = facts.assign(squared=facts["value"] ** 2).groupby(["line", "date", "hour", "cell"], sort=False)
+    rows = grouped.agg(count=("value", "size"), sum=("value", "sum"), sumsq=("squared", "sum"),
+                       min=("value", "min"), max=("value", "max")).reset_index()
+    rows.insert(0, "metric", metric)
+    return rows[list(DIMENSIONS + MEASURES)]
+
+
+@timed()
+def hour_partition(folder: str, bus_stops_coordinates_file: Optional[str] = None,
+                   timetables_file: Optional[str] = None, cell_size: float = CUBE_CELL_SIZE) -> DataFrame:
+    """
+    Cube rows of one processed hour folder.
+
+    Args:
+    - folder (str): Processed hour folder, named "YYYY-MM-DD HH".
+    - bus_stops_coordinates_file, timetables_file (str): Processed stop coordinates and timetables; delays
+      are aggregated only if both are given.
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    DataFrame: Cube rows of the speeds, the speeding segments and, optionally, of the delays.
+    """
+    df = read_locations_compact(folder)
+    speeds = speed_facts(df, cell_size)
+    speeding = speeds[(speeds["value"] > SPEEDING_MIN_SPEED) & (speeds["value"] < SPEEDING_MAX_SPEED)]
+    partitions = [aggregate_facts(speeds, SPEED), aggregate_facts(speeding, SPEEDING)]
+    if bus_stops_coordinates_file and timetables_file:
+        df_bus_stop_info = pd.merge(pd.read_json(bus_stops_coordinates_file), pd.read_json(timetables_file),
+                                    left_on=["zespol", "slupek"], right_on=["busstopId", "busstopNr"])
+        date = os.path.basename(os.path.normpath(folder))[:10]
+        partitions.append(aggregate_facts(delay_facts(group_by_bus(from_compact(df)), df_bus_stop_info, date,
+                                                      cell_size), DELAY))
+    return pd.concat(partitions, ignore_index=True)
+
+
+def timetable_date(timetables_file: str) -> str:
+    """Date ("YYYY-MM-DD") the processed timetables were written on, which is the day they describe."""
+    return date.fromtimestamp(os.path.getmtime(timetables_file)).isoformat()
+
+
+def roll_up(rows: DataFrame, by: Sequence[str] = ()) -> DataFrame:
+    """
+    Roll cube rows up to the given dimensions.
+
+    Counts, sums and sums of squares add up, minimums and maximums are taken over the rolled-up rows.
+
+    Args:
+    - rows (DataFrame): Cube rows.
+    - by (Sequence[str]): Dimensions to keep; all the others are rolled up. Empty for a single total.
+
+    Returns:
+    DataFrame: The kept dimensions, the MEASURES and the derived mean and std columns.
+    """
+    aggregations = {"count": ("count", "sum"), "sum": ("sum", "sum"), "sumsq": ("sumsq", "sum"),
+                    "min": ("min", "min"), "max": ("max", "max")}
+    if by:
+        result = rows.groupby(list(by), sort=True, observed=True).agg(**aggregations).reset_index()
+    else:
+        result = DataFrame([{name: getattr(rows[column], function)() for name, (column, function)
+                             in aggregations.items()}])
+    count = result["count"].where(result["count"] > 0)
+    result["mean"] = result["sum"] / count
+    result["std"] = np.sqrt(np.maximum(result["sumsq"] / count - result["mean"] ** 2, 0))
+    return result
+
+
+class MetricsCube:
+    """
+    The cube stored as one partition file per processed hour in a folder, e.g. data/processed/metrics_cube.
+
+    Partitions are loaded once and kept in memory; update adds the hours that are new or were re-processed.
+    """
+
+    def __init__(self, cube_folder: str, cell_size: float = CUBE_CELL_SIZE) -> None:
+        self.cube_folder = cube_folder
+        self.cell_size = cell_size
+        self._rows: Optional[DataFrame] = None
+        self._signature: Optional[str] = None
+
+    def _partition_path(self, hour: str) -> str:
+        return os.path.join(self.cube_folder, hour + CUBE_FILE_EXTENSION)
+
+    def hours(self) -> List[str]:
+        """Hour labels ("YYYY-MM-DD HH") of the stored partitions."""
+        if not os.path.isdir(self.cube_folder):
+            return []
+        return sorted(filename[:-len(CUBE_FILE_EXTENSION)] for filename in os.listdir(self.cube_folder)
+                      if filename.endswith(CUBE_FILE_EXTENSION))
+
+    def stored_timetable_date(self, hour: str) -> str:
+        """Date of the timetables the delays of a stored partition were computed with, empty without delays."""
+        with np.load(self._partition_path(hour)) as partition:
+            return str(partition["timetable_date"]) if "timetable_date" in partition.files else ""
+
+    def is_stale(self, hour_folder: str, timetables_date: Optional[str] = None) -> bool:
+        """
+        Whether the partition of an hour folder has to be aggregated again.
+
+        Only the hour's own location files are compared with the partition, so the daily rewrite of the
+        timetables does not make the partitions of earlier days stale.
+
+        Args:
+        - hour_folder (str): Processed hour folder, named "YYYY-MM-DD HH".
+        - timetables_date (str): Date of the current timetables (see timetable_date) if delays are wanted.
+
+        Returns:
+        bool: True if the partition is missing or older than the folder or its files, or if delays are wanted
+        and the partition has none or the current timetables are those of the hour's own day.
+        """
+        hour = os.path.basename(os.path.normpath(hour_folder))
+        path = self._partition_path(hour)
+        if not os.path.exists(path):
+            return True
+        paths = [hour_folder] + [os.path.join(hour_folder, name) for name in os.listdir(hour_folder)]
+        if max(os.path.getmtime(path) for path in paths) > os.path.getmtime(path):
+            return True
+        if timetables_date is None:
+            return False
+        stored = self.stored_timetable_date(hour)
+        return not stored or (stored != timetables_date and timetables_date == hour[:10])
+
+    def save_partition(self, hour: str, rows: DataFrame, timetables_date: str = "") -> str:
+        """
+        Store the cube rows of one hour, replacing its previous partition.
+
+        Args:
+        - hour (str): Hour label ("YYYY-MM-DD HH").
+        - rows (DataFrame): Cube rows, see hour_partition.
+        - timetables_date (str): Date of the timetables of the delays among the rows, empty without delays.
+
+        Returns:
+        str: Path of the saved file.
+        """
+        os.makedirs(self.cube_folder, exist_ok=True)
+        path = self._partition_path(hour)
+        np.savez_compressed(path, cell_size=self.cell_size, timetable_date=timetables_date,
+                            **{column: rows[column].to_numpy().astype(column_type)
+                               for column, column_type in _COLUMN_TYPES.items()})
+        self._rows = None
+        return path
+
+    def load_partition(self, hour: str) -> DataFrame:
+        """
+        Cube rows of one hour.
+
+        Raises:
+        ValueError: If the partition was created with a different cell size.
+        """
+        with np.load(self._partition_path(hour)) as partition:
+            if float(partition["cell_size"]) != self.cell_size:
+                raise ValueError(f"Partition {hour} has cell size {float(partition['cell_size'])} m, "
+                                 f"expected {self.cell_size} m")
+            return DataFrame({column: partition[column] for column in DIMENSIONS + MEASURES})
+
+    @timed(stage="metrics_cube_update")
+    def update(self, hour_folders: Iterable[str], bus_stops_coordinates_file: Optional[str] = None,
+               timetables_file: Optional[str] = None, force: bool = False) -> List[str]:
+        """
+        Aggregate the hour folders whose partitions are missing or out of date.
+
+        Args:
+        - hour_folders (Iterable[str]): Processed hour folders.
+        - bus_stops_coordinates_file, timetables_file (str): Inputs of the delays, see hour_partition.
+        - force (bool): Aggregate every folder again.
+
+        Returns:
+        List[str]: Hour labels of the updated partitions.
+        """
+        os.makedirs(self.cube_folder, exist_ok=True)
+        delays = bool(bus_stops_coordinates_file and timetables_file)
+        timetables_date = timetable_date(timetables_file) if delays else None
+        updated = []
+        for folder in hour_folders:
+            if not force and not self.is_stale(folder, timetables_date):
+                continue
+            hour = os.path.basename(os.path.normpath(folder))
+            self.save_partition(hour, hour_partition(folder, bus_stops_coordinates_file, timetables_file,
+                                                     self.cell_size), timetables_date or "")
+            updated.append(hour)
+        return updated
+
+    @property
+    def rows(self) -> DataFrame:
+        """All cube rows, with categorical metric and line columns for fast filtering."""
+        if self._rows is None:
+            partitions = [self.load_partition(hour) for hour in self.hours()]
+            rows = pd.concat(partitions, ignore_index=True) if partitions else \
+                DataFrame({column: [] for column in DIMENSIONS + MEASURES})
+            rows = rows.astype({column: ("category" if column_type is str else column_type)
+                                for column, column_type in _COLUMN_TYPES.items()})
+            self._rows = rows
+        return self._rows
+
+    def query(self, metric: str = SPEED, by: Sequence[str] = (), bus_lines: Optional[Iterable] = None,
+              hours: Optional[Iterable[int]] = None, start: Optional[str] = None, end: Optional[str] = None,
+              bbox: Optional[Tuple[float, float, float, float]] = None,
+              rows: Optional[DataFrame] = None) -> DataFrame:
+        """
+        Statistics of a metric over a slice of the cube, rolled up to the given dimensions.
+
+        Args:
+        - metric (str): SPEED (km/h), DELAY (minutes) or SPEEDING (speeds of the speeding segments).
+        - by (Sequence[str]): Dimensions to group by, e.g. ("line", "hour"); empty for a single total.
+        - bus_lines (Iterable): Lines to include (any form, e.g. 180 or "180"); None for all.
+        - hours (Iterable[int]): Hours of day to include; None for all.
+        - start, end (str): First and last hour to include, "YYYY-MM-DD HH" or a whole day "YYYY-MM-DD";
+          None means unbounded.
+        - bbox (Tuple[float, float, float, float]): (lat_min, lat_max, lon_min, lon_max) of the cells to include.
+        - rows (DataFrame): Cube rows to query, e.g. taken earlier from the rows property; the current rows
+          by default.
+
+        Returns:
+        DataFrame: See roll_up.
+        """
+        rows = self.rows if rows is None else rows
+        mask = (rows["metric"] == metric).to_numpy()
+        if bus_lines is not None:
+            mask &= rows["line"].isin([str(line) for line in bus_lines]).to_numpy()
+        if hours is not None:
+            mask &= rows["hour"].isin(list(hours)).to_numpy()
+        if start is not None:
+            mask &= self._after(rows, start[:10], int(start[11:13] or 0))
+        if end is not None:
+            mask &= ~self._after(rows, end[:10], int(end[11:13] or 23) + 1)
+        if bbox is not None:
+            mask &= rows["cell"].isin(cells_in_box(*bbox, cell_size=self.cell_size)).to_numpy()
+        return roll_up(rows[mask], by)
+
+    @staticmethod
+    def _after(rows: DataFrame, date: str, hour: int) -> np.ndarray:
+        """Mask of the rows at or after an hour of a date."""
+        later_dates = [category for category in rows["date"].cat.categories if category > date]
+        return (rows["date"].isin(later_dates) | ((rows["date"] == date) & (rows["hour"] >= hour))).to_numpy()
+
+    def refresh(self) -> str:
+        """
+        Drop the loaded rows if partitions were added, replaced or removed since they were loaded.
+
+        Returns:
+        str: Signature of the stored partitions (names, sizes and modification times).
+        """
+        signature = []
+        for hour in self.hours():
+            stat = os.stat(self._partition_path(hour))
+            signature.append(f"{hour}:{stat.st_size}:{stat.st_mtime_ns}")
+        signature = ";".join(signature)
+        if signature != self._signature:
+            self._rows = None
+            self._signature = signature
+        return signature
+
+    def summary(self) -> Dict[str, int]:
+        """Number of hours and rows in the cube."""
+        return {"hours": len(self.hours()), "rows": len(self.rows)}
@@ -0,0 +1,330 @@
+"""
+Read-only HTTP query service over the metrics cube.
+
+One process holds the cube in memory and answers the queries of every analyst and dashboard, so nobody loads
+result files whole any more:
+
+    GET /avg-speed?line=180&start=2024-02-26 08&end=2024-02-26 12&by=hour
+    GET /delay?bbox=52.22,52.24,20.98,21.02&by=line
+    GET /speeding-hotspots?line=180&line=523&limit=20
+    GET /status
+
+Every endpoint accepts repeatable line parameters, start and end hours ("YYYY-MM-DD HH" or a day), hour (hours
+of day), bbox (LAT_MIN,LAT_MAX,LON_MIN,LON_MAX) and by (dimensions to group by, comma separated). Results are
+JSON arrays of records. They are kept in an in-memory LRU cache keyed by the query and the version of the cube;
+the ETag is derived from the same key, so an unchanged result is revalidated with 304 Not Modified without being
+computed. Results with many rows are streamed with chunked transfer encoding.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from pandas import DataFrame
+from src.analyze.metrics_cube import DELAY, SPEED, SPEEDING, MetricsCube, cell_bounds
+from src.common.log import get_logger
+from src.common.metrics import QUERY_LATENCY, QUERY_REQUESTS
+
+__all__ = [
+    "DEFAULT_PORT",
+    "QueryError",
+    "LRUCache",
+    "QueryStore",
+    "QueryHandler",
+    "make_server",
+    "serve"
+]
+
+logger = get_logger(__name__)
+
+DEFAULT_PORT = 8050
+# Number of results kept in memory.
+CACHE_SIZE = 256
+# Results with more rows than this are streamed in batches of this many rows.
+STREAM_ROWS = 1000
+# Seconds between checks of the cube folder for new or re-processed hours.
+REFRESH_INTERVAL = 5
+HOTSPOTS_LIMIT = 50
+
+ENDPOINTS = {"/avg-speed": SPEED, "/delay": DELAY, "/speeding-hotspots": SPEEDING}
+GROUP_BY = ("line", "date", "hour", "cell")
+
+
+class QueryError(ValueError):
+    """A query parameter is missing or malformed."""
+
+
+class LRUCache:
+    """A thread-safe mapping that keeps the most recently used entries."""
+
+    def __init__(self, max_size: int = CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _parse_hour_label(value: str) -> str:
+    if len(value) not in (10, 13) or not value[:4].isdigit() or (len(value) == 13 and not value[11:].isdigit()):
+        raise QueryError(f'{value!r} is not an hour "YYYY-MM-DD HH" or a day "YYYY-MM-DD"')
+    return value
+
+
+def parse_query(endpoint: str, params: Dict[str, List[str]]) -> Tuple:
+    """
+    Canonical form of the parameters of a query, used as its cache key.
+
+    Raises:
+    QueryError: If a parameter is malformed.
+    """
+    try:
+        bus_lines = tuple(sorted({line for value in params.get("line", []) for line in value.split(",") if line}))
+        hours = tuple(sorted({int(hour) for value in params.get("hour", []) for hour in value.split(",")}))
+        bbox = tuple(float(value) for value in params["bbox"][-1].split(",")) if "bbox" in params else None
+        limit = int(params.get("limit", [HOTSPOTS_LIMIT])[-1])
+    except ValueError as e:
+        raise QueryError(f"Malformed parameter: {e}")
+    if bbox is not None and len(bbox) != 4:
+        raise QueryError("bbox needs LAT_MIN,LAT_MAX,LON_MIN,LON_MAX")
+    by = tuple(dimension for value in params.get("by", []) for dimension in value.split(",") if dimension)
+    unknown = set(by) - set(GROUP_BY)
+    if unknown:
+        raise QueryError(f"Unknown dimensions {sorted(unknown)}; use {', '.join(GROUP_BY)}")
+    start = _parse_hour_label(params["start"][-1]) if "start" in params else None
+    end = _parse_hour_label(params["end"][-1]) if "end" in params else None
+    return endpoint, bus_lines or None, hours or None, start, end, bbox, by, limit
+
+
+class QueryStore:
+    """
+    The cube shared by all request threads, with the cache of query results.
+
+    The cube is loaded once and reloaded only when its partitions change, checked at most every
+    refresh_interval seconds.
+    """
+
+    def __init__(self, cube: MetricsCube, cache_size: int = CACHE_SIZE,
+                 refresh_interval: float = REFRESH_INTERVAL) -> None:
+        self.cube = cube
+        self.cache = LRUCache(cache_size)
+        self.refresh_interval = refresh_interval
+        self._version = ""
+        self._rows: Optional[DataFrame] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Tuple[str, DataFrame]:
+        """
+        Version and rows of the loaded cube, taken together; the cube is (re)loaded here, never while a query runs.
+
+        A query computed on the returned rows belongs to the returned version even if the cube is reloaded
+        meanwhile.
+        """
+        with self._lock:
+            if self._rows is None or time.monotonic() - self._checked >= self.refresh_interval:
+                self._version = hashlib.sha1(self.cube.refresh().encode()).hexdigest()[:16]
+                self._rows = self.cube.rows
+                self._checked = time.monotonic()
+            return self._version, self._rows
+
+    def version(self) -> str:
+        """Version of the loaded cube."""
+        return self.snapshot()[0]
+
+    def etag(self, key: Tuple, version: Optional[str] = None) -> str:
+        """ETag of the result of a parsed query in a version of the cube, the current one by default."""
+        version = self.version() if version is None else version
+        return '"' + hashlib.sha1(repr((version, key)).encode()).hexdigest()[:20] + '"'
+
+    def result(self, key: Tuple, snapshot: Optional[Tuple[str, DataFrame]] = None) -> Tuple[DataFrame, bool]:
+        """
+        Result of a parsed query.
+
+        Args:
+        - key (Tuple): The query, see parse_query.
+        - snapshot (Tuple[str, DataFrame]): Version and rows to answer from, see snapshot; the current ones
+          by default.
+
+        Returns:
+        Tuple[DataFrame, bool]: The result and whether it came from the cache.
+        """
+        version, rows = snapshot or self.snapshot()
+        cache_key = (version, key)
+        result = self.cache.get(cache_key)
+        if result is not None:
+            return result, True
+        result = self._compute(rows, *key)
+        self.cache.put(cache_key, result)
+        return result, False
+
+    def _compute(self, rows: DataFrame, endpoint: str, bus_lines: Optional[Tuple], hours: Optional[Tuple],
+                 start: Optional[str], end: Optional[str], bbox: Optional[Tuple], by: Tuple, limit: int) -> DataFrame:
+        metric = ENDPOINTS[endpoint]
+        filters = {"bus_lines": bus_lines, "hours": hours, "start": start, "end": end, "bbox": bbox, "rows": rows}
+        if metric != SPEEDING:
+            return self.cube.query(metric, by=by, **filters)
+        hotspots = self.cube.query(SPEEDING, by=("cell",), **filters)
+        hotspots = hotspots[hotspots["cell"] >= 0].nlargest(limit, "count").reset_index(drop=True)
+        bounds = cell_bounds(hotspots["cell"], self.cube.cell_size)
+        for column, values in zip(("lat_min", "lat_max", "lon_min", "lon_max"), bounds):
+            hotspots[column] = values
+        return hotspots[["cell", "lat_min", "lat_max", "lon_min", "lon_max", "count", "mean", "max"]]
+
+    def status(self) -> Dict[str, Any]:
+        version, rows = self.snapshot()
+        return {"version": version, "hours": len(self.cube.hours()), "rows": len(rows),
+                "cached_results": len(self.cache), "cache_hits": self.cache.hits, "cache_misses": self.cache.misses}
+
+
+def _json_batches(result: DataFrame, batch_size: int = STREAM_ROWS) -> Iterator[bytes]:
+    """A JSON array of the records of a result, in batches of rows."""
+    yield b"["
+    for start in range(0, len(result), batch_size):
+        records = result.iloc[start:start + batch_size].to_json(orient="records")[1:-1]
+        yield (b"," if start else b"") + records.encode()
+    yield b"]"
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answers GET and HEAD requests from the QueryStore of the server; other methods are not allowed."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "bus-analysis-query/1"
+
+    def do_GET(self) -> None:
+        self._respond(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._respond(send_body=False)
+
+    def _method_not_allowed(self) -> None:
+        self._send_error(405, "The query service is read-only", {"Allow": "GET, HEAD"})
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = _method_not_allowed
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("Query request", extra={"client": self.client_address[0], "request": format % args})
+
+    def _respond(self, send_body: bool) -> None:
+        url = urlsplit(self.path)
+        started = time.perf_counter()
+        status, cache = 200, "miss"
+        try:
+            store: QueryStore = self.server.store
+            if url.path == "/status":
+                self._send_json(200, json.dumps(store.status()).encode(), {}, send_body)
+                return
+            if url.path not in ENDPOINTS:
+                status = 404
+                self._send_error(404, f"Unknown endpoint {url.path}; use {', '.join(ENDPOINTS)}")
+                return
+            key = parse_query(url.path, parse_qs(url.query))
+            snapshot = store.snapshot()
+            etag = store.etag(key, snapshot[0])
+            if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+                status, cache = 304, "revalidated"
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            result, cached = store.result(key, snapshot)
+            cache = "hit" if cached else "miss"
+            self._send_result(result, etag, send_body)
+        except QueryError as e:
+            status = 400
+            self._send_error(400, str(e))
+        except Exception as e:
+            status = 500
+            logger.error("Error occurred while answering a query", extra={"path": self.path, "error": str(e)})
+            self._send_error(500, "Internal error")
+        finally:
+            endpoint = url.path if url.path in ENDPOINTS or url.path == "/status" else "other"
+            QUERY_REQUESTS.labels(endpoint=endpoint, status=str(status), cache=cache).inc()
+            QUERY_LATENCY.labels(endpoint=endpoint).observe(time.perf_counter() - started)
+
+    def _send_result(self, result: DataFrame, etag: str, send_body: bool) -> None:
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Result-Rows": str(len(result))}
+        if len(result) <= STREAM_ROWS:
+            self._send_json(200, b"".join(_json_batches(result)), headers, send_body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not send_body:
+            return
+        for batch in _json_batches(result):
+            self.wfile.write(f"{len(batch):X}\r\n".encode() + batch + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, status: int, body: bytes, headers: Dict[str, str], send_body: bool = True) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps({"error": message}).encode()
+        self._send_json(status, body, headers or {}, self.command != "HEAD")
+
+
+def make_server(store: QueryStore, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    A threading HTTP server answering queries from the store; port 0 picks a free port.
+
+    The server is returned unstarted; call serve_forever, e.g. in a thread.
+    """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def serve(cube_folder: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> None:
+    """
+    Serve queries over the cube in a folder until interrupted.
+
+    Args:
+    - cube_folder (str): Folder of the metrics cube, e.g. data/processed/metrics_cube.
+    - host (str): Address to listen on; only local clients by default.
+    - port (int): Port to listen on.
+    """
+    store = QueryStore(MetricsCube(cube_folder))
+    store.version()
+    server = make_server(store, host, port)
+    logger.info("Serving queries", extra={"host": host, "port": server.server_address[1], **store.cube.summary()})
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,253 @@
+"""
+Headless report runner: every registered analysis over the same trajectories of an hour.
+
+The single hour notebooks each load and group an hour folder (combine_bus_locations_within_hour and
+group_by_bus) before running their analysis. The runner loads and groups every hour once and passes a shallow
+copy of the grouped trajectories to every analysis, so the columns one analysis adds or the rows it drops are
+not seen by the others. Hours are processed in parallel worker processes; every analysis writes
+<output_dir>/<hour>/<analysis>.json, in the format of the results the notebooks write, and the run writes
+<output_dir>/summary.json with the timings and failures of every hour and analysis.
+
+New analyses are added with the register_analysis decorator.
+"""
+import functools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+import pandas as pd
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import combine_bus_locations_within_hour, group_by_bus, count_durations, \
+    count_avg_speed, clean_df
+from src.analyze.analyze_punctuality import analyze_punctuality_for_a_bus_stop
+from src.analyze.analyze_speeding import analyze_speeding_points, collect_speeding_points
+from src.analyze.dictionary_data import avg_speed, brigade, lat, lines, lon
+from src.common.config import DATE_FORMAT
+from src.common.log import get_logger
+from src.common.metrics import timed
+
+__all__ = [
+    "Analysis",
+    "HourContext",
+    "ANALYSES",
+    "register_analysis",
+    "load_bus_stops",
+    "run_hour",
+    "run_report"
+]
+
+logger = get_logger(__name__)
+
+SUMMARY_FILE = "summary.json"
+# Hours processed by a worker process before it is replaced, releasing whatever memory it kept.
+TASKS_PER_WORKER = 8
+
+
+@dataclass(frozen=True)
+class Analysis:
+    """
+    An analysis of the grouped trajectories of an hour.
+
+    Attributes:
+        name (str): Name of the analysis and of its result file.
+        function (Callable): Called with the trajectories and the HourContext; returns a JSON serialisable result.
+        needs_bus_stops (bool): Whether the analysis uses HourContext.bus_stops.
+    """
+    name: str
+    function: Callable[[DataFrame, "HourContext"], Any]
+    needs_bus_stops: bool = False
+
+
+@dataclass
+class HourContext:
+    """
+    What an analysis knows besides the trajectories.
+
+    Attributes:
+        hour (str): Name of the hour folder.
+        folder (str): Path of the hour folder.
+        bus_stops (Optional[DataFrame]): Bus stops merged with their timetables (see load_bus_stops), loaded only
+            if a selected analysis needs them.
+    """
+    hour: str
+    folder: str
+    bus_stops: Optional[DataFrame] = None
+
+
+ANALYSES: Dict[str, Analysis] = {}
+
+
+def register_analysis(name: str, needs_bus_stops: bool = False) -> Callable[[Callable], Callable]:
+    """
+    Decorator registering a function as an analysis of the report.
+
+    Args:
+    - name (str): Name of the analysis.
+    - needs_bus_stops (bool): Whether the analysis uses the bus stops of the HourContext.
+
+    Returns:
+    Callable: The decorator, which returns the function unchanged.
+    """
+    def decorator(function: Callable) -> Callable:
+        ANALYSES[name] = Analysis(name, function, needs_bus_stops)
+        return function
+    return decorator
+
+
+@register_analysis("avg_speed")
+def avg_speed_report(trajectories: DataFrame, context: HourContext) -> List[Dict[str, Any]]:
+    """Average speed of every bus, cleaned of implausible speeds."""
+    df = clean_df(count_avg_speed(count_durations(trajectories)))
+    return json.loads(df[[lines, brigade, avg_speed]].to_json(orient='records'))
+
+
+@register_analysis("speeding")
+def speeding_report(trajectories: DataFrame, context: HourContext) -> List[Dict[str, float]]:
+    """Coordinates of every speeding point."""
+    return [{lat: point[0], lon: point[1]} for point in collect_speeding_points(analyze_speeding_points(trajectories))]
+
+
+@register_analysis("punctuality", needs_bus_stops=True)
+def punctuality_report(trajectories: DataFrame, context: HourContext) -> List[Dict[str, Any]]:
+    """Mean delay at every bus stop with a matched arrival, in minutes."""
+    stops = context.bus_stops.copy()
+    stops['delay'] = [analyze_punctuality_for_a_bus_stop(trajectories, row, 'rozklad', 'szer_geo', 'dlug_geo')
+                      for _, row in stops.iterrows()]
+    stops = stops[stops['delay'] != -1]
+    return json.loads(stops[["zespol", "slupek", "nazwa_zespolu", "delay"]].to_json(orient='records',
+                                                                                   force_ascii=False))
+
+
+@functools.lru_cache(maxsize=1)
+def load_bus_stops(bus_stops_coordinates_file: str, timetables_file: str) -> DataFrame:
+    """
+    Processed bus stops merged with their processed timetables, loaded once per process.
+
+    Args:
+    - bus_stops_coordinates_file (str): Processed bus stop coordinates.
+    - timetables_file (str): Processed timetables.
+
+    Returns:
+    DataFrame: A row per bus stop with its coordinates and its timetables by line ('rozklad').
+    """
+    return pd.merge(pd.read_json(bus_stops_coordinates_file), pd.read_json(timetables_file),
+                    left_on=["zespol", "slupek"], right_on=["busstopId", "busstopNr"])
+
+
+def _write_result(path: str, result: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(result, file, ensure_ascii=False)
+
+
+def run_hour(folder: str, output_dir: str, analyses: Sequence[str],
+             bus_stops_files: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Load and group an hour folder once and run the analyses over it.
+
+    An analysis that fails is recorded in the summary of the hour; the other analyses still run.
+
+    Args:
+    - folder (str): Processed hour folder.
+    - output_dir (str): Folder of the report; results are written to <output_dir>/<hour>/<analysis>.json.
+    - analyses (Sequence[str]): Names of registered analyses.
+    - bus_stops_files (Sequence[str]): Processed bus stop coordinates and timetables files, required if an
+      analysis needs bus stops.
+
+    Returns:
+    Dict: Summary of the hour: load time and the status, time, number of records and result file of every analysis.
+    """
+    hour = os.path.basename(os.path.normpath(folder))
+    start = time.perf_counter()
+    trajectories = group_by_bus(combine_bus_locations_within_hour(folder))
+    if trajectories is None:
+        raise ValueError(f"No bus locations could be loaded from {folder}")
+    context = HourContext(hour, folder)
+    if any(ANALYSES[name].needs_bus_stops for name in analyses):
+        context.bus_stops = load_bus_stops(*bus_stops_files)
+    summary = {"hour": hour, "vehicles": len(trajectories), "load_seconds": time.perf_counter() - start,
+               "analyses": {}}
+
+    for name in analyses:
+        start = time.perf_counter()
+        try:
+            result = ANALYSES[name].function(trajectories.copy(deep=False), context)
+            path = os.path.join(output_dir, hour, name + ".json")
+            _write_result(path, result)
+            summary["analyses"][name] = {"status": "ok", "seconds": time.perf_counter() - start,
+                                         "records": len(result) if hasattr(result, "__len__") else None,
+                                         "path": path}
+        except Exception as e:
+            logger.error("Error occurred while running an analysis",
+                         extra={"analysis": name, "hour": hour, "error": str(e)})
+            summary["analyses"][name] = {"status": "failed", "seconds": time.perf_counter() - start,
+                                         "error": str(e)}
+    return summary
+
+
+@timed()
+def run_report(folders: Iterable[str], output_dir: str, analyses: Optional[Sequence[str]] = None,
+               workers: Optional[int] = None, bus_stops_coordinates_file: Optional[str] = None,
+               timetables_file: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run the analyses over hour folders on a process pool and write the results and a run summary.
+
+    Args:
+    - folders (Iterable[str]): Processed hour folders.
+    - output_dir (str): Folder of the report.
+    - analyses (Sequence[str]): Names of registered analyses, all by default. Analyses needing bus stops are
+      skipped when the bus stop files are not given.
+    - workers (int): Worker processes, the number of CPUs by default; 1 runs in this process.
+    - bus_stops_coordinates_file, timetables_file (str): Processed bus stops and timetables.
+
+    Returns:
+    Dict: The run summary, also written to <output_dir>/summary.json.
+    """
+    names = list(analyses) if analyses is not None else list(ANALYSES)
+    unknown = [name for name in names if name not in ANALYSES]
+    if unknown:
+        raise ValueError(f"Unknown analyses {', '.join(unknown)}; use any of {', '.join(ANALYSES)}")
+    bus_stops_files = None
+    if bus_stops_coordinates_file and timetables_file:
+        bus_stops_files = (bus_stops_coordinates_file, timetables_file)
+    else:
+        skipped = [name for name in names if ANALYSES[name].needs_bus_stops]
+        if skipped:
+            logger.warning("Analyses skipped without bus stops", extra={"analyses": skipped})
+        names = [name for name in names if name not in skipped]
+
+    folders = list(folders)
+    started = datetime.now()
+    start = time.perf_counter()
+    hours: Dict[str, Dict[str, Any]] = {}
+    failed: Dict[str, str] = {}
+    if workers == 1:
+        for folder in folders:
+            try:
+                hours[folder] = run_hour(folder, output_dir, names, bus_stops_files)
+            except Exception as e:
+                failed[folder] = str(e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=TASKS_PER_WORKER) as executor:
+            futures = {executor.submit(run_hour, folder, output_dir, names, bus_stops_files): folder
+                       for folder in folders}
+            for future in as_completed(futures):
+                try:
+                    hours[futures[future]] = future.result()
+                except Exception as e:
+                    failed[futures[future]] = str(e)
+    for folder, error in failed.items():
+        logger.error("Error occurred while loading an hour", extra={"folder": folder, "error": error})
+
+    summary = {
+        "started": started.strftime(DATE_FORMAT),
+        "seconds": time.perf_counter() - start,
+        "analyses": names,
+        "hours": [hours[folder] for folder in sorted(hours, key=lambda folder: hours[folder]["hour"])],
+        "failed": failed
+    }
+    _write_result(os.path.join(output_dir, SUMMARY_FILE), summary)
+    return summary
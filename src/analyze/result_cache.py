@@ -0,0 +1,334 @@
+"""
+Disk-backed memoisation of analysis results.
+
+Results are keyed by the function, its version and fingerprints of the arguments. A processed hour folder
+(or any other path) is fingerprinted by the names, sizes and modification times of its files, so an unchanged
+hour is never recomputed while a re-processed one is. Least recently used entries are evicted once the cache
+grows over its size limit, also when several processes share the cache folder.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional
+import pandas as pd
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import (MIN_AVG_SPEED, MAX_AVG_SPEED, combine_bus_locations_within_hour,
+                                           group_by_bus, count_durations, count_avg_speed, clean_df)
+from src.analyze.analyze_punctuality import analyze_punctuality_for_a_bus_stop
+from src.analyze.analyze_speeding import analyze_speeding_points
+from src.common.config import CACHE
+from src.fetch_and_preprocess.file_utils import get_data_dir
+
+__all__ = [
+    "ResultCache",
+    "fingerprint",
+    "default_cache",
+    "cached_group_by_bus",
+    "cached_avg_speed",
+    "cached_speeding_points",
+    "cached_punctuality"
+]
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+ENTRY_EXTENSION = ".pkl"
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(file: BinaryIO) -> None:
+    """Block until this process holds the exclusive lock of an open file."""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(file: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def fingerprint(value: Any) -> str:
+    """
+    Stable fingerprint of a function argument.
+
+    Paths of existing files and folders are fingerprinted by name, size and modification time of every
+    file (not by content), DataFrames and other objects by their pickled bytes.
+
+    Args:
+        value (Any): The argument.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    if isinstance(value, (str, os.PathLike)) and os.path.exists(value):
+        path = os.path.abspath(value)
+        digest.update(path.encode())
+        if os.path.isdir(path):
+            for root, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    stat = os.stat(os.path.join(root, filename))
+                    digest.update(f"{os.path.relpath(os.path.join(root, filename), path)}"
+                                  f":{stat.st_size}:{stat.st_mtime_ns}".encode())
+        else:
+            stat = os.stat(path)
+            digest.update(f":{stat.st_size}:{stat.st_mtime_ns}".encode())
+    elif isinstance(value, (str, int, float, bool, type(None))):
+        digest.update(repr(value).encode())
+    else:
+        digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Pickled results stored in a folder, with an index of sizes and access times.
+
+    Several processes may share the folder: entries are written and the index is re-read, updated and saved
+    under an exclusive lock on a file next to it. Lookups only read; their access times are kept in memory and
+    merged into the index with the next write, so a hit costs no write.
+
+    Args:
+        cache_dir (Optional[str]): Folder of the cache, data/cache of the current data folder if None.
+        max_bytes (int): Size limit of the entries.
+
+    Attributes:
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that had to compute the result.
+        evictions (int): Entries removed to respect max_bytes.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self._cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {}
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir or os.path.join(get_data_dir(), CACHE)
+
+    # ---------- index ----------
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index: Dict[str, Dict[str, Any]]) -> None:
+        tmp_path = os.path.join(self.cache_dir, INDEX_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, os.path.join(self.cache_dir, INDEX_FILE))
+
+    @contextmanager
+    def _locked_index(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """
+        The index as saved by any process, with the access times of this one merged in, locked against
+        the other processes; it is saved when the block ends.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.cache_dir, LOCK_FILE), 'a+b') as lock_file:
+            _lock_file(lock_file)
+            try:
+                index = self._read_index()
+                for key, last_access in self._accessed.items():
+                    if key in index:
+                        index[key]["last_access"] = max(index[key]["last_access"], last_access)
+                self._accessed.clear()
+                yield index
+                self._write_index(index)
+            finally:
+                _unlock_file(lock_file)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ENTRY_EXTENSION)
+
+    # ---------- public API ----------
+    def make_key(self, function_name: str, version: Any, args: tuple, kwargs: Dict[str, Any]) -> str:
+        """Key of a call: function name, version and fingerprints of all arguments."""
+        parts = [function_name, repr(version)]
+        parts.extend(fingerprint(arg) for arg in args)
+        parts.extend(f"{name}={fingerprint(kwargs[name])}" for name in sorted(kwargs))
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Cached value of the key, or default. Updates the hit/miss statistics."""
+        try:
+            with open(self._entry_path(key), 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self._accessed[key] = time.time()
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any, function_name: str = "") -> None:
+        """
+        Store a value and evict least recently used entries if the cache is over its size limit.
+        None, the error result of the analysis functions, is not stored.
+        """
+        if value is None:
+            return
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._locked_index() as index:
+            tmp_path = self._entry_path(key) + ".tmp"
+            with open(tmp_path, 'wb') as file:
+                file.write(payload)
+            os.replace(tmp_path, self._entry_path(key))
+            index[key] = {"function": function_name, "size": len(payload), "last_access": time.time()}
+            self._adopt_unindexed(index)
+            self._evict(index, keep=key)
+
+    def _adopt_unindexed(self, index: Dict[str, Dict[str, Any]]) -> None:
+        """Index entries whose index update was lost (e.g. written by an older version), so they can be evicted."""
+        for filename in os.listdir(self.cache_dir):
+            key = filename[:-len(ENTRY_EXTENSION)]
+            if filename.endswith(ENTRY_EXTENSION) and key not in index:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                index[key] = {"function": "", "size": stat.st_size, "last_access": stat.st_mtime}
+
+    def _evict(self, index: Dict[str, Dict[str, Any]], keep: str) -> None:
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index.pop(key)["size"]
+            self.evictions += 1
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._locked_index() as index:
+            self._adopt_unindexed(index)
+            for key in index:
+                try:
+                    os.remove(self._entry_path(key))
+                except FileNotFoundError:
+                    pass
+            index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss statistics and current size of the cache."""
+        index = self._read_index()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(index),
+                "bytes": sum(entry["size"] for entry in index.values()),
+                "max_bytes": self.max_bytes
+            }
+
+    def memoize(self, version: Any = 1) -> Callable[[Callable], Callable]:
+        """
+        Decorator caching the results of a function.
+
+        Bump the version whenever the function's logic changes, so old results are not reused.
+        Cached results are fresh copies, so functions that modify their arguments in place
+        should be called for their return value. Arguments are bound to the signature with the defaults
+        applied, so a call has the same key whether an argument is passed by position, by name or left out,
+        and changing a default changes the key.
+        """
+        def decorator(function: Callable) -> Callable:
+            function_name = f"{function.__module__}.{function.__qualname__}"
+            signature = inspect.signature(function)
+            missing = object()
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = self.make_key(function_name, version, bound.args, bound.kwargs)
+                result = self.get(key, missing)
+                if result is missing:
+                    result = function(*args, **kwargs)
+                    self.put(key, result, function_name)
+                return result
+
+            wrapper.cache = self
+            return wrapper
+        return decorator
+
+
+default_cache = ResultCache()
+
+
+@default_cache.memoize(version=1)
+def cached_group_by_bus(folder: str) -> DataFrame:
+    """
+    Combined and grouped bus locations of a processed hour folder (combine_bus_locations_within_hour
+    followed by group_by_bus).
+    """
+    return group_by_bus(combine_bus_locations_within_hour(folder))
+
+
+@default_cache.memoize(version=1)
+def cached_avg_speed(folder: str, min_speed: float = MIN_AVG_SPEED, max_speed: float = MAX_AVG_SPEED) -> DataFrame:
+    """
+    Average speed of every bus in a processed hour folder, cleaned with the given speed bounds
+    (count_durations, count_avg_speed and clean_df on top of cached_group_by_bus).
+    """
+    df = cached_group_by_bus(folder)
+    return clean_df(count_avg_speed(count_durations(df)), min_speed, max_speed)
+
+
+@default_cache.memoize(version=1)
+def cached_speeding_points(folder: str) -> DataFrame:
+    """
+    Grouped bus locations of a processed hour folder with the speeding_points column
+    (analyze_speeding_points on top of cached_group_by_bus).
+    """
+    return analyze_speeding_points(cached_group_by_bus(folder))
+
+
+@default_cache.memoize(version=1)
+def cached_punctuality(folder: str, bus_stops_coordinates_file: str, timetables_file: str) -> DataFrame:
+    """
+    Mean delay at every bus stop, as computed in the punctuality notebook.
+
+    Args:
+        folder (str): Processed hour folder with bus locations.
+        bus_stops_coordinates_file (str): Processed bus stop coordinates.
+        timetables_file (str): Processed timetables.
+
+    Returns:
+        DataFrame: Bus stops with a 'delay' column in minutes; stops without a matched arrival are dropped.
+    """
+    df_locations = cached_group_by_bus(folder)
+    df_bus_stop_info = pd.merge(pd.read_json(bus_stops_coordinates_file), pd.read_json(timetables_file),
+                                left_on=["zespol", "slupek"], right_on=["busstopId", "busstopNr"])
+    df_bus_stop_info['delay'] = df_bus_stop_info.apply(
+        lambda row: analyze_punctuality_for_a_bus_stop(df_locations, row, 'rozklad', 'szer_geo', 'dlug_geo'), axis=1)
+    return df_bus_stop_info[df_bus_stop_info['delay'] != -1]
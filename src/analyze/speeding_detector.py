@@ -0,0 +1,126 @@
+"""
+Streaming counterpart of analyze_speeding_points.
+
+SpeedingDetector remembers the previous fix of every vehicle and compares it with each new poll,
+so speeding segments are known as soon as the poll arrives instead of after a whole hour is processed.
+Detected segments are appended to a JSON Lines event log.
+"""
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+from geopy.distance import geodesic as GD
+from src.analyze.analyze_avg_speed import vehicle_key
+from src.analyze.analyze_speeding import SPEEDING_MIN_SPEED, SPEEDING_MAX_SPEED
+from src.analyze.dictionary_data import *
+from src.common.config import DATE_FORMAT
+
+__all__ = [
+    "SpeedingDetector"
+]
+
+# Vehicles that have not reported for this long are forgotten, which bounds memory by the active fleet.
+STALE_AFTER = timedelta(minutes=10)
+
+speed = "Speed"
+previous_time = "Previous_Time"
+
+
+class SpeedingDetector:
+    """
+    Detects speeding segments between consecutive fixes of each (Lines, Brigade).
+
+    A segment is speeding when its speed is within the same band as in analyze_speeding_points_single.
+    Each event holds the vehicle, the midpoint of the segment (as in collect_speeding_points),
+    its speed and both fix times. Work per fix is constant.
+    """
+
+    def __init__(self, event_log: Optional[str] = None, stale_after: timedelta = STALE_AFTER) -> None:
+        """
+        Args:
+        - event_log (str): Path of the JSON Lines file events are appended to. No file is written if None.
+        - stale_after (timedelta): How long a vehicle's last fix is kept without a new one.
+        """
+        self.event_log = event_log
+        self.stale_after = stale_after
+        # Ordered by the arrival of the latest fix, so the stale vehicles are at the front.
+        self.last_fix: "OrderedDict[Tuple[Hashable, Hashable], Tuple[datetime, float, float]]" = OrderedDict()
+        self.skipped_points = 0
+
+    def __call__(self, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.process(records)
+
+    def check_fix(self, bus_line: Hashable, bus_brigade: Hashable, lat_value: float, lon_value: float,
+                  item_time: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Compare a fix with the previous fix of the same vehicle and remember it.
+
+        Returns:
+        Optional[Dict]: The speeding event, or None if the segment is not speeding.
+        """
+        key = vehicle_key(bus_line, bus_brigade)
+        previous = self.last_fix.get(key)
+        if previous is not None and item_time < previous[0]:
+            self.skipped_points += 1
+            return None
+        self.last_fix[key] = (item_time, lat_value, lon_value)
+        self.last_fix.move_to_end(key)
+        if previous is None:
+            return None
+
+        prev_time, prev_lat, prev_lon = previous
+        time_delta = (item_time - prev_time).total_seconds() / 3600
+        if time_delta <= 0:
+            return None
+        segment_speed = GD((prev_lat, prev_lon), (lat_value, lon_value)).km / time_delta
+        if not SPEEDING_MIN_SPEED < segment_speed < SPEEDING_MAX_SPEED:
+            return None
+        return {
+            lines: bus_line,
+            brigade: bus_brigade,
+            time: item_time.strftime(DATE_FORMAT),
+            previous_time: prev_time.strftime(DATE_FORMAT),
+            lat: (lat_value + prev_lat) / 2,
+            lon: (lon_value + prev_lon) / 2,
+            speed: segment_speed
+        }
+
+    def process(self, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Process a single poll and append its speeding events to the event log.
+
+        Args:
+        - records: Bus location dictionaries with Lines, Brigade, Lat, Lon and Time keys,
+          filtered as in the processed buses_live_locations files.
+
+        Returns:
+        List[Dict]: Speeding events detected in this poll.
+        """
+        events = []
+        newest = None
+        for record in records:
+            item_time = datetime.strptime(record[time], DATE_FORMAT)
+            newest = item_time if newest is None else max(newest, item_time)
+            event = self.check_fix(record[lines], record[brigade], record[lat], record[lon], item_time)
+            if event:
+                events.append(event)
+
+        if newest is not None:
+            self.forget_stale(newest)
+        if events and self.event_log:
+            with open(self.event_log, 'a', encoding='utf-8') as file:
+                file.writelines(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+        return events
+
+    def forget_stale(self, now: datetime) -> None:
+        """
+        Drop vehicles whose last fix is older than stale_after. Only the vehicles at the front of last_fix are
+        checked, so the cost is the number of vehicles dropped rather than the size of the fleet. A fix that
+        arrived late may stay a little longer, until the vehicles in front of it are dropped.
+        """
+        threshold = now - self.stale_after
+        while self.last_fix:
+            key, (item_time, _, _) = next(iter(self.last_fix.items()))
+            if item_time >= threshold:
+                break
+            del self.last_fix[key]
@@ -0,0 +1,268 @@
+"""
+Grid aggregation of speeding points.
+
+Speeding midpoints are binned into a fixed grid of square cells (in metres) laid over the Warsaw bounds.
+Count matrices are stored per hour, so any time range is aggregated by adding hourly matrices,
+and a tile pyramid of coarser resolutions is built from a matrix by summing blocks of 2x2 cells.
+"""
+import math
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from pandas import DataFrame
+from src.analyze.analyze_speeding import analyze_speeding_points, collect_speeding_points
+from src.analyze.analyze_avg_speed import combine_bus_locations_within_hour, group_by_bus
+from src.analyze.geo import WARSAW_CENTER_LAT, metres_per_degree
+from src.common.config import *
+from src.common.metrics import timed
+
+__all__ = [
+    "GRID_CELL_SIZE",
+    "grid_edges",
+    "empty_grid",
+    "bin_points",
+    "speeding_grid",
+    "speeding_grid_for_hour",
+    "save_hour_grid",
+    "load_hour_grid",
+    "update_hour_grids",
+    "aggregate_hour_grids",
+    "downsample",
+    "build_pyramid",
+    "merge_grids",
+    "hotspots"
+]
+
+# Side of a grid cell in metres.
+GRID_CELL_SIZE = 250
+
+GRID_FILE_EXTENSION = ".npz"
+
+
+@lru_cache(maxsize=None)
+def grid_edges(cell_size: float = GRID_CELL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cell edges of the grid covering the Warsaw bounds. Cells are square at the centre of Warsaw.
+
+    Args:
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    Tuple[ndarray, ndarray]: Latitude edges and longitude edges, both ascending.
+    """
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    lat_step, lon_step = cell_size / lat_m, cell_size / lon_m
+    lat_cells = math.ceil((WARSAW_LAT_MAX - WARSAW_LAT_MIN) / lat_step)
+    lon_cells = math.ceil((WARSAW_LON_MAX - WARSAW_LON_MIN) / lon_step)
+    lat_edges = WARSAW_LAT_MIN + lat_step * np.arange(lat_cells + 1)
+    lon_edges = WARSAW_LON_MIN + lon_step * np.arange(lon_cells + 1)
+    lat_edges.flags.writeable = lon_edges.flags.writeable = False
+    return lat_edges, lon_edges
+
+
+def empty_grid(cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """Count matrix of the grid with the given cell size, without any points."""
+    lat_edges, lon_edges = grid_edges(cell_size)
+    return np.zeros((len(lat_edges) - 1, len(lon_edges) - 1), dtype=np.int64)
+
+
+def bin_points(points: Sequence[Tuple[float, float]], cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """
+    Count points per grid cell. Points outside the Warsaw bounds are ignored.
+
+    Args:
+    - points: (lat, lon) pairs, e.g. the output of collect_speeding_points, or an (N, 2) array.
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    ndarray: Integer matrix of counts indexed by [latitude cell, longitude cell].
+    """
+    lat_edges, lon_edges = grid_edges(cell_size)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    counts, _, _ = np.histogram2d(points[:, 0], points[:, 1], bins=(lat_edges, lon_edges))
+    return counts.astype(np.int64)
+
+
+@timed()
+def speeding_grid(df: DataFrame, cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """
+    Count matrix of the speeding points of a DataFrame processed by analyze_speeding_points.
+    """
+    return bin_points(collect_speeding_points(df), cell_size)
+
+
+@timed()
+def speeding_grid_for_hour(folder: str, cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """
+    Count matrix of the speeding points in a processed hour folder.
+
+    Args:
+    - folder (str): The path to the folder containing JSON files of one hour.
+    - cell_size (float): Side of a cell in metres.
+    """
+    df = analyze_speeding_points(group_by_bus(combine_bus_locations_within_hour(folder)))
+    return speeding_grid(df, cell_size)
+
+
+def save_hour_grid(counts: np.ndarray, grids_folder: str, hour: str, cell_size: float = GRID_CELL_SIZE) -> str:
+    """
+    Save the count matrix of one hour.
+
+    Args:
+    - counts (ndarray): Count matrix created with the given cell size.
+    - grids_folder (str): Folder with hourly matrices, e.g. data/processed/speeding_grids.
+    - hour (str): Hour label in the format of the processed hour folders ("YYYY-MM-DD HH").
+    - cell_size (float): Side of a cell in metres.
+
+    Returns:
+    str: Path of the saved file.
+    """
+    os.makedirs(grids_folder, exist_ok=True)
+    path = _hour_path(grids_folder, hour)
+    np.savez_compressed(path, counts=counts, cell_size=cell_size)
+    return path
+
+
+def load_hour_grid(path: str) -> Tuple[np.ndarray, float]:
+    """
+    Load an hourly count matrix.
+
+    Returns:
+    Tuple[ndarray, float]: The count matrix and its cell size in metres.
+    """
+    with np.load(path) as grid:
+        return grid["counts"], float(grid["cell_size"])
+
+
+def _hour_path(grids_folder: str, hour: str) -> str:
+    return os.path.join(grids_folder, hour + GRID_FILE_EXTENSION)
+
+
+def _is_current(grid_path: str, folder: str) -> bool:
+    """Whether a saved hour grid is newer than every file of its hour folder."""
+    if not os.path.exists(grid_path):
+        return False
+    grid_time = os.path.getmtime(grid_path)
+    return all(os.path.getmtime(os.path.join(folder, filename)) <= grid_time for filename in os.listdir(folder))
+
+
+@timed()
+def update_hour_grids(folders: Iterable[str], grids_folder: str, cell_size: float = GRID_CELL_SIZE,
+                      force: bool = False) -> List[str]:
+    """
+    Compute and save the count matrices of processed hour folders whose matrix is missing or older than the folder.
+
+    Args:
+    - folders (Iterable[str]): Processed hour folders, named by their hour label ("YYYY-MM-DD HH").
+    - grids_folder (str): Folder with hourly matrices.
+    - cell_size (float): Side of a cell in metres.
+    - force (bool): Compute the matrices of up to date hours again.
+
+    Returns:
+    List[str]: Hour labels whose matrix was saved.
+    """
+    updated = []
+    for folder in folders:
+        hour = os.path.basename(os.path.normpath(folder))
+        if not force and _is_current(_hour_path(grids_folder, hour), folder):
+            continue
+        save_hour_grid(speeding_grid_for_hour(folder, cell_size), grids_folder, hour, cell_size)
+        updated.append(hour)
+    return updated
+
+
+@timed()
+def aggregate_hour_grids(grids_folder: str, start: Optional[str] = None, end: Optional[str] = None,
+                         cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """
+    Sum the hourly count matrices of a time range.
+
+    Args:
+    - grids_folder (str): Folder with hourly matrices.
+    - start, end (str): First and last hour label to include ("YYYY-MM-DD HH"); None means unbounded.
+    - cell_size (float): Cell size of the matrices to aggregate.
+
+    Returns:
+    ndarray: Count matrix of the whole range; all zeros if no hour matches.
+
+    Raises:
+    ValueError: If a matrix in the range was created with a different cell size.
+    """
+    total = empty_grid(cell_size)
+    if not os.path.isdir(grids_folder):
+        return total
+    for filename in sorted(os.listdir(grids_folder)):
+        if not filename.endswith(GRID_FILE_EXTENSION):
+            continue
+        hour = filename[:-len(GRID_FILE_EXTENSION)]
+        if (start is not None and hour < start) or (end is not None and hour > end):
+            continue
+        counts, grid_cell_size = load_hour_grid(os.path.join(grids_folder, filename))
+        if grid_cell_size != cell_size:
+            raise ValueError(f"Grid {filename} has cell size {grid_cell_size} m, expected {cell_size} m")
+        total += counts
+    return total
+
+
+def downsample(counts: np.ndarray) -> np.ndarray:
+    """Sum blocks of 2x2 cells; odd dimensions are padded with empty cells."""
+    rows, cols = counts.shape
+    padded = np.pad(counts, ((0, rows % 2), (0, cols % 2)))
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3))
+
+
+@timed()
+def build_pyramid(counts: np.ndarray, levels: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Build a multi-resolution tile pyramid of a count matrix.
+
+    Level k has cells 2**k times larger than the base matrix and the same origin
+    (the south-west corner of the Warsaw bounds).
+
+    Args:
+    - counts (ndarray): Base count matrix (level 0).
+    - levels (int): Number of levels; by default levels are added until a single cell remains.
+
+    Returns:
+    List[ndarray]: Matrices from the finest to the coarsest level.
+    """
+    pyramid = [counts]
+    while (levels is None and max(pyramid[-1].shape) > 1) or (levels is not None and len(pyramid) < levels):
+        pyramid.append(downsample(pyramid[-1]))
+    return pyramid
+
+
+def merge_grids(grids: Iterable[np.ndarray], cell_size: float = GRID_CELL_SIZE) -> np.ndarray:
+    """
+    Add count matrices of the same cell size, e.g. different hours or shards of vehicles.
+
+    Returns:
+    ndarray: The sum; all zeros if there is no matrix.
+    """
+    total = empty_grid(cell_size)
+    for counts in grids:
+        total += counts
+    return total
+
+
+def hotspots(counts: np.ndarray, cell_size: float = GRID_CELL_SIZE, level: int = 0,
+             top: int = 10) -> List[Dict[str, Any]]:
+    """
+    Cells with the most points.
+
+    Args:
+    - counts (ndarray): Count matrix, or a level of its pyramid.
+    - cell_size (float): Cell size of the base matrix in metres.
+    - level (int): Pyramid level of counts (see build_pyramid).
+    - top (int): Largest number of cells returned.
+
+    Returns:
+    List[Dict]: Centre (lat, lon) and count of every non-empty cell among the top ones, most points first.
+    """
+    lat_edges, lon_edges = grid_edges(cell_size)
+    scale = 2 ** level
+    lat_step, lon_step = (lat_edges[1] - lat_edges[0]) * scale, (lon_edges[1] - lon_edges[0]) * scale
+    rows, cols = np.unravel_index(np.argsort(counts, axis=None, kind='stable')[::-1][:top], counts.shape)
+    return [{"lat": float(lat_edges[0] + (row + 0.5) * lat_step), "lon": float(lon_edges[0] + (col + 0.5) * lon_step),
+             "count": int(counts[row, col])} for row, col in zip(rows, cols) if counts[row, col]]
@@ -0,0 +1,73 @@
+import unittest
+import pandas as pd
+from ..analyze_avg_speed import *
+from ..avg_speed_accumulator import AvgSpeedAccumulator
+
+bus_locations = [
+    {"Lines": "213", "Lon": 21.1000, "Lat": 52.2200, "Brigade": "3", "Time": "2024-02-26 08:00:10"},
+    {"Lines": "213", "Lon": 21.1000, "Lat": 52.2300, "Brigade": "3", "Time": "2024-02-26 08:01:10"},
+    {"Lines": "213", "Lon": 21.1050, "Lat": 52.2350, "Brigade": "3", "Time": "2024-02-26 08:02:40"},
+    {"Lines": "213", "Lon": 21.1100, "Lat": 52.2400, "Brigade": "3", "Time": "2024-02-26 08:04:00"},
+    {"Lines": "225", "Lon": 21.0500, "Lat": 52.2500, "Brigade": "04", "Time": "2024-02-26 08:00:20"},
+    {"Lines": "225", "Lon": 21.0510, "Lat": 52.2500, "Brigade": "04", "Time": "2024-02-26 08:02:20"},
+    {"Lines": "225", "Lon": 21.0520, "Lat": 52.2500, "Brigade": "04", "Time": "2024-02-26 08:03:50"},
+    {"Lines": "180", "Lon": 21.0000, "Lat": 52.2000, "Brigade": "1", "Time": "2024-02-26 08:00:30"},
+]
+
+
+def batch_avg_speed(records):
+    df = pd.DataFrame(records).astype({"Lines": int, "Brigade": int})
+    df = count_avg_speed(count_durations(group_by_bus(df)))
+    return df.set_index([lines, brigade])[avg_speed]
+
+
+class TestAvgSpeedAccumulator(unittest.TestCase):
+
+    def test_same_results_as_batch(self):
+        accumulator = AvgSpeedAccumulator()
+        accumulator.update(bus_locations)
+        expected = batch_avg_speed(bus_locations)
+        result = accumulator.to_dataframe(clean=False).set_index([lines, brigade])[avg_speed]
+        pd.testing.assert_series_equal(result.sort_index(), expected.sort_index(), check_names=False)
+
+    def test_clean_filter(self):
+        accumulator = AvgSpeedAccumulator()
+        accumulator.update(bus_locations)
+        result = accumulator.to_dataframe()
+        self.assertTrue(((result[avg_speed] >= MIN_AVG_SPEED) & (result[avg_speed] <= MAX_AVG_SPEED)).all())
+        self.assertEqual(list(result[lines]), [213])
+
+    def test_late_fix_within_window(self):
+        shuffled = [bus_locations[0], bus_locations[2], bus_locations[1], bus_locations[3]]
+        accumulator = AvgSpeedAccumulator()
+        accumulator.update(shuffled)
+        self.assertAlmostEqual(accumulator.avg_speed("213", "3"), batch_avg_speed(bus_locations[:4])[(213, 3)])
+        self.assertEqual(accumulator.skipped_points, 0)
+
+    def test_merge_consecutive_periods(self):
+        first, second = AvgSpeedAccumulator(), AvgSpeedAccumulator()
+        first.update(bus_locations[:2] + bus_locations[4:5])
+        second.update(bus_locations[2:4] + bus_locations[5:])
+        merged = second.merge(first).to_dataframe(clean=False).set_index([lines, brigade])[avg_speed]
+        expected = batch_avg_speed(bus_locations)
+        pd.testing.assert_series_equal(merged.sort_index(), expected.sort_index(), check_names=False)
+
+    def test_merge_copies_states(self):
+        first, second = AvgSpeedAccumulator(), AvgSpeedAccumulator()
+        second.update(bus_locations[:2])
+        first.merge(second)
+        speed = second.avg_speed("213", "3")
+        first.update(bus_locations[2:4])
+        self.assertEqual(second.avg_speed("213", "3"), speed)
+        self.assertEqual(second.vehicles[(213, 3)].points, 2)
+
+    def test_merge_overlapping_periods(self):
+        first, second = AvgSpeedAccumulator(), AvgSpeedAccumulator()
+        first.update(bus_locations[0:4:2])
+        second.update(bus_locations[1:4:2])
+        with self.assertRaises(ValueError):
+            first.merge(second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from ..analyze_avg_speed import combine_bus_locations_within_hour
+from ..compact_locations import epoch_seconds, format_times, from_compact, memory_usage, read_locations_compact, \
+    to_compact
+
+SAMPLE_HOUR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data', 'processed', 'buses_live_locations',
+                           '2024-02-26 08')
+
+# Night lines and some brigades are not numbers.
+records = [
+    {"Lines": "180", "Lon": 21.012345, "Lat": 52.231234, "Brigade": "3", "Time": "2024-02-26 08:00:06"},
+    {"Lines": "N01", "Lon": 20.998765, "Lat": 52.219876, "Brigade": "N1", "Time": "2024-02-26 08:00:31"},
+    {"Lines": "180", "Lon": 21.013345, "Lat": 52.232234, "Brigade": "3", "Time": "2024-02-26 08:01:06"}
+]
+
+
+class TestCompactLocations(unittest.TestCase):
+
+    def test_epoch_seconds(self):
+        seconds = epoch_seconds(["1970-01-01 00:01:00", "2024-02-26 08:00:00"])
+        self.assertEqual(seconds.dtype, np.int32)
+        self.assertEqual(list(seconds), [60, 1708934400])
+        self.assertEqual(list(format_times(seconds)), ["1970-01-01 00:01:00", "2024-02-26 08:00:00"])
+
+    def test_to_compact(self):
+        compact = to_compact(pd.DataFrame(records))
+        self.assertEqual(list(compact.columns), ["Lines", "Brigade", "Lat", "Lon", "Timestamp"])
+        self.assertIsInstance(compact["Lines"].dtype, pd.CategoricalDtype)
+        self.assertEqual(sorted(compact["Lines"].cat.categories), ["180", "N01"])
+        # A brigade that is not a number makes the column a category.
+        self.assertIsInstance(compact["Brigade"].dtype, pd.CategoricalDtype)
+        self.assertEqual(compact["Lat"].dtype, np.float32)
+        numeric = to_compact(pd.DataFrame([records[0], records[2]]))
+        self.assertEqual(numeric["Brigade"].dtype, np.int16)
+
+    def test_round_trip(self):
+        original = pd.DataFrame(records)
+        restored = from_compact(to_compact(original))
+        self.assertEqual(list(restored["Lines"]), [180, "N01", 180])
+        self.assertEqual(list(restored["Brigade"]), [3, "N1", 3])
+        self.assertEqual(list(restored["Time"]), list(original["Time"]))
+        self.assertEqual(list(restored["Timestamp"]), list(epoch_seconds(original["Time"])))
+        np.testing.assert_allclose(restored["Lat"], original["Lat"], atol=1e-5)
+        np.testing.assert_allclose(restored["Lon"], original["Lon"], atol=1e-5)
+
+    def test_read_locations_compact(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for index, record in enumerate(records):
+                with open(os.path.join(folder, f"2024-02-26 08:0{index}:00.json"), 'w', encoding='utf-8') as file:
+                    json.dump([record], file)
+            compact = read_locations_compact(folder)
+        pd.testing.assert_frame_equal(compact, to_compact(pd.DataFrame(records)))
+
+    def test_sample_hour(self):
+        combined = combine_bus_locations_within_hour(SAMPLE_HOUR)
+        compact = read_locations_compact(SAMPLE_HOUR)
+        self.assertEqual(len(compact), len(combined))
+        self.assertLess(memory_usage(compact) * 5, memory_usage(combined))
+        restored = from_compact(compact)
+        columns = ["Lines", "Brigade", "Time"]
+        pd.testing.assert_frame_equal(restored[columns].sort_values(columns).reset_index(drop=True),
+                                      combined[columns].sort_values(columns).reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
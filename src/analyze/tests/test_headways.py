@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+from pandas import DataFrame
+from ..compact_locations import to_compact
+from ..headways import compute_headways, find_passages, scheduled_departures, summarise_headways
+from ..line_stops import LineStopsIndex
+
+index = LineStopsIndex({"180": {"busstopId": ["1001", "1002"], "busstopNr": ["01", "01"],
+                                "lat": [52.2200, 52.2300], "lon": [21.0000, 21.0000]}})
+
+
+def locations(rows):
+    return to_compact(DataFrame(rows, columns=["Lines", "Brigade", "Lat", "Lon", "Time"]))
+
+
+# Brigades 1, 2 and 3 of line 180 pass stop 1001/01 at 08:00, 08:10 and 08:11; brigade 3 passes it again at 08:30
+# after a loop. Fixes 30 m before and 10 m past the stop belong to the same passage.
+fixes = locations([
+    ("180", 1, 52.21973, 21.0, "2024-02-26 07:59:40"), ("180", 1, 52.22009, 21.0, "2024-02-26 08:00:00"),
+    ("180", 1, 52.2250, 21.0, "2024-02-26 08:01:00"),
+    ("180", 2, 52.22000, 21.0, "2024-02-26 08:10:00"),
+    ("180", 3, 52.22000, 21.0, "2024-02-26 08:11:00"), ("180", 3, 52.22000, 21.0, "2024-02-26 08:30:00"),
+    ("523", 1, 52.22000, 21.0, "2024-02-26 08:05:00"),
+])
+
+timetables = [{"busstopId": 1001, "busstopNr": 1, "rozklad": {"180": [
+    {"czas": "08:00:00", "brygada": "1"}, {"czas": "08:10:00", "brygada": "2"},
+    {"czas": "08:20:00", "brygada": "3"}, {"czas": "08:40:00", "brygada": "1"}]}}]
+
+
+class TestHeadways(unittest.TestCase):
+
+    def test_passages(self):
+        passages = find_passages(fixes, index)
+        self.assertEqual(list(passages["Brigade"]), [1, 2, 3, 3])
+        self.assertEqual(set(passages["busstopId"]), {"1001"})
+        self.assertLess(passages["distance"].iloc[0], 15)
+
+    def test_headways_and_bunching(self):
+        headways = compute_headways(find_passages(fixes, index), scheduled_departures(timetables))
+        self.assertEqual(list(headways["headway"]), [600, 60, 1140])
+        np.testing.assert_array_equal(headways["scheduled_headway"], [600, 600, 1200])
+        self.assertEqual(list(headways["bunched"]), [False, True, False])
+        self.assertFalse(headways["gapped"].any())
+
+    def test_summary(self):
+        headways = compute_headways(find_passages(fixes, index), scheduled_departures(timetables))
+        by_line = summarise_headways(headways, by=["Lines"])
+        self.assertEqual(by_line["headways"][0], 3)
+        self.assertEqual(by_line["bunched"][0], 1)
+        self.assertAlmostEqual(by_line["mean_headway"][0], 10)
+        actual = np.array([10, 1, 19])
+        scheduled = np.array([10, 10, 20])
+        expected = (actual ** 2).sum() / (2 * actual.sum()) - (scheduled ** 2).sum() / (2 * scheduled.sum())
+        self.assertAlmostEqual(by_line["excess_wait"][0], expected)
+
+    def test_without_schedule(self):
+        headways = compute_headways(find_passages(fixes, index))
+        self.assertTrue(headways["scheduled_headway"].isna().all())
+        self.assertFalse(headways["bunched"].any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from ..line_stops import LineStopsIndex
+from src.fetch_and_preprocess.process_data import build_lines_to_stops, stop_code
+
+coordinates = [
+    {"zespol": "1001", "slupek": "01", "nazwa_zespolu": "Kijowska", "id_ulicy": "2201",
+     "szer_geo": "52.248455", "dlug_geo": "21.044827"},
+    {"zespol": "1001", "slupek": "02", "nazwa_zespolu": "Kijowska", "id_ulicy": "2201",
+     "szer_geo": "52.249078", "dlug_geo": "21.044443"},
+    {"zespol": "R-01", "slupek": "01", "nazwa_zespolu": "Dworzec", "id_ulicy": "1000",
+     "szer_geo": "52.230000", "dlug_geo": "21.000000"},
+]
+
+# Processed buses at stops as read by pd.read_json: busstopNr became an integer.
+buses_at_stops = [
+    {"busstopId": "1001", "busstopNr": 2, "autobusy": ["138", "166"]},
+    {"busstopId": "1001", "busstopNr": 1, "autobusy": ["138"]},
+    {"busstopId": "R-01", "busstopNr": 1, "autobusy": ["166"]},
+    {"busstopId": "9999", "busstopNr": 1, "autobusy": ["138"]},
+]
+
+
+class TestLineStops(unittest.TestCase):
+
+    def setUp(self):
+        self.index = build_lines_to_stops(buses_at_stops, coordinates)
+
+    def test_build_lines_to_stops(self):
+        self.assertEqual(list(self.index), ["138", "166"])
+        self.assertEqual(self.index["138"]["busstopId"], ["1001", "1001"])
+        self.assertEqual(self.index["138"]["busstopNr"], ["01", "02"])
+        self.assertEqual(self.index["166"]["busstopId"], ["1001", "R-01"])
+        self.assertAlmostEqual(self.index["166"]["lat"][1], 52.23)
+
+    def test_stop_code(self):
+        self.assertEqual([stop_code(value, 2) for value in (1, np.int64(1), "01", "R1")], ["01", "01", "01", "R1"])
+        self.assertEqual(stop_code(np.int64(7009), 4), "7009")
+
+    def test_nearest_stops(self):
+        index = LineStopsIndex(self.index)
+        stops, distances = index.nearest_stops(138, np.array([52.24906, 52.2485]), np.array([21.04444, 21.0448]))
+        self.assertEqual(stops, [("1001", "02"), ("1001", "01")])
+        self.assertTrue(np.all(distances < 10))
+
+        stops, distances = index.nearest_stops(999, np.array([52.24906]), np.array([21.04444]))
+        self.assertEqual(stops, [None])
+        self.assertEqual(distances[0], np.inf)
+
+    def test_stops_near(self):
+        index = LineStopsIndex(self.index)
+        near = index.stops_near("166", np.array([52.24906, 52.23]), np.array([21.04444, 21.0]), radius=50)
+        self.assertEqual([(position, stop_id, stop_nr) for position, stop_id, stop_nr, _ in near],
+                         [(0, "1001", "02"), (1, "R-01", "01")])
+
+
+if __name__ == '__main__':
+    unittest.main()
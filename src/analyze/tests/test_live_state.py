@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from pandas import DataFrame
+from ..live_state import LiveState
+
+stops = DataFrame([("1001", "01", 52.2200, 21.0000), ("1002", "01", 52.2300, 21.0000)],
+                  columns=["busstopId", "busstopNr", "szer_geo", "dlug_geo"])
+
+
+def poll(minute, vehicles):
+    return [{"Lines": line, "Brigade": vehicle_brigade, "Lat": vehicle_lat, "Lon": vehicle_lon,
+             "Time": f"2024-02-26 08:{minute:02d}:00"} for line, vehicle_brigade, vehicle_lat, vehicle_lon in vehicles]
+
+
+class TestLiveState(unittest.TestCase):
+
+    def test_ring_buffer_keeps_the_latest_fixes(self):
+        live = LiveState(capacity=4, buffer_length=3)
+        for minute in range(5):
+            live(poll(minute, [("180", "1", 52.22 + minute * 0.001, 21.0)]))
+        times, lats, _ = live.history("180", 1)
+        self.assertEqual(len(times), 3)
+        np.testing.assert_allclose(lats, [52.222, 52.223, 52.224])
+        self.assertTrue((np.diff(times) == 60).all())
+        self.assertEqual(len(live.history(180, "1", minutes=1)[0]), 2)
+        self.assertEqual(len(live.history("523", "1")[0]), 0)
+
+    def test_repeated_fixes_are_skipped(self):
+        live = LiveState()
+        self.assertEqual(live(poll(0, [("180", "1", 52.22, 21.0)])), 1)
+        self.assertEqual(live(poll(0, [("180", "1", 52.22, 21.0)])), 0)
+        self.assertEqual(live.skipped_points, 1)
+
+    def test_buses_near_a_stop(self):
+        live = LiveState(stops=stops)
+        live(poll(0, [("180", "1", 52.2201, 21.0), ("180", "2", 52.2250, 21.0), ("523", "1", 52.2290, 21.0)]))
+        near = live.buses_near_stop("1001", "01", radius=300)
+        self.assertEqual([(bus["Lines"], bus["Brigade"]) for bus in near], [(180, 1)])
+        near = live.buses_near_stop(1002, 1, radius=600)
+        self.assertEqual([(bus["Lines"], bus["Brigade"]) for bus in near], [(523, 1), (180, 2)])
+        # A vehicle that moved is found only at its current position.
+        live(poll(1, [("180", "1", 52.2300, 21.0)]))
+        self.assertEqual(live.buses_near_stop("1001", "01", radius=300), [])
+
+    def test_stops_without_a_position_are_unknown(self):
+        # The timetable store returns the stops missing from the coordinates with NaN positions.
+        live = LiveState(stops=DataFrame([("1001", "01", 52.2200, 21.0000), ("1002", "01", np.nan, np.nan),
+                                          ("1003", "01", None, None)],
+                                         columns=["busstopId", "busstopNr", "szer_geo", "dlug_geo"]))
+        self.assertEqual(list(live.stops), [("1001", "01")])
+        for bus_stop_id in ("1002", "1003"):
+            with self.assertRaises(KeyError):
+                live.buses_near_stop(bus_stop_id, "01", radius=300)
+
+    def test_memory_is_bounded(self):
+        live = LiveState(capacity=2, buffer_length=2, stale_after=120)
+        live(poll(0, [("180", "1", 52.22, 21.0), ("180", "2", 52.22, 21.0)]))
+        live(poll(1, [("180", "1", 52.22, 21.0), ("523", "1", 52.22, 21.0)]))
+        self.assertEqual(sorted(live.vehicles()), [(180, 1), (523, 1)])
+        live(poll(5, [("523", "1", 52.22, 21.0)]))
+        self.assertEqual(live.vehicles(), [(523, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
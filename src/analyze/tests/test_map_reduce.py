@@ -0,0 +1,37 @@
+import os
+import unittest
+import numpy as np
+import pandas as pd
+from ..map_reduce import run_map_reduce
+
+LOCATIONS = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data', 'processed', 'buses_live_locations')
+SAMPLE_HOURS = [os.path.join(LOCATIONS, hour) for hour in ("2024-02-26 08", "2024-02-26 12")]
+
+
+class TestMapReduce(unittest.TestCase):
+
+    def test_worker_processes_match_a_single_process(self):
+        folders = SAMPLE_HOURS + [os.path.join(LOCATIONS, "2024-02-26 99")]
+        with self.assertLogs("bus_analysis", level="ERROR"):
+            parallel = run_map_reduce(folders, period="hour", workers=2)
+            serial = run_map_reduce(folders, period="hour", workers=1)
+        self.assertEqual(parallel.hours, ["2024-02-26 08", "2024-02-26 12"])
+        self.assertEqual(list(parallel.failed), [folders[2]])
+        pd.testing.assert_frame_equal(parallel.line_stats_dataframe(), serial.line_stats_dataframe())
+        self.assertEqual(sorted(parallel.speeding_grids), ["2024-02-26 08", "2024-02-26 12"])
+        for label, grid in serial.speeding_grids.items():
+            np.testing.assert_array_equal(parallel.speeding_grids[label], grid)
+        self.assertGreater(grid.sum(), 0)
+
+    def test_periods_add_up(self):
+        by_hour = run_map_reduce(SAMPLE_HOURS, period="hour", workers=2)
+        by_day = run_map_reduce(SAMPLE_HOURS, period="day", workers=2)
+        np.testing.assert_array_equal(by_day.speeding_grids["2024-02-26"], sum(by_hour.speeding_grids.values()))
+        vehicles = by_hour.line_stats_dataframe().groupby("Lines")["vehicles"].sum()
+        self.assertEqual(vehicles.to_dict(), by_day.line_stats_dataframe().set_index("Lines")["vehicles"].to_dict())
+        with self.assertRaises(ValueError):
+            run_map_reduce(SAMPLE_HOURS, period="week")
+
+
+if __name__ == '__main__':
+    unittest.main()
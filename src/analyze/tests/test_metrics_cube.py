@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+import numpy as np
+from ..metrics_cube import MetricsCube, SPEED, cells_in_box, cube_cells
+
+
+def location(line, brigade, lat, lon, time):
+    return {"Lines": line, "Lon": lon, "Lat": lat, "Brigade": brigade, "Time": time}
+
+
+# Line 180 drives 500 m north per minute (30 km/h), line 523 stands still, both near the centre of Warsaw.
+polls = {
+    "2024-02-26 08:00:06.json": [location("180", "1", 52.2200, 21.0000, "2024-02-26 08:00:00"),
+                                 location("523", "2", 52.2300, 21.0100, "2024-02-26 08:00:00")],
+    "2024-02-26 08:01:07.json": [location("180", "1", 52.2245, 21.0000, "2024-02-26 08:01:00"),
+                                 location("523", "2", 52.2300, 21.0100, "2024-02-26 08:01:00")],
+    "2024-02-26 08:02:06.json": [location("180", "1", 52.2290, 21.0000, "2024-02-26 08:02:00"),
+                                 location("523", "2", 52.2300, 21.0100, "2024-02-26 08:02:00")],
+}
+
+coordinates = [{"zespol": "1001", "slupek": "01", "nazwa_zespolu": "Kijowska", "id_ulicy": "2201",
+                "szer_geo": "52.2245", "dlug_geo": "21.0"}]
+timetables = [{"busstopId": "1001", "busstopNr": "01",
+               "rozklad": {"180": [{"czas": "08:00:00", "brygada": "1"}]}}]
+
+
+class TestMetricsCube(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp_dir.name, "2024-02-26 08")
+        os.makedirs(self.folder)
+        for filename, records in polls.items():
+            with open(os.path.join(self.folder, filename), 'w') as file:
+                json.dump(records, file)
+        self.cube = MetricsCube(os.path.join(self.tmp_dir.name, "cube"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_update_is_incremental(self):
+        self.assertEqual(self.cube.update([self.folder]), ["2024-02-26 08"])
+        self.assertEqual(self.cube.update([self.folder]), [])
+        self.assertEqual(self.cube.hours(), ["2024-02-26 08"])
+
+    def test_delays_follow_the_timetables_of_their_day(self):
+        files = [os.path.join(self.tmp_dir.name, name) for name in ("coordinates.json", "timetables.json")]
+        for path, data in zip(files, (coordinates, timetables)):
+            with open(path, 'w') as file:
+                json.dump(data, file)
+
+        def timetables_written_on(day):
+            written = datetime.strptime(day, "%Y-%m-%d").replace(hour=12).timestamp()
+            os.utime(files[1], (written, written))
+
+        self.cube.update([self.folder])
+        timetables_written_on("2024-02-27")
+        # The partition has no delays yet.
+        self.assertEqual(self.cube.update([self.folder], *files), ["2024-02-26 08"])
+        self.assertEqual(self.cube.stored_timetable_date("2024-02-26 08"), "2024-02-27")
+        # Timetables of later days do not replace delays already computed.
+        timetables_written_on("2024-02-28")
+        self.assertEqual(self.cube.update([self.folder], *files), [])
+        # The timetables of the hour's own day do.
+        timetables_written_on("2024-02-26")
+        self.assertEqual(self.cube.update([self.folder], *files), ["2024-02-26 08"])
+        self.assertEqual(self.cube.update([self.folder], *files), [])
+        self.assertEqual(self.cube.update([self.folder]), [])
+
+    def test_roll_up(self):
+        self.cube.update([self.folder])
+        by_line = self.cube.query(SPEED, by=("line",))
+        self.assertEqual(list(by_line["line"]), ["180", "523"])
+        self.assertEqual(list(by_line["count"]), [2, 2])
+        np.testing.assert_allclose(by_line["mean"], [30, 0], atol=0.5)
+
+        total = self.cube.query(SPEED)
+        self.assertEqual(total["count"][0], by_line["count"].sum())
+        self.assertAlmostEqual(total["sum"][0], by_line["sum"].sum())
+        self.assertEqual(total["max"][0], by_line["max"].max())
+        self.assertAlmostEqual(total["std"][0], np.std([*[30] * 2, 0, 0]), delta=0.5)
+
+    def test_filters(self):
+        self.cube.update([self.folder])
+        self.assertEqual(self.cube.query(SPEED, bus_lines=[180])["count"][0], 2)
+        self.assertEqual(self.cube.query(SPEED, hours=[9])["count"][0], 0)
+        self.assertEqual(self.cube.query(SPEED, start="2024-02-27")["count"][0], 0)
+        self.assertEqual(self.cube.query(SPEED, start="2024-02-26 08", end="2024-02-26")["count"][0], 4)
+        self.assertEqual(self.cube.query(SPEED, end="2024-02-26 07")["count"][0], 0)
+        self.assertEqual(self.cube.query(SPEED, bbox=(52.229, 52.231, 21.009, 21.011))["count"][0], 2)
+
+    def test_cells(self):
+        cells = cube_cells([52.23, 52.0], [21.01, 21.0])
+        self.assertEqual(cells[1], -1)
+        self.assertIn(cells[0], cells_in_box(52.229, 52.231, 21.009, 21.011))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import http.client
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from .. import query_service
+from ..metrics_cube import MetricsCube
+from ..query_service import LRUCache, QueryStore, make_server, parse_query
+from .test_metrics_cube import polls
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c"), len(cache)), (1, 3, 2))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+class TestQueryService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.locations = os.path.join(self.tmp_dir.name, "locations")
+        self.cube = MetricsCube(os.path.join(self.tmp_dir.name, "cube"))
+        self.add_hour("2024-02-26 08")
+        self.store = QueryStore(self.cube, refresh_interval=0)
+        self.server = make_server(self.store, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def add_hour(self, hour):
+        folder = os.path.join(self.locations, hour)
+        os.makedirs(folder)
+        for filename, records in polls.items():
+            with open(os.path.join(folder, filename.replace("2024-02-26 08", hour)), 'w') as file:
+                json.dump([{**record, "Time": hour + record["Time"][13:]} for record in records], file)
+        self.cube.update([folder])
+
+    def get(self, path, headers=None):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=5)
+        try:
+            connection.request("GET", path, headers=headers or {})
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def test_etag_revalidation(self):
+        response, body = self.get("/avg-speed?by=line")
+        self.assertEqual(response.status, 200)
+        self.assertEqual([row["line"] for row in json.loads(body)], ["180", "523"])
+        etag = response.getheader("ETag")
+        response, body = self.get("/avg-speed?by=line", {"If-None-Match": etag})
+        self.assertEqual((response.status, body), (304, b""))
+        self.assertEqual(self.get("/avg-speed?by=hour", {"If-None-Match": etag})[0].status, 200)
+        # A new hour in the cube changes the version, so the old ETag no longer matches.
+        self.add_hour("2024-02-26 09")
+        response, body = self.get("/avg-speed?by=line", {"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader("ETag"), etag)
+        self.assertEqual([row["count"] for row in json.loads(body)], [4, 4])
+
+    def test_results_are_cached_per_version(self):
+        key = parse_query("/avg-speed", {"by": ["line"]})
+        result, cached = self.store.result(key)
+        self.assertFalse(cached)
+        self.assertEqual(self.store.result(key), (result, True))
+        self.add_hour("2024-02-26 09")
+        self.assertFalse(self.store.result(key)[1])
+
+    def test_snapshot_keeps_rows_and_version_together(self):
+        key = parse_query("/avg-speed", {})
+        snapshot = self.store.snapshot()
+        self.add_hour("2024-02-26 09")
+        result, _ = self.store.result(key, snapshot)
+        self.assertEqual(result["count"][0], 4)
+        self.assertEqual(self.store.result(key)[0]["count"][0], 8)
+        self.assertEqual(self.store.result(key, snapshot), (result, True))
+
+    def test_large_results_are_streamed(self):
+        expected = json.loads(self.get("/avg-speed?by=line,hour")[1])
+        with mock.patch.object(query_service, "STREAM_ROWS", 1):
+            response, body = self.get("/avg-speed?by=line,hour")
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        self.assertIsNone(response.getheader("Content-Length"))
+        self.assertEqual(json.loads(body), expected)
+
+    def test_errors(self):
+        self.assertEqual(self.get("/avg-speed?by=week")[0].status, 400)
+        self.assertEqual(self.get("/unknown")[0].status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
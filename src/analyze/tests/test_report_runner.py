@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from ..analyze_avg_speed import clean_df, combine_bus_locations_within_hour, count_avg_speed, count_durations, \
+    group_by_bus
+from ..analyze_speeding import analyze_speeding_points, collect_speeding_points
+from ..report_runner import ANALYSES, SUMMARY_FILE, register_analysis, run_report
+
+LOCATIONS = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data', 'processed', 'buses_live_locations')
+# The first polls of the sample hour, enough for every analysis to have results.
+SAMPLE_POLLS = 5
+
+
+class TestReportRunner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sample_dir = tempfile.TemporaryDirectory()
+        cls.hour = os.path.join(cls.sample_dir.name, "2024-02-26 08")
+        os.makedirs(cls.hour)
+        sample_hour = os.path.join(LOCATIONS, "2024-02-26 08")
+        for filename in sorted(os.listdir(sample_hour))[:SAMPLE_POLLS]:
+            shutil.copy(os.path.join(sample_hour, filename), cls.hour)
+        cls.trajectories = group_by_bus(combine_bus_locations_within_hour(cls.hour))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sample_dir.cleanup()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_result(self, name):
+        with open(os.path.join(self.tmp_dir.name, "2024-02-26 08", name + ".json"), 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def test_results_match_the_single_analyses(self):
+        summary = run_report([self.hour], self.tmp_dir.name, ["avg_speed", "speeding"], workers=1)
+        self.assertEqual(summary["failed"], {})
+        hour = summary["hours"][0]
+        self.assertEqual(hour["vehicles"], len(self.trajectories))
+        self.assertEqual({name: result["status"] for name, result in hour["analyses"].items()},
+                         {"avg_speed": "ok", "speeding": "ok"})
+
+        expected = clean_df(count_avg_speed(count_durations(self.trajectories.copy())))
+        speeds = self.read_result("avg_speed")
+        self.assertEqual(len(speeds), len(expected))
+        self.assertAlmostEqual(sum(row["Average_Speed"] for row in speeds), expected["Average_Speed"].sum(), places=6)
+        points = collect_speeding_points(analyze_speeding_points(self.trajectories.copy()))
+        self.assertEqual([[point["Lat"], point["Lon"]] for point in self.read_result("speeding")],
+                         [list(point) for point in points])
+        with open(os.path.join(self.tmp_dir.name, SUMMARY_FILE), 'r', encoding='utf-8') as file:
+            self.assertEqual(json.load(file)["analyses"], ["avg_speed", "speeding"])
+
+    def test_failures_are_recorded(self):
+        @register_analysis("broken")
+        def broken(trajectories, context):
+            raise RuntimeError("broken analysis")
+        self.addCleanup(ANALYSES.pop, "broken")
+
+        missing = os.path.join(LOCATIONS, "2024-02-26 99")
+        with self.assertLogs("bus_analysis", level="WARNING"):
+            summary = run_report([self.hour, missing], self.tmp_dir.name, ["broken", "speeding", "punctuality"],
+                                 workers=1)
+        self.assertEqual(list(summary["failed"]), [missing])
+        self.assertEqual(summary["analyses"], ["broken", "speeding"])
+        analyses = summary["hours"][0]["analyses"]
+        self.assertEqual((analyses["broken"]["status"], analyses["broken"]["error"]), ("failed", "broken analysis"))
+        self.assertEqual(analyses["speeding"]["status"], "ok")
+        with self.assertRaises(ValueError):
+            run_report([self.hour], self.tmp_dir.name, ["unknown"])
+
+    def test_worker_processes(self):
+        summary = run_report([self.hour], self.tmp_dir.name, ["speeding"], workers=2)
+        self.assertEqual([hour["hour"] for hour in summary["hours"]], ["2024-02-26 08"])
+        self.assertEqual(len(self.read_result("speeding")), summary["hours"][0]["analyses"]["speeding"]["records"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from src.common.config import DATA_DIR_ENV
+from ..result_cache import INDEX_FILE, ResultCache, fingerprint
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_index(self):
+        with open(os.path.join(self.cache_dir, INDEX_FILE), 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def test_memoize(self):
+        cache, calls = ResultCache(self.cache_dir), []
+
+        @cache.memoize(version=1)
+        def square(value):
+            calls.append(value)
+            return value * value
+
+        self.assertEqual([square(3), square(3), square(4)], [9, 9, 16])
+        self.assertEqual(calls, [3, 4])
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_arguments_are_keyed_with_their_defaults(self):
+        cache, calls = ResultCache(self.cache_dir), []
+
+        def scaled(value, factor=2):
+            calls.append((value, factor))
+            return value * factor
+
+        memoized = cache.memoize()(scaled)
+        self.assertEqual([memoized(3), memoized(3, 2), memoized(3, factor=2), memoized(value=3)], [6, 6, 6, 6])
+        self.assertEqual(calls, [(3, 2)])
+        # A changed default is a different call.
+        scaled.__defaults__ = (3,)
+        self.assertEqual(cache.memoize()(scaled)(3), 9)
+        self.assertEqual(calls, [(3, 2), (3, 3)])
+
+    def test_errors_are_not_cached(self):
+        cache, calls = ResultCache(self.cache_dir), []
+
+        @cache.memoize()
+        def failing(value):
+            calls.append(value)
+            return None
+
+        failing(1)
+        failing(1)
+        self.assertEqual(calls, [1, 1])
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_hits_do_not_write(self):
+        cache = ResultCache(self.cache_dir)
+        cache.put("a", [1, 2, 3])
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        written = os.stat(index_path).st_mtime_ns
+        self.assertEqual(cache.get("a"), [1, 2, 3])
+        self.assertEqual(os.stat(index_path).st_mtime_ns, written)
+        # The access time is merged into the index with the next write.
+        accessed = cache._accessed["a"]
+        cache.put("b", 1)
+        self.assertEqual(self.read_index()["a"]["last_access"], accessed)
+
+    def test_shared_folder(self):
+        # Separate instances stand for separate processes: only the file lock keeps their index updates apart.
+        caches = [ResultCache(self.cache_dir, max_bytes=40 * 1024) for _ in range(4)]
+
+        def fill(cache, prefix):
+            for number in range(25):
+                cache.put(f"{prefix}{number}", b"x" * 1024)
+
+        threads = [threading.Thread(target=fill, args=(cache, prefix)) for cache, prefix in zip(caches, "abcd")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        index = self.read_index()
+        entries = {name[:-4] for name in os.listdir(self.cache_dir) if name.endswith(".pkl")}
+        self.assertEqual(set(index), entries)
+        self.assertLessEqual(sum(entry["size"] for entry in index.values()), 40 * 1024)
+        self.assertEqual(sum(cache.evictions for cache in caches), 100 - len(entries))
+
+    def test_unindexed_entries_are_evicted(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, "lost.pkl"), 'wb') as file:
+            file.write(b"x" * 2048)
+        cache = ResultCache(self.cache_dir, max_bytes=2048)
+        cache.put("new", b"y" * 1024)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["index.json", "index.lock", "new.pkl"])
+
+    def test_default_folder_follows_the_data_folder(self):
+        cache = ResultCache()
+        with patch.dict(os.environ, {DATA_DIR_ENV: self.tmp_dir.name}):
+            cache.put("a", 1)
+            self.assertEqual(cache.cache_dir, os.path.join(self.tmp_dir.name, "cache"))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "cache", "a.pkl")))
+
+    def test_fingerprint_of_changed_file(self):
+        path = os.path.join(self.tmp_dir.name, "hour.json")
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write("[]")
+        before = fingerprint(path)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write("[{}]")
+        self.assertNotEqual(fingerprint(path), before)
+        self.assertEqual(fingerprint(path), fingerprint(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
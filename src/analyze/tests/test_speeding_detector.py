@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from ..speeding_detector import SpeedingDetector
+
+
+def poll(minute, vehicles):
+    return [{"Lines": line, "Brigade": vehicle_brigade, "Lat": vehicle_lat, "Lon": 21.0,
+             "Time": f"2024-02-26 08:{minute:02d}:00"} for line, vehicle_brigade, vehicle_lat in vehicles]
+
+
+class TestSpeedingDetector(unittest.TestCase):
+
+    def test_speeding_segment(self):
+        detector = SpeedingDetector()
+        self.assertEqual(detector(poll(0, [("180", "1", 52.2200), ("523", "1", 52.2200)])), [])
+        # 180 drives about 1.1 km in a minute (67 km/h), 523 about 0.3 km (17 km/h).
+        events = detector(poll(1, [("180", "1", 52.2300), ("523", "1", 52.2227)]))
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0]["Lines"], events[0]["Brigade"]), ("180", "1"))
+        self.assertAlmostEqual(events[0]["Lat"], 52.2250)
+        self.assertAlmostEqual(events[0]["Speed"], 66.8, delta=0.5)
+        self.assertEqual(events[0]["Previous_Time"], "2024-02-26 08:00:00")
+
+    def test_older_fix_is_skipped(self):
+        detector = SpeedingDetector()
+        detector(poll(1, [("180", "1", 52.2300)]))
+        self.assertEqual(detector(poll(0, [("180", "1", 52.2200)])), [])
+        self.assertEqual(detector.skipped_points, 1)
+
+    def test_stale_vehicles_are_forgotten(self):
+        detector = SpeedingDetector()
+        detector(poll(0, [("180", "1", 52.2200), ("523", "1", 52.2200)]))
+        detector(poll(5, [("523", "1", 52.2200)]))
+        self.assertEqual(len(detector.last_fix), 2)
+        detector(poll(12, [("523", "1", 52.2200)]))
+        self.assertEqual(list(detector.last_fix), [(523, 1)])
+        detector.forget_stale(datetime(2024, 2, 26, 9, 0))
+        self.assertEqual(len(detector.last_fix), 0)
+
+    def test_event_log(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "events.jsonl")
+            detector = SpeedingDetector(event_log=path)
+            detector(poll(0, [("180", "1", 52.2200)]))
+            detector(poll(1, [("180", "1", 52.2300)]))
+            with open(path, encoding='utf-8') as file:
+                events = [json.loads(line) for line in file]
+        self.assertEqual([event["Lines"] for event in events], ["180"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..speeding_grid import aggregate_hour_grids, bin_points, build_pyramid, empty_grid, grid_edges, hotspots, \
+    load_hour_grid, merge_grids, save_hour_grid, update_hour_grids
+
+# Line 180 drives about 1.1 km a minute (67 km/h) near the centre of Warsaw: two speeding segments.
+bus_locations = [{"Lines": 180, "Lon": 21.0, "Lat": 52.2200 + minute * 0.01, "Brigade": 1,
+                  "Time": f"2024-02-26 08:0{minute}:00"} for minute in range(3)]
+
+
+class TestSpeedingGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.grids = os.path.join(self.tmp_dir.name, "speeding_grids")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_bin_points(self):
+        counts = bin_points([(52.2, 21.0), (52.2, 21.0), (52.25, 21.1), (53.0, 21.0)])
+        self.assertEqual(counts.shape, empty_grid().shape)
+        self.assertEqual(counts.sum(), 3)
+        self.assertEqual(counts.max(), 2)
+        lat_edges, lon_edges = grid_edges()
+        self.assertAlmostEqual((lat_edges[1] - lat_edges[0]) * 111250, 250, delta=1)
+
+    def test_merge_grids(self):
+        self.assertEqual(merge_grids([]).shape, empty_grid().shape)
+        self.assertEqual(merge_grids([]).sum(), 0)
+        counts = bin_points([(52.2, 21.0)])
+        self.assertEqual(merge_grids([counts, counts])[counts > 0].tolist(), [2])
+
+    def test_aggregate_time_range(self):
+        for hour, points in (("2024-02-26 08", [(52.2, 21.0)]), ("2024-02-26 09", [(52.2, 21.0), (52.25, 21.1)]),
+                             ("2024-02-27 08", [(52.25, 21.1)])):
+            save_hour_grid(bin_points(points), self.grids, hour)
+        self.assertEqual(aggregate_hour_grids(self.grids).sum(), 4)
+        self.assertEqual(aggregate_hour_grids(self.grids, "2024-02-26 09", "2024-02-26 23").sum(), 2)
+        self.assertEqual(aggregate_hour_grids(os.path.join(self.tmp_dir.name, "missing")).sum(), 0)
+        save_hour_grid(bin_points([], 500), self.grids, "2024-02-28 08", 500)
+        with self.assertRaises(ValueError):
+            aggregate_hour_grids(self.grids)
+
+    def test_pyramid_and_hotspots(self):
+        counts = bin_points([(52.2, 21.0)] * 3 + [(52.25, 21.1)])
+        pyramid = build_pyramid(counts)
+        self.assertEqual(pyramid[-1].shape, (1, 1))
+        self.assertTrue(all(level.sum() == 4 for level in pyramid))
+        spots = hotspots(pyramid[2], level=2, top=5)
+        self.assertEqual([spot["count"] for spot in spots], [3, 1])
+        self.assertAlmostEqual(spots[0]["lat"], 52.2, delta=0.01)
+        self.assertAlmostEqual(spots[0]["lon"], 21.0, delta=0.015)
+
+    def test_update_hour_grids(self):
+        folder = os.path.join(self.tmp_dir.name, "2024-02-26 08")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "2024-02-26 08:03:00.json"), 'w', encoding='utf-8') as file:
+            json.dump(bus_locations, file)
+        self.assertEqual(update_hour_grids([folder], self.grids), ["2024-02-26 08"])
+        counts, cell_size = load_hour_grid(os.path.join(self.grids, "2024-02-26 08.npz"))
+        self.assertEqual((counts.sum(), cell_size), (2, 250))
+        # Up to date hours are skipped unless forced.
+        self.assertEqual(update_hour_grids([folder], self.grids), [])
+        self.assertEqual(update_hour_grids([folder], self.grids, force=True), ["2024-02-26 08"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+from ..headways import compute_headways, find_passages
+from ..timetable_store import TimetableStore
+from .test_headways import fixes, index
+
+coordinates = [
+    {"zespol": "1001", "slupek": "01", "nazwa_zespolu": "Kijowska", "id_ulicy": "2201", "szer_geo": "52.22",
+     "dlug_geo": "21.0"},
+    {"zespol": "1002", "slupek": "01", "nazwa_zespolu": "Targowa", "id_ulicy": "2202", "szer_geo": "52.23",
+     "dlug_geo": "21.0"}
+]
+
+# Identifiers as pd.read_json writes them back: integers without their leading zeros.
+timetables = [
+    {"busstopId": 1001, "busstopNr": 1, "rozklad": {
+        "180": [{"czas": "08:00:00", "brygada": "1"}, {"czas": "08:10:00", "brygada": "2"},
+                {"czas": "08:20:00", "brygada": "3"}, {"czas": "08:40:00", "brygada": "1"}],
+        "523": [{"czas": "08:05:00", "brygada": "1"}]}},
+    {"busstopId": "1002", "busstopNr": "01", "rozklad": {
+        "180": [{"czas": "08:02:00", "brygada": "1"}, {"czas": "24:10:00", "brygada": "5"}]}}
+]
+
+
+class TestTimetableStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.files = [os.path.join(self.tmp_dir.name, name) for name in ("coordinates.json", "timetables.json")]
+        for path, data in zip(self.files, (coordinates, timetables)):
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+        self.path = os.path.join(self.tmp_dir.name, "timetables.sqlite")
+        self.store = TimetableStore.load(self.path, *self.files)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_normalised_tables(self):
+        self.assertEqual(self.store.summary(), {"stops": 2, "lines": 2, "departures": 7})
+        self.assertEqual(self.store.lines(), ["180", "523"])
+        self.assertEqual(self.store.stop(1001, 1)["nazwa_zespolu"], "Kijowska")
+        self.assertEqual(list(self.store.stops("523")["busstopId"]), ["1001"])
+
+    def test_departure_queries(self):
+        departures = self.store.departures(bus_lines=["180"], brigades=["1"])
+        self.assertEqual(list(departures["czas"]), ["08:00:00", "08:02:00", "08:40:00"])
+        departures = self.store.departures(bus_stops=[("1001", "01")], start="08:05:00", end="08:20:00")
+        self.assertEqual(list(departures["seconds"]), [8 * 3600 + 600, 8 * 3600 + 1200, 8 * 3600 + 300])
+        self.assertEqual(self.store.departures(start="24:00:00")["busstopId"].tolist(), ["1002"])
+        departures = self.store.departures(bus_stops=[(1001, 1), ("1002", "01"), ("9999", "01")], brigades=["1"])
+        self.assertEqual(list(departures["busstopId"]), ["1001", "1002", "1001", "1001"])
+        self.assertTrue(self.store.departures(bus_stops=[]).empty)
+        self.assertEqual(self.store.stop_timetables("1001", "01")["523"], [{"czas": "08:05:00", "brygada": "1"}])
+
+    def test_reloaded_when_the_files_change(self):
+        self.assertTrue(self.store.is_current(self.files))
+        with open(self.files[1], 'w', encoding='utf-8') as file:
+            json.dump(timetables[:1], file)
+        self.assertFalse(self.store.is_current(self.files))
+        store = TimetableStore.load(self.path, *self.files)
+        self.assertEqual(store.summary()["departures"], 5)
+        store.close()
+
+    def test_schedule_of_headways(self):
+        schedule = self.store.departures(bus_lines=["180"])
+        headways = compute_headways(find_passages(fixes, index), schedule)
+        self.assertEqual(list(headways["scheduled_headway"]), [600, 600, 1200])
+
+
+if __name__ == '__main__':
+    unittest.main()
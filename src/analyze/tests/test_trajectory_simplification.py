@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+from ..trajectory_simplification import simplify_hour_folder
+
+
+def poll(minute):
+    """One vehicle driving east at constant speed and one standing still."""
+    return [
+        {"Lines": "180", "Brigade": "1", "Lat": 52.23, "Lon": 21.0 + 0.005 * minute,
+         "Time": f"2024-02-26 08:{minute:02d}:00"},
+        {"Lines": "523", "Brigade": "2", "Lat": 52.25, "Lon": 21.05, "Time": f"2024-02-26 08:{minute:02d}:30"}
+    ]
+
+
+class TestSimplifyHourFolder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp_dir.name, "2024-02-26 08")
+        os.makedirs(self.folder)
+        for minute in range(5):
+            self.write(os.path.join(self.folder, f"2024-02-26 08:{minute:02d}:10.json"), poll(minute))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def write(path, records):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(records, file)
+
+    def read_folder(self, folder):
+        records = {}
+        for filename in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as file:
+                records[filename] = json.load(file)
+        return records
+
+    def test_writes_to_output_folder(self):
+        original = self.read_folder(self.folder)
+        output = os.path.join(self.tmp_dir.name, "simplified", "2024-02-26 08")
+        report = simplify_hour_folder(self.folder, output_folder=output)
+        self.assertEqual(self.read_folder(self.folder), original)
+        simplified = self.read_folder(output)
+        self.assertEqual(list(simplified), list(original))
+        kept = [record for records in simplified.values() for record in records]
+        # Only the ends of both trajectories are kept.
+        self.assertEqual(len(kept), 4)
+        self.assertEqual((report.points_in, report.points_kept), (10, 4))
+        self.assertEqual(simplified["2024-02-26 08:00:10.json"], original["2024-02-26 08:00:10.json"])
+
+    def test_in_place_needs_overwrite(self):
+        original = self.read_folder(self.folder)
+        for output in (None, self.folder):
+            with self.assertRaises(ValueError):
+                simplify_hour_folder(self.folder, output_folder=output)
+        self.assertEqual(self.read_folder(self.folder), original)
+        simplify_hour_folder(self.folder, overwrite=True)
+        self.assertEqual(sum(len(records) for records in self.read_folder(self.folder).values()), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
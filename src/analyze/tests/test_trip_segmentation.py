@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+from pandas import DataFrame
+from ..analyze_avg_speed import count_avg_speed
+from ..compact_locations import to_compact
+from ..line_stops import LineStopsIndex
+from ..trip_segmentation import line_termini, segment_trips, trip_totals
+
+# Line 180 runs north along a meridian between termini at 52.2200 and 52.2400, with a stop halfway.
+index = LineStopsIndex({"180": {"busstopId": ["1001", "1002", "1003"], "busstopNr": ["01", "01", "01"],
+                                "lat": [52.2200, 52.2300, 52.2400], "lon": [21.0, 21.0, 21.0]}})
+STEP = 0.0025  # about 278 m, driven in a minute: 16.7 km/h
+
+
+def locations(rows):
+    return to_compact(DataFrame(rows, columns=["Lines", "Brigade", "Lat", "Lon", "Time"]))
+
+
+def fix(minute, latitude, vehicle_brigade=1):
+    return ("180", vehicle_brigade, latitude, 21.0, f"2024-02-26 08:{minute:02d}:00")
+
+
+# Brigade 1 drives from the southern terminus to the northern one (minutes 0-8), lays over there for 10 minutes
+# and drives back to the middle stop (minutes 18-22).
+trajectory = [fix(minute, 52.2200 + minute * STEP) for minute in range(9)] \
+    + [fix(minute, 52.2400) for minute in range(9, 18)] \
+    + [fix(minute, 52.2400 - (minute - 17) * STEP) for minute in range(18, 22)]
+
+
+class TestTripSegmentation(unittest.TestCase):
+
+    def test_termini(self):
+        x, y = line_termini(index)["180"]
+        self.assertEqual(len(x), 2)
+        self.assertAlmostEqual(abs(y[0] - y[1]), 2226, delta=5)
+
+    def test_layover_at_terminus_splits_trips(self):
+        trips, dwells = segment_trips(locations(trajectory), line_termini(index))
+        self.assertEqual(len(trips), 2)
+        self.assertEqual(list(trips["fixes"]), [9, 5])
+        self.assertEqual(list(trips["seconds"]), [480, 240])
+        self.assertAlmostEqual(trips["metres"][0], 2226, delta=5)
+        self.assertEqual(len(dwells), 1)
+        self.assertTrue(dwells["at_terminus"][0])
+        self.assertEqual(dwells["seconds"][0], 9 * 60)
+
+    def test_long_stop_without_termini(self):
+        trips, dwells = segment_trips(locations(trajectory), dwell_seconds=300)
+        self.assertEqual(len(trips), 2)
+        self.assertFalse(dwells["at_terminus"].any())
+        # A short stop is part of the trip.
+        trips, dwells = segment_trips(locations(trajectory), dwell_seconds=900)
+        self.assertEqual(len(trips), 1)
+        self.assertEqual(len(dwells), 0)
+
+    def test_gaps_and_vehicles_split_trips(self):
+        rows = [fix(0, 52.225), fix(1, 52.228), fix(20, 52.231), fix(21, 52.234), fix(0, 52.225, 2), fix(1, 52.228, 2)]
+        trips, _ = segment_trips(locations(rows))
+        self.assertEqual(list(trips["Brigade"]), [1, 1, 2])
+        self.assertEqual(list(trips["seconds"]), [60, 60, 60])
+
+    def test_average_speed_over_trips(self):
+        trips, _ = segment_trips(locations(trajectory), line_termini(index))
+        speeds = count_avg_speed(trip_totals(trips))
+        self.assertEqual(speeds["Lines"][0], 180)
+        self.assertEqual(speeds["trips"][0], 2)
+        np.testing.assert_allclose(speeds["Average_Speed"], [16.7], atol=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+"""
+Embedded SQLite store of the processed timetables and bus stops.
+
+The processed files are loaded once into normalised tables (stops, lines and departures) with indexes on
+(line, brigade, time) and on (busstopId, busstopNr), so an analysis queries exactly the departures it needs,
+e.g. those of one line between two times or those at one stop, instead of reading the whole timetables file,
+merging it with the bus stop coordinates and iterating the nested timetables in Python.
+
+    store = TimetableStore.load()
+    store.departures(bus_lines=["180"], start="08:00:00", end="09:00:00")
+
+Identifiers are stored in the form of the bus stop coordinates, busstopId "1001" and busstopNr "01", also when
+the processed files hold them as the integers pd.read_json made of them. The store remembers the size and
+modification time of the files it was loaded from and is loaded again by TimetableStore.load when they change.
+"""
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from pandas import DataFrame
+from src.analyze.dictionary_data import brigade, lines
+from src.common.config import BUS_STOPS_COORDINATES_FILE, TIMETABLE_STORE_FILE, TIMETABLES
+from src.common.log import get_logger
+from src.common.metrics import count_records, timed
+from src.fetch_and_preprocess.process_data import stop_code
+
+__all__ = [
+    "DEPARTURE_COLUMNS",
+    "STOP_COLUMNS",
+    "TimetableStore"
+]
+
+logger = get_logger(__name__)
+
+DEPARTURE_COLUMNS = [lines, "busstopId", "busstopNr", brigade, "czas", "seconds"]
+STOP_COLUMNS = ["busstopId", "busstopNr", "nazwa_zespolu", "id_ulicy", "szer_geo", "dlug_geo"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stops (
+    id INTEGER PRIMARY KEY,
+    busstopId TEXT NOT NULL,
+    busstopNr TEXT NOT NULL,
+    name TEXT,
+    street_id TEXT,
+    lat REAL,
+    lon REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS stops_code ON stops (busstopId, busstopNr);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    line TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS departures (
+    line_id INTEGER NOT NULL REFERENCES lines (id),
+    stop_id INTEGER NOT NULL REFERENCES stops (id),
+    brigade TEXT NOT NULL,
+    time TEXT NOT NULL,
+    seconds INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS departures_line_brigade_time ON departures (line_id, brigade, seconds);
+CREATE INDEX IF NOT EXISTS departures_stop_time ON departures (stop_id, seconds);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+"""
+
+DEPARTURES_QUERY = """
+SELECT lines.line, stops.busstopId, stops.busstopNr, departures.brigade, departures.time, departures.seconds
+FROM departures JOIN lines ON lines.id = departures.line_id JOIN stops ON stops.id = departures.stop_id
+"""
+
+
+def _seconds(time: str) -> int:
+    # Times of night departures go past 24:00:00 and keep their order after midnight.
+    hours, minutes, seconds = map(int, time.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _source_signature(paths: Iterable[str]) -> List[Tuple[str, int, float]]:
+    return [(os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+
+
+class TimetableStore:
+    """
+    Stops, lines and departures in a SQLite file, with a small query API returning DataFrames.
+
+    Args:
+    - path (str): The database file, created if missing.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, bus_stops_coordinates_file: Optional[str] = None,
+             timetables_file: Optional[str] = None) -> "TimetableStore":
+        """
+        Open the store, loading the processed files into it first if they changed since they were loaded.
+
+        Args:
+        - path (str): The database file, TIMETABLE_STORE_FILE of the processed data folder by default.
+        - bus_stops_coordinates_file, timetables_file (str): Processed bus stops and timetables, those of the
+          processed data folder by default.
+
+        Returns:
+        TimetableStore: The up to date store.
+        """
+        if path is None or bus_stops_coordinates_file is None or timetables_file is None:
+            from src.fetch_and_preprocess.file_utils import get_filepath
+            path = path or get_filepath(TIMETABLE_STORE_FILE, False)
+            bus_stops_coordinates_file = bus_stops_coordinates_file or get_filepath(BUS_STOPS_COORDINATES_FILE, False)
+            timetables_file = timetables_file or get_filepath(TIMETABLES, False)
+        store = cls(path)
+        if not store.is_current([bus_stops_coordinates_file, timetables_file]):
+            store.build(bus_stops_coordinates_file, timetables_file)
+        return store
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def is_current(self, paths: Sequence[str]) -> bool:
+        """Whether the store was loaded from exactly these files, unchanged since."""
+        stored = self._connection.execute("SELECT path, size, mtime FROM sources ORDER BY path").fetchall()
+        return stored == sorted(_source_signature(paths))
+
+    @timed()
+    def build(self, bus_stops_coordinates_file: str, timetables_file: str) -> None:
+        """
+        Replace the contents of the store with the processed files, in a single transaction.
+
+        Args:
+        - bus_stops_coordinates_file (str): Processed bus stop coordinates (BUS_STOPS_COORDINATES_FILE).
+        - timetables_file (str): Processed timetables (TIMETABLES), records with 'busstopId', 'busstopNr' and
+          'rozklad', the departures ({'czas': 'HH:MM:SS', 'brygada': ...}) by line.
+        """
+        with open(bus_stops_coordinates_file, 'r', encoding='utf-8') as file:
+            coordinates = json.load(file)
+        with open(timetables_file, 'r', encoding='utf-8') as file:
+            timetables = json.load(file)
+
+        stop_ids: Dict[Tuple[str, str], int] = {}
+        stop_rows = []
+        for stop in coordinates:
+            code = (stop_code(stop['zespol'], 4), stop_code(stop['slupek'], 2))
+            if code not in stop_ids:
+                stop_ids[code] = len(stop_ids) + 1
+                stop_rows.append((stop_ids[code], *code, stop.get('nazwa_zespolu'), stop.get('id_ulicy'),
+                                  float(stop['szer_geo']), float(stop['dlug_geo'])))
+        line_ids: Dict[str, int] = {}
+        departure_rows = []
+        for stop in timetables:
+            code = (stop_code(stop['busstopId'], 4), stop_code(stop['busstopNr'], 2))
+            if code not in stop_ids:
+                # A stop missing from the coordinates keeps its departures, without a position.
+                stop_ids[code] = len(stop_ids) + 1
+                stop_rows.append((stop_ids[code], *code, None, None, None, None))
+            for line, departures in stop['rozklad'].items():
+                line_id = line_ids.setdefault(str(line), len(line_ids) + 1)
+                departure_rows.extend((line_id, stop_ids[code], str(departure['brygada']), departure['czas'],
+                                       _seconds(departure['czas'])) for departure in departures)
+
+        with self._connection:
+            self._connection.execute("DELETE FROM departures")
+            self._connection.execute("DELETE FROM lines")
+            self._connection.execute("DELETE FROM stops")
+            self._connection.execute("DELETE FROM sources")
+            self._connection.executemany("INSERT INTO stops VALUES (?, ?, ?, ?, ?, ?, ?)", stop_rows)
+            self._connection.executemany("INSERT INTO lines VALUES (?, ?)",
+                                         ((line_id, line) for line, line_id in line_ids.items()))
+            self._connection.executemany("INSERT INTO departures VALUES (?, ?, ?, ?, ?)", departure_rows)
+            self._connection.executemany("INSERT INTO sources VALUES (?, ?, ?)",
+                                         _source_signature([bus_stops_coordinates_file, timetables_file]))
+        self._connection.execute("ANALYZE")
+        count_records("timetable_store", len(departure_rows), len(departure_rows))
+        logger.info("Timetable store built", extra={"path": self.path, "stops": len(stop_rows),
+                                                    "lines": len(line_ids), "departures": len(departure_rows)})
+
+    def lines(self) -> List[str]:
+        """Lines with departures, in ascending order."""
+        return [row[0] for row in self._connection.execute("SELECT line FROM lines ORDER BY line")]
+
+    def stop(self, bus_stop_id: Any, bus_stop_nr: Any) -> Optional[Dict[str, Any]]:
+        """
+        A bus stop with its name and position.
+
+        Returns:
+        Optional[Dict]: The STOP_COLUMNS of the stop, None for an unknown stop.
+        """
+        row = self._connection.execute(
+            "SELECT busstopId, busstopNr, name, street_id, lat, lon FROM stops WHERE busstopId = ? AND busstopNr = ?",
+            (stop_code(bus_stop_id, 4), stop_code(bus_stop_nr, 2))).fetchone()
+        return dict(zip(STOP_COLUMNS, row)) if row else None
+
+    def stops(self, bus_line: Optional[Any] = None) -> DataFrame:
+        """
+        Bus stops, all of them or those a line departs from.
+
+        Args:
+        - bus_line: A line, e.g. "180"; all stops by default.
+
+        Returns:
+        DataFrame: The STOP_COLUMNS of every stop, ordered by busstopId and busstopNr.
+        """
+        query = "SELECT busstopId, busstopNr, name, street_id, lat, lon FROM stops"
+        params: List[Any] = []
+        if bus_line is not None:
+            query += (" WHERE id IN (SELECT stop_id FROM departures WHERE line_id = "
+                      "(SELECT id FROM lines WHERE line = ?))")
+            params.append(str(bus_line))
+        return DataFrame(self._connection.execute(query + " ORDER BY busstopId, busstopNr", params).fetchall(),
+                         columns=STOP_COLUMNS)
+
+    def departures(self, bus_lines: Optional[Iterable[Any]] = None, brigades: Optional[Iterable[Any]] = None,
+                   bus_stops: Optional[Iterable[Tuple[Any, Any]]] = None, start: Optional[str] = None,
+                   end: Optional[str] = None) -> DataFrame:
+        """
+        Departures matching all of the given conditions.
+
+        Args:
+        - bus_lines: Lines to include, all by default.
+        - brigades: Brigades to include, all by default.
+        - bus_stops: (busstopId, busstopNr) pairs of the stops to include, all by default.
+        - start, end (str): Earliest and latest departure time ("HH:MM:SS"), both included.
+
+        Returns:
+        DataFrame: The DEPARTURE_COLUMNS (Lines, busstopId, busstopNr, Brigade, czas, seconds since midnight) of
+        every departure, ordered by line, brigade and time.
+        """
+        conditions, params = [], []
+        if bus_lines is not None:
+            bus_lines = [str(line) for line in bus_lines]
+            conditions.append(f"lines.line IN ({', '.join('?' * len(bus_lines))})")
+            params.extend(bus_lines)
+        if brigades is not None:
+            brigades = [str(value) for value in brigades]
+            conditions.append(f"departures.brigade IN ({', '.join('?' * len(brigades))})")
+            params.extend(brigades)
+        if bus_stops is not None:
+            bus_stops = [(stop_code(stop_id, 4), stop_code(stop_nr, 2)) for stop_id, stop_nr in bus_stops]
+            # One row value per stop, so the unique stops_code index is looked up once per stop.
+            conditions.append("departures.stop_id IN (SELECT id FROM stops WHERE (busstopId, busstopNr) IN "
+                              f"(VALUES {', '.join(['(?, ?)'] * len(bus_stops))}))" if bus_stops else "0")
+            params.extend(value for stop in bus_stops for value in stop)
+        if start is not None:
+            conditions.append("departures.seconds >= ?")
+            params.append(_seconds(start))
+        if end is not None:
+            conditions.append("departures.seconds <= ?")
+            params.append(_seconds(end))
+        query = DEPARTURES_QUERY + (" WHERE " + " AND ".join(conditions) if conditions else "") \
+            + " ORDER BY lines.line, departures.brigade, departures.seconds"
+        df = DataFrame(self._connection.execute(query, params).fetchall(), columns=DEPARTURE_COLUMNS)
+        return df.astype({"seconds": "int64"})
+
+    def stop_timetables(self, bus_stop_id: Any, bus_stop_nr: Any) -> Dict[str, List[Dict[str, str]]]:
+        """
+        Departures at a stop by line, in the form of the 'rozklad' of the processed timetables.
+
+        Returns:
+        Dict[str, List[Dict]]: Departures ({'czas': 'HH:MM:SS', 'brygada': ...}) of every line, in time order.
+        """
+        timetables: Dict[str, List[Dict[str, str]]] = {}
+        rows = self._connection.execute(
+            "SELECT lines.line, departures.time, departures.brigade FROM departures "
+            "JOIN lines ON lines.id = departures.line_id "
+            "WHERE departures.stop_id = (SELECT id FROM stops WHERE busstopId = ? AND busstopNr = ?) "
+            "ORDER BY departures.seconds", (stop_code(bus_stop_id, 4), stop_code(bus_stop_nr, 2)))
+        for line, time, brigade_value in rows:
+            timetables.setdefault(line, []).append({"czas": time, "brygada": brigade_value})
+        return timetables
+
+    def summary(self) -> Dict[str, int]:
+        """Number of stops, lines and departures."""
+        return {table: self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("stops", "lines", "departures")}
@@ -0,0 +1,242 @@
+"""
+Trajectory simplification.
+
+Stationary buses and straight driving produce runs of redundant points. Douglas-Peucker drops every point
+that lies within a tolerance (in metres) of the simplified trajectory. The time-aware variant measures the
+synchronized euclidean distance instead: the distance between a point and the position interpolated on the
+simplified segment at the point's timestamp. It bounds the position error at every original timestamp,
+so stops and changes of speed are kept, not only changes of direction.
+
+Kept points are the original records, timestamps included. The first and the last point of every trajectory
+are always kept, so trip durations do not change and the average speed error equals the distance error
+divided by the duration; both are reported by SimplificationReport.
+"""
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import vehicle_key
+from src.analyze.dictionary_data import data, lat, lines, brigade, lon, time
+from src.analyze.geo import to_local_metres
+from src.common.metrics import timed
+
+__all__ = [
+    "SIMPLIFY_TOLERANCE",
+    "SimplificationReport",
+    "simplify_mask",
+    "simplify_trajectory",
+    "simplify_trajectories",
+    "simplify_hour_folder"
+]
+
+# Largest position error (metres) of a dropped point; below the usual GPS noise of the live locations.
+SIMPLIFY_TOLERANCE = 10
+
+
+def _deviations(x: np.ndarray, y: np.ndarray, t: Optional[np.ndarray], start: int, end: int) -> np.ndarray:
+    """Distances of the points between start and end from the segment joining them."""
+    px, py = x[start + 1:end], y[start + 1:end]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    if t is not None:
+        duration = t[end] - t[start]
+        fraction = (t[start + 1:end] - t[start]) / duration if duration > 0 else np.zeros(len(px))
+    else:
+        length = dx * dx + dy * dy
+        fraction = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length, 0, 1) if length > 0 \
+            else np.zeros(len(px))
+    return np.hypot(px - (x[start] + fraction * dx), py - (y[start] + fraction * dy))
+
+
+def simplify_mask(x: np.ndarray, y: np.ndarray, t: Optional[np.ndarray] = None,
+                  tolerance: float = SIMPLIFY_TOLERANCE) -> Tuple[np.ndarray, float]:
+    """
+    Douglas-Peucker simplification of a trajectory in metres, time-aware if timestamps are given.
+
+    Args:
+    - x, y (ndarray): Positions in metres, ordered by time.
+    - t (ndarray): Timestamps in seconds; if given, deviations are synchronized euclidean distances.
+    - tolerance (float): Largest allowed deviation of a dropped point in metres.
+
+    Returns:
+    Tuple[ndarray, float]: Boolean mask of the kept points and the largest deviation of a dropped point.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1] if n else []] = True
+    max_error = 0.0
+    segments = [(0, n - 1)] if n > 2 else []
+    while segments:
+        start, end = segments.pop()
+        deviations = _deviations(x, y, t, start, end)
+        farthest = int(np.argmax(deviations))
+        if deviations[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            segments.extend(segment for segment in ((start, split), (split, end)) if segment[1] - segment[0] > 1)
+        else:
+            max_error = max(max_error, float(deviations[farthest]))
+    return keep, max_error
+
+
+def _to_arrays(lat_values: Sequence[float], lon_values: Sequence[float],
+               time_values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x, y = to_local_metres(lat_values, lon_values)
+    t = np.array(time_values, dtype='datetime64[s]').astype(np.int64).astype(np.float64)
+    return x, y, t
+
+
+def _path_length(x: np.ndarray, y: np.ndarray) -> float:
+    return float(np.hypot(np.diff(x), np.diff(y)).sum())
+
+
+@dataclass
+class SimplificationReport:
+    """
+    Effect of a simplification on the points and on the distance and speed metrics.
+
+    Distances are path lengths of the projected trajectories; dropping points can only shorten a path,
+    so the distance errors are underestimates of the original distance.
+    """
+    tolerance: float
+    time_aware: bool
+    trajectories: int = 0
+    points_in: int = 0
+    points_kept: int = 0
+    max_position_error_m: float = 0.0
+    total_distance_m: float = 0.0
+    total_distance_error_m: float = 0.0
+    max_distance_error_m: float = 0.0
+    max_avg_speed_error_kmh: float = 0.0
+
+    def add(self, x: np.ndarray, y: np.ndarray, t: np.ndarray, keep: np.ndarray, max_error: float) -> None:
+        distance = _path_length(x, y)
+        distance_error = distance - _path_length(x[keep], y[keep])
+        duration = t[-1] - t[0] if len(t) else 0
+        self.trajectories += 1
+        self.points_in += len(x)
+        self.points_kept += int(keep.sum())
+        self.max_position_error_m = max(self.max_position_error_m, max_error)
+        self.total_distance_m += distance
+        self.total_distance_error_m += distance_error
+        self.max_distance_error_m = max(self.max_distance_error_m, distance_error)
+        if duration > 0:
+            self.max_avg_speed_error_kmh = max(self.max_avg_speed_error_kmh, distance_error / duration * 3.6)
+
+    @property
+    def compression(self) -> float:
+        """Fraction of the points kept."""
+        return self.points_kept / self.points_in if self.points_in else 1.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "compression": self.compression}
+
+
+def simplify_trajectory(items: List[Dict[str, Any]], tolerance: float = SIMPLIFY_TOLERANCE,
+                        time_aware: bool = True,
+                        report: Optional[SimplificationReport] = None) -> List[Dict[str, Any]]:
+    """
+    Simplify the locations of one bus, as in the Data column built by group_by_bus.
+
+    Args:
+    - items (List[Dict]): Locations with Time, Lat and Lon, ordered by time.
+    - tolerance (float): Largest allowed deviation of a dropped point in metres.
+    - time_aware (bool): Measure synchronized euclidean distances instead of distances from the path.
+    - report (SimplificationReport): Report the errors of this trajectory are added to.
+
+    Returns:
+    List[Dict]: The kept locations.
+    """
+    if len(items) < 3:
+        return list(items)
+    x, y, t = _to_arrays([item[lat] for item in items], [item[lon] for item in items],
+                         [item[time] for item in items])
+    keep, max_error = simplify_mask(x, y, t if time_aware else None, tolerance)
+    if report is not None:
+        report.add(x, y, t, keep, max_error)
+    return [item for item, kept in zip(items, keep) if kept]
+
+
+@timed()
+def simplify_trajectories(df: DataFrame, tolerance: float = SIMPLIFY_TOLERANCE,
+                          time_aware: bool = True) -> Tuple[DataFrame, SimplificationReport]:
+    """
+    Simplify the Data column of a DataFrame grouped by group_by_bus.
+
+    The result can be passed to count_durations, count_avg_speed and analyze_speeding_points like the original.
+
+    Args:
+    - df (DataFrame): DataFrame grouped by bus.
+    - tolerance (float): Largest allowed deviation of a dropped point in metres.
+    - time_aware (bool): Measure synchronized euclidean distances instead of distances from the path.
+
+    Returns:
+    Tuple[DataFrame, SimplificationReport]: A copy of df with simplified trajectories and the report.
+    """
+    report = SimplificationReport(tolerance, time_aware)
+    simplified = df.copy()
+    simplified[data] = [simplify_trajectory(items, tolerance, time_aware, report) for items in df[data]]
+    return simplified, report
+
+
+@timed()
+def simplify_hour_folder(folder: str, tolerance: float = SIMPLIFY_TOLERANCE, time_aware: bool = True,
+                         output_folder: Optional[str] = None, overwrite: bool = False) -> SimplificationReport:
+    """
+    Write the files of a processed hour folder without their redundant locations.
+
+    Trajectories are assembled across the files of the folder the same way group_by_bus does, and every
+    file is written to output_folder without the dropped records. The processed files are replaced only
+    with overwrite, as the dropped records cannot be restored without processing the raw files again.
+
+    Args:
+    - folder (str): The path to the folder containing JSON files of one hour.
+    - tolerance (float): Largest allowed deviation of a dropped point in metres.
+    - time_aware (bool): Measure synchronized euclidean distances instead of distances from the path.
+    - output_folder (str): Where to write the simplified files; needed unless overwrite is set.
+    - overwrite (bool): Replace the files of folder in place when no output_folder is given.
+
+    Returns:
+    SimplificationReport: Effect of the simplification.
+
+    Raises:
+    ValueError: If the files of folder would be replaced without overwrite.
+    """
+    output_folder = output_folder or (folder if overwrite else None)
+    if output_folder is None or (not overwrite and os.path.abspath(output_folder) == os.path.abspath(folder)):
+        raise ValueError(f"Simplifying {folder} in place needs overwrite=True")
+    filenames = sorted(filename for filename in os.listdir(folder) if filename.endswith('.json'))
+    files = []
+    for filename in filenames:
+        with open(os.path.join(folder, filename), 'r', encoding='utf-8') as file:
+            files.append(json.load(file))
+
+    trajectories: Dict[Tuple, List[Tuple[int, int]]] = {}
+    for file_index, records in enumerate(files):
+        for record_index, record in enumerate(records):
+            trajectories.setdefault(vehicle_key(record[lines], record[brigade]), []).append((file_index, record_index))
+
+    report = SimplificationReport(tolerance, time_aware)
+    kept = [np.ones(len(records), dtype=bool) for records in files]
+    for positions in trajectories.values():
+        if len(positions) < 3:
+            continue
+        records = [files[file_index][record_index] for file_index, record_index in positions]
+        order = sorted(range(len(records)), key=lambda index: records[index][time])
+        x, y, t = _to_arrays([float(records[index][lat]) for index in order],
+                             [float(records[index][lon]) for index in order],
+                             [records[index][time] for index in order])
+        keep, max_error = simplify_mask(x, y, t if time_aware else None, tolerance)
+        report.add(x, y, t, keep, max_error)
+        for index, kept_point in zip(order, keep):
+            if not kept_point:
+                file_index, record_index = positions[index]
+                kept[file_index][record_index] = False
+
+    os.makedirs(output_folder, exist_ok=True)
+    for filename, records, mask in zip(filenames, files, kept):
+        with open(os.path.join(output_folder, filename), 'w', encoding='utf-8') as file:
+            json.dump([record for record, kept_record in zip(records, mask) if kept_record], file,
+                      indent=4, ensure_ascii=False)
+    return report
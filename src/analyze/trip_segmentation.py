@@ -0,0 +1,182 @@
+"""
+Segmentation of vehicle trajectories into trips and dwell periods.
+
+count_trip_duration takes the span between the first and the last fix of a vehicle in the hour as one trip, so
+the layovers at the termini count as driving time and lower the average speed. Here the segments between
+consecutive fixes of every vehicle (vehicle_segments) are classified at once for the whole fleet:
+
+    dwell       both fixes near a terminus of the line (a layover or a turnaround), or part of a stationary run
+                (segment speed under STATIONARY_SPEED) lasting at least DWELL_SECONDS anywhere
+    gap         more than MAX_SEGMENT_GAP seconds between the fixes: missing data, neither trip nor dwell
+    travel      every other segment
+
+A trip is a run of travel segments and a dwell a run of dwell segments. Runs are numbered with cumulative sums
+and summed with np.bincount, so the cost is a constant number of array operations over the fixes, plus one
+distance computation per line for the termini. The termini of a line are the two of its stops farthest apart,
+with the other posts of the same places (stops within TERMINUS_RADIUS of them).
+
+trip_totals sums the trips of every vehicle into the Trip_Duration and Total_Distance columns count_avg_speed
+divides, so the average speed of a vehicle is its speed while driving.
+"""
+from typing import Dict, Optional, Tuple
+import numpy as np
+from pandas import DataFrame
+from src.analyze.analyze_avg_speed import vehicle_key
+from src.analyze.compact_locations import vehicle_segments
+from src.analyze.dictionary_data import brigade, lat, lines, lon, timestamp, total_distance, trip_duration
+from src.analyze.geo import to_local_metres
+from src.analyze.line_stops import LineStopsIndex
+from src.common.metrics import count_records, timed
+
+__all__ = [
+    "STATIONARY_SPEED",
+    "DWELL_SECONDS",
+    "TERMINUS_RADIUS",
+    "MAX_SEGMENT_GAP",
+    "TRIP_COLUMNS",
+    "DWELL_COLUMNS",
+    "line_termini",
+    "segment_trips",
+    "trip_totals"
+]
+
+# Segments slower than this (km/h) are stationary: GPS noise of a standing bus stays well below it.
+STATIONARY_SPEED = 3
+# Stationary runs at least this long (seconds) are dwells even away from the termini, e.g. a driver's break.
+DWELL_SECONDS = 300
+# Fixes closer than this (metres) to a terminus of their line are at the terminus.
+TERMINUS_RADIUS = 150
+# Segments longer than this (seconds) span gaps in the data, as in metrics_cube.
+MAX_SEGMENT_GAP = 300
+
+TRIP_COLUMNS = [lines, brigade, "start", "end", "seconds", "metres", "fixes"]
+DWELL_COLUMNS = [lines, brigade, "start", "end", "seconds", "at_terminus", lat, lon]
+
+
+def line_termini(index: LineStopsIndex, radius: float = TERMINUS_RADIUS) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Termini of every line: its two stops farthest apart and the stops within a radius of them.
+
+    Args:
+    - index (LineStopsIndex): Stops of every line.
+    - radius (float): Distance in metres within which other stops belong to a terminus.
+
+    Returns:
+    Dict[str, Tuple[ndarray, ndarray]]: Positions of the termini of every line with at least two stops, in metres
+    (see to_local_metres).
+    """
+    termini = {}
+    for line in index.lines():
+        stops = index.stops(line)
+        if stops is None or len(stops) < 2:
+            continue
+        x, y = to_local_metres(stops.lat, stops.lon)
+        distances = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+        ends = np.unravel_index(np.argmax(distances), distances.shape)
+        near = (distances[list(ends)] <= radius).any(axis=0)
+        termini[line] = (x[near], y[near])
+    return termini
+
+
+def _at_terminus(df: DataFrame, termini: Dict[str, Tuple[np.ndarray, np.ndarray]], radius: float) -> np.ndarray:
+    """Whether every fix of locations sorted by line is within radius of a terminus of its line."""
+    line_values = df[lines].astype(str).to_numpy()
+    x, y = to_local_metres(df[lat].to_numpy(np.float64), df[lon].to_numpy(np.float64))
+    at_terminus = np.zeros(len(df), dtype=bool)
+    starts = np.flatnonzero(np.concatenate([[True], line_values[1:] != line_values[:-1]]))
+    for start, end in zip(starts, np.concatenate([starts[1:], [len(df)]])):
+        points = termini.get(line_values[start])
+        if points is None:
+            continue
+        distances = np.hypot(x[start:end, None] - points[0][None, :], y[start:end, None] - points[1][None, :])
+        at_terminus[start:end] = distances.min(axis=1) <= radius
+    return at_terminus
+
+
+def _runs(flags: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Number of the run of consecutive True flags every flag belongs to (-1 for False) and the start of every run."""
+    starts = flags & ~np.concatenate([[False], flags[:-1]])
+    return np.where(flags, np.cumsum(starts) - 1, -1), np.flatnonzero(starts)
+
+
+@timed()
+def segment_trips(df: DataFrame, termini: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None,
+                  stationary_speed: float = STATIONARY_SPEED, dwell_seconds: float = DWELL_SECONDS,
+                  terminus_radius: float = TERMINUS_RADIUS,
+                  max_gap: float = MAX_SEGMENT_GAP) -> Tuple[DataFrame, DataFrame]:
+    """
+    Split the trajectories of all vehicles into trips and dwell periods.
+
+    Args:
+    - df (DataFrame): Compact bus locations (see compact_locations), of one or more hours.
+    - termini (Dict): Termini of every line from line_termini; without them only long stationary runs are dwells.
+    - stationary_speed (float): Speed in km/h under which a segment is stationary.
+    - dwell_seconds (float): Shortest stationary run in seconds that is a dwell away from the termini.
+    - terminus_radius (float): Distance in metres within which a fix is at a terminus.
+    - max_gap (float): Longest segment in seconds; longer ones are gaps in the data.
+
+    Returns:
+    Tuple[DataFrame, DataFrame]: Trips (TRIP_COLUMNS: vehicle, start and end Timestamp, seconds, metres and
+    number of fixes) and dwells (DWELL_COLUMNS: vehicle, start and end Timestamp, seconds, whether at a terminus
+    and the position of the first fix), both ordered by vehicle and time.
+    """
+    df, same_vehicle, seconds, metres = vehicle_segments(df)
+    if len(df) < 2:
+        return DataFrame(columns=TRIP_COLUMNS), DataFrame(columns=DWELL_COLUMNS)
+    valid = same_vehicle & (seconds <= max_gap)
+    stationary = valid & (metres * 3.6 <= stationary_speed * seconds)
+
+    # Stationary runs long enough to be dwells wherever they are.
+    run, run_starts = _runs(stationary)
+    run_seconds = np.bincount(run[stationary], weights=seconds[stationary], minlength=len(run_starts))
+    long_stop = np.zeros(len(stationary), dtype=bool)
+    long_stop[stationary] = run_seconds[run[stationary]] >= dwell_seconds
+    at_terminus = _at_terminus(df, termini, terminus_radius) if termini else np.zeros(len(df), dtype=bool)
+    terminus = valid & at_terminus[:-1] & at_terminus[1:]
+    dwell = long_stop | terminus
+    travel = valid & ~dwell
+
+    times = df[timestamp].to_numpy(np.int64)
+    vehicles = df[[lines, brigade]].reset_index(drop=True)
+
+    trip, first = _runs(travel)
+    trip_count = len(first)
+    fixes = np.bincount(trip[travel], minlength=trip_count) + 1
+    trips = vehicles.iloc[first].reset_index(drop=True).assign(
+        start=times[first], end=times[first + fixes - 1],
+        seconds=np.bincount(trip[travel], weights=seconds[travel], minlength=trip_count),
+        metres=np.bincount(trip[travel], weights=metres[travel], minlength=trip_count), fixes=fixes)
+
+    stay, first = _runs(dwell)
+    stay_count = len(first)
+    segments = np.bincount(stay[dwell], minlength=stay_count)
+    dwells = vehicles.iloc[first].reset_index(drop=True).assign(
+        start=times[first], end=times[first + segments],
+        seconds=np.bincount(stay[dwell], weights=seconds[dwell], minlength=stay_count),
+        at_terminus=np.bincount(stay[dwell], weights=terminus[dwell], minlength=stay_count) > 0,
+        **{lat: df[lat].to_numpy(np.float64)[first], lon: df[lon].to_numpy(np.float64)[first]})
+    count_records("segment_trips", len(df), int(fixes.sum()))
+    return trips[TRIP_COLUMNS], dwells[DWELL_COLUMNS]
+
+
+def trip_totals(trips: DataFrame) -> DataFrame:
+    """
+    Driving time and distance of every vehicle over its trips, for count_avg_speed.
+
+    Args:
+    - trips (DataFrame): Trips from segment_trips.
+
+    Returns:
+    DataFrame: Lines and Brigade (numeric identifiers as integers, as group_by_bus has them), trips,
+    Trip_Duration (hours) and Total_Distance (kilometres).
+    """
+    keys = [vehicle_key(str(bus_line), str(bus_brigade))
+            for bus_line, bus_brigade in zip(trips[lines], trips[brigade])]
+    totals = DataFrame({lines: [key[0] for key in keys], brigade: [key[1] for key in keys],
+                        "seconds": trips["seconds"].to_numpy(np.float64),
+                        "metres": trips["metres"].to_numpy(np.float64)})
+    totals = totals.groupby([lines, brigade], sort=True).agg(
+        trips=("seconds", "size"), seconds=("seconds", "sum"), metres=("metres", "sum")).reset_index()
+    totals[trip_duration] = totals["seconds"] / 3600
+    totals[total_distance] = totals["metres"] / 1000
+    return totals[[lines, brigade, "trips", trip_duration, total_distance]]
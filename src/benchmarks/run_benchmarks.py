@@ -0,0 +1,187 @@
+"""
+Benchmarks of the pipeline hot paths on synthetic data.
+
+Generates a synthetic data folder, points the pipeline at it through DATA_DIR_ENV and times the processing
+and analysis functions. Runtime and peak memory (tracemalloc) of every benchmark are written as JSON,
+so the results of two versions can be compared.
+
+Usage:
+    python -m src.benchmarks.run_benchmarks --vehicles 1500 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from src.benchmarks.synthetic_fleet import FleetConfig, generate_fleet_data
+from src.common.config import *
+
+__all__ = [
+    "run_benchmark",
+    "run_benchmarks"
+]
+
+
+def run_benchmark(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Time a function and measure its peak memory.
+
+    The function is run `repeat` times for timing and once more under tracemalloc, so the
+    tracing overhead does not distort the timings. Output printed by the function is discarded.
+
+    Returns:
+        Dict: Wall times of all runs in seconds, their minimum and median, and the peak of memory
+        allocated by Python during the traced run in bytes.
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        "seconds": timings,
+        "min_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "peak_memory_bytes": peak
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(config: FleetConfig, data_dir: str, repeat: int = 3, punctuality_stops: int = 50) -> Dict[str, Any]:
+    """
+    Generate synthetic data in data_dir and benchmark the pipeline on it.
+
+    Args:
+        config (FleetConfig): Size of the synthetic data.
+        data_dir (str): Folder for the synthetic data folder.
+        repeat (int): Timed runs of every benchmark.
+        punctuality_stops (int): Bus stops analysed in the punctuality benchmark.
+
+    Returns:
+        Dict: Metadata of the run and results of every benchmark.
+    """
+    saved_data_dir = os.environ.get(DATA_DIR_ENV)
+    try:
+        os.environ[DATA_DIR_ENV] = data_dir
+        return _run_benchmarks(config, data_dir, repeat, punctuality_stops)
+    finally:
+        if saved_data_dir is None:
+            os.environ.pop(DATA_DIR_ENV, None)
+        else:
+            os.environ[DATA_DIR_ENV] = saved_data_dir
+
+
+def _run_benchmarks(config: FleetConfig, data_dir: str, repeat: int, punctuality_stops: int) -> Dict[str, Any]:
+    # Imported here, so modules that resolve paths at import time see the synthetic data folder.
+    from src.fetch_and_preprocess.process_data import process_bus_location_file, process_bus_location_files, \
+        process_timetables
+    from src.analyze.analyze_avg_speed import combine_bus_locations_within_hour, group_by_bus, count_distance
+    from src.analyze.analyze_speeding import analyze_speeding_points
+    from src.analyze.analyze_punctuality import analyze_punctuality_for_a_bus_stop
+    from src.analyze.dictionary_data import data
+
+    generate_start = time.perf_counter()
+    summary = generate_fleet_data(config, data_dir)
+    generate_seconds = time.perf_counter() - generate_start
+
+    raw_locations = os.path.join(data_dir, RAW, BUSES_LIVE_LOCATIONS)
+    first_poll = sorted(os.listdir(raw_locations))[0]
+    hour_folder = os.path.join(data_dir, PROCESSED, BUSES_LIVE_LOCATIONS, first_poll[:len("YYYY-MM-DD HH")])
+    second_hour = (config.hour + 1) % 24
+
+    results: Dict[str, Any] = {}
+    results["process_bus_location_file"] = run_benchmark(lambda: process_bus_location_file(first_poll), repeat)
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_bus_location_files()
+    results["process_timetables"] = run_benchmark(lambda: process_timetables(config.hour, second_hour), repeat)
+
+    results["combine_bus_locations_within_hour"] = run_benchmark(
+        lambda: combine_bus_locations_within_hour(hour_folder), repeat)
+    combined = combine_bus_locations_within_hour(hour_folder)
+    results["group_by_bus"] = run_benchmark(lambda: group_by_bus(combined), repeat)
+    grouped = group_by_bus(combined)
+    results["count_distance"] = run_benchmark(lambda: [count_distance(items) for items in grouped[data]], repeat)
+    results["analyze_speeding_points"] = run_benchmark(lambda: analyze_speeding_points(grouped.copy()), repeat)
+
+    bus_stops = pd.merge(pd.read_json(os.path.join(data_dir, PROCESSED, BUS_STOPS_COORDINATES_FILE),
+                                      dtype={"zespol": str, "slupek": str}),
+                         pd.read_json(os.path.join(data_dir, PROCESSED, TIMETABLES),
+                                      dtype={"busstopId": str, "busstopNr": str}),
+                         left_on=["zespol", "slupek"], right_on=["busstopId", "busstopNr"]).head(punctuality_stops)
+    results["analyze_punctuality_for_a_bus_stop"] = run_benchmark(
+        lambda: [analyze_punctuality_for_a_bus_stop(grouped, row, 'rozklad', 'szer_geo', 'dlug_geo')
+                 for _, row in bus_stops.iterrows()], repeat)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().strftime(DATE_FORMAT),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "repeat": repeat,
+            "punctuality_stops": len(bus_stops),
+            "config": config.to_dict(),
+            "data": summary,
+            "generate_seconds": generate_seconds
+        },
+        "results": results
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    defaults = FleetConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline hot paths on synthetic data")
+    parser.add_argument("--vehicles", type=int, default=defaults.vehicles)
+    parser.add_argument("--lines", type=int, default=defaults.lines)
+    parser.add_argument("--stops", type=int, default=defaults.stops)
+    parser.add_argument("--polls-per-hour", type=int, default=defaults.polls_per_hour)
+    parser.add_argument("--departures-per-hour", type=int, default=defaults.departures_per_hour)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of every benchmark")
+    parser.add_argument("--punctuality-stops", type=int, default=50, help="Bus stops in the punctuality benchmark")
+    parser.add_argument("--data-dir", type=str, default=None, help="Where to generate data (default: temporary)")
+    parser.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    config = FleetConfig(vehicles=args.vehicles, lines=args.lines, stops=args.stops,
+                         polls_per_hour=args.polls_per_hour, departures_per_hour=args.departures_per_hour,
+                         seed=args.seed)
+    data_dir = contextlib.nullcontext(args.data_dir) if args.data_dir else tempfile.TemporaryDirectory()
+    with data_dir as path:
+        report = run_benchmarks(config, path, args.repeat, args.punctuality_stops)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Deterministic generator of Warsaw-scale synthetic data.
+
+The generated files follow the layout and record schemas of the data folder (raw live location polls,
+raw timetables, processed bus stop coordinates and buses at stops), with every position inside the
+Warsaw bounds from config.py. The same configuration and seed always produce the same files.
+"""
+import json
+import os
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import numpy as np
+from src.analyze.geo import WARSAW_CENTER_LAT, metres_per_degree
+from src.common.config import *
+
+__all__ = [
+    "FleetConfig",
+    "generate_fleet_data"
+]
+
+
+@dataclass
+class FleetConfig:
+    """
+    Size of the generated data. The defaults are close to the real Warsaw bus network.
+
+    Attributes:
+        vehicles (int): Buses reporting their location.
+        lines (int): Bus lines; vehicles are spread evenly across them.
+        stops (int): Bus stop posts (zespol + slupek).
+        stops_per_line (int): Stops on the route of every line.
+        polls_per_hour (int): Live location polls in the generated hour.
+        departures_per_hour (int): Departures of a line from each of its stops per hour.
+        timetable_hours (int): Hours covered by the timetables, centred on the poll hour.
+        invalid_fraction (float): Share of live location records the processing step should reject.
+        date (str): Day of the data, YYYY-MM-DD.
+        hour (int): Hour of the live location polls.
+        seed (int): Seed of the random generator.
+    """
+    vehicles: int = 1500
+    lines: int = 250
+    stops: int = 7000
+    stops_per_line: int = 25
+    polls_per_hour: int = 60
+    departures_per_hour: int = 4
+    timetable_hours: int = 5
+    invalid_fraction: float = 0.05
+    date: str = "2024-02-26"
+    hour: int = 8
+    seed: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _write_json(data: Any, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+
+
+def _generate_stops(config: FleetConfig, rng: np.random.Generator) -> List[Dict[str, str]]:
+    margin = 0.01
+    lats = rng.uniform(WARSAW_LAT_MIN + margin, WARSAW_LAT_MAX - margin, config.stops)
+    lons = rng.uniform(WARSAW_LON_MIN + margin, WARSAW_LON_MAX - margin, config.stops)
+    return [{
+        "zespol": str(1000 + i // 4),
+        "slupek": f"{i % 4 + 1:02d}",
+        "nazwa_zespolu": f"Przystanek {1000 + i // 4}",
+        "id_ulicy": str(2000 + i // 40),
+        "szer_geo": f"{lats[i]:.6f}",
+        "dlug_geo": f"{lons[i]:.6f}"
+    } for i in range(config.stops)]
+
+
+def _generate_routes(config: FleetConfig, rng: np.random.Generator, stop_coords: np.ndarray) -> np.ndarray:
+    """Routes as indexes of stops lying close to a straight line with a random start and heading."""
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    spacing_m = 600
+    starts = stop_coords[rng.integers(0, len(stop_coords), config.lines)]
+    headings = rng.uniform(0, 2 * np.pi, config.lines)
+    steps = np.arange(config.stops_per_line) * spacing_m
+    route_lats = starts[:, None, 0] + np.cos(headings)[:, None] * steps / lat_m
+    route_lons = starts[:, None, 1] + np.sin(headings)[:, None] * steps / lon_m
+    waypoints = np.stack([route_lats, route_lons], axis=-1).reshape(-1, 2)
+    routes = np.empty(len(waypoints), dtype=np.int64)
+    for chunk in range(0, len(waypoints), 512):
+        block = waypoints[chunk:chunk + 512]
+        dist = (((block[:, None, 0] - stop_coords[None, :, 0]) * lat_m) ** 2
+                + ((block[:, None, 1] - stop_coords[None, :, 1]) * lon_m) ** 2)
+        routes[chunk:chunk + 512] = dist.argmin(axis=1)
+    routes = routes.reshape(config.lines, config.stops_per_line)
+    # A short route in a sparse network can snap to a single stop; end it at the nearest other stop
+    # instead, so every route has a length to drive along.
+    for line in np.flatnonzero((routes == routes[:, :1]).all(axis=1)):
+        first = stop_coords[routes[line, 0]]
+        dist = ((stop_coords[:, 0] - first[0]) * lat_m) ** 2 + ((stop_coords[:, 1] - first[1]) * lon_m) ** 2
+        dist[routes[line, 0]] = np.inf
+        routes[line, -1] = dist.argmin()
+    return routes
+
+
+def _generate_polls(config: FleetConfig, rng: np.random.Generator, stop_coords: np.ndarray,
+                    routes: np.ndarray, line_names: List[str], raw_dir: str) -> None:
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    route_coords = stop_coords[routes]
+    segment_m = np.hypot(np.diff(route_coords[:, :, 0], axis=1) * lat_m, np.diff(route_coords[:, :, 1], axis=1) * lon_m)
+    cumulative_m = np.concatenate([np.zeros((config.lines, 1)), np.cumsum(segment_m, axis=1)], axis=1)
+
+    vehicle_line = np.arange(config.vehicles) % config.lines
+    vehicle_brigade = np.arange(config.vehicles) // config.lines + 1
+    vehicle_offset = rng.uniform(0, 1, config.vehicles) * 2 * cumulative_m[vehicle_line, -1]
+    vehicle_speed = rng.uniform(10, 70, config.vehicles) / 3.6
+    start = datetime.strptime(config.date, "%Y-%m-%d") + timedelta(hours=config.hour)
+    poll_interval = 3600 / config.polls_per_hour
+
+    for poll in range(config.polls_per_hour):
+        poll_time = start + timedelta(seconds=int(poll * poll_interval) + 5)
+        report_lag = rng.integers(0, 40, config.vehicles)
+        records = []
+        for vehicle in range(config.vehicles):
+            line = vehicle_line[vehicle]
+            report_time = poll_time - timedelta(seconds=int(report_lag[vehicle]))
+            elapsed = (report_time - start).total_seconds()
+            # Vehicles drive to the end of the route and back.
+            length = cumulative_m[line, -1]
+            if length > 0:
+                position = (vehicle_offset[vehicle] + vehicle_speed[vehicle] * elapsed) % (2 * length)
+                position = position if position <= length else 2 * length - position
+            else:
+                # A route of a single stop (stops_per_line=1 or a single stop in total): the vehicle waits there.
+                position = 0.0
+            lat_value = np.interp(position, cumulative_m[line], route_coords[line, :, 0])
+            lon_value = np.interp(position, cumulative_m[line], route_coords[line, :, 1])
+            records.append({
+                "Lines": line_names[line],
+                "Lon": round(float(lon_value), 7),
+                "VehicleNumber": str(1000 + vehicle),
+                "Time": report_time.strftime(DATE_FORMAT),
+                "Lat": round(float(lat_value), 7),
+                "Brigade": str(vehicle_brigade[vehicle])
+            })
+        for index in np.flatnonzero(rng.uniform(0, 1, len(records)) < config.invalid_fraction):
+            records[index] = dict(records[index], Lines="T" + records[index]["Lines"], Lat=52.5)
+        _write_json({"result": records},
+                    os.path.join(raw_dir, BUSES_LIVE_LOCATIONS, poll_time.strftime(DATE_FORMAT) + ".json"))
+
+
+def _generate_timetables(config: FleetConfig, stops: List[Dict[str, str]], routes: np.ndarray,
+                         line_names: List[str]) -> List[List[Dict[str, Any]]]:
+    brigades = -(-config.vehicles // config.lines)
+    first_hour = max(0, config.hour - config.timetable_hours // 2)
+    last_hour = min(24, first_hour + config.timetable_hours)
+    minutes = np.arange(first_hour * 60, last_hour * 60, 60 // config.departures_per_hour)
+
+    lines_at_stop: Dict[int, List[int]] = {}
+    for line, route in enumerate(routes):
+        for position, stop in enumerate(route):
+            lines_at_stop.setdefault(int(stop), [])
+            if line not in lines_at_stop[int(stop)]:
+                lines_at_stop[int(stop)].append(line)
+
+    timetables = []
+    for stop, stop_lines in sorted(lines_at_stop.items()):
+        stop_timetables = []
+        for line in stop_lines:
+            position = int(np.argmax(routes[line] == stop))
+            departures = minutes + 2 * position
+            stop_timetables.append({
+                "busstopId": stops[stop]["zespol"],
+                "busstopNr": stops[stop]["slupek"],
+                "linia": line_names[line],
+                "rozklad": [{
+                    "czas": f"{minute // 60 % 24:02d}:{minute % 60:02d}:00",
+                    "trasa": f"TP-{line_names[line]}",
+                    "kierunek": stops[routes[line, -1]]["nazwa_zespolu"],
+                    "brygada": str(i % brigades + 1),
+                    "symbol_1": "null",
+                    "symbol_2": "null"
+                } for i, minute in enumerate(departures)]
+            })
+        timetables.append(stop_timetables)
+    return timetables
+
+
+def generate_fleet_data(config: FleetConfig, data_dir: str) -> Dict[str, Any]:
+    """
+    Write a synthetic data folder.
+
+    Creates raw live location polls and raw timetables (inputs of the processing step), and processed
+    bus stop coordinates and buses at stops (inputs of the timetable crawl and of the analysis).
+
+    Args:
+        config (FleetConfig): Size of the data.
+        data_dir (str): Folder laid out like the data folder of the repository.
+
+    Returns:
+        Dict: Summary with the number of generated records.
+    """
+    rng = np.random.default_rng(config.seed)
+    raw_dir, processed_dir = os.path.join(data_dir, RAW), os.path.join(data_dir, PROCESSED)
+    os.makedirs(os.path.join(processed_dir, BUSES_LIVE_LOCATIONS), exist_ok=True)
+
+    stops = _generate_stops(config, rng)
+    stop_coords = np.array([[float(s["szer_geo"]), float(s["dlug_geo"])] for s in stops])
+    routes = _generate_routes(config, rng, stop_coords)
+    line_names = [str(100 + line) for line in range(config.lines)]
+
+    _generate_polls(config, rng, stop_coords, routes, line_names, raw_dir)
+    timetables = _generate_timetables(config, stops, routes, line_names)
+
+    _write_json(stops, os.path.join(processed_dir, BUS_STOPS_COORDINATES_FILE))
+    _write_json([{
+        "busstopId": stop_timetables[0]["busstopId"],
+        "busstopNr": int(stop_timetables[0]["busstopNr"]),
+        "autobusy": [timetable["linia"] for timetable in stop_timetables]
+    } for stop_timetables in timetables], os.path.join(processed_dir, BUSES_AT_STOPS_FILE))
+    _write_json(timetables, os.path.join(raw_dir, TIMETABLES))
+
+    return {
+        "stops": len(stops),
+        "stops_with_timetables": len(timetables),
+        "location_records": config.vehicles * config.polls_per_hour,
+        "departures": sum(len(t["rozklad"]) for stop_timetables in timetables for t in stop_timetables)
+    }
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.common.config import DATA_DIR_ENV
+from ..run_benchmarks import run_benchmarks
+from ..synthetic_fleet import FleetConfig
+
+
+class TestRunBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = FleetConfig(vehicles=12, lines=3, stops=30, stops_per_line=4, polls_per_hour=2,
+                                  departures_per_hour=2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_results_of_every_benchmark(self):
+        with patch.dict(os.environ, {DATA_DIR_ENV: "/previous/data"}):
+            report = run_benchmarks(self.config, self.tmp_dir.name, repeat=1, punctuality_stops=2)
+            self.assertEqual(os.environ[DATA_DIR_ENV], "/previous/data")
+        self.assertIn("process_timetables", report["results"])
+        self.assertEqual(report["meta"]["config"], self.config.to_dict())
+
+    def test_data_dir_is_unset_again(self):
+        with patch.dict(os.environ):
+            os.environ.pop(DATA_DIR_ENV, None)
+            run_benchmarks(self.config, self.tmp_dir.name, repeat=1, punctuality_stops=2)
+            self.assertNotIn(DATA_DIR_ENV, os.environ)
+
+
+if __name__ == '__main__':
+    unittest.main()
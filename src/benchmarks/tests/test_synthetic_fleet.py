@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+import warnings
+from src.common.config import BUSES_LIVE_LOCATIONS, RAW
+from src.fetch_and_preprocess.check_format import check_coordinates
+from src.fetch_and_preprocess.schema_validation import BUSES_LOCATION_SCHEMA
+from ..synthetic_fleet import FleetConfig, generate_fleet_data
+
+
+class TestSyntheticFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def polls(self, config):
+        generate_fleet_data(config, self.tmp_dir.name)
+        folder = os.path.join(self.tmp_dir.name, RAW, BUSES_LIVE_LOCATIONS)
+        for filename in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as file:
+                yield filename, json.load(file)
+
+    def test_poll_records_pass_the_location_schema(self):
+        config = FleetConfig(vehicles=20, lines=4, stops=8, stops_per_line=3, polls_per_hour=3, invalid_fraction=0)
+        polls = list(self.polls(config))
+        self.assertEqual(len(polls), 3)
+        for filename, payload in polls:
+            validation = BUSES_LOCATION_SCHEMA.validate(payload)
+            self.assertTrue(validation.complete, filename)
+            self.assertEqual(len(validation.valid), config.vehicles)
+            for record in validation.valid:
+                self.assertTrue(check_coordinates(record["Lat"], record["Lon"]), record)
+
+    def test_single_stop_routes_park_their_vehicles(self):
+        config = FleetConfig(vehicles=4, lines=2, stops=3, stops_per_line=1, polls_per_hour=2, invalid_fraction=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            polls = list(self.polls(config))
+        for _, payload in polls:
+            for record in payload["result"]:
+                self.assertTrue(check_coordinates(record["Lat"], record["Lon"]), record)
+
+    def test_same_seed_same_data(self):
+        config = FleetConfig(vehicles=6, lines=2, stops=10, stops_per_line=4, polls_per_hour=2)
+        first = list(self.polls(config))
+        self.tmp_dir.cleanup()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.assertEqual(list(self.polls(config)), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,511 @@
+"""
+Command line interface of the project, installed as the bus-analysis command.
+
+    bus-analysis poll API_KEY                          single poll of live bus locations (e.g. from cron)
+    bus-analysis poll API_KEY --hour 8                 poll every minute during 8:00-9:00
+    bus-analysis crawl API_KEY                         bus stops, buses at stops and timetables
+    bus-analysis crawl-queue seed                      timetable crawl tasks for sharded workers
+    bus-analysis crawl-queue work API_KEY              drain the crawl queue (run one per API key/host)
+    bus-analysis process timetables --hours 8 12       process fetched data
+    bus-analysis process simplify --tolerance 10       processed hour folders without redundant points
+    bus-analysis collect API_KEY 8 12                  the whole daily collection (crawl, polls, processing)
+    bus-analysis analyze avg-speed "2024-02-26 08"     analyse an hour of processed bus locations
+    bus-analysis analyze trip-speed "2024-02-26 08"    average speeds over trips, without layovers
+    bus-analysis aggregate --period month              per-line speeds and speeding grids of many hours
+    bus-analysis speeding-grid update                  save the speeding grid of every new hour
+    bus-analysis speeding-grid query --level 2         speeding hotspots of a time range from the saved grids
+    bus-analysis report "2024-02-26 08"                every analysis of an hour, loading it once
+    bus-analysis timetables query --line 180           departures from the indexed timetable store
+    bus-analysis headways --by line                    headway regularity and bunching by line or by stop
+    bus-analysis cube update                           aggregate new hours into the metrics cube
+    bus-analysis cube query --by line --line 180       speed statistics from the metrics cube
+    bus-analysis serve --port 8050                     local HTTP query service over the metrics cube
+
+Everything except this module's own dependencies is imported inside the commands, so a single poll
+does not load pandas, numpy or geopy.
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, Optional
+from src.common.config import BUS_STOPS_COORDINATES_FILE, BUSES_LIVE_LOCATIONS, DATA_DIR_ENV, LINES_TO_STOPS_FILE, \
+    METRICS_CUBE, OFFLINE_ENV, REPORTS, SIMPLIFIED_LOCATIONS, SPEEDING_EVENTS_FILE, SPEEDING_GRIDS, TIMETABLES
+
+__all__ = [
+    "main"
+]
+
+
+def _speeding_consumers(detect_speeding: bool) -> List[Any]:
+    if not detect_speeding:
+        return []
+    from src.analyze.speeding_detector import SpeedingDetector
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    return [SpeedingDetector(get_filepath(SPEEDING_EVENTS_FILE, False))]
+
+
+def _report_stages(results: Dict[str, Any]) -> int:
+    from src.common.log import get_logger
+    logger = get_logger(__name__)
+    for stage, result in results.items():
+        logger.info("Stage result", extra={"stage": stage, "status": result.status,
+                                           "seconds": round(result.seconds, 3)})
+    return 1 if any(result.status in ("failed", "blocked") for result in results.values()) else 0
+
+
+def _hour_folder(folder: str) -> str:
+    """A processed hour folder given by path or by name, e.g. "2024-02-26 08"."""
+    if os.path.isdir(folder):
+        return folder
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    return get_filepath(os.path.join(BUSES_LIVE_LOCATIONS, folder), False)
+
+
+def _hour_folders(folders: List[str]) -> List[str]:
+    """The given hour folders, or every processed hour folder if none is given."""
+    if folders:
+        return [_hour_folder(folder) for folder in folders]
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    locations = get_filepath(BUSES_LIVE_LOCATIONS, False)
+    return [os.path.join(locations, name) for name in sorted(os.listdir(locations))]
+
+
+def _write_output(text: str, output: Optional[str]) -> None:
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+def command_poll(args: argparse.Namespace) -> int:
+    from src.fetch_and_preprocess.fetch_data import fetch_and_save_bus_locations
+    consumers = _speeding_consumers(args.detect_speeding)
+    if args.hour is None:
+        fetch_and_save_bus_locations(args.api_key, consumers=consumers, validation_sample=args.validation_sample)
+    else:
+        from src.fetch_and_preprocess.scheduled_function_runner import run_during_hour
+        run_during_hour(args.hour, fetch_and_save_bus_locations, args.api_key, consumers=consumers,
+                        validation_sample=args.validation_sample)
+    return 0
+
+
+def command_crawl(args: argparse.Namespace) -> int:
+    from src.fetch_and_preprocess.pipeline import build_crawl_pipeline
+    return _report_stages(build_crawl_pipeline(args.api_key).run(only=args.only, force=args.force))
+
+
+def command_crawl_queue(args: argparse.Namespace) -> int:
+    import json
+    from src.fetch_and_preprocess.sharded_crawl import default_queue, export_timetables, run_crawl_worker, \
+        seed_timetable_tasks
+    from src.fetch_and_preprocess.work_queue import WorkQueue
+    queue = WorkQueue(args.queue) if args.queue else default_queue()
+    if args.retry_failed:
+        queue.retry_failed()
+    if args.action == "seed":
+        seed_timetable_tasks(queue)
+    elif args.action == "work":
+        if args.api_key is None:
+            raise SystemExit("crawl-queue work needs an API_KEY")
+        from src.fetch_and_preprocess.fetch_data import MAX_WORKERS
+        run_crawl_worker(queue, args.api_key, threads=args.threads or MAX_WORKERS, max_tasks=args.max_tasks)
+    elif args.action == "export":
+        export_timetables(queue)
+    _write_output(json.dumps({**queue.stats(), "failures": len(queue.failures())}, indent=4), None)
+    return 1 if args.action == "export" and queue.failures() else 0
+
+
+def command_process(args: argparse.Namespace) -> int:
+    import json
+    from src.fetch_and_preprocess import process_data
+    if args.what in ("bus-stops", "all"):
+        process_data.process_bus_stops_coordinates()
+    if args.what in ("buses-at-stops", "all"):
+        process_data.process_buses_at_stops()
+    if args.what in ("locations", "all"):
+        process_data.process_bus_location_files()
+    if args.what in ("timetables", "all"):
+        if args.hours is None:
+            raise SystemExit("process timetables needs --hours FIRST SECOND")
+        process_data.process_timetables(*args.hours)
+    if args.what == "simplify":
+        from src.analyze.trajectory_simplification import simplify_hour_folder
+        from src.fetch_and_preprocess.file_utils import get_filepath
+        if args.overwrite and args.output_dir:
+            raise SystemExit("process simplify takes either --overwrite or --output-dir")
+        output_dir = args.output_dir or get_filepath(SIMPLIFIED_LOCATIONS, False)
+        options = {"time_aware": not args.spatial}
+        if args.tolerance is not None:
+            options["tolerance"] = args.tolerance
+        reports = {}
+        for folder in _hour_folders(args.folders):
+            output_folder = None if args.overwrite else os.path.join(output_dir, os.path.basename(folder))
+            reports[os.path.basename(folder)] = simplify_hour_folder(folder, output_folder=output_folder,
+                                                                     overwrite=args.overwrite, **options).to_dict()
+        _write_output(json.dumps(reports, indent=4), None)
+    return 0
+
+
+def command_collect(args: argparse.Namespace) -> int:
+    from src.fetch_and_preprocess.pipeline import build_collection_pipeline
+    pipeline = build_collection_pipeline(args.api_key, args.first_hour, args.second_hour,
+                                         _speeding_consumers(args.detect_speeding))
+    return _report_stages(pipeline.run(only=args.only, force=args.force))
+
+
+def command_analyze(args: argparse.Namespace) -> int:
+    import json
+    from src.analyze import result_cache
+    from src.analyze.dictionary_data import avg_speed, brigade, lines
+    folder = _hour_folder(args.folder)
+    if args.analysis == "avg-speed":
+        bounds = {name: value for name, value in (("min_speed", args.min_speed), ("max_speed", args.max_speed))
+                  if value is not None}
+        df = result_cache.cached_avg_speed(folder, **bounds)
+        text = df[[lines, brigade, avg_speed]].to_json(orient='records', indent=4)
+    elif args.analysis == "trip-speed":
+        from src.analyze.analyze_avg_speed import MAX_AVG_SPEED, clean_df, count_avg_speed
+        from src.analyze.compact_locations import read_locations_compact
+        from src.analyze.trip_segmentation import line_termini, segment_trips, trip_totals
+        from src.fetch_and_preprocess.file_utils import get_filepath
+        termini = None
+        if os.path.exists(get_filepath(LINES_TO_STOPS_FILE, False)):
+            from src.analyze.line_stops import LineStopsIndex
+            termini = line_termini(LineStopsIndex.load())
+        trips, _ = segment_trips(read_locations_compact(folder), termini)
+        # Speeds while driving need no lower bound against layovers; only GPS jumps are removed by default.
+        df = clean_df(count_avg_speed(trip_totals(trips)), args.min_speed if args.min_speed is not None else 0,
+                      args.max_speed if args.max_speed is not None else MAX_AVG_SPEED)
+        text = df[[lines, brigade, "trips", avg_speed]].to_json(orient='records', indent=4)
+    elif args.analysis == "speeding":
+        from src.analyze.analyze_speeding import collect_speeding_points
+        text = json.dumps(collect_speeding_points(result_cache.cached_speeding_points(folder)), indent=4)
+    else:
+        from src.fetch_and_preprocess.file_utils import get_filepath
+        df = result_cache.cached_punctuality(folder, get_filepath(BUS_STOPS_COORDINATES_FILE, False),
+                                             get_filepath(TIMETABLES, False))
+        text = df[["zespol", "slupek", "nazwa_zespolu", "delay"]].to_json(orient='records', indent=4,
+                                                                          force_ascii=False)
+    _write_output(text, args.output)
+    return 0
+
+
+def command_aggregate(args: argparse.Namespace) -> int:
+    import json
+    from src.analyze.map_reduce import run_map_reduce
+    from src.analyze.speeding_grid import hotspots
+    bounds = {name: value for name, value in (("min_speed", args.min_speed), ("max_speed", args.max_speed))
+              if value is not None}
+    result = run_map_reduce(_hour_folders(args.folders), args.period, args.workers, **bounds)
+    speeding = {label: {"points": int(grid.sum()), "hotspots": hotspots(grid, result.cell_size, top=args.hotspots)}
+                for label, grid in sorted(result.speeding_grids.items())}
+    text = json.dumps({"hours": result.hours, "failed": result.failed,
+                       "lines": json.loads(result.line_stats_dataframe().to_json(orient='records')),
+                       "speeding": speeding}, indent=4)
+    _write_output(text, args.output)
+    return 1 if result.failed else 0
+
+
+def command_speeding_grid(args: argparse.Namespace) -> int:
+    import json
+    from src.analyze.speeding_grid import aggregate_hour_grids, build_pyramid, hotspots, update_hour_grids
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    grids_folder = get_filepath(SPEEDING_GRIDS, False)
+    if args.action == "update":
+        text = json.dumps({"updated": update_hour_grids(_hour_folders(args.folders), grids_folder, force=args.force)},
+                          indent=4)
+    else:
+        counts = build_pyramid(aggregate_hour_grids(grids_folder, args.start, args.end), args.level + 1)[-1]
+        text = json.dumps({"points": int(counts.sum()), "level": args.level,
+                           "hotspots": hotspots(counts, level=args.level, top=args.hotspots)}, indent=4)
+    _write_output(text, args.output)
+    return 0
+
+
+def command_headways(args: argparse.Namespace) -> int:
+    import pandas as pd
+    from src.analyze.compact_locations import read_locations_compact
+    from src.analyze.dictionary_data import lines
+    from src.analyze.headways import STOP_COLUMNS, compute_headways, find_passages, summarise_headways
+    from src.analyze.line_stops import LineStopsIndex
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    df = pd.concat([read_locations_compact(folder) for folder in _hour_folders(args.folders)], ignore_index=True)
+    schedule = None
+    if all(os.path.exists(get_filepath(name, False)) for name in (BUS_STOPS_COORDINATES_FILE, TIMETABLES)):
+        from src.analyze.timetable_store import TimetableStore
+        schedule = TimetableStore.load().departures(bus_lines=df[lines].astype(str).unique())
+    headways = compute_headways(find_passages(df, LineStopsIndex.load()), schedule, args.bunching_ratio)
+    summary = summarise_headways(headways, [lines] if args.by == "line" else [lines, *STOP_COLUMNS])
+    _write_output(summary.to_json(orient='records', indent=4), args.output)
+    return 0
+
+
+def command_timetables(args: argparse.Namespace) -> int:
+    import json
+    from src.analyze.timetable_store import TimetableStore
+    store = TimetableStore.load()
+    if args.action == "build":
+        text = json.dumps(store.summary(), indent=4)
+    elif args.stop is not None and args.line is None and args.brigade is None:
+        text = json.dumps({"stop": store.stop(*args.stop), "rozklad": store.stop_timetables(*args.stop)}, indent=4,
+                          ensure_ascii=False)
+    else:
+        departures = store.departures(bus_lines=args.line, brigades=args.brigade,
+                                      bus_stops=[args.stop] if args.stop else None, start=args.start, end=args.end)
+        text = departures.to_json(orient='records', indent=4)
+    _write_output(text, args.output)
+    return 0
+
+
+def command_report(args: argparse.Namespace) -> int:
+    import json
+    from datetime import datetime
+    from src.analyze.report_runner import run_report
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    output_dir = args.output_dir or get_filepath(os.path.join(REPORTS, datetime.now().strftime("%Y-%m-%d %H%M%S")),
+                                                 False)
+    bus_stops_files = [get_filepath(BUS_STOPS_COORDINATES_FILE, False), get_filepath(TIMETABLES, False)]
+    if not all(os.path.exists(path) for path in bus_stops_files):
+        bus_stops_files = [None, None]
+    summary = run_report(_hour_folders(args.folders), output_dir, args.analyses, args.workers, *bus_stops_files)
+    _write_output(json.dumps({"output_dir": output_dir, "hours": len(summary["hours"]), "failed": summary["failed"],
+                              "seconds": round(summary["seconds"], 3)}, indent=4), None)
+    return 1 if summary["failed"] else 0
+
+
+def command_cube(args: argparse.Namespace) -> int:
+    import json
+    from src.analyze.metrics_cube import MetricsCube
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    cube = MetricsCube(get_filepath(METRICS_CUBE, False))
+    if args.action == "update":
+        delay_inputs = [get_filepath(BUS_STOPS_COORDINATES_FILE, False), get_filepath(TIMETABLES, False)]
+        if not args.delays or not all(os.path.exists(path) for path in delay_inputs):
+            delay_inputs = [None, None]
+        updated = cube.update(_hour_folders(args.folders), *delay_inputs, force=args.force)
+        text = json.dumps({"updated": updated, **cube.summary()}, indent=4)
+    else:
+        result = cube.query(args.metric, by=args.by, bus_lines=args.line, hours=args.hour,
+                            start=args.start, end=args.end, bbox=args.bbox)
+        text = result.to_json(orient='records', indent=4)
+    _write_output(text, args.output)
+    return 0
+
+
+def command_serve(args: argparse.Namespace) -> int:
+    from src.analyze.query_service import serve
+    from src.fetch_and_preprocess.file_utils import get_filepath
+    serve(get_filepath(METRICS_CUBE, False), args.host, args.port)
+    return 0
+
+
+def _hour(value: str) -> int:
+    hour = int(value)
+    if not 0 <= hour <= 23:
+        raise argparse.ArgumentTypeError(f"{value} is not an hour between 0 and 23")
+    return hour
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--data-dir", type=str, default=None, help="Data folder (default: data of the repository)")
+    common.add_argument("--log-level", type=str, default="INFO", help="Minimum level of logged records")
+    common.add_argument("--json-logs", action="store_true", help="Log JSON Lines instead of plain text")
+    common.add_argument("--profile", nargs="?", const="", default=None, metavar="DIR",
+                        help="Profile every stage into a run folder in DIR (default: data/profiles)")
+    common.add_argument("--offline", action="store_true",
+                        help="Answer API requests only from the HTTP cache of the static endpoints")
+    common.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port while running")
+    common.add_argument("--metrics-snapshot", type=str, default=None,
+                        help="Write a JSON snapshot of the metrics to this file at the end")
+
+    parser = argparse.ArgumentParser(prog="bus-analysis",
+                                     description="Collect and analyse Warsaw public transport data")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    poll = commands.add_parser("poll", parents=[common],
+                               help="Fetch live bus locations once, or every minute during an hour")
+    poll.add_argument("api_key", type=str, help="API key of api.um.warszawa.pl")
+    poll.add_argument("--hour", type=_hour, default=None, help="Poll every minute during this hour")
+    poll.add_argument("--detect-speeding", action="store_true",
+                      help="Append speeding events of every poll to " + SPEEDING_EVENTS_FILE)
+    poll.add_argument("--validation-sample", type=int, default=None,
+                      help="Validate only this many records of a poll unless one of them is malformed")
+    poll.set_defaults(handler=command_poll)
+
+    crawl = commands.add_parser("crawl", parents=[common],
+                                help="Fetch bus stops, buses at stops and timetables")
+    crawl.add_argument("api_key", type=str, help="API key of api.um.warszawa.pl")
+    crawl.add_argument("--only", action="append", default=None, metavar="STAGE", help="Re-run only this stage")
+    crawl.add_argument("--force", action="store_true", help="Run stages even if their outputs are up to date")
+    crawl.set_defaults(handler=command_crawl)
+
+    crawl_queue = commands.add_parser("crawl-queue", parents=[common],
+                                      help="Crawl timetables with any number of workers sharing a task queue")
+    crawl_queue.add_argument("action", choices=["seed", "work", "status", "export"])
+    crawl_queue.add_argument("api_key", type=str, nargs="?", default=None,
+                             help="API key of api.um.warszawa.pl of this worker (work)")
+    crawl_queue.add_argument("--queue", type=str, default=None,
+                             help="Queue file, shared by the workers (default: data/raw/crawl_queue.sqlite)")
+    crawl_queue.add_argument("--threads", type=int, default=None,
+                             help="Concurrent requests of this worker (work, default: 40)")
+    crawl_queue.add_argument("--max-tasks", type=int, default=None, help="Stop after this many tasks (work)")
+    crawl_queue.add_argument("--retry-failed", action="store_true", help="Make failed tasks pending again first")
+    crawl_queue.set_defaults(handler=command_crawl_queue)
+
+    process = commands.add_parser("process", parents=[common], help="Process fetched data")
+    process.add_argument("what", choices=["bus-stops", "buses-at-stops", "locations", "timetables", "all",
+                                          "simplify"],
+                         help="simplify writes processed hour folders without redundant points (not part of all)")
+    process.add_argument("folders", nargs="*", default=[],
+                         help="Hour folders to simplify, by path or name (default: all)")
+    process.add_argument("--hours", type=_hour, nargs=2, default=None, metavar=("FIRST", "SECOND"),
+                         help="Hours of the timetables to keep")
+    process.add_argument("--tolerance", type=float, default=None,
+                         help="Largest position error of a dropped point in metres (simplify, default: 10)")
+    process.add_argument("--spatial", action="store_true",
+                         help="Plain Douglas-Peucker instead of the time-aware variant (simplify)")
+    process.add_argument("--output-dir", type=str, default=None,
+                         help="Folder of the simplified hour folders (simplify, default: data/processed/"
+                              + SIMPLIFIED_LOCATIONS + ")")
+    process.add_argument("--overwrite", action="store_true",
+                         help="Replace the processed hour folders in place (simplify)")
+    process.set_defaults(handler=command_process)
+
+    collect = commands.add_parser("collect", parents=[common], help="Run the whole daily collection")
+    collect.add_argument("api_key", type=str, help="API key of api.um.warszawa.pl")
+    collect.add_argument("first_hour", type=_hour, help="First hour of live polling")
+    collect.add_argument("second_hour", type=_hour, help="Second hour of live polling")
+    collect.add_argument("--detect-speeding", action="store_true",
+                         help="Append speeding events of every poll to " + SPEEDING_EVENTS_FILE)
+    collect.add_argument("--only", action="append", default=None, metavar="STAGE",
+                         help="Re-run only this stage (repeatable); the stages it depends on run if out of date")
+    collect.add_argument("--force", action="store_true", help="Run stages even if their outputs are up to date")
+    collect.set_defaults(handler=command_collect)
+
+    analyze = commands.add_parser("analyze", parents=[common],
+                                  help="Analyse an hour of processed bus locations")
+    analyze.add_argument("analysis", choices=["avg-speed", "trip-speed", "speeding", "punctuality"])
+    analyze.add_argument("folder", type=str, help='Processed hour folder, by path or name (e.g. "2024-02-26 08")')
+    analyze.add_argument("--min-speed", type=float, default=None, help="Lowest plausible average speed (km/h)")
+    analyze.add_argument("--max-speed", type=float, default=None, help="Highest plausible average speed (km/h)")
+    analyze.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    analyze.set_defaults(handler=command_analyze)
+
+    aggregate = commands.add_parser("aggregate", parents=[common],
+                                    help="Per-line average speeds and speeding hotspots of many hours (map-reduce)")
+    aggregate.add_argument("folders", nargs="*", default=[],
+                           help="Hour folders to aggregate, by path or name (default: all)")
+    aggregate.add_argument("--period", choices=["hour", "hour-of-day", "day", "month", "all"], default="day",
+                           help="Period to group the results by")
+    aggregate.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    aggregate.add_argument("--min-speed", type=float, default=None, help="Lowest plausible average speed (km/h)")
+    aggregate.add_argument("--max-speed", type=float, default=None, help="Highest plausible average speed (km/h)")
+    aggregate.add_argument("--hotspots", type=int, default=10, help="Speeding hotspots listed per period")
+    aggregate.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    aggregate.set_defaults(handler=command_aggregate)
+
+    speeding_grid = commands.add_parser("speeding-grid", parents=[common],
+                                        help="Save hourly speeding grids and query hotspots of any time range")
+    speeding_grid.add_argument("action", choices=["update", "query"])
+    speeding_grid.add_argument("folders", nargs="*", default=[],
+                               help="Hour folders to grid, by path or name (update, default: all)")
+    speeding_grid.add_argument("--force", action="store_true", help="Grid up to date hours again (update)")
+    speeding_grid.add_argument("--start", type=str, default=None, help='First hour to include ("YYYY-MM-DD HH")')
+    speeding_grid.add_argument("--end", type=str, default=None, help='Last hour to include ("YYYY-MM-DD HH")')
+    speeding_grid.add_argument("--level", type=int, default=0,
+                               help="Pyramid level: cells 2**LEVEL times larger than the 250 m base cells")
+    speeding_grid.add_argument("--hotspots", type=int, default=10, help="Speeding hotspots listed")
+    speeding_grid.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    speeding_grid.set_defaults(handler=command_speeding_grid)
+
+    headways = commands.add_parser("headways", parents=[common],
+                                   help="Headway regularity and bunching of hour folders, by line or stop")
+    headways.add_argument("folders", nargs="*", default=[],
+                          help="Hour folders, by path or name, analysed together (default: all)")
+    headways.add_argument("--by", choices=["line", "stop"], default="line", help="Summarise by line or by stop")
+    headways.add_argument("--bunching-ratio", type=float, default=0.25,
+                          help="Share of the scheduled headway below which a passage is bunched")
+    headways.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    headways.set_defaults(handler=command_headways)
+
+    timetables = commands.add_parser("timetables", parents=[common],
+                                     help="Build or query the indexed store of the processed timetables")
+    timetables.add_argument("action", choices=["build", "query"],
+                            help="build loads the processed files if they changed; query loads them first too")
+    timetables.add_argument("--line", action="append", default=None, help="Line to include (repeatable)")
+    timetables.add_argument("--brigade", action="append", default=None, help="Brigade to include (repeatable)")
+    timetables.add_argument("--stop", nargs=2, default=None, metavar=("BUSSTOP_ID", "BUSSTOP_NR"),
+                            help="Stop to include; alone, the timetables of the stop by line")
+    timetables.add_argument("--start", type=str, default=None, help='Earliest departure ("HH:MM:SS")')
+    timetables.add_argument("--end", type=str, default=None, help='Latest departure ("HH:MM:SS")')
+    timetables.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    timetables.set_defaults(handler=command_timetables)
+
+    report = commands.add_parser("report", parents=[common],
+                                 help="Run every analysis over hour folders, loading each hour once")
+    report.add_argument("folders", nargs="*", default=[],
+                        help="Hour folders to report on, by path or name (default: all)")
+    report.add_argument("--analyses", nargs="+", default=None, choices=["avg_speed", "speeding", "punctuality"],
+                        help="Analyses to run (default: all; punctuality needs processed bus stops and timetables)")
+    report.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    report.add_argument("--output-dir", type=str, default=None,
+                        help="Folder of the results and summary.json (default: a new folder in data/processed/reports)")
+    report.set_defaults(handler=command_report)
+
+    cube = commands.add_parser("cube", parents=[common], help="Update or query the metrics cube")
+    cube.add_argument("action", choices=["update", "query"])
+    cube.add_argument("folders", nargs="*", default=[],
+                      help="Hour folders to aggregate, by path or name (update, default: all)")
+    cube.add_argument("--force", action="store_true", help="Aggregate up to date hours again (update)")
+    cube.add_argument("--delays", action="store_true",
+                      help="Also aggregate delays from the processed timetables (update, slow)")
+    cube.add_argument("--metric", choices=["speed", "delay", "speeding"], default="speed", help="Metric to query")
+    cube.add_argument("--by", nargs="*", default=[], choices=["line", "date", "hour", "cell"],
+                      help="Dimensions to group by (default: a single total)")
+    cube.add_argument("--line", action="append", default=None, help="Line to include (repeatable)")
+    cube.add_argument("--hour", type=_hour, action="append", default=None, help="Hour to include (repeatable)")
+    cube.add_argument("--start", type=str, default=None, help='First hour to include ("YYYY-MM-DD HH" or a day)')
+    cube.add_argument("--end", type=str, default=None, help='Last hour to include ("YYYY-MM-DD HH" or a day)')
+    cube.add_argument("--bbox", type=float, nargs=4, default=None,
+                      metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"), help="Area to include")
+    cube.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    cube.set_defaults(handler=command_cube)
+
+    serve = commands.add_parser("serve", parents=[common], help="Serve read-only queries over the metrics cube")
+    serve.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: local only)")
+    serve.add_argument("--port", type=int, default=8050, help="Port to listen on")
+    serve.set_defaults(handler=command_serve)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "collect" and args.first_hour >= args.second_hour:
+        raise SystemExit("first_hour must be earlier than second_hour")
+    if args.data_dir:
+        os.environ[DATA_DIR_ENV] = args.data_dir
+    if args.offline:
+        os.environ[OFFLINE_ENV] = "1"
+
+    import logging
+    from src.common.log import configure_logging
+    configure_logging(level=getattr(logging, args.log_level.upper()), json_format=args.json_logs)
+    if args.profile is not None:
+        from src.common.profiling import enable_profiling
+        enable_profiling(args.profile or None)
+    if args.metrics_port is not None:
+        from src.common.metrics import start_metrics_server
+        start_metrics_server(args.metrics_port)
+    try:
+        return args.handler(args)
+    finally:
+        if args.metrics_snapshot:
+            from src.common.metrics import write_snapshot
+            write_snapshot(args.metrics_snapshot)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
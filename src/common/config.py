@@ -10,13 +10,33 @@ from typing import Final
 BUS_STOPS_COORDINATES_FILE: Final = 'bus_stops_coordinates.json'
 BUSES_AT_STOPS_FILE: Final = 'buses_at_stops.json'
 TIMETABLES: Final = 'timetables.json'
+LINES_TO_STOPS_FILE: Final = 'lines_to_stops.json'
+SPEEDING_EVENTS_FILE: Final = 'speeding_events.jsonl'
+CRAWL_QUEUE_FILE: Final = 'crawl_queue.sqlite'
+TIMETABLE_STORE_FILE: Final = 'timetables.sqlite'
 
 # ----------Directory names-------------
 PROCESSED: Final = "processed"
 RAW: Final = "raw"
 DATA_FOLDER = "data"
 SRC_FOLDER = "src"
+CACHE: Final = "cache"
+PROFILES: Final = "profiles"
+QUARANTINE: Final = "quarantine"
+HTTP_CACHE: Final = "http"
 BUSES_LIVE_LOCATIONS: Final = 'buses_live_locations'
+SIMPLIFIED_LOCATIONS: Final = 'buses_live_locations_simplified'
+SPEEDING_GRIDS: Final = 'speeding_grids'
+METRICS_CUBE: Final = 'metrics_cube'
+REPORTS: Final = 'reports'
+
+# ----------Environment variables-------------
+# Overrides the location of the data folder (e.g. for benchmarks on synthetic data).
+DATA_DIR_ENV: Final = "BUS_ANALYSIS_DATA_DIR"
+# Enables profiling of every stage: "1" for the default folder or a folder for the profiles.
+PROFILE_ENV: Final = "BUS_ANALYSIS_PROFILE"
+# Set to "1" to answer API requests only from the HTTP cache, without network access.
+OFFLINE_ENV: Final = "BUS_ANALYSIS_OFFLINE"
 
 # -------Warsaw geographic boundaries--------
 WARSAW_LAT_MIN, WARSAW_LAT_MAX = 52.1, 52.3
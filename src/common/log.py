@@ -0,0 +1,79 @@
+"""
+Structured logging for the pipeline.
+
+Modules log through get_logger and pass context as `extra` fields. configure_logging sets up either
+plain text or JSON Lines output, in which every extra field becomes a key of the log record.
+"""
+import json
+import logging
+import sys
+from typing import Any, Dict, Optional
+
+__all__ = [
+    "get_logger",
+    "configure_logging",
+    "JsonFormatter"
+]
+
+ROOT_LOGGER = "bus_analysis"
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger of a module, placed under the common root logger so the whole pipeline is configured at once.
+
+    Args:
+        name (str): Usually __name__ of the module.
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON object with its extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format with the extra fields appended as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def configure_logging(level: int = logging.INFO, json_format: bool = False, stream: Optional[Any] = None) -> None:
+    """
+    Configure the output of all pipeline loggers.
+
+    Args:
+        level (int): Minimum level of logged records.
+        json_format (bool): Emit JSON Lines instead of plain text.
+        stream: Output stream, stderr by default.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_format else TextFormatter("%(asctime)s %(levelname)s %(message)s"))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [handler]
+    root.setLevel(level)
+    root.propagate = False
@@ -0,0 +1,233 @@
+"""
+Pipeline metrics: counters, gauges and histograms of fetches, validation, processing, file I/O and analysis stages.
+
+Values are kept in-process and can be exported as a JSON snapshot or, with prometheus_client installed, served
+in the Prometheus text format by start_metrics_server. prometheus_client is only imported when serving,
+so short commands do not pay for its import.
+"""
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from src.common import profiling
+
+__all__ = [
+    "FETCH_REQUESTS",
+    "FETCH_LATENCY",
+    "FETCH_IN_PROGRESS",
+    "HTTP_CACHE_LOOKUPS",
+    "CRAWL_TASKS",
+    "VALIDATION_REJECTIONS",
+    "VALIDATION_RECORDS",
+    "VALIDATION_FIELD_ERRORS",
+    "RECORDS",
+    "FILE_BYTES",
+    "STAGE_DURATION",
+    "LAST_POLL_RECORDS",
+    "LAST_POLL_TIMESTAMP",
+    "QUERY_REQUESTS",
+    "QUERY_LATENCY",
+    "count_records",
+    "timed",
+    "snapshot",
+    "write_snapshot",
+    "start_metrics_server"
+]
+
+NAMESPACE = "bus_analysis"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_METRICS: List["Metric"] = []
+
+
+class _Child:
+    """Value of a metric for one combination of label values."""
+
+    def __init__(self, metric: "Metric") -> None:
+        self._metric = metric
+        self.value = 0.0
+        self.count = 0
+        self.bucket_counts = [0] * (len(metric.buckets) + 1)
+
+    def inc(self, amount: float = 1) -> None:
+        with self._metric.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._metric.lock:
+            self.value = value
+
+    def observe(self, value: float) -> None:
+        with self._metric.lock:
+            self.value += value
+            self.count += 1
+            self.bucket_counts[bisect.bisect_left(self._metric.buckets, value)] += 1
+
+
+class Metric:
+    """
+    A counter, gauge or histogram with optional labels, used like its prometheus_client counterpart:
+    metric.labels(stage="x").inc() or metric.inc() for metrics without labels.
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.kind, self.name, self.documentation = kind, f"{NAMESPACE}_{name}", documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if kind == "histogram" else ()
+        self.lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+        _METRICS.append(self)
+
+    def labels(self, *args: Any, **kwargs: Any) -> _Child:
+        label_values = tuple(str(value) for value in args) or tuple(str(kwargs[name]) for name in self.labelnames)
+        child = self._children.get(label_values)
+        if child is None:
+            with self.lock:
+                child = self._children.setdefault(label_values, _Child(self))
+        return child
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = []
+        for label_values, child in list(self._children.items()):
+            sample: Dict[str, Any] = {"labels": dict(zip(self.labelnames, label_values))}
+            if self.kind == "histogram":
+                cumulative, buckets = 0, {}
+                for bound, count in zip(self.buckets + (float("inf"),), child.bucket_counts):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                sample.update({"count": child.count, "sum": child.value, "buckets": buckets})
+            else:
+                sample["value"] = child.value
+            samples.append(sample)
+        return {"type": self.kind, "help": self.documentation, "samples": samples}
+
+
+FETCH_REQUESTS = Metric("counter", "fetch_requests_total", "API requests by endpoint and HTTP status",
+                        ["endpoint", "status"])
+FETCH_LATENCY = Metric("histogram", "fetch_latency_seconds", "API request latency", ["endpoint"])
+FETCH_IN_PROGRESS = Metric("gauge", "fetch_in_progress", "API requests in flight", ["endpoint"])
+HTTP_CACHE_LOOKUPS = Metric("counter", "http_cache_lookups_total",
+                            "API requests answered by the HTTP cache by endpoint and result", ["endpoint", "result"])
+CRAWL_TASKS = Metric("counter", "crawl_tasks_total", "Sharded crawl tasks by outcome (done, retried, failed)",
+                     ["outcome"])
+VALIDATION_REJECTIONS = Metric("counter", "validation_rejections_total", "Responses rejected by format checks",
+                               ["check"])
+VALIDATION_RECORDS = Metric("counter", "validation_records_total", "Records of API payloads by schema and outcome",
+                            ["schema", "outcome"])
+VALIDATION_FIELD_ERRORS = Metric("counter", "validation_field_errors_total",
+                                 "Failures of record fields in API payloads by schema and field", ["schema", "field"])
+RECORDS = Metric("counter", "records_total", "Records entering (in) and leaving (kept) processing stages",
+                 ["stage", "outcome"])
+FILE_BYTES = Metric("counter", "file_bytes_total", "Bytes read and written in the data folder",
+                    ["operation", "folder"])
+STAGE_DURATION = Metric("histogram", "stage_duration_seconds", "Duration of processing and analysis stages",
+                        ["stage"])
+LAST_POLL_RECORDS = Metric("gauge", "last_poll_records", "Bus locations returned by the last live poll")
+LAST_POLL_TIMESTAMP = Metric("gauge", "last_poll_timestamp_seconds", "Unix time of the last successful live poll")
+QUERY_REQUESTS = Metric("counter", "query_requests_total", "Query service requests by endpoint, status and cache use",
+                        ["endpoint", "status", "cache"])
+QUERY_LATENCY = Metric("histogram", "query_latency_seconds", "Query service response latency", ["endpoint"])
+
+
+def count_records(stage: str, records_in: int, records_kept: int) -> None:
+    """Record how many records a processing stage received and kept."""
+    RECORDS.labels(stage=stage, outcome="in").inc(records_in)
+    RECORDS.labels(stage=stage, outcome="kept").inc(records_kept)
+
+
+@contextmanager
+def _stage_timer(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def timed(stage: Optional[str] = None) -> Callable:
+    """
+    Decorator marking a pipeline stage: records the duration of every call in STAGE_DURATION
+    and profiles the call while profiling is enabled.
+
+    Args:
+        stage (str): Label of the stage, the function name by default.
+    """
+    def decorator(function: Callable) -> Callable:
+        label = stage or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _stage_timer(label):
+                if profiling.is_enabled():
+                    return profiling.profile_call(label, function, *args, **kwargs)
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> Dict[str, Any]:
+    """Current values of all metrics, keyed by metric name."""
+    return {metric.name: metric.snapshot() for metric in _METRICS}
+
+
+def write_snapshot(path: str) -> None:
+    """Write the snapshot of all metrics to a JSON file."""
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(snapshot(), file, indent=4)
+
+
+def start_metrics_server(port: int, address: str = "0.0.0.0") -> None:
+    """
+    Serve the metrics in the Prometheus text format on http://address:port/metrics.
+
+    Raises:
+        RuntimeError: If prometheus_client is not installed.
+    """
+    try:
+        import prometheus_client
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+    except ImportError:
+        raise RuntimeError("prometheus_client is not installed; use write_snapshot instead")
+
+    class Collector:
+        """Exposes the current values of all metrics on every scrape."""
+
+        def collect(self):
+            for metric in _METRICS:
+                if metric.kind == "counter":
+                    family = CounterMetricFamily(metric.name.removesuffix("_total"), metric.documentation,
+                                                 labels=metric.labelnames)
+                elif metric.kind == "gauge":
+                    family = GaugeMetricFamily(metric.name, metric.documentation, labels=metric.labelnames)
+                else:
+                    family = HistogramMetricFamily(metric.name, metric.documentation, labels=metric.labelnames)
+                for label_values, child in list(metric._children.items()):
+                    if metric.kind == "histogram":
+                        cumulative, buckets = 0, []
+                        for bound, count in zip(metric.buckets + (float("inf"),), child.bucket_counts):
+                            cumulative += count
+                            buckets.append((prometheus_client.utils.floatToGoString(bound), cumulative))
+                        family.add_metric(list(label_values), buckets, child.value)
+                    else:
+                        family.add_metric(list(label_values), child.value)
+                yield family
+
+    registry = prometheus_client.CollectorRegistry()
+    registry.register(Collector())
+    prometheus_client.start_http_server(port, addr=address, registry=registry)
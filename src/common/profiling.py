@@ -0,0 +1,196 @@
+"""
+Opt-in profiling of pipeline stages.
+
+Every function decorated with metrics.timed is a stage. When profiling is enabled, either by setting
+PROFILE_ENV or with enable_profiling (the --profile option of the CLI), each stage call
+records its wall and CPU time and its tracemalloc peak, and the outermost stage on the stack also dumps
+cProfile statistics. Results of a run go to their own folder:
+
+    <profile dir>/<YYYYmmdd-HHMMSS>-<pid>/
+        stages.jsonl            one line per stage call
+        <stage>-<n>.prof        pstats dump, readable with pstats.Stats or snakeviz
+
+When profiling is disabled, a stage call costs a single check of a module attribute.
+
+Usage:
+    python -m src.common.profiling data/profiles/20240301-081500-1234 --top 30
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from src.common.config import PROFILES, PROFILE_ENV
+
+__all__ = [
+    "enable_profiling",
+    "disable_profiling",
+    "is_enabled",
+    "profile_call",
+    "print_report"
+]
+
+STAGES_FILE = "stages.jsonl"
+
+
+class _ProfilingState:
+    """
+    Where the current run writes to. Profiling enabled through PROFILE_ENV creates its run folder with the first
+    stage call, as the data folder cannot be resolved while this module is imported.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.profile_dir: Optional[str] = None
+        self.run_dir: Optional[str] = None
+        self.counter = itertools.count(1)
+        self.write_lock = threading.Lock()
+        # cProfile and tracemalloc are process-wide, so only one stage at a time may own them.
+        self.owner_lock = threading.Lock()
+
+
+_state = _ProfilingState()
+
+
+def _start_run(profile_dir: Optional[str]) -> str:
+    if profile_dir is None:
+        # Imported here: file_utils imports metrics, which imports this module.
+        from src.fetch_and_preprocess.file_utils import get_data_dir
+        profile_dir = os.path.join(get_data_dir(), PROFILES)
+    run_dir = os.path.join(profile_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    os.makedirs(run_dir, exist_ok=True)
+    return run_dir
+
+
+def enable_profiling(profile_dir: Optional[str] = None) -> str:
+    """
+    Start profiling every stage call.
+
+    Args:
+        profile_dir (str): Folder for the run folders, data/profiles of the current data folder by default.
+
+    Returns:
+        str: Folder of this run.
+    """
+    _state.profile_dir, _state.run_dir = profile_dir, _start_run(profile_dir)
+    _state.enabled = True
+    return _state.run_dir
+
+
+def disable_profiling() -> None:
+    """Stop profiling; stage calls run undecorated again."""
+    _state.enabled, _state.run_dir = False, None
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+def _current_run_dir() -> str:
+    with _state.write_lock:
+        if _state.run_dir is None:
+            _state.run_dir = _start_run(_state.profile_dir)
+        return _state.run_dir
+
+
+def _write_stage(run_dir: str, entry: Dict[str, Any]) -> None:
+    with _state.write_lock:
+        with open(os.path.join(run_dir, STAGES_FILE), 'a', encoding='utf-8') as file:
+            file.write(json.dumps(entry) + "\n")
+
+
+def profile_call(stage: str, function: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Call a function as a profiled stage.
+
+    The first stage to start owns cProfile and tracemalloc until it returns; stages nested in it,
+    or running at the same time in other threads, only record their wall and CPU time.
+
+    Args:
+        stage (str): Name of the stage.
+        function (Callable): The stage function, called with args and kwargs.
+
+    Returns:
+        Any: The result of the function.
+    """
+    import cProfile
+    import tracemalloc
+    run_dir = _current_run_dir()
+    owner = _state.owner_lock.acquire(blocking=False)
+    profiler = cProfile.Profile() if owner else None
+    started_tracing = owner and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif owner:
+        tracemalloc.reset_peak()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        if profiler is not None:
+            return profiler.runcall(function, *args, **kwargs)
+        return function(*args, **kwargs)
+    finally:
+        entry: Dict[str, Any] = {
+            "stage": stage,
+            "start": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "wall_seconds": time.perf_counter() - wall_start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            "thread": threading.current_thread().name
+        }
+        if owner:
+            entry["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            profile_file = f"{stage}-{next(_state.counter)}.prof"
+            profiler.dump_stats(os.path.join(run_dir, profile_file))
+            entry["profile"] = profile_file
+            _state.owner_lock.release()
+        _write_stage(run_dir, entry)
+
+
+def print_report(run_dir: str, top: int = 20, sort: str = "cumulative") -> None:
+    """
+    Print the stage timings of a run and the top functions of its merged cProfile dumps.
+
+    Args:
+        run_dir (str): Folder of the run.
+        top (int): Number of functions listed.
+        sort (str): pstats sort key.
+    """
+    import pstats
+    totals: Dict[str, Dict[str, float]] = {}
+    with open(os.path.join(run_dir, STAGES_FILE), encoding='utf-8') as file:
+        for line in file:
+            entry = json.loads(line)
+            stage = totals.setdefault(entry["stage"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                       "peak_memory_bytes": 0})
+            stage["calls"] += 1
+            stage["wall_seconds"] += entry["wall_seconds"]
+            stage["cpu_seconds"] += entry["cpu_seconds"]
+            stage["peak_memory_bytes"] = max(stage["peak_memory_bytes"], entry.get("peak_memory_bytes", 0))
+
+    print(f"{'stage':40} {'calls':>6} {'wall s':>10} {'cpu s':>10} {'peak MiB':>10}")
+    for name, stage in sorted(totals.items(), key=lambda item: -item[1]["wall_seconds"]):
+        print(f"{name:40} {stage['calls']:>6} {stage['wall_seconds']:>10.3f} {stage['cpu_seconds']:>10.3f} "
+              f"{stage['peak_memory_bytes'] / 2 ** 20:>10.1f}")
+
+    profiles = sorted(os.path.join(run_dir, name) for name in os.listdir(run_dir) if name.endswith(".prof"))
+    if profiles:
+        print()
+        pstats.Stats(*profiles).sort_stats(sort).print_stats(top)
+
+
+_env_value = os.environ.get(PROFILE_ENV, "")
+if _env_value and _env_value != "0":
+    _state.profile_dir, _state.enabled = None if _env_value == "1" else _env_value, True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summary of a profiling run")
+    parser.add_argument("run_dir", type=str, help="Folder of the run")
+    parser.add_argument("--top", type=int, default=20, help="Number of functions listed")
+    parser.add_argument("--sort", type=str, default="cumulative", help="pstats sort key")
+    args = parser.parse_args()
+    print_report(args.run_dir, args.top, args.sort)
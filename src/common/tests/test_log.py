@@ -0,0 +1,47 @@
+import io
+import json
+import logging
+import unittest
+from ..log import ROOT_LOGGER, configure_logging, get_logger
+
+
+class TestLog(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger(ROOT_LOGGER)
+        saved = root.handlers, root.level, root.propagate
+
+        def restore():
+            root.handlers, root.level, root.propagate = saved
+        self.addCleanup(restore)
+        self.stream = io.StringIO()
+
+    def test_json_lines_with_extra_fields(self):
+        configure_logging(json_format=True, stream=self.stream)
+        get_logger("tests").warning("Failed to fetch data", extra={"endpoint": "buses_location", "status": 500})
+        entry = json.loads(self.stream.getvalue())
+        self.assertEqual(entry["logger"], f"{ROOT_LOGGER}.tests")
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["message"], "Failed to fetch data")
+        self.assertEqual((entry["endpoint"], entry["status"]), ("buses_location", 500))
+
+    def test_json_exception(self):
+        configure_logging(json_format=True, stream=self.stream)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            get_logger("tests").exception("Stage failed")
+        self.assertIn("ValueError: broken", json.loads(self.stream.getvalue())["exception"])
+
+    def test_text_format_and_level(self):
+        configure_logging(level=logging.WARNING, stream=self.stream)
+        logger = get_logger("tests")
+        logger.info("Not shown")
+        logger.error("Stage failed", extra={"stage": "poll"})
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("ERROR Stage failed stage=poll"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+from .. import metrics
+from ..metrics import Metric, count_records, snapshot, timed, write_snapshot
+
+
+class TestMetrics(unittest.TestCase):
+
+    def metric(self, *args, **kwargs):
+        metric = Metric(*args, **kwargs)
+        self.addCleanup(metrics._METRICS.remove, metric)
+        return metric
+
+    def test_counter_with_labels(self):
+        counter = self.metric("counter", "test_requests_total", "Test requests", ["endpoint", "status"])
+        counter.labels(endpoint="a", status=200).inc()
+        counter.labels("a", "200").inc(2)
+        counter.labels(endpoint="b", status=500).inc()
+        samples = {tuple(sample["labels"].values()): sample["value"] for sample in counter.snapshot()["samples"]}
+        self.assertEqual(samples, {("a", "200"): 3, ("b", "500"): 1})
+
+    def test_gauge(self):
+        gauge = self.metric("gauge", "test_in_progress", "Test gauge")
+        gauge.labels().inc()
+        gauge.labels().dec()
+        gauge.set(7)
+        self.assertEqual(gauge.snapshot()["samples"], [{"labels": {}, "value": 7}])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.metric("histogram", "test_latency_seconds", "Test latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+        sample = histogram.snapshot()["samples"][0]
+        self.assertEqual(sample["count"], 4)
+        self.assertAlmostEqual(sample["sum"], 4.25)
+        self.assertEqual(sample["buckets"], {"0.1": 1, "1.0": 3, "inf": 4})
+
+    def test_timed(self):
+        @timed("test_stage")
+        def stage(value):
+            return value * 2
+
+        child = metrics.STAGE_DURATION.labels(stage="test_stage")
+        count = child.count
+        self.assertEqual(stage(21), 42)
+        self.assertEqual(stage.__name__, "stage")
+        self.assertEqual(child.count, count + 1)
+
+    def test_count_records_and_snapshot(self):
+        count_records("test_filter", 10, 7)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "metrics.json")
+            write_snapshot(path)
+            with open(path, 'r', encoding='utf-8') as file:
+                saved = json.load(file)
+        self.assertEqual(set(saved), set(snapshot()))
+        records = saved["bus_analysis_records_total"]["samples"]
+        samples = {sample["labels"]["outcome"]: sample["value"] for sample in records
+                   if sample["labels"]["stage"] == "test_filter"}
+        self.assertEqual(samples, {"in": 10, "kept": 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from .. import profiling
+from ..config import DATA_DIR_ENV, PROFILE_ENV, PROFILES
+from ..metrics import timed
+from ..profiling import STAGES_FILE
+
+
+@timed("test_inner")
+def inner(values):
+    return sum(values)
+
+
+@timed("test_outer")
+def outer(count):
+    return inner(range(count))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profiled_stages(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_dir = profiling.enable_profiling(tmp_dir)
+            try:
+                self.assertTrue(profiling.is_enabled())
+                self.assertEqual(outer(1000), 499500)
+            finally:
+                profiling.disable_profiling()
+            self.assertFalse(profiling.is_enabled())
+            with open(os.path.join(run_dir, STAGES_FILE), encoding='utf-8') as file:
+                entries = [json.loads(line) for line in file]
+            # The nested stage ends first and only the outer one owns cProfile and tracemalloc.
+            self.assertEqual([entry["stage"] for entry in entries], ["test_inner", "test_outer"])
+            self.assertNotIn("profile", entries[0])
+            self.assertTrue(os.path.exists(os.path.join(run_dir, entries[1]["profile"])))
+            self.assertIn("peak_memory_bytes", entries[1])
+            report = io.StringIO()
+            with contextlib.redirect_stdout(report):
+                profiling.print_report(run_dir, top=5)
+            self.assertIn("test_outer", report.getvalue())
+
+    def test_runs_go_to_the_data_folder(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.dict(os.environ, {DATA_DIR_ENV: tmp_dir}):
+            run_dir = profiling.enable_profiling()
+            profiling.disable_profiling()
+            self.assertEqual(os.path.dirname(run_dir), os.path.join(tmp_dir, PROFILES))
+
+    def test_enabled_by_the_environment(self):
+        # The data folder is known only once file_utils, which imports this module, is imported.
+        code = ("from src.fetch_and_preprocess.file_utils import get_data_dir\n"
+                "from src.common.tests.test_profiling import outer\n"
+                "outer(10)")
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subprocess.run([sys.executable, "-c", code], cwd=root, check=True,
+                           env=dict(os.environ, **{DATA_DIR_ENV: tmp_dir, PROFILE_ENV: "1"}))
+            run_dir, = os.listdir(os.path.join(tmp_dir, PROFILES))
+            with open(os.path.join(tmp_dir, PROFILES, run_dir, STAGES_FILE), encoding='utf-8') as file:
+                self.assertEqual([json.loads(line)["stage"] for line in file], ["test_inner", "test_outer"])
+
+    def test_disabled_by_default(self):
+        self.assertFalse(profiling.is_enabled())
+        self.assertEqual(outer(10), 45)
+
+
+if __name__ == '__main__':
+    unittest.main()
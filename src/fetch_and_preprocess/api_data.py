@@ -3,14 +3,42 @@ This module constructs API request data for Warsaw public transport services,
 covering dictionaries, bus stop coordinates, schedules, and live bus locations.
 Functions return dictionaries for API requests, specifying URLs, necessary API keys, and query parameters.
 API documentation can be found here: https://api.um.warszawa.pl/#
+The API address can be overridden with the API_URL_ENV environment variable (e.g. to use a local replay server).
 """
+import os
+
+API_URL: str = 'https://api.um.warszawa.pl/api/action'
+API_URL_ENV: str = 'WARSAW_API_URL'
+
+# Resource ids of the endpoints.
+BUS_STOPS_COORDINATES_ID: str = '1c08a38c-ae09-46d2-8926-4f9d25cb0630'
+BUSES_AT_STOP_ID: str = '88cd555f-6f31-43ca-9de4-66c479ad5942'
+TIMETABLE_AT_STOP_ID: str = 'e923fa0e-d96c-43f9-ae6e-60518c9f3238'
+BUSES_LOCATION_RESOURCE_ID: str = 'f2e5503e927d-4ad3-9500-4ab9e55deb59'
+
+ENDPOINT_NAMES = {
+    BUS_STOPS_COORDINATES_ID: 'bus_stops_coordinates',
+    BUSES_AT_STOP_ID: 'buses_at_stop',
+    TIMETABLE_AT_STOP_ID: 'timetable_at_stop',
+    BUSES_LOCATION_RESOURCE_ID: 'buses_location'
+}
+
+
+def get_api_url() -> str:
+    return os.environ.get(API_URL_ENV, API_URL).rstrip('/')
+
+
+def get_endpoint_name(request_data):
+    """Short name of the endpoint a request data dictionary targets, e.g. for metrics labels."""
+    params = request_data.get('params') or {}
+    return ENDPOINT_NAMES.get(params.get('id') or params.get('resource_id'), 'unknown')
 
 
 def get_request_data_bus_stops_coordinates(apikey):
     return {
-        'url': 'https://api.um.warszawa.pl/api/action/dbstore_get',
+        'url': f'{get_api_url()}/dbstore_get',
         'params': {
-            'id': '1c08a38c-ae09-46d2-8926-4f9d25cb0630',
+            'id': BUS_STOPS_COORDINATES_ID,
             'apikey': apikey
         },
         'headers': {}
@@ -19,9 +47,9 @@ def get_request_data_bus_stops_coordinates(apikey):
 
 def get_request_data_buses_at_stop(bus_stop_id, bus_stop_nr, apikey):
     return {
-        'url': "https://api.um.warszawa.pl/api/action/dbtimetable_get",
+        'url': f"{get_api_url()}/dbtimetable_get",
         'params': {
-            'id': '88cd555f-6f31-43ca-9de4-66c479ad5942',
+            'id': BUSES_AT_STOP_ID,
             'busstopId': bus_stop_id,
             'busstopNr': bus_stop_nr,
             'apikey': apikey
@@ -32,9 +60,9 @@ def get_request_data_buses_at_stop(bus_stop_id, bus_stop_nr, apikey):
 
 def get_request_data_timetable_at_stop_for_line(line, bus_stop_id, bus_stop_nr, apikey):
     return {
-        'url': "https://api.um.warszawa.pl/api/action/dbtimetable_get",
+        'url': f"{get_api_url()}/dbtimetable_get",
         'params': {
-            'id': 'e923fa0e-d96c-43f9-ae6e-60518c9f3238',
+            'id': TIMETABLE_AT_STOP_ID,
             'line': line,
             'busstopId': bus_stop_id,
             'busstopNr': bus_stop_nr,
@@ -46,9 +74,9 @@ def get_request_data_timetable_at_stop_for_line(line, bus_stop_id, bus_stop_nr,
 
 def get_request_data_buses_location(apikey):
     return {
-        'url': "https://api.um.warszawa.pl/api/action/busestrams_get/",
+        'url': f"{get_api_url()}/busestrams_get/",
         'params': {
-            "resource_id": "f2e5503e927d-4ad3-9500-4ab9e55deb59",
+            "resource_id": BUSES_LOCATION_RESOURCE_ID,
             "type": "1",
             "apikey": apikey
         },
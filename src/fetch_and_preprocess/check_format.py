@@ -1,9 +1,14 @@
+import functools
 import json
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable
 import requests
 from requests import Response
 from src.common.config import WARSAW_LAT_MIN, WARSAW_LAT_MAX, WARSAW_LON_MIN, WARSAW_LON_MAX
+from src.common.log import get_logger
+from src.common.metrics import VALIDATION_REJECTIONS
+from src.fetch_and_preprocess.schema_validation import BUS_STOPS_COORDINATES_SCHEMA, BUSES_AT_STOP_SCHEMA, \
+    TIMETABLE_AT_STOP_SCHEMA, BUSES_LOCATION_SCHEMA
 
 __all__ = [
     'check_format_basic',
@@ -16,15 +21,37 @@ __all__ = [
     'check_time_in_range'
 ]
 
-def check_format_basic(response: Response) -> bool:
+logger = get_logger(__name__)
+
+
+def counted_check(check: str) -> Callable[[Callable[..., bool]], Callable[..., bool]]:
+    """
+    Decorator counting the rejections of a format check in the VALIDATION_REJECTIONS metric.
+
+    Args:
+        check (str): Label of the check.
+    """
+    def decorator(function: Callable[..., bool]) -> Callable[..., bool]:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs) -> bool:
+            result = function(*args, **kwargs)
+            if not result:
+                VALIDATION_REJECTIONS.labels(check=check).inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def check_format_basic(response: Response, allow_empty: bool = False) -> bool:
     """
     Checks if the API response adheres to the expected format according to the documentation.
     According to the API documentation, every successful response should contain a 'result' key
     with a non-empty list of data, represented as {'result': [DATA]}.
-    An empty response ({'result': []}) is considered unsuccessful.
+    An empty response ({'result': []}) is considered unsuccessful unless allow_empty is set.
 
     Args:
         response (Response): The response object received from the API request.
+        allow_empty (bool): Accept an empty result, e.g. of a line that does not stop at a stop on that day.
 
     Returns:
         bool: True if the response is correct according to the documentation, False otherwise.
@@ -37,19 +64,25 @@ def check_format_basic(response: Response) -> bool:
 
         data = response.json()
 
-        if isinstance(data, dict) and 'result' in data and isinstance(data['result'], list) and data['result']:
+        if isinstance(data, dict) and 'result' in data and isinstance(data['result'], list) \
+                and (data['result'] or allow_empty):
             return True
         else:
-            print("Invalid API response: missing data or incorrect format." + response.text)
+            logger.warning("Invalid API response: missing data or incorrect format.",
+                           extra={"response": response.text})
     except requests.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
+        logger.warning("HTTP error occurred", extra={"error": str(http_err)})
     except json.JSONDecodeError as json_err:
-        print(f"JSON decoding error occurred: {json_err}")
+        logger.warning("JSON decoding error occurred", extra={"error": str(json_err)})
+    VALIDATION_REJECTIONS.labels(check="basic").inc()
     return False
 
+@counted_check("buses_coordinates")
 def check_format_buses_coordinates(result: Any) -> bool:
     """
     Checks if the format of result data is as expected for bus coordinates.
+    Every record must pass BUS_STOPS_COORDINATES_SCHEMA; use the schema directly to keep the valid records
+    of a partly malformed response.
 
     Args:
         result (dict): The result data. Provided in JSON format
@@ -57,37 +90,14 @@ def check_format_buses_coordinates(result: Any) -> bool:
     Returns:
         bool: True if the format is correct, False otherwise.
     """
-    required_keys = {'zespol', 'slupek', 'nazwa_zespolu', 'id_ulicy', 'szer_geo', 'dlug_geo', 'kierunek',
-                     'obowiazuje_od'}
-
-    # Check if 'result' is a dictionary
-    if not isinstance(result, dict):
-        return False
-
-    # Check if 'result' contains the key 'result'
-    if 'result' not in result or not isinstance(result['result'], list):
-        return False
-
-    # Check if each item in the list has the key 'values' and if it's a list
-    for item in result['result']:
-        if not isinstance(item, dict) or 'values' not in item or not isinstance(item['values'], list):
-            return False
-
-        # Check if first item in the 'values' list is a dictionary with keys 'value' and 'key'
-        for value_item in item['values']:
-            if not isinstance(value_item, dict) or 'key' not in value_item or 'value' not in value_item:
-                return False
-
-            # Check if each dictionary item in 'values' has correct key 'key'
-            if value_item['key'] not in required_keys:
-                return False
-
-    return True
+    return BUS_STOPS_COORDINATES_SCHEMA.validate(result).complete
 
 
+@counted_check("buses_at_stop")
 def check_format_buses_at_stop(result: Any) -> bool:
     """
     Checks if the format of result data is as expected for bus buses at stop.
+    Every record must pass BUSES_AT_STOP_SCHEMA.
 
     Args:
         result (dict): The result data. Provided in JSON format
@@ -95,26 +105,14 @@ def check_format_buses_at_stop(result: Any) -> bool:
     Returns:
         bool: True if the format is correct, False otherwise.
     """
-    if not isinstance(result, dict):
-        return False
-
-    if "result" not in result or not isinstance(result["result"], list):
-        return False
-
-    for item in result["result"]:
-        if not isinstance(item, dict) or "values" not in item or not isinstance(item["values"], list):
-            return False
-
-        for value_item in item["values"]:
-            if not isinstance(value_item, dict) or "value" not in value_item or "key" not in value_item:
-                return False
-
-    return True
+    return BUSES_AT_STOP_SCHEMA.validate(result).complete
 
 
+@counted_check("timetables_at_stop")
 def check_format_timetables_at_stop(result: Any) -> bool:
     """
     Checks if the format of result data is as expected for timetables of a bus at a stop.
+    Every record must pass TIMETABLE_AT_STOP_SCHEMA.
 
     Args:
         result (dict): The result data. Provided in JSON format
@@ -122,43 +120,22 @@ def check_format_timetables_at_stop(result: Any) -> bool:
     Returns:
         bool: True if the format is correct, False otherwise.
     """
-    required_keys = {"czas", "trasa", "kierunek", "brygada", "symbol_1", "symbol_2"}
-    if "result" not in result:
-        return False
-
-    if not isinstance(result["result"], list):
-        return False
-
-    for item in result["result"]:
-        if not isinstance(item, dict) and "values" not in item:
-            return False
-
-        if not isinstance(item["values"], list):
-            return False
-
-        for value_item in item["values"]:
-            if "value" not in value_item or "key" not in value_item:
-                return False
-
-            if value_item["key"] not in required_keys:
-                return False
-
-    return True
+    return TIMETABLE_AT_STOP_SCHEMA.validate(result).complete
 
 
+@counted_check("buses_location")
 def check_format_buses_location(result: Any) -> bool:
-    required_keys = ["Lines", "Lon", "VehicleNumber", "Time", "Lat", "Brigade"]
-    if "result" not in result:
-        return False
-
-    if not isinstance(result["result"], list):
-        return False
+    """
+    Checks if the format of result data is as expected for live bus locations.
+    Every record must pass BUSES_LOCATION_SCHEMA.
 
-    for item in result["result"]:
-        if not all(key in item for key in required_keys):
-            return False
+    Args:
+        result (dict): The result data. Provided in JSON format
 
-    return True
+    Returns:
+        bool: True if the format is correct, False otherwise.
+    """
+    return BUSES_LOCATION_SCHEMA.validate(result).complete
 
 def check_coordinates(lat: float, lon: float) -> bool:
     """
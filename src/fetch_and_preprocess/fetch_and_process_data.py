@@ -1,28 +1,11 @@
-import argparse
-from fetch_data import *
-from process_data import *
-from scheduled_function_runner import start
+"""
+The daily collection, kept for existing scripts: same as `bus-analysis collect`.
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Program description")
-    parser.add_argument("API KEY", type=str, help="Description of argument 1")
-    parser.add_argument("first_hour", type=int, help="When fetching data from api")
-    parser.add_argument("second_hour", type=int, help="When fetching data from api")
-    args = parser.parse_args()
-
-    API_KEY = args.API_KEY
-    first_hour, second_hour = args.first_hour, args.second_hour
-    assert (0 <= first_hour <= 23 and 0 <= second_hour <= 23 and first_hour < second_hour)
-
-    fetch_and_save_bus_stops_coordinates(API_KEY)
-    process_bus_stops_coordinates()
+Usage:
+    python -m src.fetch_and_preprocess.fetch_and_process_data API_KEY FIRST_HOUR SECOND_HOUR [options]
+"""
+import sys
+from src.cli import main
 
-    fetch_and_save_buses_at_stops(API_KEY)
-    process_buses_at_stops()
-
-    start(first_hour, fetch_and_save_bus_locations, API_KEY)
-    start(second_hour, fetch_and_save_bus_locations, API_KEY)
-    process_bus_location_files()
-
-    fetch_and_save_timetables(API_KEY)
-    process_timetables(first_hour, second_hour)
+if __name__ == '__main__':
+    sys.exit(main(["collect"] + sys.argv[1:]))
@@ -1,63 +1,113 @@
-from typing import Dict, Optional, Callable, List, Any
+from typing import Dict, Optional, Callable, List, Any, Iterable
 import requests
 from requests import Response
 import json
 from src.common.config import *
-from api_data import *
-from file_utils import save_file_to_data_folder, get_filepath
-from check_format import *
+from src.fetch_and_preprocess.api_data import *
+from src.fetch_and_preprocess.file_utils import save_file_to_data_folder, get_filepath
+from src.fetch_and_preprocess.http_cache import default_http_cache
+from src.fetch_and_preprocess.check_format import *
+from src.fetch_and_preprocess.process_data import filter_bus_locations
+from src.fetch_and_preprocess.schema_validation import BUS_STOPS_COORDINATES_SCHEMA, BUSES_AT_STOP_SCHEMA, \
+    TIMETABLE_AT_STOP_SCHEMA, BUSES_LOCATION_SCHEMA, write_quarantine
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import time
 from datetime import datetime
+from src.common.log import get_logger
+from src.common.metrics import FETCH_REQUESTS, FETCH_LATENCY, FETCH_IN_PROGRESS, LAST_POLL_RECORDS, \
+    LAST_POLL_TIMESTAMP, timed
 
 MAX_WORKERS = 40
 
+# Functions called with (endpoint, status, seconds) after every API request, status "error" if it raised,
+# e.g. the client side log of the load test.
+REQUEST_OBSERVERS: List[Callable[[str, Any, float], Any]] = []
+
 __all__ = ["fetch_and_save_bus_stops_coordinates",
            "fetch_and_save_buses_at_stops",
            "fetch_and_save_timetables",
            "fetch_and_save_bus_locations"]
 
+logger = get_logger(__name__)
+
 
-def fetch_data(request_data: Dict) -> Optional[Response]:
+def fetch_data(request_data: Dict, session: Optional[requests.Session] = None,
+               allow_empty: bool = False) -> Optional[Response]:
     """
-    Fetches data based on the provided API data.
+    Fetches data based on the provided API data. Responses of the static endpoints are answered from
+    the HTTP cache (see http_cache) while they are fresh.
 
     Args:
         request_data (Dict): Dictionary containing the API request details with keys: 'url', 'params', and 'headers'.
+        session (Optional[requests.Session]): Session to reuse connections with, a new connection is used if None.
+        allow_empty (bool): Accept an empty result ({'result': []}) as successful, see check_format_basic.
 
     Returns:
-        Optional[Response]: The response object from the API request if the fetch is successful, None otherwise.
+        Optional[Response]: The response object from the API request (or the cache) if the fetch is successful,
+        None otherwise.
     """
+    return default_http_cache.fetch(request_data, lambda data: fetch_from_api(data, session, allow_empty))
 
-    try:
-        url, params, headers = request_data.get('url'), request_data.get('params'), request_data.get('headers')
 
-        response = requests.get(url, params=params, headers=headers)
+def fetch_from_api(request_data: Dict, session: Optional[requests.Session] = None,
+                   allow_empty: bool = False) -> Optional[Response]:
+    """
+    Fetches data from the API, bypassing the cache.
+
+    Args:
+        request_data (Dict): Dictionary containing the API request details with keys: 'url', 'params', and 'headers'.
+        session (Optional[requests.Session]): Session to reuse connections with, a new connection is used if None.
+        allow_empty (bool): Accept an empty result ({'result': []}) as successful, see check_format_basic.
+
+    Returns:
+        Optional[Response]: The response object from the API request if the fetch is successful, None otherwise.
+    """
+    url, params, headers = request_data.get('url'), request_data.get('params'), request_data.get('headers')
+    endpoint = get_endpoint_name(request_data)
+    FETCH_IN_PROGRESS.labels(endpoint=endpoint).inc()
+    start = time.perf_counter()
+    status = "error"
+    try:
+        response = (session or requests).get(url, params=params, headers=headers)
+        status = getattr(response, "status_code", "unknown")
 
-        if check_format_basic(response):
+        if check_format_basic(response, allow_empty):
             return response
         else:
-            print(f"Failed to fetch data from {url}. Response: {response.text}")
+            logger.warning("Failed to fetch data", extra={"url": url, "endpoint": endpoint, "status": status})
             return None
 
     except requests.RequestException as e:
-        print(f"Request Exception occurred: {e}")
+        logger.warning("Request Exception occurred", extra={"url": url, "endpoint": endpoint, "error": str(e)})
         return None
+    finally:
+        seconds = time.perf_counter() - start
+        FETCH_IN_PROGRESS.labels(endpoint=endpoint).dec()
+        FETCH_LATENCY.labels(endpoint=endpoint).observe(seconds)
+        FETCH_REQUESTS.labels(endpoint=endpoint, status=status).inc()
+        for observer in REQUEST_OBSERVERS:
+            observer(endpoint, status, seconds)
 
 
+@timed()
 def fetch_and_save_bus_stops_coordinates(api_key: str) -> None:
     """
     Fetches bus stops coordinates data from an API using the provided API key,
-    checks its format, and saves it to a file in the RAW folder.
+    checks its format, and saves it to a file in the RAW folder. Malformed records are quarantined
+    and the valid ones are saved.
 
     Args:
         api_key (str): The API key required to access the bus stops coordinates data.
     """
     response = fetch_data(get_request_data_bus_stops_coordinates(api_key))
-    if check_format_basic(response) and check_format_buses_coordinates(response.json()):
-        save_file_to_data_folder(response.json(), BUS_STOPS_COORDINATES_FILE, True)
+    validation = BUS_STOPS_COORDINATES_SCHEMA.validate(response.json()) if check_format_basic(response) else None
+    if validation is not None:
+        write_quarantine(validation)
+    if validation is not None and validation.ok:
+        save_file_to_data_folder(validation.payload(), BUS_STOPS_COORDINATES_FILE, True)
     else:
-        print(f"An error occurred while fetching and saving data: bus_stops_coordinates.")
+        logger.error("An error occurred while fetching and saving data", extra={"file": BUS_STOPS_COORDINATES_FILE})
 
 
 def fetch_and_save_multiple(input_file: str, output_file: str, helper_function: Callable, api_key: str) -> None:
@@ -102,11 +152,11 @@ def fetch_buses_at_stop(stop: Any, api_key: str) -> Optional[Dict[str, Any]]:
 
     response = fetch_data(api_data)
     if check_format_basic(response):
-        result = response.json()
-        if check_format_buses_at_stop(result):
+        validation = BUSES_AT_STOP_SCHEMA.validate(response.json())
+        write_quarantine(validation)
+        if validation.envelope_ok:
             buses = []
-            values = result.get("result", [])
-            for value in values:
+            for value in validation.valid:
                 for bus_line in value.get("values", []):
                     buses.append(bus_line.get("value"))
             return {
@@ -117,6 +167,43 @@ def fetch_buses_at_stop(stop: Any, api_key: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+def fetch_timetable_at_stop_for_line(bus_stop_id: Any, bus_stop_nr: Any, bus_line: str, api_key: str,
+                                     session: Optional[requests.Session] = None,
+                                     allow_empty: bool = False) -> Optional[Dict[str, Any]]:
+    """Fetches the timetable of one line at a given bus stop.
+
+    Args:
+        bus_stop_id (Any): The bus stop ID (busstopId).
+        bus_stop_nr (Any): The bus stop number (busstopNr).
+        bus_line (str): The bus line.
+        api_key (str): The API key required to access the data.
+        session (Optional[requests.Session]): Session to reuse connections with.
+        allow_empty (bool): Return an empty timetable for an empty result instead of None.
+
+    Returns:
+        Optional[Dict]: Bus stop ID, number, bus line and the timetable of the line ('rozklad') if successful,
+        otherwise None.
+    """
+    api_data = get_request_data_timetable_at_stop_for_line(bus_line, bus_stop_id, bus_stop_nr, api_key)
+    response = fetch_data(api_data, session, allow_empty)
+    # fetch_data returns only responses that passed check_format_basic already.
+    if response is not None:
+        validation = TIMETABLE_AT_STOP_SCHEMA.validate(response.json())
+        write_quarantine(validation)
+        if validation.envelope_ok:
+            timetable_data = [{
+                value["key"]: value["value"]
+                for value in item["values"]
+            } for item in validation.valid]
+            return {
+                'busstopId': bus_stop_id,
+                'busstopNr': bus_stop_nr,
+                'linia': bus_line,
+                'rozklad': timetable_data
+            }
+    return None
+
+
 def fetch_timetable_at_stop(stop: Dict[str, Any], api_key: str) -> List[Dict[str, Any]]:
     """Fetches the timetable at a given bus stop.
 
@@ -132,27 +219,9 @@ def fetch_timetable_at_stop(stop: Dict[str, Any], api_key: str) -> List[Dict[str
     session = requests.Session()
     all_timetables = []
 
-    def fetch_timetable_at_stop_for_a_line(bus_line):
-        api_data = get_request_data_timetable_at_stop_for_line(bus_line, bus_stop_id, bus_stop_nr, api_key)
-        response = session.get(api_data['url'], params=api_data['params'])
-        if check_format_basic(response):
-            result = response.json()
-            if check_format_timetables_at_stop(result):
-                timetable_data = result.get('result', [])
-                timetable_data = [{
-                    value["key"]: value["value"]
-                    for value in item["values"]
-                } for item in timetable_data]
-                return {
-                    'busstopId': bus_stop_id,
-                    'busstopNr': bus_stop_nr,
-                    'linia': bus_line,
-                    'rozklad': timetable_data
-                }
-        return None
-
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(fetch_timetable_at_stop_for_a_line, bus_line) for bus_line in buses]
+        futures = [executor.submit(fetch_timetable_at_stop_for_line, bus_stop_id, bus_stop_nr, bus_line, api_key,
+                                   session) for bus_line in buses]
         for future in futures:
             future_result = future.result()
             if future_result:
@@ -161,6 +230,7 @@ def fetch_timetable_at_stop(stop: Dict[str, Any], api_key: str) -> List[Dict[str
     return all_timetables
 
 
+@timed()
 def fetch_and_save_buses_at_stops(api_key: str) -> None:
     """
     Fetches and saves the list of buses at stops using the provided API key.
@@ -171,6 +241,7 @@ def fetch_and_save_buses_at_stops(api_key: str) -> None:
     fetch_and_save_multiple(BUS_STOPS_COORDINATES_FILE, BUSES_AT_STOPS_FILE, fetch_buses_at_stop, api_key)
 
 
+@timed()
 def fetch_and_save_timetables(api_key: str) -> None:
     """
     Fetches and saves the timetables at stops using the provided API key.
@@ -181,20 +252,42 @@ def fetch_and_save_timetables(api_key: str) -> None:
     fetch_and_save_multiple(BUSES_AT_STOPS_FILE, TIMETABLES, fetch_timetable_at_stop, api_key)
 
 
-def fetch_and_save_bus_locations(api_key: str) -> None:
+@timed()
+def fetch_and_save_bus_locations(api_key: str,
+                                 consumers: Iterable[Callable[[List[Dict[str, Any]]], Any]] = (),
+                                 validation_sample: Optional[int] = None) -> None:
     """
     Fetches and saves the live locations of buses using the provided API key.
+    Malformed records are quarantined, so one bad record does not lose the whole snapshot.
 
     Args:
         api_key (str): The API key required to access the data.
+        consumers (Iterable[Callable]): Functions fed with the records of every successful poll, already
+        filtered the same way as in the processed files (e.g. a live speeding detector). Errors of a consumer
+        are logged and do not stop the poll or the other consumers.
+        validation_sample (Optional[int]): Check only this many evenly spaced records of the poll and every
+        record if one of them fails; every record is checked if None.
     """
-    curr_time = datetime.now().strftime(DATE_FORMAT)
+    poll_time = datetime.now()
+    curr_time = poll_time.strftime(DATE_FORMAT)
 
     filename = str(curr_time) + '.json'
     filepath = os.path.join(BUSES_LIVE_LOCATIONS, filename)
     response = fetch_data(get_request_data_buses_location(api_key))
     if check_format_basic(response):
-        result = response.json()
-        if check_format_buses_location(result):
+        validation = BUSES_LOCATION_SCHEMA.validate(response.json(), validation_sample)
+        write_quarantine(validation)
+        if validation.ok:
+            result = validation.payload()
             save_file_to_data_folder(result, filepath, True)
+            LAST_POLL_RECORDS.set(len(result["result"]))
+            LAST_POLL_TIMESTAMP.set(poll_time.timestamp())
+            if consumers:
+                bus_locations = filter_bus_locations(result["result"], poll_time)
+                for consumer in consumers:
+                    try:
+                        consumer(bus_locations)
+                    except Exception as e:
+                        logger.error("Error occurred in a consumer of bus locations",
+                                     extra={"consumer": repr(consumer), "error": str(e)})
             return
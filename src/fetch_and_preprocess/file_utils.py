@@ -1,15 +1,31 @@
 import os
 
 from src.common.config import *
+from src.common.log import get_logger
+from src.common.metrics import FILE_BYTES
 from typing import Any
 import json
 
 __all__ = [
+    "get_data_dir",
     "get_filepath",
     "save_file_to_data_folder",
     "read_file_from_data_folder"
 ]
 
+logger = get_logger(__name__)
+
+
+def get_data_dir() -> str:
+    """
+    Returns the path of the data folder: the DATA_DIR_ENV environment variable if set,
+    otherwise the data folder of the repository.
+    """
+    data_dir = os.environ.get(DATA_DIR_ENV)
+    if data_dir:
+        return os.path.abspath(data_dir)
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', DATA_FOLDER))
+
 
 def get_filepath(filename: str, data_is_raw: bool) -> str:
     """
@@ -22,12 +38,12 @@ def get_filepath(filename: str, data_is_raw: bool) -> str:
     Returns:
         str: The full file path based on the provided filename and data form.
     """
-    src_path = os.path.abspath(os.path.dirname(__file__))
+    data_dir = get_data_dir()
 
     if data_is_raw:
-        data_path = os.path.abspath(os.path.join(src_path, '..', '..', DATA_FOLDER, RAW, filename))
+        data_path = os.path.abspath(os.path.join(data_dir, RAW, filename))
     else:
-        data_path = os.path.abspath(os.path.join(src_path, '..', '..', DATA_FOLDER, PROCESSED, filename))
+        data_path = os.path.abspath(os.path.join(data_dir, PROCESSED, filename))
 
     return data_path
 
@@ -52,7 +68,9 @@ def save_file_to_data_folder(json_result: Any, output_file: str, data_is_raw: bo
     dest_path = get_filepath(output_file, data_is_raw)
     with open(dest_path, 'w', encoding='utf-8') as f:
         json.dump(json_result, f, indent=4, ensure_ascii=False)
-        print(f"Data saved to {dest_path}")
+        written = f.tell()
+    FILE_BYTES.labels(operation="write", folder=RAW if data_is_raw else PROCESSED).inc(written)
+    logger.info("Data saved", extra={"path": dest_path, "bytes": written})
 
 
 def read_file_from_data_folder(filename: str, data_is_raw: bool) -> Any:
@@ -66,9 +84,10 @@ def read_file_from_data_folder(filename: str, data_is_raw: bool) -> Any:
     data_path = get_filepath(filename, data_is_raw)
 
     if not os.path.exists(data_path):
-        print("No such file or directory: " + data_path)
+        logger.warning("No such file or directory", extra={"path": data_path})
         return None
     else:
         with open(data_path, 'r', encoding='utf-8') as file:
             data = json.load(file)
-            return data
+        FILE_BYTES.labels(operation="read", folder=RAW if data_is_raw else PROCESSED).inc(os.path.getsize(data_path))
+        return data
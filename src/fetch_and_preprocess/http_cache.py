@@ -0,0 +1,267 @@
+"""
+Persistent cache of API responses of the static endpoints.
+
+Bus stop coordinates and the lines at every stop change rarely, yet a crawl requests them thousands of times.
+Successful responses of these endpoints are stored in data/cache/http, one JSON file per request, keyed by the
+URL and the parameters of the request without the API key. Every endpoint has its own policy:
+
+    fresh for ttl            served from the cache (for timetables at most until the midnight after the fetch)
+    stale for ttl + stale    served from the cache and refreshed in the background (stale-while-revalidate)
+    older                    fetched again; the old entry is served if the fetch fails
+
+In offline mode (OFFLINE_ENV set to "1", or bus-analysis --offline) requests are answered only from the cache,
+whatever the age of the entry, and requests of uncached endpoints fail without touching the network.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Set
+from urllib.parse import urlsplit
+from requests import Response
+from src.common.config import CACHE, HTTP_CACHE, OFFLINE_ENV
+from src.common.log import get_logger
+from src.common.metrics import HTTP_CACHE_LOOKUPS
+from src.fetch_and_preprocess.api_data import get_endpoint_name
+from src.fetch_and_preprocess.file_utils import get_data_dir
+
+__all__ = [
+    "CachePolicy",
+    "CACHE_POLICIES",
+    "HttpCache",
+    "request_key",
+    "is_offline",
+    "default_http_cache"
+]
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Caching of the responses of an endpoint.
+
+    Attributes:
+        ttl (timedelta): Age until which an entry is served without a request.
+        stale (timedelta): Further age during which an entry is served while it is refreshed in the background.
+        same_day (bool): Whether entries also expire at the midnight after they were fetched, for responses that
+            describe the day of the request.
+    """
+    ttl: timedelta
+    stale: timedelta = timedelta(0)
+    same_day: bool = False
+
+    def expires_at(self, fetched_at: float) -> float:
+        """Unix time until which an entry fetched at fetched_at (Unix time) is served without a request."""
+        expires = fetched_at + self.ttl.total_seconds()
+        if self.same_day:
+            midnight = datetime.combine(date.fromtimestamp(fetched_at) + timedelta(days=1), datetime.min.time())
+            expires = min(expires, midnight.timestamp())
+        return expires
+
+
+# Endpoints missing here (live locations) are never cached. Timetables are kept only for re-runs on the same day.
+CACHE_POLICIES: Dict[str, CachePolicy] = {
+    "bus_stops_coordinates": CachePolicy(timedelta(days=7), timedelta(days=7)),
+    "buses_at_stop": CachePolicy(timedelta(days=7), timedelta(days=7)),
+    "timetable_at_stop": CachePolicy(timedelta(hours=12), same_day=True)
+}
+
+# Parameters left out of the cache key.
+IGNORED_PARAMS = frozenset({"apikey"})
+REVALIDATE_WORKERS = 4
+
+
+def public_params(request_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Parameters of a request without the API key, as stored and logged."""
+    return {name: value for name, value in (request_data.get('params') or {}).items() if name not in IGNORED_PARAMS}
+
+
+def request_key(request_data: Dict[str, Any]) -> str:
+    """
+    Key of a request: its URL without a trailing slash and its sorted parameters, except the API key.
+
+    Args:
+        request_data (Dict): Request details with keys 'url' and 'params', see api_data.
+
+    Returns:
+        str: Hex digest.
+    """
+    url = urlsplit(request_data.get('url') or '')
+    normalised_url = f"{url.scheme.lower()}://{url.netloc.lower()}{url.path.rstrip('/')}"
+    params = sorted((str(name), str(value)) for name, value in public_params(request_data).items())
+    return hashlib.sha256(json.dumps([normalised_url, params]).encode()).hexdigest()
+
+
+def is_offline() -> bool:
+    return os.environ.get(OFFLINE_ENV, "") not in ("", "0")
+
+
+def _to_response(entry: Dict[str, Any]) -> Response:
+    response = Response()
+    response.status_code = entry["status"]
+    response.url = entry["url"]
+    response.encoding = 'utf-8'
+    response.headers["Content-Type"] = "application/json"
+    response._content = entry["body"].encode('utf-8')
+    return response
+
+
+class HttpCache:
+    """
+    Responses of the static endpoints stored in a folder, one subfolder per endpoint.
+
+    Args:
+        cache_dir (Optional[str]): Folder of the cache, data/cache/http of the current data folder if None.
+        policies (Dict[str, CachePolicy]): Policy by endpoint name; other endpoints are not cached.
+        offline (Optional[bool]): Answer only from the cache; follows OFFLINE_ENV if None.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, policies: Dict[str, CachePolicy] = CACHE_POLICIES,
+                 offline: Optional[bool] = None) -> None:
+        self._cache_dir = cache_dir
+        self.policies = policies
+        self._offline = offline
+        self._lock = threading.Lock()
+        self._revalidating: Set[str] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir or os.path.join(get_data_dir(), CACHE, HTTP_CACHE)
+
+    @property
+    def offline(self) -> bool:
+        return is_offline() if self._offline is None else self._offline
+
+    def _entry_path(self, endpoint: str, key: str) -> str:
+        return os.path.join(self.cache_dir, endpoint, key + ".json")
+
+    def load(self, request_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cached entry of a request: url, params, status, fetched_at (Unix time) and body; None if missing."""
+        try:
+            with open(self._entry_path(get_endpoint_name(request_data), request_key(request_data)), 'r',
+                      encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def store(self, request_data: Dict[str, Any], response: Response) -> None:
+        """Store a successful response; the entry is replaced atomically."""
+        path = self._entry_path(get_endpoint_name(request_data), request_key(request_data))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "url": request_data.get('url'),
+            "params": public_params(request_data),
+            "status": response.status_code,
+            "fetched_at": time.time(),
+            "body": response.text
+        }
+        descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def fetch(self, request_data: Dict[str, Any],
+              fetch: Callable[[Dict[str, Any]], Optional[Response]]) -> Optional[Response]:
+        """
+        Answer a request from the cache according to the policy of its endpoint.
+
+        Args:
+            request_data (Dict): Request details, see api_data.
+            fetch (Callable): Fetches the request from the API, returning None if the response is not usable;
+                also used to refresh stale entries in the background.
+
+        Returns:
+            Optional[Response]: The cached or fetched response, None if there is neither.
+        """
+        endpoint = get_endpoint_name(request_data)
+        policy = self.policies.get(endpoint)
+        if policy is None:
+            if self.offline:
+                HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="offline_miss").inc()
+                logger.warning("Request of an uncached endpoint in offline mode", extra={"endpoint": endpoint})
+                return None
+            return fetch(request_data)
+
+        entry = self.load(request_data)
+        now = time.time()
+        expires = policy.expires_at(entry["fetched_at"]) if entry is not None else None
+        if entry is not None and (self.offline or now < expires):
+            HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="hit").inc()
+            return _to_response(entry)
+        if self.offline:
+            HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="offline_miss").inc()
+            logger.warning("Request missing from the cache in offline mode",
+                           extra={"endpoint": endpoint, "params": public_params(request_data)})
+            return None
+        if entry is not None and now < expires + policy.stale.total_seconds():
+            HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="stale").inc()
+            self._revalidate(request_data, fetch)
+            return _to_response(entry)
+
+        response = fetch(request_data)
+        if response is not None:
+            HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="miss").inc()
+            self.store(request_data, response)
+            return response
+        if entry is not None:
+            HTTP_CACHE_LOOKUPS.labels(endpoint=endpoint, result="stale_if_error").inc()
+            return _to_response(entry)
+        return None
+
+    def _revalidate(self, request_data: Dict[str, Any],
+                    fetch: Callable[[Dict[str, Any]], Optional[Response]]) -> None:
+        key = request_key(request_data)
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS, thread_name_prefix="http-cache")
+
+        def revalidate() -> None:
+            try:
+                response = fetch(request_data)
+                if response is not None:
+                    self.store(request_data, response)
+                    HTTP_CACHE_LOOKUPS.labels(endpoint=get_endpoint_name(request_data), result="revalidated").inc()
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        self._executor.submit(revalidate)
+
+    def wait(self) -> None:
+        """Wait for the background refreshes of stale entries to finish."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def clear(self, endpoint: Optional[str] = None) -> int:
+        """
+        Remove the entries of an endpoint, or all entries.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        endpoints = [endpoint] if endpoint else list(self.policies)
+        removed = 0
+        for name in endpoints:
+            folder = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(folder):
+                continue
+            for filename in os.listdir(folder):
+                os.remove(os.path.join(folder, filename))
+                removed += 1
+        return removed
+
+
+default_http_cache = HttpCache()
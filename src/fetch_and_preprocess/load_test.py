@@ -0,0 +1,188 @@
+"""
+Throughput harness of the fetch layer against the local replay server.
+
+Runs fetch_and_save_buses_at_stops, fetch_and_save_timetables and a series of live polls against a
+ReplayServer and reports requests per second, p50/p99 latency and failure counts of every scenario as JSON.
+Latency and status are recorded by the client, around every request of the fetch layer (REQUEST_OBSERVERS), so they
+include connection setup and queueing in the server, and requests that never got an answer count as failures
+(status "error"). The status counts and latency seen by the server are reported too.
+Everything is written to a temporary data folder, so the real data folder is never touched.
+
+Usage:
+    python -m src.fetch_and_preprocess.load_test --synthetic --max-workers 20 --latency lognormal --latency-ms 80 \
+        --throttle-rate 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from src.fetch_and_preprocess import fetch_data
+from src.fetch_and_preprocess.api_data import API_URL_ENV
+from src.fetch_and_preprocess.fetch_data import *
+from src.fetch_and_preprocess.replay_server import ReplayPayloads, ReplayServer, add_fault_arguments, \
+    fault_config_from_args
+from src.common.config import *
+
+__all__ = [
+    "ClientLog",
+    "run_scenario",
+    "run_load_test"
+]
+
+API_KEY = "load-test"
+
+
+class ClientLog:
+    """Requests of the fetch layer as the client saw them: (endpoint, status or "error", seconds)."""
+
+    def __init__(self) -> None:
+        self.entries: List[Tuple[str, Any, float]] = []
+        self.lock = threading.Lock()
+
+    def record(self, endpoint: str, status: Any, seconds: float) -> None:
+        with self.lock:
+            self.entries.append((endpoint, status, seconds))
+
+    def reset(self) -> List[Tuple[str, Any, float]]:
+        with self.lock:
+            entries, self.entries = self.entries, []
+        return entries
+
+
+def _percentiles(seconds: List[float]) -> Tuple[Optional[float], Optional[float]]:
+    if not seconds:
+        return None, None
+    latencies = np.array(seconds) * 1000
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def _status_counts(log: List[Tuple[str, Any, float]]) -> Dict[str, int]:
+    statuses: Dict[str, int] = {}
+    for _, status, _ in log:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return statuses
+
+
+def summarize(client_log: List[Tuple[str, Any, float]], server_log: List[Tuple[str, int, float]],
+              wall_seconds: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles and failures of the requests made during a scenario."""
+    statuses = _status_counts(client_log)
+    latency_p50, latency_p99 = _percentiles([seconds for _, _, seconds in client_log])
+    server_p50, server_p99 = _percentiles([seconds for _, _, seconds in server_log])
+    return {
+        "requests": len(client_log),
+        "wall_seconds": wall_seconds,
+        "requests_per_second": len(client_log) / wall_seconds if wall_seconds > 0 else 0.0,
+        "latency_p50_ms": latency_p50,
+        "latency_p99_ms": latency_p99,
+        "status_counts": statuses,
+        "failures": sum(count for status, count in statuses.items() if status != "200"),
+        "server_requests": len(server_log),
+        "server_latency_p50_ms": server_p50,
+        "server_latency_p99_ms": server_p99,
+        "server_status_counts": _status_counts(server_log)
+    }
+
+
+def run_scenario(server: ReplayServer, client: ClientLog, scenario: Callable[[], Any]) -> Dict[str, Any]:
+    """Run a scenario with its output discarded and summarize the requests it made."""
+    server.reset_log()
+    client.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario()
+    wall_seconds = time.perf_counter() - start
+    return summarize(client.reset(), server.reset_log(), wall_seconds)
+
+
+def _prepare_data_dir(source_dir: str, data_dir: str) -> None:
+    """Copy the inputs of the crawls: processed bus stop coordinates and buses at stops."""
+    os.makedirs(os.path.join(data_dir, RAW, BUSES_LIVE_LOCATIONS), exist_ok=True)
+    os.makedirs(os.path.join(data_dir, PROCESSED), exist_ok=True)
+    for filename in (BUS_STOPS_COORDINATES_FILE, BUSES_AT_STOPS_FILE):
+        source = os.path.join(source_dir, PROCESSED, filename)
+        if os.path.exists(source):
+            shutil.copy(source, os.path.join(data_dir, PROCESSED, filename))
+
+
+def run_load_test(source_dir: str, server: ReplayServer, polls: int, max_workers: int) -> Dict[str, Any]:
+    """
+    Run all scenarios against a running server.
+
+    Args:
+        source_dir (str): Data folder with the crawl inputs the payloads were loaded from.
+        server (ReplayServer): Server started with start_in_background.
+        polls (int): Number of live location polls.
+        max_workers (int): Thread pool size of the crawls (fetch_data.MAX_WORKERS).
+
+    Returns:
+        Dict: Results of every scenario.
+    """
+    saved_workers = fetch_data.MAX_WORKERS
+    saved_environ = {name: os.environ.get(name) for name in (DATA_DIR_ENV, API_URL_ENV)}
+    client = ClientLog()
+    fetch_data.REQUEST_OBSERVERS.append(client.record)
+    try:
+        fetch_data.MAX_WORKERS = max_workers
+        with tempfile.TemporaryDirectory() as data_dir:
+            _prepare_data_dir(source_dir, data_dir)
+            os.environ[DATA_DIR_ENV] = data_dir
+            os.environ[API_URL_ENV] = server.api_url
+            return {
+                "buses_at_stops": run_scenario(server, client, lambda: fetch_and_save_buses_at_stops(API_KEY)),
+                "timetables": run_scenario(server, client, lambda: fetch_and_save_timetables(API_KEY)),
+                "live_polling": run_scenario(server, client, lambda: [fetch_and_save_bus_locations(API_KEY)
+                                                                      for _ in range(polls)])
+            }
+    finally:
+        fetch_data.REQUEST_OBSERVERS.remove(client.record)
+        fetch_data.MAX_WORKERS = saved_workers
+        for name, value in saved_environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test of the fetch layer against a local replay server")
+    parser.add_argument("--data-dir", type=str, default=os.path.join(os.path.dirname(__file__), '..', '..',
+                                                                     DATA_FOLDER),
+                        help="Data folder with recorded payloads and crawl inputs")
+    parser.add_argument("--synthetic", action="store_true", help="Serve synthetic payloads instead of recorded ones")
+    parser.add_argument("--stops", type=int, default=7000, help="Bus stops of the synthetic data")
+    parser.add_argument("--polls", type=int, default=10, help="Live location polls")
+    parser.add_argument("--max-workers", type=int, default=fetch_data.MAX_WORKERS)
+    parser.add_argument("--output", type=str, default=None, help="JSON output file (default: stdout)")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        source = args.data_dir
+        if args.synthetic:
+            from src.benchmarks.synthetic_fleet import FleetConfig, generate_fleet_data
+            generate_fleet_data(FleetConfig(stops=args.stops, polls_per_hour=max(args.polls, 1)), synthetic_dir)
+            source = synthetic_dir
+        payloads = ReplayPayloads(source)
+        replay_server = ReplayServer(payloads, fault_config_from_args(args)).start_in_background()
+        try:
+            report = {
+                "payloads": payloads.summary(),
+                "faults": {key: value for key, value in vars(replay_server.faults).items() if not key.startswith('_')},
+                "max_workers": args.max_workers,
+                "scenarios": run_load_test(source, replay_server, args.polls, args.max_workers)
+            }
+        finally:
+            replay_server.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
@@ -0,0 +1,303 @@
+"""
+Pipeline runner: stages declare the files they read and write, the runner derives the dependencies
+between them and runs every stage as soon as the stages producing its inputs are done, independent
+stages concurrently. Stages whose outputs are newer than their inputs (and younger than their max_age)
+are skipped, like in make.
+
+build_crawl_pipeline and build_collection_pipeline declare the crawl and the daily collection run by the CLI.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import timedelta
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set
+from src.common.config import *
+from src.common.log import get_logger
+from src.fetch_and_preprocess.file_utils import get_filepath
+
+__all__ = [
+    "Stage",
+    "StageResult",
+    "Pipeline",
+    "build_crawl_pipeline",
+    "build_collection_pipeline"
+]
+
+logger = get_logger(__name__)
+
+# Timetables are refreshed once a day, bus stops as often as their HTTP cache entries expire;
+# stages with max_age zero (live polls) always run.
+DAILY = timedelta(days=1)
+ALWAYS = timedelta(0)
+
+RAN, SKIPPED, FAILED, BLOCKED = "ran", "skipped", "failed", "blocked"
+
+
+@dataclass
+class Stage:
+    """
+    A step of the pipeline.
+
+    Args:
+        name (str): Unique name of the stage.
+        function (Callable): Called without arguments to run the stage.
+        inputs (List[str]): Files or folders the stage reads.
+        outputs (List[str]): Files or folders the stage writes.
+        max_age (Optional[timedelta]): Outputs older than this are out of date even if newer than the inputs.
+        only_when_named (bool): Run by Pipeline.run(only=...) only if named itself, not as a dependency of
+        a named stage, e.g. live polls, which block until their hour is over.
+    """
+    name: str
+    function: Callable[[], Any]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    max_age: Optional[timedelta] = None
+    only_when_named: bool = False
+
+
+@dataclass
+class StageResult:
+    status: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def _newest_mtime(path: str) -> Optional[float]:
+    """Modification time of a file, or of the newest file in a folder; None if there is none."""
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    newest = None
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            mtime = os.path.getmtime(os.path.join(root, filename))
+            newest = mtime if newest is None else max(newest, mtime)
+    return newest
+
+
+def _is_up_to_date(stage: Stage) -> bool:
+    if not stage.outputs:
+        return False
+    output_mtimes = [_newest_mtime(path) for path in stage.outputs]
+    if any(mtime is None for mtime in output_mtimes):
+        return False
+    oldest_output = min(output_mtimes)
+    if stage.max_age is not None and time.time() - oldest_output >= stage.max_age.total_seconds():
+        return False
+    input_mtimes = [mtime for mtime in map(_newest_mtime, stage.inputs) if mtime is not None]
+    return not input_mtimes or max(input_mtimes) <= oldest_output
+
+
+class Pipeline:
+    """Stages and the dependencies between them, derived from their inputs and outputs."""
+
+    def __init__(self, stages: Sequence[Stage]) -> None:
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            self.stages[stage.name] = stage
+
+        producers: Dict[str, List[str]] = {}
+        for stage in stages:
+            for path in stage.outputs:
+                producers.setdefault(os.path.abspath(path), []).append(stage.name)
+        self.dependencies: Dict[str, Set[str]] = {
+            stage.name: {producer for path in stage.inputs for producer in producers.get(os.path.abspath(path), [])
+                         if producer != stage.name}
+            for stage in stages
+        }
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        visiting, done = set(), set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage dependencies form a cycle through {name}")
+            visiting.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def upstream(self, names: Iterable[str]) -> Set[str]:
+        """
+        The given stages and every stage they depend on, directly or not, except the stages that run
+        only when named.
+        """
+        names = list(names)
+        selected, pending = set(), list(names)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage: {name}")
+            if name not in selected:
+                selected.add(name)
+                pending.extend(dependency for dependency in self.dependencies[name]
+                               if dependency in names or not self.stages[dependency].only_when_named)
+        return selected
+
+    def run(self, only: Optional[Iterable[str]] = None, force: bool = False,
+            max_workers: Optional[int] = None) -> Dict[str, StageResult]:
+        """
+        Run the pipeline.
+
+        Args:
+            only (Iterable[str]): Stages to re-run; they run even if up to date, the stages they depend on
+            only if out of date, and the stages that run only when named not at all unless named too.
+            All stages by default.
+            force (bool): Run the selected stages even if their outputs are up to date.
+            max_workers (int): Stages running at the same time, all independent ones by default.
+
+        Returns:
+            Dict[str, StageResult]: Result of every selected stage. A stage fails if it raises or does not
+            produce its outputs; the stages depending on it are then blocked, the others still run.
+        """
+        forced = set(self.stages) if force else set(only or ())
+        selected = self.upstream(only) if only else set(self.stages)
+        results: Dict[str, StageResult] = {}
+        running: Dict[Future, str] = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(selected) or 1) as executor:
+            while len(results) < len(selected):
+                for name in sorted(selected):
+                    if name in results or name in running.values():
+                        continue
+                    dependencies = self.dependencies[name] & selected
+                    if any(results[dependency].status in (FAILED, BLOCKED)
+                           for dependency in dependencies if dependency in results):
+                        results[name] = StageResult(BLOCKED)
+                        logger.warning("Stage blocked by a failed dependency", extra={"stage": name})
+                    elif all(dependency in results for dependency in dependencies):
+                        running[executor.submit(self._run_stage, self.stages[name], name in forced)] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[running.pop(future)] = future.result()
+        return results
+
+    @staticmethod
+    def _run_stage(stage: Stage, forced: bool) -> StageResult:
+        if not forced and _is_up_to_date(stage):
+            logger.info("Stage up to date, skipped", extra={"stage": stage.name})
+            return StageResult(SKIPPED)
+
+        logger.info("Stage started", extra={"stage": stage.name})
+        start = time.perf_counter()
+        try:
+            stage.function()
+        except Exception as e:
+            logger.exception("Stage failed", extra={"stage": stage.name})
+            return StageResult(FAILED, time.perf_counter() - start, str(e))
+        seconds = time.perf_counter() - start
+
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        if missing:
+            logger.error("Stage did not produce its outputs", extra={"stage": stage.name, "missing": missing})
+            return StageResult(FAILED, seconds, f"Missing outputs: {missing}")
+        logger.info("Stage finished", extra={"stage": stage.name, "seconds": round(seconds, 3)})
+        return StageResult(RAN, seconds)
+
+
+def _crawl_stages(api_key: str) -> List[Stage]:
+    from src.fetch_and_preprocess.fetch_data import fetch_and_save_bus_stops_coordinates, \
+        fetch_and_save_buses_at_stops, fetch_and_save_timetables
+    from src.fetch_and_preprocess.http_cache import CACHE_POLICIES
+    from src.fetch_and_preprocess.process_data import process_bus_stops_coordinates, process_buses_at_stops
+
+    raw_coordinates = get_filepath(BUS_STOPS_COORDINATES_FILE, True)
+    coordinates = get_filepath(BUS_STOPS_COORDINATES_FILE, False)
+    raw_buses_at_stops = get_filepath(BUSES_AT_STOPS_FILE, True)
+    buses_at_stops = get_filepath(BUSES_AT_STOPS_FILE, False)
+    return [
+        Stage("fetch_bus_stops_coordinates", partial(fetch_and_save_bus_stops_coordinates, api_key),
+              outputs=[raw_coordinates], max_age=CACHE_POLICIES["bus_stops_coordinates"].ttl),
+        Stage("process_bus_stops_coordinates", process_bus_stops_coordinates,
+              inputs=[raw_coordinates], outputs=[coordinates]),
+        Stage("fetch_buses_at_stops", partial(fetch_and_save_buses_at_stops, api_key),
+              inputs=[coordinates], outputs=[raw_buses_at_stops], max_age=CACHE_POLICIES["buses_at_stop"].ttl),
+        Stage("process_buses_at_stops", process_buses_at_stops,
+              inputs=[raw_buses_at_stops, coordinates],
+              outputs=[buses_at_stops, get_filepath(LINES_TO_STOPS_FILE, False)]),
+        Stage("fetch_timetables", partial(fetch_and_save_timetables, api_key),
+              inputs=[buses_at_stops], outputs=[get_filepath(TIMETABLES, True)], max_age=DAILY)
+    ]
+
+
+def build_crawl_pipeline(api_key: str) -> Pipeline:
+    """
+    Declare the crawl of the static data: bus stops, buses at stops and the raw timetables at every stop.
+
+    Args:
+        api_key (str): The API key required to access the data.
+
+    Returns:
+        Pipeline: The crawl pipeline.
+    """
+    return Pipeline(_crawl_stages(api_key))
+
+
+def build_collection_pipeline(api_key: str, first_hour: int, second_hour: int,
+                              consumers: Iterable[Callable[[List[Dict[str, Any]]], Any]] = ()) -> Pipeline:
+    """
+    Declare the daily data collection: the crawl of build_crawl_pipeline, live polling during two hours
+    and the processing of the locations and timetables, whose new hours are then added to the metrics cube; the
+    processed timetables are also loaded into the timetable store.
+
+    The timetable crawl depends only on the buses at stops, so it runs during the polling hours.
+
+    Args:
+        api_key (str): The API key required to access the data.
+        first_hour (int): First hour of live polling.
+        second_hour (int): Second hour of live polling.
+        consumers (Iterable[Callable]): Consumers of every poll, see fetch_and_save_bus_locations.
+
+    Returns:
+        Pipeline: The collection pipeline.
+    """
+    from src.fetch_and_preprocess.fetch_data import fetch_and_save_bus_locations
+    from src.fetch_and_preprocess.process_data import process_timetables, process_bus_location_files
+    from src.fetch_and_preprocess.scheduled_function_runner import run_during_hour
+
+    consumers = list(consumers)
+    raw_locations = get_filepath(BUSES_LIVE_LOCATIONS, True)
+    processed_locations = get_filepath(BUSES_LIVE_LOCATIONS, False)
+    delay_inputs = [get_filepath(BUS_STOPS_COORDINATES_FILE, False), get_filepath(TIMETABLES, False)]
+
+    def update_metrics_cube() -> None:
+        # New timetables rerun this stage, but only the partitions of the hours of their own day are
+        # aggregated again (see MetricsCube.is_stale).
+        from src.analyze.metrics_cube import MetricsCube
+        MetricsCube(get_filepath(METRICS_CUBE, False)).update(
+            [os.path.join(processed_locations, name) for name in sorted(os.listdir(processed_locations))],
+            *delay_inputs)
+
+    def build_timetable_store() -> None:
+        from src.analyze.timetable_store import TimetableStore
+        TimetableStore.load().close()
+
+    def poll_stage(hour: int) -> Stage:
+        return Stage(f"poll_hour_{hour}",
+                     partial(run_during_hour, hour, fetch_and_save_bus_locations, api_key, consumers=consumers),
+                     outputs=[raw_locations], max_age=ALWAYS, only_when_named=True)
+
+    return Pipeline(_crawl_stages(api_key) + [
+        poll_stage(first_hour),
+        poll_stage(second_hour),
+        Stage("process_bus_locations", process_bus_location_files,
+              inputs=[raw_locations], outputs=[processed_locations]),
+        Stage("process_timetables", partial(process_timetables, first_hour, second_hour),
+              inputs=[get_filepath(TIMETABLES, True)], outputs=[get_filepath(TIMETABLES, False)]),
+        Stage("build_timetable_store", build_timetable_store,
+              inputs=delay_inputs, outputs=[get_filepath(TIMETABLE_STORE_FILE, False)]),
+        Stage("update_metrics_cube", update_metrics_cube,
+              inputs=[processed_locations] + delay_inputs, outputs=[get_filepath(METRICS_CUBE, False)])
+    ])
@@ -1,57 +1,148 @@
 from datetime import datetime, timedelta
+from numbers import Integral
+from typing import Any, Dict, List
 from src.common.config import *
-from file_utils import *
-import pandas as pd
+from src.fetch_and_preprocess.file_utils import *
 import os
 import json
-from check_format import *
+from src.fetch_and_preprocess.check_format import *
+from src.common.log import get_logger
+from src.common.metrics import FILE_BYTES, count_records, timed
 
 __all__ = [
     "process_bus_stops_coordinates",
     "process_buses_at_stops",
     "process_timetables",
-    "process_bus_location_files"
+    "process_bus_location_files",
+    "check_bus_location",
+    "filter_bus_locations",
+    "stop_code",
+    "build_lines_to_stops"
 ]
 
+logger = get_logger(__name__)
 
+
+def _log_saved(dest_path: str) -> None:
+    written = os.path.getsize(dest_path)
+    FILE_BYTES.labels(operation="write", folder=PROCESSED).inc(written)
+    logger.info("Data saved", extra={"path": dest_path, "bytes": written})
+
+
+@timed()
 def process_bus_stops_coordinates():
     """
    Processes the coordinates of bus stops.
    Reads the raw coordinates data from the specified file, cleans it, and saves the processed data to a new file
    BUS_STOPS_COORDINATES_FILE in data/processed folder.
    """
+    import pandas as pd
     data = read_file_from_data_folder(BUS_STOPS_COORDINATES_FILE, True)
 
     df = pd.DataFrame([{item['key']: item['value'] for item in record['values']} for record in data['result']])
 
     selected_columns = ['zespol', 'slupek', 'nazwa_zespolu', 'id_ulicy', 'szer_geo', 'dlug_geo']
     df = df[selected_columns]
+    count_records("bus_stops_coordinates", len(data['result']), len(df))
 
     dest_path = get_filepath(BUS_STOPS_COORDINATES_FILE, False)
     df.to_json(dest_path, orient='records', indent=4, force_ascii=False)
-    print(f"Data saved to {dest_path}")
+    _log_saved(dest_path)
 
 
+@timed()
 def process_buses_at_stops():
     """
     Processes the list of buses available at stops.
     Reads the raw buses data from the specified file, filters it, and saves the processed data to a new file
-    BUSES_AT_STOPS_FILE in data/processed folder.
+    BUSES_AT_STOPS_FILE in data/processed folder, together with the index of the stops served by every line
+    (LINES_TO_STOPS_FILE, see build_lines_to_stops).
     """
+    import pandas as pd
     df = pd.read_json(get_filepath(BUSES_AT_STOPS_FILE, RAW))
 
     # Filter vehicles - remove all trams and all buses starting with a letter.
     def filter_buses(bus_list):
         return [bus for bus in bus_list if not bus[0].isalpha() and len(bus) > 2]
 
+    records_in = len(df)
     df['autobusy'] = df['autobusy'].apply(filter_buses)
     df = df[df['autobusy'].apply(bool)]
+    count_records("buses_at_stops", records_in, len(df))
 
     dest_path = get_filepath(BUSES_AT_STOPS_FILE, False)
     df.to_json(dest_path, orient='records', indent=4, force_ascii=False)
-    print(f"Data saved to {dest_path}")
+    _log_saved(dest_path)
+
+    coordinates = read_file_from_data_folder(BUS_STOPS_COORDINATES_FILE, False)
+    if coordinates is None:
+        logger.warning("Bus stop coordinates not processed, index of lines to stops not built")
+        return
+    # Written without indentation: the index holds long lists of numbers and is read by programs only.
+    dest_path = get_filepath(LINES_TO_STOPS_FILE, False)
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        json.dump(build_lines_to_stops(df.to_dict('records'), coordinates), f, separators=(',', ':'),
+                  ensure_ascii=False)
+    _log_saved(dest_path)
+
+
+def stop_code(value: Any, width: int) -> str:
+    """
+    Identifier of a bus stop in the form of the bus stop coordinates.
 
+    pd.read_json turns numeric identifiers into integers (Python or numpy): busstopNr 1 is post "01"
+    of the coordinates.
 
+    Args:
+        value: busstopId (width 4) or busstopNr (width 2), as a string or as an integer.
+        width (int): Number of digits.
+
+    Returns:
+        str: The identifier, e.g. "01" for busstopNr 1.
+    """
+    return f"{value:0{width}d}" if isinstance(value, Integral) else str(value)
+
+
+def build_lines_to_stops(buses_at_stops: List[Dict[str, Any]],
+                         coordinates: List[Dict[str, Any]]) -> Dict[str, Dict[str, List]]:
+    """
+    Builds the reverse index from a bus line to the stops it serves, with their coordinates.
+
+    Every line maps to parallel lists (busstopId, busstopNr, lat, lon), ready to be turned into arrays.
+    Stops without known coordinates are left out.
+
+    Args:
+        buses_at_stops (List[Dict]): Processed buses at stops, records with 'busstopId', 'busstopNr' and 'autobusy'.
+        coordinates (List[Dict]): Processed bus stop coordinates, records with 'zespol', 'slupek',
+        'szer_geo' and 'dlug_geo'.
+
+    Returns:
+        Dict[str, Dict[str, List]]: The index, lines and stops in ascending order.
+    """
+    positions = {(stop['zespol'], stop['slupek']): (float(stop['szer_geo']), float(stop['dlug_geo']))
+                 for stop in coordinates}
+    lines_to_stops: Dict[str, List] = {}
+    for stop in buses_at_stops:
+        bus_stop_id, bus_stop_nr = stop_code(stop['busstopId'], 4), stop_code(stop['busstopNr'], 2)
+        position = positions.get((bus_stop_id, bus_stop_nr))
+        if position is None:
+            continue
+        for line in stop['autobusy']:
+            lines_to_stops.setdefault(str(line), []).append((bus_stop_id, bus_stop_nr) + position)
+
+    index = {}
+    for line in sorted(lines_to_stops):
+        stops = sorted(set(lines_to_stops[line]))
+        index[line] = {
+            'busstopId': [stop[0] for stop in stops],
+            'busstopNr': [stop[1] for stop in stops],
+            'lat': [stop[2] for stop in stops],
+            'lon': [stop[3] for stop in stops]
+        }
+    return index
+
+
+@timed()
 def process_timetables(first_hour, second_hour):
     """
     Processes the timetables at stops.
@@ -74,6 +165,7 @@ def process_timetables(first_hour, second_hour):
         return time_ok and brigade_ok
 
     cleaned_data = []
+    departures_in = departures_kept = 0
     for bus_stop_timetables in data:
         if bus_stop_timetables:
             first_bus_stop = bus_stop_timetables[0]
@@ -87,19 +179,71 @@ def process_timetables(first_hour, second_hour):
                 bus_line_number = bus_line_timetable[bus_line]
                 departures = []
 
+                departures_in += len(bus_line_timetable[timetables])
                 for departure in bus_line_timetable[timetables]:
                     if check_condition(departure, first_hour, second_hour):
                         departure_data = {"czas": departure["czas"], "brygada": departure["brygada"]}
                         departures.append(departure_data)
                 if departures:
                     bus_stop_data[timetables][bus_line_number] = departures
+                    departures_kept += len(departures)
 
         if bus_stop_data[timetables]:
             cleaned_data.append(bus_stop_data)
 
+    count_records("timetables", departures_in, departures_kept)
     save_file_to_data_folder(cleaned_data, TIMETABLES, False)
 
 
+def check_bus_location(bus_location: Dict[str, Any], poll_datetime: datetime) -> bool:
+    """
+    Checks if a live bus location record is usable for the analysis: a bus (line starting with a digit)
+    with a numeric brigade, located in Warsaw and reported within a minute of the poll.
+
+    Args:
+        bus_location (Dict): A single record of the live locations API response.
+        poll_datetime (datetime): Time of the poll that returned the record.
+
+    Returns:
+        bool: True if the record should be kept, False otherwise.
+    """
+    try:
+        coordinates_ok = check_coordinates(bus_location['Lat'], bus_location['Lon'])
+        line_number_ok = bus_location['Lines'][0].isdigit()
+        brigade_ok = bus_location['Brigade'].isdigit()
+        time_ok = check_time(bus_location['Time'], DATE_FORMAT) and (abs(
+            datetime.strptime(bus_location["Time"], DATE_FORMAT) - poll_datetime) <= timedelta(minutes=1))
+        return brigade_ok and coordinates_ok and line_number_ok and time_ok
+    except (KeyError, IndexError, ValueError, TypeError, AttributeError):
+        # Records accepted on a sampled validation may still have fields of the wrong type.
+        return False
+
+
+def filter_bus_locations(bus_locations: List[Dict[str, Any]], poll_datetime: datetime) -> List[Dict[str, Any]]:
+    """
+    Filters live bus location records and keeps only the fields used by the analysis.
+
+    Args:
+        bus_locations (List[Dict]): Records of the live locations API response.
+        poll_datetime (datetime): Time of the poll that returned the records.
+
+    Returns:
+        List[Dict]: Records with 'Lines', 'Lon', 'Lat', 'Brigade' and 'Time' keys that passed check_bus_location.
+    """
+    return [
+        {
+            'Lines': bus_location['Lines'],
+            'Lon': bus_location['Lon'],
+            'Lat': bus_location['Lat'],
+            'Brigade': bus_location['Brigade'],
+            'Time': bus_location['Time']
+        }
+        for bus_location in bus_locations
+        if check_bus_location(bus_location, poll_datetime)
+    ]
+
+
+@timed()
 def process_bus_location_file(filename: str) -> None:
     """
     Processes bus location data from a single file.
@@ -117,41 +261,21 @@ def process_bus_location_file(filename: str) -> None:
     with open(get_filepath(filepath, True), 'r', encoding='utf-8') as file:
         data = json.load(file)
 
-    def check_condition(bus_location, file_datetime) -> bool:
-        try:
-            coordinates_ok = check_coordinates(bus_location['Lat'], bus_location['Lon'])
-            line_number_ok = bus_location['Lines'][0].isdigit()
-            brigade_ok = bus_location['Brigade'].isdigit()
-            time_ok = check_time(bus_location['Time'], DATE_FORMAT) and (abs(
-                datetime.strptime(bus_location["Time"], DATE_FORMAT) - file_datetime) <= timedelta(minutes=1))
-            return brigade_ok and coordinates_ok and line_number_ok and time_ok
-        except (KeyError, IndexError, ValueError):
-            return False
-
-    filtered_bus_locations = [
-        {
-            'Lines': bus_location['Lines'],
-            'Lon': bus_location['Lon'],
-            'Lat': bus_location['Lat'],
-            'Brigade': bus_location['Brigade'],
-            'Time': bus_location['Time']
-        }
-        for bus_location in data.get("result", [])
-        if check_condition(bus_location, file_datetime)
-    ]
+    filtered_bus_locations = filter_bus_locations(data.get("result", []), file_datetime)
+    count_records("bus_locations", len(data.get("result", [])), len(filtered_bus_locations))
     length = len("YYYY-MM-DD HH")
     path = os.path.join(BUSES_LIVE_LOCATIONS, filename[:length])
     live_buses_location_hour_directory = get_filepath(path, False)
     try:
         os.makedirs(get_filepath(live_buses_location_hour_directory, False), exist_ok=True)
-        print(f"Directory '{get_filepath(live_buses_location_hour_directory, False)}' created successfully.")
         new_file_path = os.path.join(live_buses_location_hour_directory, filename)
         save_file_to_data_folder(filtered_bus_locations, new_file_path, False)
     except Exception as e:
-        print(f"Error occurred while creating directory "
-              f"'{get_filepath(live_buses_location_hour_directory, False)}': {e}")
+        logger.error("Error occurred while creating directory",
+                     extra={"path": get_filepath(live_buses_location_hour_directory, False), "error": str(e)})
 
 
+@timed()
 def process_bus_location_files() -> None:
     """
     Processes bus location data from multiple files.
@@ -0,0 +1,304 @@
+"""
+Local stand-in for api.um.warszawa.pl, used to load-test the fetch layer.
+
+The server answers the four requests built in api_data.py (dbstore_get, both dbtimetable_get variants and
+busestrams_get) with payloads recorded in a data folder or generated by src.benchmarks.synthetic_fleet.
+Latency, server errors, 429 responses and a rate limit can be injected, and every answered request is
+recorded, so throughput and latency percentiles can be reported.
+
+Usage:
+    python -m src.fetch_and_preprocess.replay_server --port 8080 --latency lognormal --latency-ms 80 --error-rate 0.01
+    WARSAW_API_URL=http://127.0.0.1:8080/api/action bus-analysis collect ...
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from src.fetch_and_preprocess.api_data import *
+from src.fetch_and_preprocess.process_data import stop_code
+from src.common.config import *
+
+__all__ = [
+    "FaultConfig",
+    "ReplayPayloads",
+    "ReplayServer"
+]
+
+BUS_STOPS_COORDINATES_KEYS = ['zespol', 'slupek', 'nazwa_zespolu', 'id_ulicy', 'szer_geo', 'dlug_geo', 'kierunek',
+                              'obowiazuje_od']
+
+
+def _stop_key(bus_stop_id: Any, bus_stop_nr: Any) -> Tuple[str, str]:
+    """
+    Bus stop in the form of the coordinates, see stop_code. Query parameters are strings, so numeric ones are
+    read as numbers first: busstopNr=1 is post '01', as 1 in buses_at_stops.json is.
+    """
+    def number(value: Any) -> Any:
+        return int(value) if isinstance(value, str) and value.isdigit() else value
+    return stop_code(number(bus_stop_id), 4), stop_code(number(bus_stop_nr), 2)
+
+
+def _values(record: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    return {"values": [{"value": value, "key": key} for key, value in record.items()]}
+
+
+def _read_json(path: str) -> Any:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+class ReplayPayloads:
+    """
+    API responses indexed by request. Loaded from a folder laid out like the data folder of the repository:
+    raw files are used when present, processed ones are converted back to the API format otherwise.
+    """
+
+    def __init__(self, data_dir: str) -> None:
+        raw_dir, processed_dir = os.path.join(data_dir, RAW), os.path.join(data_dir, PROCESSED)
+
+        coordinates = _read_json(os.path.join(raw_dir, BUS_STOPS_COORDINATES_FILE))
+        if coordinates is None:
+            stops = _read_json(os.path.join(processed_dir, BUS_STOPS_COORDINATES_FILE)) or []
+            coordinates = {"result": [_values({key: stop.get(key, "") for key in BUS_STOPS_COORDINATES_KEYS})
+                                      for stop in stops]}
+        self.bus_stops_coordinates: Dict[str, Any] = coordinates
+
+        buses_at_stops = _read_json(os.path.join(raw_dir, BUSES_AT_STOPS_FILE))
+        if buses_at_stops is None:
+            buses_at_stops = _read_json(os.path.join(processed_dir, BUSES_AT_STOPS_FILE)) or []
+        self.buses_at_stop: Dict[Tuple[str, str], Dict[str, Any]] = {
+            _stop_key(stop['busstopId'], stop['busstopNr']): {"result": [_values({"linia": line})
+                                                                         for line in stop['autobusy']]}
+            for stop in buses_at_stops
+        }
+
+        self.timetables: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for stop_timetables in _read_json(os.path.join(raw_dir, TIMETABLES)) or []:
+            for timetable in stop_timetables:
+                key = _stop_key(timetable['busstopId'], timetable['busstopNr']) + (str(timetable['linia']),)
+                self.timetables[key] = {"result": [_values(departure) for departure in timetable['rozklad']]}
+
+        locations_dir = os.path.join(raw_dir, BUSES_LIVE_LOCATIONS)
+        filenames = sorted(f for f in os.listdir(locations_dir) if f.endswith('.json')) \
+            if os.path.isdir(locations_dir) else []
+        self.bus_locations: List[Dict[str, Any]] = [_read_json(os.path.join(locations_dir, f)) for f in filenames]
+        self._polls = itertools.cycle(self.bus_locations) if self.bus_locations else None
+        self._polls_lock = threading.Lock()
+
+    def next_bus_locations(self) -> Dict[str, Any]:
+        """Recorded polls are replayed in order, starting over after the last one."""
+        if self._polls is None:
+            return {"result": []}
+        with self._polls_lock:
+            return next(self._polls)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "bus_stops": len(self.bus_stops_coordinates.get("result", [])),
+            "stops_with_buses": len(self.buses_at_stop),
+            "timetables": len(self.timetables),
+            "bus_location_polls": len(self.bus_locations)
+        }
+
+
+@dataclass
+class FaultConfig:
+    """
+    Injected latency and failures.
+
+    Attributes:
+        latency (str): 'none', 'fixed', 'uniform' (0 to 2x latency_ms) or 'lognormal' (median latency_ms).
+        latency_ms (float): Latency parameter in milliseconds.
+        latency_sigma (float): Shape of the lognormal distribution; larger values give a heavier tail.
+        error_rate (float): Probability of answering 500.
+        throttle_rate (float): Probability of answering 429 regardless of the rate limit.
+        rate_limit (float): Requests per second allowed by a token bucket, 0 for no limit.
+        burst (int): Size of the token bucket.
+        seed (int): Seed of the random generator, None for a random one.
+    """
+    latency: str = "none"
+    latency_ms: float = 50.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    rate_limit: float = 0.0
+    burst: int = 10
+    seed: Optional[int] = None
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+
+    def sample_latency(self) -> float:
+        """Injected latency in seconds."""
+        if self.latency == "fixed":
+            return self.latency_ms / 1000
+        if self.latency == "uniform":
+            return self._random.uniform(0, 2 * self.latency_ms) / 1000
+        if self.latency == "lognormal":
+            return self._random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+        return 0.0
+
+    def sample_failure(self) -> Optional[int]:
+        """Status code of an injected failure, None if the request should succeed."""
+        draw = self._random.random()
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate, self.capacity = rate, burst
+        self.tokens, self.updated = float(burst), time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server replaying payloads with injected faults.
+
+    Every answered request is recorded in `requests_log` as (endpoint, status, seconds spent in the server).
+    """
+    daemon_threads = True
+
+    def __init__(self, payloads: ReplayPayloads, faults: FaultConfig = None,
+                 address: Tuple[str, int] = ("127.0.0.1", 0)) -> None:
+        super().__init__(address, ReplayRequestHandler)
+        self.payloads = payloads
+        self.faults = faults or FaultConfig()
+        self.bucket = TokenBucket(self.faults.rate_limit, self.faults.burst) if self.faults.rate_limit > 0 else None
+        self.requests_log: List[Tuple[str, int, float]] = []
+        self.log_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_url(self) -> str:
+        """Value for the API_URL_ENV environment variable."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/action"
+
+    def start_in_background(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def record(self, endpoint: str, status: int, seconds: float) -> None:
+        with self.log_lock:
+            self.requests_log.append((endpoint, status, seconds))
+
+    def reset_log(self) -> List[Tuple[str, int, float]]:
+        with self.log_lock:
+            log, self.requests_log = self.requests_log, []
+        return log
+
+    def route(self, path: str, params: Dict[str, str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Endpoint name and payload of a request; the payload is None for unknown endpoints."""
+        action = path.rstrip('/').rsplit('/', 1)[-1]
+        resource_id = params.get('id')
+        if action == 'dbstore_get' and resource_id == BUS_STOPS_COORDINATES_ID:
+            return "bus_stops_coordinates", self.payloads.bus_stops_coordinates
+        if action == 'dbtimetable_get' and resource_id == BUSES_AT_STOP_ID:
+            key = _stop_key(params.get('busstopId'), params.get('busstopNr'))
+            return "buses_at_stop", self.payloads.buses_at_stop.get(key, {"result": []})
+        if action == 'dbtimetable_get' and resource_id == TIMETABLE_AT_STOP_ID:
+            key = _stop_key(params.get('busstopId'), params.get('busstopNr')) + (str(params.get('line')),)
+            return "timetable_at_stop", self.payloads.timetables.get(key, {"result": []})
+        if action == 'busestrams_get' and params.get('resource_id') == BUSES_LOCATION_RESOURCE_ID:
+            return "buses_location", self.payloads.next_bus_locations()
+        return "unknown", None
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def do_GET(self) -> None:
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint, payload = self.server.route(url.path, params)
+        faults = self.server.faults
+
+        time.sleep(faults.sample_latency())
+        if payload is None:
+            status, body = 404, {"error": "Unknown endpoint"}
+        elif self.server.bucket is not None and not self.server.bucket.take():
+            status, body = 429, {"error": "Rate limit exceeded"}
+        else:
+            status = faults.sample_failure() or 200
+            body = payload if status == 200 else {"error": "Injected failure"}
+
+        encoded = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(encoded)
+        self.server.record(endpoint, status, time.perf_counter() - start)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Per-request logging would dominate the cost of serving under load.
+        pass
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", choices=["none", "fixed", "uniform", "lognormal"], default="none")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 500 response")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second, 0 for no limit")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def fault_config_from_args(args: argparse.Namespace) -> FaultConfig:
+    return FaultConfig(latency=args.latency, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                       error_rate=args.error_rate, throttle_rate=args.throttle_rate, rate_limit=args.rate_limit,
+                       burst=args.burst, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local replay server for the Warsaw public transport API")
+    parser.add_argument("--data-dir", type=str, default=os.path.join(os.path.dirname(__file__), '..', '..',
+                                                                     DATA_FOLDER),
+                        help="Data folder with recorded payloads")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    replay_payloads = ReplayPayloads(args.data_dir)
+    server = ReplayServer(replay_payloads, fault_config_from_args(args), (args.host, args.port))
+    print(f"Serving {replay_payloads.summary()} at {server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,6 +1,6 @@
 import schedule
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
 from typing import Callable, Any
 
@@ -35,3 +35,30 @@ def start(start_hour: int, function: Callable, *args: Any, **kwargs: Any) -> Non
     while True:
         schedule.run_pending()
         time.sleep(1)
+
+
+def run_during_hour(start_hour: int, function: Callable, *args: Any, **kwargs: Any) -> None:
+    """
+    Runs the function every minute during the next occurrence of the specified hour today and returns
+    when the hour is over. Returns immediately if the hour has already passed.
+
+    Args:
+        start_hour: The hour during which the function is executed.
+        function: The function to be executed for one hour with one minute pause.
+        *args: Positional arguments to pass to the function.
+        **kwargs: Key-value arguments to pass to the function.
+    """
+    now = datetime.now()
+    hour_start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    hour_end = hour_start + timedelta(hours=1)
+    if now >= hour_end:
+        return
+
+    func_with_args = partial(function, *args, **kwargs)
+    # A scheduler of its own, so several hours can be polled from different threads.
+    scheduler = schedule.Scheduler()
+    scheduler.every().minute.do(check_and_run_function, function=func_with_args, start_hour=start_hour)
+
+    while datetime.now() < hour_end:
+        scheduler.run_pending()
+        time.sleep(1)
@@ -0,0 +1,293 @@
+"""
+Error-tolerant validation of API payloads.
+
+A Schema lists the fields of the records of one endpoint and is compiled once into a validator for a single
+record. Validating a payload checks its envelope ({'result': [...]}) and walks the records once: good records
+are kept, malformed ones are quarantined with the names of the fields that failed, and the failures are counted
+per field. One bad record no longer rejects a whole response.
+
+The records of the dbstore and dbtimetable endpoints are lists of {'key': ..., 'value': ...} pairs (the 'values'
+shape); live locations are flat dictionaries. For the live feed, a sampled mode checks an evenly spaced sample of
+the records and accepts the payload as a whole if the sample is clean and every record is at least a dictionary,
+falling back to the full per-record check as soon as one record fails.
+"""
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from src.common.config import DATE_FORMAT, QUARANTINE
+from src.common.log import get_logger
+from src.common.metrics import VALIDATION_FIELD_ERRORS, VALIDATION_RECORDS
+from src.fetch_and_preprocess.file_utils import get_filepath
+
+__all__ = [
+    "RECORD_ERROR",
+    "UNKNOWN_KEY_ERROR",
+    "Field",
+    "Schema",
+    "ValidationResult",
+    "write_quarantine",
+    "BUS_STOPS_COORDINATES_SCHEMA",
+    "BUSES_AT_STOP_SCHEMA",
+    "TIMETABLE_AT_STOP_SCHEMA",
+    "BUSES_LOCATION_SCHEMA"
+]
+
+logger = get_logger(__name__)
+
+# Error of a record that is not a dictionary (or not a list of key/value pairs for the 'values' shape).
+RECORD_ERROR = "<record>"
+# Error of a record with a key its schema does not know.
+UNKNOWN_KEY_ERROR = "<unknown key>"
+
+TIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\Z")
+# Timetable times go past midnight, e.g. "24:15:00".
+CLOCK_PATTERN = re.compile(r"\d{2}:\d{2}:\d{2}\Z")
+
+
+def is_string(value: Any) -> bool:
+    return isinstance(value, str) and value != ""
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_numeric_string(value: Any) -> bool:
+    try:
+        float(value)
+        return isinstance(value, str)
+    except (TypeError, ValueError):
+        return False
+
+
+def matches(pattern: "re.Pattern") -> Callable[[Any], bool]:
+    """Check of a string field against a compiled regular expression."""
+    def check(value: Any) -> bool:
+        return isinstance(value, str) and pattern.match(value) is not None
+    return check
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    A field of a record.
+
+    Attributes:
+        name (str): Key of the field.
+        check (Callable): Predicate the value must satisfy; None accepts any value.
+        required (bool): Whether a record without the field is malformed.
+    """
+    name: str
+    check: Optional[Callable[[Any], bool]] = None
+    required: bool = True
+
+
+@dataclass
+class ValidationResult:
+    """
+    Outcome of the validation of a payload.
+
+    Attributes:
+        schema (str): Name of the schema.
+        envelope_ok (bool): Whether the payload is a dictionary with a list under 'result'.
+        valid (List): Records that passed (or were accepted with a clean sample).
+        quarantined (List[Tuple[int, Any, List[str]]]): Index, record and failed fields of every bad record.
+        error_counts (Counter): Number of failures per field.
+        checked (int): Number of records checked.
+        sampled (bool): Whether the records were accepted on a clean sample.
+    """
+    schema: str
+    envelope_ok: bool = True
+    valid: List[Any] = field(default_factory=list)
+    quarantined: List[Tuple[int, Any, List[str]]] = field(default_factory=list)
+    error_counts: Counter = field(default_factory=Counter)
+    checked: int = 0
+    sampled: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether there is anything usable: a correct envelope and at least one valid record."""
+        return self.envelope_ok and bool(self.valid)
+
+    @property
+    def complete(self) -> bool:
+        """Whether the payload is entirely valid, as the strict check_format_* functions require."""
+        return self.envelope_ok and not self.quarantined
+
+    def payload(self) -> Dict[str, List[Any]]:
+        """The payload with the valid records only, in the shape of the API response."""
+        return {"result": self.valid}
+
+
+class Schema:
+    """
+    Fields of the records of an endpoint, compiled into a record validator.
+
+    Args:
+        name (str): Name of the schema, used in metrics and quarantine files.
+        fields (Iterable[Field]): Fields of the records.
+        values_shape (bool): Whether records are {'values': [{'key': ..., 'value': ...}, ...]}.
+        allow_unknown_keys (bool): Whether keys not listed in fields are accepted.
+    """
+
+    def __init__(self, name: str, fields: Iterable[Field], values_shape: bool = False,
+                 allow_unknown_keys: bool = False) -> None:
+        self.name = name
+        self.fields = tuple(fields)
+        self.values_shape = values_shape
+        self.allow_unknown_keys = allow_unknown_keys
+        self.validate_record = self._compile()
+
+    def is_record(self, record: Any) -> bool:
+        """Cheap check of the type of a record, done for every record of a sampled validation."""
+        if self.values_shape:
+            return isinstance(record, dict) and isinstance(record.get("values"), list)
+        return isinstance(record, dict)
+
+    def _compile(self) -> Callable[[Any], List[str]]:
+        """Build the validator of a single record, returning the failed fields (empty if valid)."""
+        required = frozenset(item.name for item in self.fields if item.required)
+        checks = tuple((item.name, item.check) for item in self.fields if item.check is not None)
+        known = None if self.allow_unknown_keys else frozenset(item.name for item in self.fields)
+
+        def to_mapping(record: Any) -> Optional[Dict[str, Any]]:
+            if not isinstance(record, dict):
+                return None
+            if not self.values_shape:
+                return record
+            values = record.get("values")
+            if not isinstance(values, list):
+                return None
+            mapping = {}
+            for value_item in values:
+                if not isinstance(value_item, dict) or "key" not in value_item or "value" not in value_item:
+                    return None
+                mapping[value_item["key"]] = value_item["value"]
+            return mapping
+
+        def validate_record(record: Any) -> List[str]:
+            mapping = to_mapping(record)
+            if mapping is None:
+                return [RECORD_ERROR]
+            errors = [] if required.issubset(mapping) else sorted(required.difference(mapping))
+            for name, check in checks:
+                if name in mapping and not check(mapping[name]):
+                    errors.append(name)
+            if known is not None and not known.issuperset(mapping):
+                errors.append(UNKNOWN_KEY_ERROR)
+            return errors
+
+        return validate_record
+
+    def validate(self, payload: Any, sample_size: Optional[int] = None) -> ValidationResult:
+        """
+        Validate a payload in a single pass over its records.
+
+        Args:
+            payload (Any): The decoded JSON response.
+            sample_size (Optional[int]): Check only this many evenly spaced records and accept all records if they
+                pass and every record has the type of a record (see is_record); every record is checked if None
+                or if a record fails.
+
+        Returns:
+            ValidationResult: Valid and quarantined records with the per-field error counts.
+        """
+        result = ValidationResult(self.name)
+        if not isinstance(payload, dict) or not isinstance(payload.get("result"), list):
+            result.envelope_ok = False
+            result.error_counts[RECORD_ERROR] += 1
+            self._count(result)
+            return result
+        records = payload["result"]
+
+        if sample_size is not None and len(records) > sample_size > 0:
+            step = len(records) / sample_size
+            sample = [records[int(index * step)] for index in range(sample_size)]
+            is_record = self.is_record
+            if not any(self.validate_record(record) for record in sample) and all(map(is_record, records)):
+                result.valid, result.checked, result.sampled = list(records), sample_size, True
+                self._count(result)
+                return result
+
+        validate_record = self.validate_record
+        for index, record in enumerate(records):
+            errors = validate_record(record)
+            if errors:
+                result.quarantined.append((index, record, errors))
+                result.error_counts.update(errors)
+            else:
+                result.valid.append(record)
+        result.checked = len(records)
+        self._count(result)
+        return result
+
+    def _count(self, result: ValidationResult) -> None:
+        VALIDATION_RECORDS.labels(schema=self.name, outcome="valid").inc(len(result.valid))
+        VALIDATION_RECORDS.labels(schema=self.name, outcome="quarantined").inc(len(result.quarantined))
+        for name, count in result.error_counts.items():
+            VALIDATION_FIELD_ERRORS.labels(schema=self.name, field=name).inc(count)
+        if result.quarantined or not result.envelope_ok:
+            logger.warning("Records failed validation", extra={
+                "schema": self.name, "quarantined": len(result.quarantined), "valid": len(result.valid),
+                "envelope_ok": result.envelope_ok, "errors": dict(result.error_counts)})
+
+
+def write_quarantine(result: ValidationResult) -> Optional[str]:
+    """
+    Append the quarantined records of a validation to QUARANTINE/<schema>.jsonl in the raw data folder.
+
+    Args:
+        result (ValidationResult): The validation result.
+
+    Returns:
+        Optional[str]: Path of the quarantine file, None if nothing was quarantined.
+    """
+    if not result.quarantined:
+        return None
+    path = get_filepath(os.path.join(QUARANTINE, result.schema + ".jsonl"), True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    quarantined_at = datetime.now().strftime(DATE_FORMAT)
+    with open(path, 'a', encoding='utf-8') as file:
+        for index, record, errors in result.quarantined:
+            file.write(json.dumps({"time": quarantined_at, "index": index, "errors": errors, "record": record},
+                                  ensure_ascii=False) + "\n")
+    return path
+
+
+BUS_STOPS_COORDINATES_SCHEMA = Schema("buses_coordinates", [
+    Field("zespol", is_string),
+    Field("slupek", is_string),
+    Field("nazwa_zespolu"),
+    Field("id_ulicy"),
+    Field("szer_geo", is_numeric_string),
+    Field("dlug_geo", is_numeric_string),
+    Field("kierunek", required=False),
+    Field("obowiazuje_od", required=False)
+], values_shape=True)
+
+# Only the shape of the records is checked, as check_format_buses_at_stop always did.
+BUSES_AT_STOP_SCHEMA = Schema("buses_at_stop", [
+    Field("linia", required=False)
+], values_shape=True, allow_unknown_keys=True)
+
+TIMETABLE_AT_STOP_SCHEMA = Schema("timetables_at_stop", [
+    Field("czas", matches(CLOCK_PATTERN)),
+    Field("brygada", is_string),
+    Field("trasa", required=False),
+    Field("kierunek", required=False),
+    Field("symbol_1", required=False),
+    Field("symbol_2", required=False)
+], values_shape=True)
+
+BUSES_LOCATION_SCHEMA = Schema("buses_location", [
+    Field("Lines", is_string),
+    Field("Lon", is_number),
+    Field("VehicleNumber"),
+    Field("Time", matches(TIME_PATTERN)),
+    Field("Lat", is_number),
+    Field("Brigade", is_string)
+], allow_unknown_keys=True)
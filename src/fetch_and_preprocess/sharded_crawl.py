@@ -0,0 +1,143 @@
+"""
+The timetable crawl split into (stop, line) tasks of a WorkQueue.
+
+seed_timetable_tasks adds a task for every line at every stop of the processed buses at stops. Any number of
+workers, each with its own API key, in processes on one host or on hosts sharing the queue file, then drain it
+with run_crawl_worker, and export_timetables writes the raw timetables file in the format of
+fetch_and_save_timetables once the queue is drained. The throughput grows with the number of workers until the
+API rate limits of the keys are reached.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from src.common.config import BUSES_AT_STOPS_FILE, CRAWL_QUEUE_FILE, TIMETABLES
+from src.common.log import get_logger
+from src.common.metrics import CRAWL_TASKS, timed
+from src.fetch_and_preprocess.fetch_data import MAX_WORKERS, fetch_timetable_at_stop_for_line
+from src.fetch_and_preprocess.file_utils import get_filepath, save_file_to_data_folder
+from src.fetch_and_preprocess.work_queue import DEFAULT_LEASE_SECONDS, FAILED, Task, WorkQueue, worker_id
+
+__all__ = [
+    "timetable_task_key",
+    "default_queue",
+    "seed_timetable_tasks",
+    "run_crawl_worker",
+    "export_timetables"
+]
+
+logger = get_logger(__name__)
+
+# Interval at which an idle worker checks for tasks released by other workers or due for a retry.
+IDLE_POLL_SECONDS = 1.0
+
+
+def timetable_task_key(bus_stop_id: Any, bus_stop_nr: Any, bus_line: Any) -> str:
+    return f"{bus_stop_id}/{bus_stop_nr}/{bus_line}"
+
+
+def default_queue() -> WorkQueue:
+    """The crawl queue of the raw data folder."""
+    return WorkQueue(get_filepath(CRAWL_QUEUE_FILE, True))
+
+
+@timed()
+def seed_timetable_tasks(queue: WorkQueue, buses_at_stops_file: Optional[str] = None) -> int:
+    """
+    Add a task for every line at every stop; tasks already in the queue are kept with their results.
+
+    Args:
+        queue (WorkQueue): The crawl queue.
+        buses_at_stops_file (Optional[str]): Processed buses at stops, BUSES_AT_STOPS_FILE by default.
+
+    Returns:
+        int: Number of new tasks.
+    """
+    with open(buses_at_stops_file or get_filepath(BUSES_AT_STOPS_FILE, False), 'r', encoding='utf-8') as file:
+        stops = json.load(file)
+    added = queue.enqueue((timetable_task_key(stop['busstopId'], stop['busstopNr'], bus_line),
+                           {'busstopId': stop['busstopId'], 'busstopNr': stop['busstopNr'], 'linia': bus_line})
+                          for stop in stops for bus_line in stop['autobusy'])
+    logger.info("Crawl tasks added", extra={"added": added, **queue.stats()})
+    return added
+
+
+def _fetch_task(task: Task, api_key: str, session: requests.Session) -> Tuple[Optional[Dict[str, Any]], str]:
+    payload = task.payload
+    try:
+        # An empty result is the timetable of a line without departures at the stop, not a failure to retry.
+        result = fetch_timetable_at_stop_for_line(payload['busstopId'], payload['busstopNr'], payload['linia'],
+                                                  api_key, session, allow_empty=True)
+    except Exception as e:
+        return None, str(e)
+    return result, "No timetable in the response"
+
+
+@timed()
+def run_crawl_worker(queue: WorkQueue, api_key: str, threads: int = MAX_WORKERS,
+                     lease_seconds: float = DEFAULT_LEASE_SECONDS, max_tasks: Optional[int] = None) -> Dict[str, int]:
+    """
+    Lease and run crawl tasks until the queue is drained.
+
+    The worker leases batches of as many tasks as it has threads and, while the remaining tasks are leased by
+    other workers or wait for a retry, checks the queue every IDLE_POLL_SECONDS: it takes over the tasks of a
+    worker whose lease expires and exits once every task is done or failed.
+
+    Args:
+        queue (WorkQueue): The crawl queue.
+        api_key (str): The API key of this worker.
+        threads (int): Concurrent requests of this worker.
+        lease_seconds (float): Lease of a batch; must be longer than the requests of a batch take.
+        max_tasks (Optional[int]): Stop after this many tasks, e.g. to share a rate limit; no limit by default.
+
+    Returns:
+        Dict[str, int]: Number of tasks this worker completed and failed.
+    """
+    owner = worker_id()
+    counts = {"done": 0, "failed": 0}
+    session = requests.Session()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while max_tasks is None or sum(counts.values()) < max_tasks:
+            batch = threads if max_tasks is None else min(threads, max_tasks - sum(counts.values()))
+            tasks = queue.lease(owner, batch, lease_seconds)
+            if not tasks:
+                next_due = queue.next_due()
+                if next_due is None:
+                    break
+                time.sleep(min(max(next_due - time.time(), 0.01), IDLE_POLL_SECONDS))
+                continue
+            completed = []
+            for task, (result, error) in zip(tasks, executor.map(lambda task: _fetch_task(task, api_key, session),
+                                                                 tasks)):
+                if result is None:
+                    status = queue.fail(task, error, owner)
+                    CRAWL_TASKS.labels(outcome="failed" if status == FAILED else "retried").inc()
+                    counts["failed"] += 1
+                else:
+                    completed.append((task, result))
+            # The results of a batch are written in one transaction: the workers share a single write lock.
+            queue.complete_many(completed, owner)
+            CRAWL_TASKS.labels(outcome="done").inc(len(completed))
+            counts["done"] += len(completed)
+    session.close()
+    logger.info("Crawl worker finished", extra={"worker": owner, **counts})
+    return counts
+
+
+@timed()
+def export_timetables(queue: WorkQueue) -> int:
+    """
+    Write the results of the queue to the raw TIMETABLES file, grouped by stop as fetch_and_save_timetables does.
+
+    Returns:
+        int: Number of stops written.
+    """
+    by_stop: Dict[Any, List[Dict[str, Any]]] = {}
+    for _, result in queue.results():
+        by_stop.setdefault((result['busstopId'], result['busstopNr']), []).append(result)
+    save_file_to_data_folder(list(by_stop.values()), TIMETABLES, True)
+    failures = queue.failures()
+    if failures:
+        logger.warning("Timetables missing after the crawl", extra={"tasks": len(failures)})
+    return len(by_stop)
@@ -1,7 +1,9 @@
 import unittest
-from unittest.mock import Mock
+from datetime import datetime
+from unittest.mock import Mock, patch
 import requests
-from ..fetch_data import check_format_basic, fetch_data
+from .. import fetch_data as fetch_data_module
+from ..fetch_data import check_format_basic, fetch_data, fetch_and_save_bus_locations
 
 
 class TestFetch(unittest.TestCase):
@@ -19,6 +21,7 @@ class TestFetch(unittest.TestCase):
         response.json.return_value = {'result': []}
         response.raise_for_status.return_value = None
         self.assertFalse(check_format_basic(response))
+        self.assertTrue(check_format_basic(response, allow_empty=True))
 
     def test_check_if_response_correct_http_error(self):
         # Simulating HTTP error
@@ -43,6 +46,20 @@ class TestFetch(unittest.TestCase):
             mocked_get.return_value = mocked_response
             self.assertIsNone(fetch_data(api_data))
 
+    def test_consumer_errors_do_not_stop_the_poll(self):
+        record = {"Lines": "180", "Lon": 21.0, "VehicleNumber": "1000", "Lat": 52.22, "Brigade": "1",
+                  "Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        response = Mock()
+        response.json.return_value = {'result': [record]}
+        failing, received = Mock(side_effect=RuntimeError("broken")), []
+        with patch.object(fetch_data_module, 'fetch_data', return_value=response), \
+                patch.object(fetch_data_module, 'save_file_to_data_folder') as save, \
+                patch.object(fetch_data_module, 'write_quarantine'):
+            fetch_and_save_bus_locations("key", consumers=[failing, received.extend])
+        save.assert_called_once()
+        failing.assert_called_once()
+        self.assertEqual([bus["Lines"] for bus in received], ["180"])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from requests import Response
+from ..api_data import get_request_data_bus_stops_coordinates, get_request_data_buses_location
+from ..http_cache import CACHE_POLICIES, CachePolicy, HttpCache, request_key
+
+payload = {"result": [{"values": [{"key": "zespol", "value": "1001"}]}]}
+
+
+def api_response(body):
+    response = Response()
+    response.status_code = 200
+    response.encoding = 'utf-8'
+    response._content = json.dumps(body).encode('utf-8')
+    return response
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = HttpCache(self.tmp_dir.name, {"bus_stops_coordinates": CachePolicy(timedelta(hours=1),
+                                                                                        timedelta(hours=1))},
+                               offline=False)
+        self.request = get_request_data_bus_stops_coordinates("key-1")
+        self.fetch = Mock(return_value=api_response(payload))
+
+    def tearDown(self):
+        self.cache.wait()
+        self.tmp_dir.cleanup()
+
+    def age_entry(self, seconds):
+        path = os.path.join(self.tmp_dir.name, "bus_stops_coordinates", request_key(self.request) + ".json")
+        with open(path, 'r', encoding='utf-8') as file:
+            entry = json.load(file)
+        entry["fetched_at"] = time.time() - seconds
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+
+    def test_key_excludes_api_key(self):
+        self.assertEqual(request_key(self.request), request_key(get_request_data_bus_stops_coordinates("key-2")))
+        self.cache.fetch(self.request, self.fetch)
+        response = self.cache.fetch(get_request_data_bus_stops_coordinates("key-2"), self.fetch)
+        self.assertEqual(response.json(), payload)
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertNotIn("key-1", json.dumps(self.cache.load(self.request)))
+
+    def test_stale_while_revalidate(self):
+        self.cache.fetch(self.request, self.fetch)
+        self.age_entry(5400)
+        self.assertEqual(self.cache.fetch(self.request, self.fetch).json(), payload)
+        self.cache.wait()
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertLess(time.time() - self.cache.load(self.request)["fetched_at"], 60)
+
+    def test_expired_entry_is_served_on_error(self):
+        self.cache.fetch(self.request, self.fetch)
+        self.age_entry(3 * 3600)
+        self.assertEqual(self.cache.fetch(self.request, Mock(return_value=None)).json(), payload)
+
+    def test_timetables_expire_at_midnight(self):
+        policy = CACHE_POLICIES["timetable_at_stop"]
+        evening = datetime(2024, 2, 26, 22).timestamp()
+        self.assertEqual(policy.expires_at(evening), datetime(2024, 2, 27).timestamp())
+        morning = datetime(2024, 2, 26, 8).timestamp()
+        self.assertEqual(policy.expires_at(morning), datetime(2024, 2, 26, 20).timestamp())
+        self.assertEqual(CACHE_POLICIES["buses_at_stop"].expires_at(evening), evening + 7 * 24 * 3600)
+
+    def test_entry_of_an_earlier_day_is_fetched_again(self):
+        self.cache.policies = {"bus_stops_coordinates": CachePolicy(timedelta(hours=12), same_day=True)}
+        self.cache.fetch(self.request, self.fetch)
+        self.cache.fetch(self.request, self.fetch)
+        self.assertEqual(self.fetch.call_count, 1)
+        # Fetched shortly before the last midnight, within the ttl but on an earlier day.
+        last_midnight = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+        self.age_entry(time.time() - last_midnight + 60)
+        self.cache.fetch(self.request, self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_offline(self):
+        offline = HttpCache(self.tmp_dir.name, self.cache.policies, offline=True)
+        self.assertIsNone(offline.fetch(self.request, self.fetch))
+        self.cache.fetch(self.request, self.fetch)
+        self.age_entry(30 * 24 * 3600)
+        self.assertEqual(offline.fetch(self.request, self.fetch).json(), payload)
+        self.assertIsNone(offline.fetch(get_request_data_buses_location("key-1"), self.fetch))
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_uncached_endpoint(self):
+        self.cache.fetch(get_request_data_buses_location("key-1"), self.fetch)
+        self.cache.fetch(get_request_data_buses_location("key-1"), self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from src.benchmarks.synthetic_fleet import FleetConfig, generate_fleet_data
+from src.common.config import DATA_DIR_ENV
+from .. import fetch_data
+from ..api_data import API_URL_ENV, TIMETABLE_AT_STOP_ID
+from ..load_test import run_load_test
+from ..replay_server import FaultConfig, ReplayPayloads, ReplayServer
+
+
+class TestLoadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        generate_fleet_data(FleetConfig(vehicles=8, lines=2, stops=6, stops_per_line=3, polls_per_hour=2),
+                            cls.tmp_dir.name)
+        cls.payloads = ReplayPayloads(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def run_against(self, server, polls=2):
+        environ = {name: os.environ.get(name) for name in (DATA_DIR_ENV, API_URL_ENV)}
+        workers = fetch_data.MAX_WORKERS
+        results = run_load_test(self.tmp_dir.name, server, polls, max_workers=4)
+        # Nothing the load test changed outlives it.
+        self.assertEqual({name: os.environ.get(name) for name in environ}, environ)
+        self.assertEqual(fetch_data.MAX_WORKERS, workers)
+        self.assertEqual(fetch_data.REQUEST_OBSERVERS, [])
+        return results
+
+    def test_scenarios(self):
+        server = ReplayServer(self.payloads).start_in_background()
+        try:
+            results = self.run_against(server)
+        finally:
+            server.stop()
+        polling = results["live_polling"]
+        self.assertEqual(polling["requests"], 2)
+        self.assertEqual(polling["status_counts"], {"200": 2})
+        self.assertEqual(polling["failures"], 0)
+        self.assertGreaterEqual(polling["latency_p99_ms"], polling["latency_p50_ms"])
+        self.assertGreater(results["buses_at_stops"]["requests"], 0)
+        self.assertEqual(results["buses_at_stops"]["requests"], results["buses_at_stops"]["server_requests"])
+
+    def test_server_errors(self):
+        server = ReplayServer(self.payloads, FaultConfig(error_rate=1.0)).start_in_background()
+        try:
+            polling = self.run_against(server)["live_polling"]
+        finally:
+            server.stop()
+        self.assertEqual(polling["failures"], 2)
+        self.assertEqual(polling["status_counts"], {"500": 2})
+        self.assertEqual(polling["server_status_counts"], {"500": 2})
+
+    def test_stops_are_routed_by_their_codes(self):
+        server = ReplayServer(self.payloads)
+        server.server_close()
+        bus_stop_id, bus_stop_nr, line = next(iter(self.payloads.timetables))
+        self.assertEqual(len(bus_stop_nr), 2)
+        for number in (bus_stop_nr, str(int(bus_stop_nr))):
+            params = {'id': TIMETABLE_AT_STOP_ID, 'busstopId': bus_stop_id, 'busstopNr': number, 'line': line}
+            endpoint, payload = server.route('/api/action/dbtimetable_get', params)
+            self.assertEqual(endpoint, "timetable_at_stop")
+            self.assertEqual(payload, self.payloads.timetables[(bus_stop_id, bus_stop_nr, line)])
+            self.assertTrue(payload["result"])
+
+    def test_requests_without_an_answer(self):
+        server = ReplayServer(self.payloads)
+        server.server_close()
+        polling = self.run_against(server)["live_polling"]
+        self.assertEqual(polling["failures"], 2)
+        self.assertEqual(polling["status_counts"], {"error": 2})
+        self.assertEqual(polling["server_requests"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from ..pipeline import Pipeline, Stage
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def writer(self, name, *paths):
+        def write():
+            self.calls.append(name)
+            for path in paths:
+                with open(path, 'w') as file:
+                    file.write(name)
+        return write
+
+    def chain(self):
+        return Pipeline([
+            Stage("process", self.writer("process", self.path("processed")),
+                  inputs=[self.path("raw")], outputs=[self.path("processed")]),
+            Stage("fetch", self.writer("fetch", self.path("raw")), outputs=[self.path("raw")])
+        ])
+
+    def test_dependencies_from_inputs_and_outputs(self):
+        pipeline = self.chain()
+        self.assertEqual(pipeline.dependencies, {"process": {"fetch"}, "fetch": set()})
+        results = pipeline.run()
+        self.assertEqual(self.calls, ["fetch", "process"])
+        self.assertEqual({name: result.status for name, result in results.items()},
+                         {"fetch": "ran", "process": "ran"})
+
+    def test_up_to_date_stages_are_skipped(self):
+        self.chain().run()
+        self.calls.clear()
+        results = self.chain().run()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(results["process"].status, "skipped")
+
+    def test_rerun_single_stage(self):
+        self.chain().run()
+        self.calls.clear()
+        self.chain().run(only=["process"])
+        self.assertEqual(self.calls, ["process"])
+
+    def test_stages_run_only_when_named(self):
+        pipeline = Pipeline([
+            Stage("process", self.writer("process", self.path("processed")),
+                  inputs=[self.path("raw")], outputs=[self.path("processed")]),
+            Stage("poll", self.writer("poll", self.path("raw")), outputs=[self.path("raw")], max_age=timedelta(0),
+                  only_when_named=True)
+        ])
+        self.assertEqual(pipeline.upstream(["process"]), {"process"})
+        pipeline.run(only=["process"])
+        self.assertEqual(self.calls, ["process"])
+        self.calls.clear()
+        pipeline.run(only=["process", "poll"])
+        self.assertEqual(self.calls, ["poll", "process"])
+        self.calls.clear()
+        pipeline.run()
+        self.assertEqual(self.calls, ["poll", "process"])
+
+    def test_independent_stages_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        pipeline = Pipeline([Stage("first", barrier.wait), Stage("second", barrier.wait)])
+        results = pipeline.run()
+        self.assertEqual({result.status for result in results.values()}, {"ran"})
+
+    def test_failure_blocks_dependent_stages(self):
+        def fail():
+            raise RuntimeError("API down")
+        pipeline = Pipeline([
+            Stage("fetch", fail, outputs=[self.path("raw")]),
+            Stage("process", self.writer("process", self.path("processed")),
+                  inputs=[self.path("raw")], outputs=[self.path("processed")]),
+            Stage("other", self.writer("other"))
+        ])
+        results = pipeline.run()
+        self.assertEqual(results["fetch"].status, "failed")
+        self.assertEqual(results["process"].status, "blocked")
+        self.assertEqual(results["other"].status, "ran")
+
+    def test_cycle_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Pipeline([
+                Stage("a", self.writer("a"), inputs=[self.path("x")], outputs=[self.path("y")]),
+                Stage("b", self.writer("b"), inputs=[self.path("y")], outputs=[self.path("x")])
+            ])
+
+
+if __name__ == '__main__':
+    unittest.main()
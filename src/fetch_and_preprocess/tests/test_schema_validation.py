@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from datetime import datetime
+from ..process_data import check_bus_location
+from ..schema_validation import BUSES_AT_STOP_SCHEMA, BUSES_LOCATION_SCHEMA, BUS_STOPS_COORDINATES_SCHEMA, \
+    RECORD_ERROR, UNKNOWN_KEY_ERROR, write_quarantine
+
+
+def location(line="180", time="2024-02-26 08:00:00", lat=52.22):
+    return {"Lines": line, "Lon": 21.0, "VehicleNumber": "1000", "Time": time, "Lat": lat, "Brigade": "1"}
+
+
+def bus_stop(**values):
+    return {"values": [{"key": key, "value": value} for key, value in values.items()]}
+
+
+class TestSchemaValidation(unittest.TestCase):
+
+    def test_bad_records_are_quarantined(self):
+        payload = {"result": [location(), location(time="26.02.2024"), "invalid data", location(lat="52.2")]}
+        result = BUSES_LOCATION_SCHEMA.validate(payload)
+        self.assertTrue(result.ok)
+        self.assertFalse(result.complete)
+        self.assertEqual(result.payload(), {"result": [location()]})
+        self.assertEqual([index for index, record, errors in result.quarantined], [1, 2, 3])
+        self.assertEqual(result.error_counts, {"Time": 1, RECORD_ERROR: 1, "Lat": 1})
+
+    def test_values_shape(self):
+        good = bus_stop(zespol="1001", slupek="01", nazwa_zespolu="Kijowska", id_ulicy="2201",
+                        szer_geo="52.248455", dlug_geo="21.044827", kierunek="al.Zieleniecka")
+        missing = bus_stop(zespol="1001", slupek="02", nazwa_zespolu="Kijowska", szer_geo="x", dlug_geo="21.0")
+        unknown = bus_stop(zespol="1001", slupek="03", nazwa_zespolu="Kijowska", id_ulicy="2201",
+                           szer_geo="52.2", dlug_geo="21.0", extra="1")
+        result = BUS_STOPS_COORDINATES_SCHEMA.validate({"result": [good, missing, unknown]})
+        self.assertEqual(result.valid, [good])
+        self.assertEqual(result.quarantined[0][2], ["id_ulicy", "szer_geo"])
+        self.assertEqual(result.quarantined[1][2], [UNKNOWN_KEY_ERROR])
+
+    def test_envelope(self):
+        for payload in [None, [], {"result": "Błędna metoda lub parametry wywołania"}]:
+            result = BUSES_LOCATION_SCHEMA.validate(payload)
+            self.assertFalse(result.ok)
+            self.assertFalse(result.envelope_ok)
+
+    def test_sampled_validation(self):
+        records = [location(line=str(line)) for line in range(100)]
+        result = BUSES_LOCATION_SCHEMA.validate({"result": records}, sample_size=10)
+        self.assertTrue(result.sampled)
+        self.assertEqual(result.checked, 10)
+        self.assertEqual(len(result.valid), 100)
+
+        records[50] = location(time=None)
+        result = BUSES_LOCATION_SCHEMA.validate({"result": records}, sample_size=10)
+        self.assertFalse(result.sampled)
+        self.assertEqual(result.checked, 100)
+        self.assertEqual(len(result.valid), 99)
+
+    def test_sampled_validation_checks_the_type_of_every_record(self):
+        records = [location(line=str(line)) for line in range(100)]
+        records[55] = "invalid data"
+        result = BUSES_LOCATION_SCHEMA.validate({"result": records}, sample_size=10)
+        self.assertFalse(result.sampled)
+        self.assertEqual([index for index, record, errors in result.quarantined], [55])
+
+    def test_records_of_the_wrong_type_are_not_kept(self):
+        poll = datetime(2024, 2, 26, 8)
+        for record in ("invalid data", None, location(line=180), {**location(), "Brigade": 1}):
+            self.assertFalse(check_bus_location(record, poll))
+        self.assertTrue(check_bus_location(location(), poll))
+
+    def test_buses_at_stop_checks_the_shape_only(self):
+        records = [bus_stop(linia="180"), bus_stop(), bus_stop(linia=180, kierunek="Kijowska"), {"values": "180"}]
+        result = BUSES_AT_STOP_SCHEMA.validate({"result": records})
+        self.assertEqual(result.valid, records[:3])
+        self.assertEqual(result.error_counts, {RECORD_ERROR: 1})
+
+    def test_write_quarantine(self):
+        result = BUSES_LOCATION_SCHEMA.validate({"result": [location(), location(time="")]})
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch("src.fetch_and_preprocess.schema_validation.get_filepath",
+                      lambda path, raw: os.path.join(tmp_dir, path)):
+            path = write_quarantine(result)
+            with open(path, 'r', encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["index"], 1)
+        self.assertEqual(lines[0]["errors"], ["Time"])
+
+
+if __name__ == '__main__':
+    unittest.main()
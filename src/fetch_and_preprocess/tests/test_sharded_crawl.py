@@ -0,0 +1,48 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import requests
+from .. import fetch_data as fetch_data_module
+from ..http_cache import HttpCache
+from ..sharded_crawl import run_crawl_worker
+from ..work_queue import DONE, FAILED, WorkQueue
+
+
+class TestShardedCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(os.path.join(self.tmp_dir.name, "queue.sqlite"), max_attempts=1)
+        self.queue.enqueue([("7009/01/180", {"busstopId": "7009", "busstopNr": "01", "linia": "180"})])
+        cache = HttpCache(os.path.join(self.tmp_dir.name, "http"), offline=False)
+        self.patches = [patch.object(fetch_data_module, "default_http_cache", cache)]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def run_worker(self, payload):
+        response = requests.Response()
+        response.status_code, response._content = 200, json.dumps(payload).encode()
+        with patch("requests.Session.get", return_value=response):
+            return run_crawl_worker(self.queue, "key", threads=1)
+
+    def test_empty_result_is_done_without_departures(self):
+        self.assertEqual(self.run_worker({"result": []}), {"done": 1, "failed": 0})
+        self.assertEqual(self.queue.stats()[DONE], 1)
+        (_, result), = self.queue.results()
+        self.assertEqual(result, {"busstopId": "7009", "busstopNr": "01", "linia": "180", "rozklad": []})
+
+    def test_malformed_response_fails(self):
+        self.assertEqual(self.run_worker({"result": "error"}), {"done": 0, "failed": 1})
+        self.assertEqual(self.queue.stats()[FAILED], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
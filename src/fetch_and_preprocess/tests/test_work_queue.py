@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import unittest
+from ..work_queue import DONE, FAILED, PENDING, WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(os.path.join(self.tmp_dir.name, "queue.sqlite"), max_attempts=2)
+        self.queue.enqueue((f"task-{i}", {"i": i}) for i in range(5))
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(self.queue.enqueue([("task-0", {"i": 0}), ("task-5", {"i": 5})]), 1)
+        self.assertEqual(self.queue.stats()[PENDING], 6)
+
+    def test_leases_are_exclusive(self):
+        first = self.queue.lease("a", 3)
+        second = self.queue.lease("b", 3)
+        self.assertEqual([task.key for task in first], ["task-0", "task-1", "task-2"])
+        self.assertEqual([task.key for task in second], ["task-3", "task-4"])
+        self.assertEqual(self.queue.lease("c", 3), [])
+
+    def test_expired_lease_is_leased_again(self):
+        self.queue.lease("a", 5, lease_seconds=-1)
+        tasks = self.queue.lease("b", 5)
+        self.assertEqual(len(tasks), 5)
+        self.assertEqual(tasks[0].attempts, 2)
+
+    def test_failed_task_is_retried_then_fails(self):
+        task, *others = self.queue.lease("a", 5)
+        for other in others:
+            self.queue.complete(other, {}, "a")
+        self.assertEqual(self.queue.fail(task, "timeout", "a"), PENDING)
+        self.assertGreater(self.queue.next_due(), time.time())
+        self.assertEqual(self.queue.lease("a", 5), [])
+
+        self.queue._connection().execute("UPDATE tasks SET available_at = 0")
+        retried = self.queue.lease("b", 5)
+        self.assertEqual([t.key for t in retried], [task.key])
+        self.assertEqual(self.queue.fail(retried[0], "timeout", "b"), FAILED)
+        self.assertIsNone(self.queue.next_due())
+        self.assertEqual(self.queue.failures(), [(task.key, "timeout")])
+        self.assertEqual(self.queue.retry_failed(), 1)
+
+    def test_first_result_wins(self):
+        task = self.queue.lease("a", 1, lease_seconds=-1)[0]
+        again = self.queue.lease("b", 1)[0]
+        self.assertTrue(self.queue.complete(again, {"by": "b"}, "b"))
+        self.assertFalse(self.queue.complete(task, {"by": "a"}, "a"))
+        # A late failure of the first worker does not undo the result.
+        self.queue.fail(task, "late", "a")
+        self.assertEqual(list(self.queue.results()), [(task.key, {"by": "b"})])
+        self.assertEqual(self.queue.stats()[DONE], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+"""
+Durable work queue in a SQLite file, shared by any number of worker processes.
+
+Tasks are identified by a unique key, so seeding the same tasks again is a no-op. A worker leases a batch of
+tasks for a limited time; a task whose lease expires (its worker died or hangs) is leased again by another
+worker. A failed task is retried with a growing delay until it has been attempted max_attempts times. Results
+are written under the key of their task in the same transaction that marks it done, and the first result of a
+key wins, so a task completed twice (after its lease expired) still has a single result.
+
+Every change runs in a short IMMEDIATE transaction, which is all the locking SQLite needs between processes.
+The rollback journal is used instead of WAL, so workers on several hosts can share the file over a network
+filesystem that supports locks (e.g. NFS with lockd).
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+__all__ = [
+    "PENDING",
+    "LEASED",
+    "DONE",
+    "FAILED",
+    "Task",
+    "WorkQueue",
+    "worker_id"
+]
+
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+# Delay before the retry of a failed task, doubled after every attempt.
+RETRY_DELAY = 5.0
+BUSY_TIMEOUT_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    written_at REAL NOT NULL
+);
+"""
+
+
+def worker_id() -> str:
+    """Identifier of a worker, unique across hosts and processes."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+@dataclass(frozen=True)
+class Task:
+    """
+    A leased task.
+
+    Attributes:
+        id (int): Row id of the task.
+        key (str): Unique key of the task.
+        payload (Any): Decoded JSON payload.
+        attempts (int): Number of leases of the task, including this one.
+    """
+    id: int
+    key: str
+    payload: Any
+    attempts: int
+
+
+class WorkQueue:
+    """
+    Tasks and their results in a SQLite file.
+
+    Args:
+        path (str): The database file, created if missing.
+        max_attempts (int): Leases of a task before a failure is final.
+    """
+
+    def __init__(self, path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection per thread: sqlite3 connections must not be shared between threads.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=DELETE")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._connection())
+
+    def close(self) -> None:
+        """Close the connection of the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def enqueue(self, tasks: Iterable[Tuple[str, Any]]) -> int:
+        """
+        Add tasks; tasks with a key already in the queue are left as they are.
+
+        Args:
+            tasks (Iterable[Tuple[str, Any]]): (key, JSON serialisable payload) pairs.
+
+        Returns:
+            int: Number of new tasks.
+        """
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO tasks (key, payload) VALUES (?, ?)",
+                                   ((key, json.dumps(payload)) for key, payload in tasks))
+            return connection.total_changes - before
+
+    def lease(self, owner: str, count: int = 1, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[Task]:
+        """
+        Lease up to count tasks that are pending and due, or whose lease expired. Expired tasks without
+        attempts left fail for good instead.
+
+        Args:
+            owner (str): Identifier of the worker, see worker_id.
+            count (int): Largest number of tasks.
+            lease_seconds (float): Time after which the tasks can be leased by other workers.
+
+        Returns:
+            List[Task]: The leased tasks, in the order they were added.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET status = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL "
+                               "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                               (FAILED, "Lease expired", LEASED, now, self.max_attempts))
+            rows = connection.execute(
+                "SELECT id, key, payload, attempts FROM tasks "
+                "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?) "
+                "ORDER BY id LIMIT ?", (PENDING, now, LEASED, now, count)).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?", ((LEASED, owner, now + lease_seconds, row[0]) for row in rows))
+        return [Task(row[0], row[1], json.loads(row[2]), row[3] + 1) for row in rows]
+
+    def complete(self, task: Task, result: Any, owner: str) -> bool:
+        """
+        Store the result of a task and mark it done.
+
+        Args:
+            task (Task): The leased task.
+            result (Any): JSON serialisable result.
+            owner (str): Identifier of the worker.
+
+        Returns:
+            bool: Whether the result was written; False if the task already had one.
+        """
+        return bool(self.complete_many([(task, result)], owner))
+
+    def complete_many(self, completed: Sequence[Tuple[Task, Any]], owner: str) -> int:
+        """
+        Store the results of several tasks and mark them done in a single transaction, so a worker takes the
+        write lock once per batch instead of once per task.
+
+        Args:
+            completed (Sequence[Tuple[Task, Any]]): (leased task, JSON serialisable result) pairs.
+            owner (str): Identifier of the worker.
+
+        Returns:
+            int: Number of results written; tasks that already had a result keep it.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO results (key, result, worker, written_at) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   ((task.key, json.dumps(result, ensure_ascii=False), owner, now)
+                                    for task, result in completed))
+            written = connection.total_changes - before
+            connection.executemany("UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                                   "last_error = NULL WHERE id = ?", ((DONE, task.id) for task, _ in completed))
+        return written
+
+    def fail(self, task: Task, error: str, owner: str) -> str:
+        """
+        Record a failed attempt: the task is retried later, or fails for good after max_attempts.
+
+        Args:
+            task (Task): The leased task.
+            error (str): Description of the failure.
+            owner (str): Identifier of the worker; the failure is ignored if another worker holds the lease now.
+
+        Returns:
+            str: The new status of the task.
+        """
+        status = FAILED if task.attempts >= self.max_attempts else PENDING
+        available_at = time.time() + RETRY_DELAY * 2 ** (task.attempts - 1)
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL, "
+                "last_error = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (status, available_at, error, task.id, LEASED, owner))
+        return status
+
+    def retry_failed(self) -> int:
+        """Make failed tasks pending again with fresh attempts; returns their number."""
+        with self._transaction() as connection:
+            return connection.execute("UPDATE tasks SET status = ?, attempts = 0, available_at = 0 WHERE status = ?",
+                                      (PENDING, FAILED)).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """Number of tasks by status and number of results."""
+        connection = self._connection()
+        counts = {status: 0 for status in (PENDING, LEASED, DONE, FAILED)}
+        counts.update(connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        counts["results"] = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return counts
+
+    def next_due(self) -> Optional[float]:
+        """Time at which the next unfinished task can be leased (now if one can be), None if all are finished."""
+        row = self._connection().execute(
+            "SELECT MIN(CASE WHEN status = ? THEN available_at ELSE lease_expires END) FROM tasks "
+            "WHERE status IN (?, ?)", (PENDING, PENDING, LEASED)).fetchone()
+        return row[0]
+
+    def results(self) -> Iterator[Tuple[str, Any]]:
+        """(key, result) of every completed task, in the order of the keys."""
+        for key, result in self._connection().execute("SELECT key, result FROM results ORDER BY key"):
+            yield key, json.loads(result)
+
+    def failures(self) -> List[Tuple[str, Optional[str]]]:
+        """(key, last error) of every task that failed for good."""
+        return self._connection().execute("SELECT key, last_error FROM tasks WHERE status = ? ORDER BY id",
+                                          (FAILED,)).fetchall()
+
+
+class _Transaction:
+    """IMMEDIATE transaction: takes the write lock at the start, so concurrent leases never see the same rows."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,93 @@
+import contextlib
+import filecmp
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from src.common.config import DATA_DIR_ENV
+from src.common.log import ROOT_LOGGER
+from ..cli import build_parser, main
+
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SAMPLE_HOUR = os.path.join(REPOSITORY, 'data', 'processed', 'buses_live_locations', '2024-02-26 08')
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = os.environ.get(DATA_DIR_ENV)
+        root = logging.getLogger(ROOT_LOGGER)
+        self.logging_state = (root.handlers, root.level, root.propagate)
+
+    def tearDown(self):
+        if self.data_dir is None:
+            os.environ.pop(DATA_DIR_ENV, None)
+        else:
+            os.environ[DATA_DIR_ENV] = self.data_dir
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers, root.level, root.propagate = self.logging_state
+        self.tmp_dir.cleanup()
+
+    def test_parser(self):
+        args = build_parser().parse_args(["poll", "KEY", "--hour", "8", "--validation-sample", "100"])
+        self.assertEqual((args.command, args.api_key, args.hour, args.validation_sample), ("poll", "KEY", 8, 100))
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            build_parser().parse_args(["poll", "KEY", "--hour", "24"])
+
+    def test_import_loads_no_analysis_dependencies(self):
+        code = "import sys, src.cli; print(sorted({'pandas', 'numpy', 'geopy'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=REPOSITORY, capture_output=True, text=True,
+                                check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_help(self):
+        result = subprocess.run([sys.executable, "-m", "src.cli", "--help"], cwd=REPOSITORY, capture_output=True,
+                                text=True, check=True)
+        self.assertIn("bus-analysis", result.stdout)
+
+    def test_analyze_sample_hour(self):
+        output = os.path.join(self.tmp_dir.name, "trip_speed.json")
+        code = main(["analyze", "trip-speed", SAMPLE_HOUR, "--data-dir", self.tmp_dir.name, "--output", output,
+                     "--log-level", "WARNING"])
+        self.assertEqual(code, 0)
+        with open(output, 'r', encoding='utf-8') as file:
+            rows = json.load(file)
+        self.assertTrue(rows)
+        self.assertEqual(set(rows[0]), {"Lines", "Brigade", "trips", "Average_Speed"})
+
+    def test_simplify_keeps_processed_folders(self):
+        folder = os.path.join(self.tmp_dir.name, "2024-02-26 08")
+        shutil.copytree(SAMPLE_HOUR, folder)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            main(["process", "simplify", folder, "--data-dir", self.tmp_dir.name, "--log-level", "WARNING"])
+        report = json.loads(stdout.getvalue())["2024-02-26 08"]
+        self.assertLess(report["points_kept"], report["points_in"])
+        self.assertEqual(filecmp.dircmp(folder, SAMPLE_HOUR).diff_files, [])
+        output = os.path.join(self.tmp_dir.name, "processed", "buses_live_locations_simplified", "2024-02-26 08")
+        self.assertEqual(sorted(os.listdir(output)), sorted(os.listdir(SAMPLE_HOUR)))
+        with self.assertRaises(SystemExit):
+            main(["process", "simplify", folder, "--overwrite", "--output-dir", self.tmp_dir.name])
+
+    def test_report_summary(self):
+        folder = os.path.join(self.tmp_dir.name, "2024-02-26 08")
+        os.makedirs(folder)
+        for filename in sorted(os.listdir(SAMPLE_HOUR))[:3]:
+            shutil.copy(os.path.join(SAMPLE_HOUR, filename), folder)
+        output_dir = os.path.join(self.tmp_dir.name, "report")
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            code = main(["report", folder, "--data-dir", self.tmp_dir.name, "--output-dir", output_dir,
+                         "--analyses", "speeding", "--workers", "1", "--log-level", "WARNING"])
+        self.assertEqual(code, 0)
+        summary = json.loads(stdout.getvalue())
+        self.assertEqual((summary["output_dir"], summary["hours"], summary["failed"]), (output_dir, 1, {}))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "2024-02-26 08", "speeding.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 from src.common.config import *
+from src.analyze.dictionary_data import *
 
 buses_locations_at_8 = os.path.join("..", "..", DATA_FOLDER, PROCESSED, BUSES_LIVE_LOCATIONS, "2024-02-26 08")
 buses_locations_at_12 = os.path.join("..", "..", DATA_FOLDER, PROCESSED, BUSES_LIVE_LOCATIONS, "2024-02-26 12")
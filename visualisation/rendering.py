@@ -0,0 +1,157 @@
+"""
+Rasterised rendering of large point sets for the conclusion notebooks.
+
+Scatter plots draw every point, so their time grows with the number of points and multi-day data sets do not
+render at all. Here points are binned with np.bincount into a density image of a fixed size over the Warsaw
+bounds, which is scaled (logarithmically or between percentiles) and drawn with a single imshow: the drawing
+takes the same time for a thousand points as for ten million. Images of several files or days are accumulated
+by passing the counts of the previous call.
+
+    counts = rasterize(data[lat], data[lon])
+    plt.imshow(to_image(counts), cmap='inferno', **imshow_kwargs())
+"""
+from typing import Any, Dict, Iterable, Optional, Tuple
+import numpy as np
+from src.analyze.geo import WARSAW_CENTER_LAT, metres_per_degree
+from src.common.config import WARSAW_LAT_MIN, WARSAW_LAT_MAX, WARSAW_LON_MIN, WARSAW_LON_MAX
+
+__all__ = [
+    "DEFAULT_WIDTH",
+    "image_shape",
+    "rasterize",
+    "log_scale",
+    "percentile_scale",
+    "to_image",
+    "imshow_kwargs",
+    "value_histogram"
+]
+
+# Width of the density image in pixels; the height follows from the proportions of the Warsaw bounds.
+DEFAULT_WIDTH = 800
+
+
+def image_shape(width: int = DEFAULT_WIDTH) -> Tuple[int, int]:
+    """
+    Shape of an image of the Warsaw bounds with square pixels.
+
+    Args:
+    - width (int): Width in pixels.
+
+    Returns:
+    Tuple[int, int]: (height, width).
+    """
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    height = (WARSAW_LAT_MAX - WARSAW_LAT_MIN) * lat_m / ((WARSAW_LON_MAX - WARSAW_LON_MIN) * lon_m) * width
+    return max(int(round(height)), 1), width
+
+
+def rasterize(lats: Iterable[float], lons: Iterable[float], width: int = DEFAULT_WIDTH,
+              weights: Optional[Iterable[float]] = None, counts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Bin points into a density image of the Warsaw bounds. Points outside the bounds or without a position (NaN) are
+    ignored.
+
+    Args:
+    - lats, lons: Coordinates of the points in degrees.
+    - width (int): Width of the image in pixels.
+    - weights: Weight of every point, 1 by default.
+    - counts (ndarray): Image to add the points to, e.g. of the previous day; a new image by default.
+
+    Returns:
+    ndarray: Float image of shape image_shape(width), row 0 at WARSAW_LAT_MIN.
+    """
+    height, width = image_shape(width)
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    finite = np.isfinite(lats) & np.isfinite(lons)
+    lats, lons = lats[finite], lons[finite]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[finite]
+    rows = np.floor((lats - WARSAW_LAT_MIN) / (WARSAW_LAT_MAX - WARSAW_LAT_MIN) * height).astype(np.int64)
+    cols = np.floor((lons - WARSAW_LON_MIN) / (WARSAW_LON_MAX - WARSAW_LON_MIN) * width).astype(np.int64)
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    if weights is not None:
+        weights = weights[inside]
+    image = np.bincount(rows[inside] * width + cols[inside], weights=weights,
+                        minlength=height * width).astype(np.float64).reshape(height, width)
+    if counts is not None:
+        counts += image
+        return counts
+    return image
+
+
+def log_scale(counts: np.ndarray) -> np.ndarray:
+    """Counts scaled to [0, 1] by log(1 + count), so single points stay visible next to hotspots."""
+    scaled = np.log1p(counts)
+    top = scaled.max()
+    return scaled / top if top > 0 else scaled
+
+
+def percentile_scale(counts: np.ndarray, low: float = 1, high: float = 99) -> np.ndarray:
+    """
+    Counts scaled to [0, 1] linearly between percentiles of the non-empty pixels, clipping outliers.
+
+    Args:
+    - counts (ndarray): Density image.
+    - low, high (float): Percentiles mapped to 0 and 1.
+    """
+    filled = counts[counts > 0]
+    if not len(filled):
+        return np.zeros_like(counts, dtype=np.float64)
+    low_value, high_value = np.percentile(filled, [low, high])
+    span = high_value - low_value if high_value > low_value else 1
+    return np.clip((counts - low_value) / span, 0, 1)
+
+
+def to_image(counts: np.ndarray, scale: str = "log", low: float = 1, high: float = 99) -> np.ma.MaskedArray:
+    """
+    Scale a density image for imshow, with the empty pixels masked so the background stays blank.
+
+    Args:
+    - counts (ndarray): Density image from rasterize.
+    - scale (str): "log" (log_scale), "percentile" (percentile_scale) or "linear".
+    - low, high (float): Percentiles of the percentile scale.
+
+    Returns:
+    MaskedArray: Values in [0, 1].
+    """
+    if scale == "log":
+        scaled = log_scale(counts)
+    elif scale == "percentile":
+        scaled = percentile_scale(counts, low, high)
+    elif scale == "linear":
+        scaled = counts / counts.max() if counts.max() > 0 else counts.astype(np.float64)
+    else:
+        raise ValueError(f"Unknown scale {scale}; use log, percentile or linear")
+    return np.ma.masked_where(counts <= 0, scaled)
+
+
+def imshow_kwargs() -> Dict[str, Any]:
+    """Keyword arguments of imshow placing an image of rasterize at its coordinates, with true proportions."""
+    lat_m, lon_m = metres_per_degree(WARSAW_CENTER_LAT)
+    return {"extent": (WARSAW_LON_MIN, WARSAW_LON_MAX, WARSAW_LAT_MIN, WARSAW_LAT_MAX), "origin": "lower",
+            "interpolation": "nearest", "aspect": lat_m / lon_m}
+
+
+def value_histogram(values: Iterable[float], bins: np.ndarray,
+                    counts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Histogram of values in fixed bins, to be drawn with plt.stairs(counts, bins) in constant time.
+
+    Args:
+    - values: The values, e.g. average speeds.
+    - bins (ndarray): Ascending bin edges; values outside them are ignored.
+    - counts (ndarray): Histogram to add the values to; a new histogram by default.
+
+    Returns:
+    ndarray: Integer counts of the len(bins) - 1 bins.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    index = np.searchsorted(bins, values, side='right') - 1
+    # The last bin includes its right edge, as in np.histogram.
+    index[values == bins[-1]] = len(bins) - 2
+    inside = (index >= 0) & (index < len(bins) - 1)
+    histogram = np.bincount(index[inside], minlength=len(bins) - 1)
+    if counts is not None:
+        counts += histogram
+        return counts
+    return histogram
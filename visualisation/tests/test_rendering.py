@@ -0,0 +1,62 @@
+import unittest
+import warnings
+import numpy as np
+from src.common.config import WARSAW_LAT_MIN, WARSAW_LAT_MAX, WARSAW_LON_MIN, WARSAW_LON_MAX
+from ..rendering import image_shape, log_scale, percentile_scale, rasterize, to_image, value_histogram
+
+
+class TestRendering(unittest.TestCase):
+
+    def test_points_are_binned_into_their_pixels(self):
+        height, width = image_shape(40)
+        counts = rasterize([WARSAW_LAT_MIN, WARSAW_LAT_MIN, WARSAW_LAT_MAX - 1e-9],
+                           [WARSAW_LON_MIN, WARSAW_LON_MIN, WARSAW_LON_MAX - 1e-9], width=40)
+        self.assertEqual(counts.shape, (height, width))
+        self.assertEqual(counts[0, 0], 2)
+        self.assertEqual(counts[-1, -1], 1)
+        self.assertEqual(counts.sum(), 3)
+
+    def test_points_outside_the_bounds_are_ignored(self):
+        counts = rasterize([WARSAW_LAT_MIN - 0.01, WARSAW_LAT_MAX, 52.2], [21.0, 21.0, WARSAW_LON_MAX + 0.01], width=40)
+        self.assertEqual(counts.sum(), 0)
+
+    def test_points_without_a_position_are_ignored(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            counts = rasterize([52.2, np.nan, 52.2], [21.0, 21.0, np.nan], width=40, weights=[2, 3, 4])
+        self.assertEqual(counts.sum(), 2)
+
+    def test_counts_are_accumulated(self):
+        counts = rasterize([52.2], [21.0], width=40, weights=[2.5])
+        result = rasterize([52.2, 52.25], [21.0, 21.0], width=40, counts=counts)
+        self.assertIs(result, counts)
+        self.assertEqual(counts.sum(), 4.5)
+        self.assertEqual(counts.max(), 3.5)
+
+    def test_scales_of_an_empty_image(self):
+        counts = np.zeros(image_shape(40))
+        self.assertEqual(log_scale(counts).max(), 0)
+        self.assertEqual(percentile_scale(counts).max(), 0)
+        self.assertTrue(to_image(counts, "percentile").mask.all())
+        with self.assertRaises(ValueError):
+            to_image(counts, "sqrt")
+
+    def test_scales_map_to_the_unit_range(self):
+        counts = np.array([[0, 1, 10], [100, 1000, 0]], dtype=np.float64)
+        for scale in ("log", "percentile", "linear"):
+            image = to_image(counts, scale)
+            self.assertEqual(image.max(), 1)
+            self.assertGreaterEqual(image.min(), 0)
+            self.assertEqual(image.mask.tolist(), [[True, False, False], [False, False, True]])
+
+    def test_value_histogram_matches_numpy(self):
+        bins = np.arange(0, 81, 10)
+        values = [0, 5, 10, 79.9, 80, 80.1, -1]
+        np.testing.assert_array_equal(value_histogram(values, bins), np.histogram(values, bins)[0])
+        counts = value_histogram([80], bins)
+        self.assertEqual(value_histogram([0, 80], bins, counts=counts).tolist(), [1, 0, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(value_histogram([], bins).sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()